@@ -0,0 +1,229 @@
+"""Partition node_metrics_snapshots by day, add 1-minute/1-hour rollups.
+
+Revision ID: 0102
+Revises: 0101
+Create Date: 2026-10-18
+
+Снимок метрик пишется каждым батчем каждой ноды, а таблица была одной кучей:
+ретеншн — пакетный DELETE раз в сутки, история за 30 дней — скан миллионов
+строк. Теперь:
+
+- node_metrics_snapshots секционирована по created_at посуточно, старые дни
+  уходят DROP'ом секции (как user_connections в 0069);
+- node_metrics_rollup_1m / node_metrics_rollup_1h — суммы и максимумы по
+  бакетам, пополняются тем же INSERT'ом, что пишет снимок. Графики
+  «История метрик» читают их, а не сырые строки.
+
+Сырые строки остаются для детектора атак (медиана по сетевым метрикам —
+из агрегатов её не собрать).
+
+Strategy: CREATE partitioned → INSERT last 30 days → RENAME swap (как 0069).
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import text
+
+revision: str = "0102"
+down_revision: Union[str, None] = "0101"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RETENTION_DAYS = 30
+DAYS_AHEAD = 7
+
+ROLLUP_TABLES = ("node_metrics_rollup_1m", "node_metrics_rollup_1h")
+
+# Колонки сырой таблицы после 0096 — в том порядке, в каком их копируем
+SNAPSHOT_COLUMNS = (
+    "node_uuid", "cpu_usage", "cpu_cores", "memory_usage",
+    "memory_total_bytes", "memory_used_bytes",
+    "disk_usage", "disk_total_bytes", "disk_used_bytes",
+    "disk_read_speed_bps", "disk_write_speed_bps", "uptime_seconds",
+    "net_rx_bps", "net_tx_bps", "net_rx_pps", "net_tx_pps",
+    "net_rx_drop_ps", "net_tx_drop_ps", "conntrack_count", "conntrack_max",
+    "tcp_established", "tcp_syncookies_ps", "tcp_listen_drop_ps",
+    "created_at",
+)
+
+
+def _create_rollups() -> None:
+    for table in ROLLUP_TABLES:
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                node_uuid UUID NOT NULL,
+                bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+                samples INTEGER NOT NULL DEFAULT 0,
+                cpu_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                cpu_max DOUBLE PRECISION,
+                memory_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                memory_max DOUBLE PRECISION,
+                disk_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                disk_max DOUBLE PRECISION,
+                PRIMARY KEY (node_uuid, bucket)
+            )
+        """)
+        op.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)")
+
+
+def _backfill_rollups() -> None:
+    for table, trunc in zip(ROLLUP_TABLES, ("minute", "hour")):
+        op.execute(f"""
+            INSERT INTO {table} (
+                node_uuid, bucket, samples,
+                cpu_sum, cpu_max, memory_sum, memory_max, disk_sum, disk_max
+            )
+            SELECT node_uuid, date_trunc('{trunc}', created_at), COUNT(*),
+                   COALESCE(SUM(cpu_usage), 0), MAX(cpu_usage),
+                   COALESCE(SUM(memory_usage), 0), MAX(memory_usage),
+                   COALESCE(SUM(disk_usage), 0), MAX(disk_usage)
+            FROM node_metrics_snapshots
+            GROUP BY node_uuid, date_trunc('{trunc}', created_at)
+            ON CONFLICT (node_uuid, bucket) DO NOTHING
+        """)
+
+
+def upgrade() -> None:
+    _create_rollups()
+
+    # Idempotency guard (как в 0069): рестарт контейнера посреди миграции
+    # не должен затеять второй swap поверх уже секционированной таблицы.
+    conn = op.get_bind()
+    relkind = conn.execute(text(
+        "SELECT relkind FROM pg_class "
+        "WHERE relname = 'node_metrics_snapshots' AND relnamespace = 'public'::regnamespace"
+    )).scalar()
+    if relkind == "p":
+        return
+
+    # 1. Partitioned table. Без FK на nodes: снимки удалённой ноды уйдут
+    #    вместе со своей секцией, а чтение всё равно идёт через JOIN nodes.
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS node_metrics_snapshots_partitioned (
+            id BIGSERIAL NOT NULL,
+            node_uuid UUID NOT NULL,
+            cpu_usage FLOAT,
+            cpu_cores INTEGER,
+            memory_usage FLOAT,
+            memory_total_bytes BIGINT,
+            memory_used_bytes BIGINT,
+            disk_usage FLOAT,
+            disk_total_bytes BIGINT,
+            disk_used_bytes BIGINT,
+            disk_read_speed_bps BIGINT DEFAULT 0,
+            disk_write_speed_bps BIGINT DEFAULT 0,
+            uptime_seconds INTEGER,
+            net_rx_bps BIGINT,
+            net_tx_bps BIGINT,
+            net_rx_pps BIGINT,
+            net_tx_pps BIGINT,
+            net_rx_drop_ps BIGINT,
+            net_tx_drop_ps BIGINT,
+            conntrack_count INTEGER,
+            conntrack_max INTEGER,
+            tcp_established INTEGER,
+            tcp_syncookies_ps INTEGER,
+            tcp_listen_drop_ps INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    # 2. Daily partitions: retention window back + a week forward + default
+    today = datetime.now(timezone.utc).date()
+    for offset in range(-RETENTION_DAYS, DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        nxt = day + timedelta(days=1)
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS node_metrics_snapshots_p{day:%Y%m%d}
+                PARTITION OF node_metrics_snapshots_partitioned
+                FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{nxt.isoformat()} 00:00:00+00')
+        """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS node_metrics_snapshots_default
+            PARTITION OF node_metrics_snapshots_partitioned DEFAULT
+    """)
+
+    # 3. Старые индексы уступают имена новым: SCHEMA_SQL на старте делает
+    #    CREATE INDEX IF NOT EXISTS по этим именам, и с другими именами на
+    #    секционированной таблице появились бы дубли.
+    op.execute("ALTER INDEX IF EXISTS idx_nms_node_created RENAME TO idx_nms_node_created_old")
+    op.execute("ALTER INDEX IF EXISTS idx_nms_created_at RENAME TO idx_nms_created_at_old")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_nms_node_created
+        ON node_metrics_snapshots_partitioned (node_uuid, created_at)
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_nms_created_at
+        ON node_metrics_snapshots_partitioned (created_at)
+    """)
+
+    # 4. Copy the retention window only — older rows would be dropped anyway
+    cols = ", ".join(SNAPSHOT_COLUMNS)
+    op.execute(f"""
+        INSERT INTO node_metrics_snapshots_partitioned ({cols})
+        SELECT {cols}
+        FROM node_metrics_snapshots
+        WHERE created_at > NOW() - make_interval(days => {RETENTION_DAYS})
+    """)
+
+    # 5. Atomic swap via RENAME
+    op.execute("ALTER TABLE node_metrics_snapshots RENAME TO node_metrics_snapshots_old")
+    op.execute("ALTER TABLE node_metrics_snapshots_partitioned RENAME TO node_metrics_snapshots")
+    op.execute("DROP TABLE IF EXISTS node_metrics_snapshots_old CASCADE")
+
+    # 6. Агрегаты за скопированное окно — чтобы графики не начались с нуля
+    _backfill_rollups()
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS node_metrics_snapshots_regular (
+            id BIGSERIAL PRIMARY KEY,
+            node_uuid UUID NOT NULL REFERENCES nodes(uuid) ON DELETE CASCADE,
+            cpu_usage FLOAT,
+            cpu_cores INTEGER,
+            memory_usage FLOAT,
+            memory_total_bytes BIGINT,
+            memory_used_bytes BIGINT,
+            disk_usage FLOAT,
+            disk_total_bytes BIGINT,
+            disk_used_bytes BIGINT,
+            disk_read_speed_bps BIGINT DEFAULT 0,
+            disk_write_speed_bps BIGINT DEFAULT 0,
+            uptime_seconds INTEGER,
+            net_rx_bps BIGINT,
+            net_tx_bps BIGINT,
+            net_rx_pps BIGINT,
+            net_tx_pps BIGINT,
+            net_rx_drop_ps BIGINT,
+            net_tx_drop_ps BIGINT,
+            conntrack_count INTEGER,
+            conntrack_max INTEGER,
+            tcp_established INTEGER,
+            tcp_syncookies_ps INTEGER,
+            tcp_listen_drop_ps INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """)
+    cols = ", ".join(SNAPSHOT_COLUMNS)
+    # Снимки нод, которых уже нет, не пройдут FK — их и не переносим
+    op.execute(f"""
+        INSERT INTO node_metrics_snapshots_regular ({cols})
+        SELECT {", ".join(f"s.{c}" for c in SNAPSHOT_COLUMNS)}
+        FROM node_metrics_snapshots s
+        JOIN nodes n ON n.uuid = s.node_uuid
+    """)
+    op.execute("DROP TABLE IF EXISTS node_metrics_snapshots CASCADE")
+    op.execute("ALTER TABLE node_metrics_snapshots_regular RENAME TO node_metrics_snapshots")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_nms_node_created
+        ON node_metrics_snapshots (node_uuid, created_at)
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_nms_created_at
+        ON node_metrics_snapshots (created_at)
+    """)
+    for table in ROLLUP_TABLES:
+        op.execute(f"DROP TABLE IF EXISTS {table}")
@@ -0,0 +1,134 @@
+"""Partition torrent_events by day, covering indexes for per-user/per-node reads.
+
+Revision ID: 0103
+Revises: 0102
+Create Date: 2026-10-18
+
+С nDPI-детектом (0100) torrent_events растёт на миллионы строк в неделю, а
+ретеншн был построчным DELETE: вакуум не успевал, таблица пухла, и вставка
+из коллектора начинала тормозить вместе с ней. Теперь:
+
+- torrent_events секционирована по detected_at посуточно, старые дни уходят
+  DROP'ом секции (как node_metrics_snapshots в 0102);
+- индексы покрывающие (INCLUDE): выборки по пользователю, по ноде и сводки
+  за период читают только индекс, не трогая кучу.
+
+Strategy: CREATE partitioned → INSERT retention window → RENAME swap (как 0069).
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import text
+
+revision: str = "0103"
+down_revision: Union[str, None] = "0102"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# torrent_retention_days по умолчанию
+RETENTION_DAYS = 90
+DAYS_AHEAD = 7
+
+EVENT_COLUMNS = (
+    "user_uuid", "user_id", "node_uuid", "ip_address", "destination",
+    "inbound_tag", "outbound_tag", "detected_at", "detected_by",
+)
+
+INDEXES = (
+    ("idx_te_user_date", "(user_uuid, detected_at) INCLUDE (node_uuid, destination, detected_by)"),
+    ("idx_te_node_date", "(node_uuid, detected_at) INCLUDE (user_uuid, destination)"),
+    ("idx_te_detected", "(detected_at) INCLUDE (user_uuid, destination)"),
+)
+
+
+def upgrade() -> None:
+    # Idempotency guard (как в 0069): рестарт контейнера посреди миграции
+    # не должен затеять второй swap поверх уже секционированной таблицы.
+    conn = op.get_bind()
+    relkind = conn.execute(text(
+        "SELECT relkind FROM pg_class "
+        "WHERE relname = 'torrent_events' AND relnamespace = 'public'::regnamespace"
+    )).scalar()
+    if relkind == "p":
+        return
+
+    # 1. Partitioned table
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS torrent_events_partitioned (
+            id BIGSERIAL NOT NULL,
+            user_uuid UUID NOT NULL,
+            user_id BIGINT,
+            node_uuid UUID NOT NULL,
+            ip_address VARCHAR(45) NOT NULL,
+            destination VARCHAR(255) NOT NULL,
+            inbound_tag VARCHAR(100) DEFAULT '',
+            outbound_tag VARCHAR(100) DEFAULT 'TORRENT',
+            detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            detected_by VARCHAR(32) NOT NULL DEFAULT 'xray_routing',
+            PRIMARY KEY (id, detected_at)
+        ) PARTITION BY RANGE (detected_at)
+    """)
+
+    # 2. Daily partitions: retention window back + a week forward + default
+    today = datetime.now(timezone.utc).date()
+    for offset in range(-RETENTION_DAYS, DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        nxt = day + timedelta(days=1)
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS torrent_events_p{day:%Y%m%d}
+                PARTITION OF torrent_events_partitioned
+                FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{nxt.isoformat()} 00:00:00+00')
+        """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS torrent_events_default
+            PARTITION OF torrent_events_partitioned DEFAULT
+    """)
+
+    # 3. Индексы: старые уступают имена (SCHEMA_SQL создаёт их по имени),
+    #    новые — покрывающие, на секционированной таблице.
+    op.execute("ALTER INDEX IF EXISTS idx_te_user_date RENAME TO idx_te_user_date_old")
+    op.execute("ALTER INDEX IF EXISTS idx_te_node_date RENAME TO idx_te_node_date_old")
+    op.execute("ALTER INDEX IF EXISTS idx_te_detected RENAME TO idx_te_detected_old")
+    for name, definition in INDEXES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON torrent_events_partitioned {definition}")
+
+    # 4. Copy the retention window only — older rows would be dropped anyway
+    cols = ", ".join(EVENT_COLUMNS)
+    op.execute(f"""
+        INSERT INTO torrent_events_partitioned ({cols})
+        SELECT {cols}
+        FROM torrent_events
+        WHERE detected_at > NOW() - make_interval(days => {RETENTION_DAYS})
+    """)
+
+    # 5. Atomic swap via RENAME
+    op.execute("ALTER TABLE torrent_events RENAME TO torrent_events_old")
+    op.execute("ALTER TABLE torrent_events_partitioned RENAME TO torrent_events")
+    op.execute("DROP TABLE IF EXISTS torrent_events_old CASCADE")
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS torrent_events_regular (
+            id BIGSERIAL PRIMARY KEY,
+            user_uuid UUID NOT NULL,
+            user_id BIGINT,
+            node_uuid UUID NOT NULL,
+            ip_address VARCHAR(45) NOT NULL,
+            destination VARCHAR(255) NOT NULL,
+            inbound_tag VARCHAR(100) DEFAULT '',
+            outbound_tag VARCHAR(100) DEFAULT 'TORRENT',
+            detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            detected_by VARCHAR(32) NOT NULL DEFAULT 'xray_routing'
+        )
+    """)
+    cols = ", ".join(EVENT_COLUMNS)
+    op.execute(f"""
+        INSERT INTO torrent_events_regular ({cols})
+        SELECT {cols} FROM torrent_events
+    """)
+    op.execute("DROP TABLE IF EXISTS torrent_events CASCADE")
+    op.execute("ALTER TABLE torrent_events_regular RENAME TO torrent_events")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_te_user_date ON torrent_events (user_uuid, detected_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_te_detected ON torrent_events (detected_at)")
@@ -0,0 +1,65 @@
+"""Index squad membership of users for RBAC scoping.
+
+Revision ID: 0104
+Revises: 0103
+Create Date: 2026-10-18
+
+Видимость юзеров по скоупу «сквад» считалась так: выгрузить raw_data всех
+юзеров и разобрать activeInternalSquads в Python. На 100k юзеров это сотни
+мегабайт JSONB по сети на каждое разрешение скоупа.
+
+Теперь членство индексируется там же, где лежит:
+
+- user_internal_squads(raw_data::jsonb) — массив UUID внутренних сквадов в нижнем
+  регистре (панель отдаёт их и строками, и объектами {uuid, name});
+- GIN по этому выражению: «юзеры любого из сквадов» — один `&&` по индексу;
+- индекс по external_squad_uuid — для внешнего сквада.
+
+Отдельная таблица user_squads не понадобилась: индекс по выражению
+обновляется самим Postgres при любой записи юзера — синке, вебхуке,
+upsert'е v3 — и разъехаться с raw_data не может.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0104"
+down_revision: Union[str, None] = "0103"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION user_internal_squads(raw jsonb)
+        RETURNS text[] AS $$
+            SELECT COALESCE(array_agg(DISTINCT sq), '{}')
+            FROM (
+                SELECT lower(btrim(CASE jsonb_typeof(e)
+                    WHEN 'string' THEN e #>> '{}'
+                    WHEN 'object' THEN COALESCE(e->>'uuid', e->>'squadUuid')
+                END)) AS sq
+                FROM jsonb_array_elements(
+                    CASE WHEN jsonb_typeof(raw->'activeInternalSquads') = 'array'
+                         THEN raw->'activeInternalSquads' ELSE '[]'::jsonb END
+                ) AS e
+            ) s
+            WHERE sq IS NOT NULL AND sq <> ''
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+        """
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_internal_squads "
+        "ON users USING GIN (user_internal_squads(raw_data::jsonb))"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_external_squad "
+        "ON users (external_squad_uuid) WHERE external_squad_uuid IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_users_external_squad")
+    op.execute("DROP INDEX IF EXISTS idx_users_internal_squads")
+    op.execute("DROP FUNCTION IF EXISTS user_internal_squads(jsonb)")
@@ -0,0 +1,73 @@
+"""Trigram index for user search.
+
+Revision ID: 0105
+Revises: 0104
+Create Date: 2026-10-18
+
+Поиск юзеров (бот, список v2, публичный v3) фильтровал по
+`LOWER(col) LIKE '%q%'` сразу по нескольким колонкам и `uuid::text` — такой
+OR не ложится ни на один btree и превращается в seq scan на каждое нажатие
+клавиши в поле поиска.
+
+Теперь все искомые поля склеены функцией user_search_text() в одну строку
+в нижнем регистре, а поверх неё — GIN с gin_trgm_ops: подстрочный LIKE
+становится одним bitmap-сканом по индексу. Точные совпадения (uuid,
+short_uuid, telegram_id, числовой id) идут мимо него по обычным btree.
+
+pg_trgm — trusted-расширение (PG13+), его может создать владелец базы. Если
+прав нет или contrib не установлен, миграция не падает: индекс не
+создаётся, поиск работает тем же запросом, просто без ускорения.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0105"
+down_revision: Union[str, None] = "0104"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'pg_trgm is not available, user search stays unindexed';
+        END
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION user_search_text(
+            username text, email text, short_uuid text, uuid uuid, description text
+        ) RETURNS text AS $$
+            SELECT lower(
+                coalesce(username, '') || ' ' || coalesce(email, '') || ' '
+                || coalesce(short_uuid, '') || ' ' || coalesce(uuid::text, '') || ' '
+                || coalesce(description, '')
+            )
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+        """
+    )
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING GIN (
+                    user_search_text(username, email, short_uuid, uuid, description) gin_trgm_ops
+                );
+            END IF;
+        END
+        $$
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_users_search_trgm")
+    op.execute("DROP FUNCTION IF EXISTS user_search_text(text, text, text, uuid, text)")
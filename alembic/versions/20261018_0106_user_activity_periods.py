@@ -0,0 +1,58 @@
+"""Per-period user activity for cohort and churn analytics.
+
+Revision ID: 0106
+Revises: 0105
+Create Date: 2026-10-18
+
+Матрица когорт и отток на каждый промах кэша джойнили users с
+user_connections за месяцы и считали COUNT(DISTINCT user_uuid) по неделям или
+месяцам — один из самых тяжёлых запросов панели. К тому же connected_at у
+активного подключения сдвигается вперёд при каждом батче коллектора, так
+что ранние периоды активности со временем «терялись», а после ретеншна
+user_connections пропадали совсем.
+
+Теперь коллектор при записи батча отмечает факт активности:
+user_activity_periods — одна строка на (гранулярность, период, юзер),
+ON CONFLICT DO NOTHING. Матрица собирается COUNT(*) по этой таблице без
+DISTINCT, объём — юзеры × недели/месяцы активности, а не подключения.
+
+Бэкфилл — из того, что ещё осталось в user_connections. Заодно индекс по
+users.created_at для группировки когорт по дате регистрации.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0106"
+down_revision: Union[str, None] = "0105"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_activity_periods (
+            granularity VARCHAR(8) NOT NULL,
+            period DATE NOT NULL,
+            user_uuid UUID NOT NULL,
+            PRIMARY KEY (granularity, period, user_uuid)
+        )
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO user_activity_periods (granularity, period, user_uuid)
+        SELECT DISTINCT g.granularity, DATE_TRUNC(g.granularity, uc.connected_at)::date, uc.user_uuid
+        FROM user_connections uc
+        CROSS JOIN (VALUES ('week'), ('month')) AS g(granularity)
+        WHERE uc.user_uuid IS NOT NULL AND uc.connected_at IS NOT NULL
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_users_created_at")
+    op.execute("DROP TABLE IF EXISTS user_activity_periods")
@@ -0,0 +1,66 @@
+"""Daily geo rollup of user connections.
+
+Revision ID: 0107
+Revises: 0106
+Create Date: 2026-10-18
+
+Карта и гео-балансировка на каждый промах кэша джойнили user_connections
+с ip_metadata по SPLIT_PART(ip_address::text, '/', 1) = TRIM(im.ip_address) —
+выражение с обеих сторон, индексы не работают, хэш-джойн по всем
+подключениям периода. CIDR-суффиксы из user_connections давно вычищены
+(ensure_connection_partitions), так что сравнивать можно просто строки.
+
+geo_daily_rollup — подключения за сутки по (юзер, нода, IP) с уже
+подставленной геопозицией IP. Заполняет его периодическая компакция
+(refresh_geo_rollup): ip_metadata дозаполняется асинхронно после ingest,
+поэтому последние сутки пересчитываются целиком, пока метаданные не
+доедут. Читатели агрегируют ограниченную по дням таблицу без джойнов.
+
+Бэкфилл — из того, что ещё осталось в user_connections.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0107"
+down_revision: Union[str, None] = "0106"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS geo_daily_rollup (
+            day DATE NOT NULL,
+            user_uuid UUID NOT NULL,
+            node_uuid UUID,
+            ip_address VARCHAR(45) NOT NULL,
+            country_code VARCHAR(2),
+            country_name VARCHAR(100),
+            city VARCHAR(100),
+            latitude NUMERIC(9,6),
+            longitude NUMERIC(9,6),
+            connections INTEGER NOT NULL
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_geo_daily_rollup_day ON geo_daily_rollup (day)")
+    op.execute(
+        """
+        INSERT INTO geo_daily_rollup (
+            day, user_uuid, node_uuid, ip_address, country_code, country_name,
+            city, latitude, longitude, connections
+        )
+        SELECT (uc.connected_at AT TIME ZONE 'UTC')::date, uc.user_uuid, uc.node_uuid, uc.ip_address,
+               im.country_code, im.country_name, im.city, im.latitude, im.longitude, COUNT(*)
+        FROM user_connections uc
+        LEFT JOIN ip_metadata im ON im.ip_address = uc.ip_address
+        WHERE uc.ip_address IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS geo_daily_rollup")
@@ -0,0 +1,42 @@
+"""Panel counters for Prometheus gauges.
+
+Revision ID: 0108
+Revises: 0107
+Create Date: 2026-10-18
+
+Апдейтер Prometheus-гейджей каждые 15 с гонял дюжину COUNT(*) и GROUP BY по
+users, user_connections, violations, user_hwid_devices и torrent_events —
+на больших базах это постоянная фоновая нагрузка сканами, не зависящая от
+того, смотрит ли кто-нибудь на графики.
+
+panel_counters — одна строка на (счётчик, метка). Нарушения ведутся
+инкрементами, users/hwid пересчитываются после синхронизации, подключения —
+коллектором не чаще раза в 15 с, всё вместе — редкой сверкой. Апдейтер
+читает только эту таблицу. Заполнится первой же сверкой при старте.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0108"
+down_revision: Union[str, None] = "0107"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS panel_counters (
+            name VARCHAR(64) NOT NULL,
+            label VARCHAR(64) NOT NULL DEFAULT '',
+            value DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (name, label)
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS panel_counters")
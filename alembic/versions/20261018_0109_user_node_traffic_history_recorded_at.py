@@ -0,0 +1,32 @@
+"""Index user_node_traffic_history by recorded_at.
+
+Revision ID: 0109
+Revises: 0108
+Create Date: 2026-10-18
+
+Монитор скорости трафика раньше листал всех юзеров панели страницами по
+100 и держал снимки в памяти — после рестарта история терялась. Теперь он
+суммирует дельты, которые синхронизация трафика нод уже пишет в
+user_node_traffic_history, за окно по recorded_at. Существующие индексы
+начинаются с node_uuid/user_uuid и выборку по времени не покрывают; новый
+заодно ускоряет очистку истории старше 48 часов.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0109"
+down_revision: Union[str, None] = "0108"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_unt_history_recorded "
+        "ON user_node_traffic_history (recorded_at)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_unt_history_recorded")
@@ -286,17 +286,19 @@ async def run_agent() -> None:
 
                         # Отправка по таймеру
                         current_time = time.monotonic()
-                        if (accumulated_connections or accumulated_torrent_events) and (current_time - last_send_time >= send_interval):
+                        if (accumulated_connections or accumulated_torrent_events) and (current_time - last_send_time >= sender.effective_interval(send_interval)):
                             metrics, net_metrics = await collect_metrics()
                             count = len(accumulated_connections)
+                            # send_batch вычёркивает отправленные куски из списков,
+                            # поэтому при сбое посередине в буфере остаётся только хвост
                             ok = await sender.send_batch(
                                 accumulated_connections,
-                                torrent_events=accumulated_torrent_events if accumulated_torrent_events else None,
+                                torrent_events=accumulated_torrent_events,
                                 system_metrics=metrics,
                                 network_metrics=net_metrics,
                             )
+                            total_sent += count - len(accumulated_connections)
                             if ok:
-                                total_sent += count
                                 accumulated_connections.clear()
                                 accumulated_torrent_events.clear()
                                 last_send_time = current_time
@@ -317,7 +319,7 @@ async def run_agent() -> None:
                 else:
                     # Метрики без подключений
                     current_time = time.monotonic()
-                    if current_time - last_send_time >= send_interval:
+                    if current_time - last_send_time >= sender.effective_interval(send_interval):
                         metrics, net_metrics = await collect_metrics()
                         ok = await sender.send_batch(
                             [], system_metrics=metrics, network_metrics=net_metrics
@@ -338,8 +340,13 @@ async def run_agent() -> None:
             except Exception as e:
                 logger.exception("Cycle #%d error: %s", cycle_count, e)
 
+            # В polling каждый цикл — это отправка, поэтому и ждём по подсказке
+            # бэкенда; в realtime темп отправки держит проверка выше
+            wait_interval = check_interval
+            if settings.log_parsing_mode.lower() != "realtime":
+                wait_interval = sender.effective_interval(check_interval)
             try:
-                await asyncio.wait_for(shutdown_event.wait(), timeout=check_interval)
+                await asyncio.wait_for(shutdown_event.wait(), timeout=wait_interval)
             except asyncio.TimeoutError:
                 pass
 
@@ -349,12 +356,12 @@ async def run_agent() -> None:
                 "Shutdown: sending remaining %d connections, %d torrent events...",
                 len(accumulated_connections), len(accumulated_torrent_events),
             )
-            ok = await sender.send_batch(
+            count = len(accumulated_connections)
+            await sender.send_batch(
                 accumulated_connections,
-                torrent_events=accumulated_torrent_events if accumulated_torrent_events else None,
+                torrent_events=accumulated_torrent_events,
             )
-            if ok:
-                total_sent += len(accumulated_connections)
+            total_sent += count - len(accumulated_connections)
 
     finally:
         # Stop WS client
@@ -12,6 +12,11 @@ from .models import BatchReport, ConnectionReport, NetworkMetrics, SystemMetrics
 
 logger = logging.getLogger(__name__)
 
+# Жёсткие пределы Collector API (BatchReport на бэкенде): батч больше —
+# 422, и повтор того же батча не поможет никогда
+MAX_BATCH_CONNECTIONS = 5000
+MAX_BATCH_TORRENT_EVENTS = 1000
+
 
 class CollectorSender:
     """HTTP-клиент для отправки данных в Collector."""
@@ -22,6 +27,11 @@ class CollectorSender:
         self._health_url = f"{settings.collector_url.rstrip('/')}/api/v2/collector/health"
         self._headers = {"Authorization": f"Bearer {settings.auth_token}"}
         self._client: httpx.AsyncClient | None = None
+        # Подсказки темпа из ответов /batch: бэкенд видит свою очередь и
+        # под нагрузкой просит слать реже и мельче
+        self.recommended_interval: float = 0.0
+        self.max_batch_size: int = MAX_BATCH_CONNECTIONS
+        self.min_interval: float = 1.0
 
     async def _get_client(self) -> httpx.AsyncClient:
         """Возвращает переиспользуемый httpx клиент."""
@@ -51,6 +61,34 @@ class CollectorSender:
             logger.warning("Collector API unreachable: %s", e)
             return False
 
+    def effective_interval(self, base: float) -> float:
+        """Интервал отправки с учётом подсказки бэкенда: реже можно, чаще — нет."""
+        return max(base, self.recommended_interval)
+
+    def _apply_flow_hints(self, resp: httpx.Response) -> None:
+        """Запомнить подсказки темпа из ответа. Старый бэкенд их не шлёт — тогда ничего не меняем."""
+        try:
+            data = resp.json()
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+        try:
+            interval = float(data.get("recommended_interval_seconds", self.recommended_interval))
+            max_batch = int(data.get("max_batch_size", self.max_batch_size))
+            min_interval = float(data.get("min_interval_seconds", self.min_interval))
+        except (TypeError, ValueError):
+            return
+        max_batch = max(1, min(max_batch, MAX_BATCH_CONNECTIONS))
+        if interval != self.recommended_interval or max_batch != self.max_batch_size:
+            logger.info(
+                "Collector flow control: interval>=%.1fs, max batch %d",
+                interval, max_batch,
+            )
+        self.recommended_interval = max(0.0, interval)
+        self.max_batch_size = max_batch
+        self.min_interval = max(0.0, min_interval)
+
     async def send_batch(
         self,
         connections: list[ConnectionReport],
@@ -58,17 +96,51 @@ class CollectorSender:
         system_metrics: SystemMetrics | None = None,
         network_metrics: NetworkMetrics | None = None,
     ) -> bool:
-        """Отправить батч подключений, торрент-событий и метрик. Возвращает True при успехе."""
+        """Отправить подключения, торрент-события и метрики. Возвращает True при успехе.
+
+        Больше max_batch_size за раз не шлём: список режется на куски, между
+        кусками выдерживается min_interval (иначе 429). Отправленные куски
+        удаляются из переданных списков — при сбое посередине повтор не
+        продублирует уже принятое бэкендом.
+        """
         if not connections and not system_metrics and not torrent_events:
             return True
 
+        torrent_events = torrent_events if torrent_events is not None else []
+        first = True
+        while first or connections or torrent_events:
+            conn_chunk = connections[:self.max_batch_size]
+            torrent_chunk = torrent_events[:MAX_BATCH_TORRENT_EVENTS]
+            if not first:
+                await asyncio.sleep(self.min_interval)
+            # Метрики — только в первом куске: это снимок, а не поток
+            ok = await self._send_report(
+                conn_chunk, torrent_chunk,
+                system_metrics if first else None,
+                network_metrics if first else None,
+            )
+            if not ok:
+                return False
+            del connections[:len(conn_chunk)]
+            del torrent_events[:len(torrent_chunk)]
+            first = False
+        return True
+
+    async def _send_report(
+        self,
+        connections: list[ConnectionReport],
+        torrent_events: list[TorrentEvent],
+        system_metrics: SystemMetrics | None,
+        network_metrics: NetworkMetrics | None,
+    ) -> bool:
+        """Один POST /batch с повторами. Возвращает True при успехе."""
         from .version import AGENT_VERSION
 
         report = BatchReport(
             node_uuid=self.settings.node_uuid,
             timestamp=datetime.now(timezone.utc).replace(tzinfo=None),
             connections=connections,
-            torrent_events=torrent_events or [],
+            torrent_events=torrent_events,
             system_metrics=system_metrics,
             network_metrics=network_metrics,
             agent_version=AGENT_VERSION,
@@ -76,9 +148,11 @@ class CollectorSender:
         payload = report.model_dump(mode="json")
 
         for attempt in range(1, self.settings.send_max_retries + 1):
+            retry_delay = self.settings.send_retry_delay_seconds
             try:
                 client = await self._get_client()
                 resp = await client.post(self._url, json=payload)
+                self._apply_flow_hints(resp)
                 resp.raise_for_status()
                 # Любой 2xx после raise_for_status = успех
                 logger.debug("Batch sent: %d connections, %s metrics",
@@ -89,6 +163,13 @@ class CollectorSender:
                     "Collector %s (attempt %d/%d)",
                     e.response.status_code, attempt, self.settings.send_max_retries,
                 )
+                if e.response.status_code == 429:
+                    # Бэкенд сам сказал, когда приходить — ждём не меньше
+                    try:
+                        retry_after = float(e.response.headers.get("Retry-After", 0))
+                    except ValueError:
+                        retry_after = 0.0
+                    retry_delay = max(retry_delay, retry_after, self.min_interval)
             except Exception as e:
                 logger.warning(
                     "Send failed (attempt %d/%d): %s",
@@ -96,7 +177,7 @@ class CollectorSender:
                 )
 
             if attempt < self.settings.send_max_retries:
-                await asyncio.sleep(self.settings.send_retry_delay_seconds)
+                await asyncio.sleep(retry_delay)
 
         logger.error("Batch failed after %d attempts (%d connections lost)",
                       self.settings.send_max_retries, len(connections))
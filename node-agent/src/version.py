@@ -5,4 +5,4 @@
 значения синхронно, иначе панель будет вечно предлагать обновление.
 """
 
-AGENT_VERSION = "1.5.0"
+AGENT_VERSION = "1.6.0"
@@ -17,6 +17,7 @@ from shared.db.finance_accounts import FinanceAccountsMixin
 from shared.db.config_versions import ConfigVersionsMixin
 from shared.db.user_presets import UserPresetsMixin
 from shared.db.bscheck import BscheckMixin
+from shared.db.counters import CountersMixin
 
 
 class DatabaseService(
@@ -31,6 +32,7 @@ class DatabaseService(
     ConfigVersionsMixin,
     UserPresetsMixin,
     BscheckMixin,
+    CountersMixin,
     DatabaseBase,
 ):
     """Async database service assembled from mixin modules."""
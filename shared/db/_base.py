@@ -101,6 +101,36 @@ CREATE TABLE IF NOT EXISTS node_metrics_snapshots (
 
 CREATE INDEX IF NOT EXISTS idx_nms_node_created ON node_metrics_snapshots(node_uuid, created_at);
 
+-- Агрегаты метрик нод по минутам и часам (пополняются вместе со снимком,
+-- секционирование самой node_metrics_snapshots — alembic 0102)
+CREATE TABLE IF NOT EXISTS node_metrics_rollup_1m (
+    node_uuid UUID NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    cpu_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    cpu_max DOUBLE PRECISION,
+    memory_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    memory_max DOUBLE PRECISION,
+    disk_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    disk_max DOUBLE PRECISION,
+    PRIMARY KEY (node_uuid, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_node_metrics_rollup_1m_bucket ON node_metrics_rollup_1m(bucket);
+
+CREATE TABLE IF NOT EXISTS node_metrics_rollup_1h (
+    node_uuid UUID NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    cpu_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    cpu_max DOUBLE PRECISION,
+    memory_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    memory_max DOUBLE PRECISION,
+    disk_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    disk_max DOUBLE PRECISION,
+    PRIMARY KEY (node_uuid, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_node_metrics_rollup_1h_bucket ON node_metrics_rollup_1h(bucket);
+
 -- Торрент-события
 CREATE TABLE IF NOT EXISTS torrent_events (
     id BIGSERIAL PRIMARY KEY,
@@ -114,8 +144,9 @@ CREATE TABLE IF NOT EXISTS torrent_events (
     detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     detected_by VARCHAR(32) NOT NULL DEFAULT 'xray_routing'
 );
-CREATE INDEX IF NOT EXISTS idx_te_user_date ON torrent_events(user_uuid, detected_at);
-CREATE INDEX IF NOT EXISTS idx_te_detected ON torrent_events(detected_at);
+CREATE INDEX IF NOT EXISTS idx_te_user_date ON torrent_events(user_uuid, detected_at) INCLUDE (node_uuid, destination, detected_by);
+CREATE INDEX IF NOT EXISTS idx_te_node_date ON torrent_events(node_uuid, detected_at) INCLUDE (user_uuid, destination);
+CREATE INDEX IF NOT EXISTS idx_te_detected ON torrent_events(detected_at) INCLUDE (user_uuid, destination);
 
 -- Хосты
 CREATE TABLE IF NOT EXISTS hosts (
@@ -243,6 +274,9 @@ class DatabaseBase:
         self._whitelist_table_available: Optional[bool] = None  # None = not checked yet
         self._whitelist_column_available: Optional[bool] = None  # excluded_analyzers column
         self._raw_data_id_cache: Dict[str, tuple] = {}  # {user_id: (uuid_or_None, monotonic_ts)}
+        self._panel_counters_at: Dict[str, float] = {}  # {group: monotonic_ts} — троттлинг refresh_panel_counters
+        self._panel_counters_pending: Set[str] = set()  # группы, ждущие отложенного пересчёта
+        self._panel_counters_task: Optional[asyncio.Task] = None
     
     @property
     def is_connected(self) -> bool:
@@ -461,6 +495,121 @@ class DatabaseBase:
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_tag ON users(tag) WHERE tag IS NOT NULL")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_hosts_tag ON hosts(tag) WHERE tag IS NOT NULL")
 
+        # v3.2.0: членство в сквадах для RBAC-скоупа (get_user_uuids_by_squads).
+        # Аналог alembic-миграции 0104 для инсталляций без alembic.
+        try:
+            await conn.execute(
+                """
+                CREATE OR REPLACE FUNCTION user_internal_squads(raw jsonb)
+                RETURNS text[] AS $$
+                    SELECT COALESCE(array_agg(DISTINCT sq), '{}')
+                    FROM (
+                        SELECT lower(btrim(CASE jsonb_typeof(e)
+                            WHEN 'string' THEN e #>> '{}'
+                            WHEN 'object' THEN COALESCE(e->>'uuid', e->>'squadUuid')
+                        END)) AS sq
+                        FROM jsonb_array_elements(
+                            CASE WHEN jsonb_typeof(raw->'activeInternalSquads') = 'array'
+                                 THEN raw->'activeInternalSquads' ELSE '[]'::jsonb END
+                        ) AS e
+                    ) s
+                    WHERE sq IS NOT NULL AND sq <> ''
+                $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+                """
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_internal_squads "
+                "ON users USING GIN (user_internal_squads(raw_data::jsonb))"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_external_squad "
+                "ON users (external_squad_uuid) WHERE external_squad_uuid IS NOT NULL"
+            )
+        except Exception as e:
+            logger.warning("Migration: skip squad membership index on users: %s", e)
+
+        # v3.2.0: поиск юзеров (user_search_sql). Аналог alembic-миграции 0105.
+        # Функция нужна запросам всегда, индекс — только при наличии pg_trgm.
+        await conn.execute(
+            """
+            CREATE OR REPLACE FUNCTION user_search_text(
+                username text, email text, short_uuid text, uuid uuid, description text
+            ) RETURNS text AS $$
+                SELECT lower(
+                    coalesce(username, '') || ' ' || coalesce(email, '') || ' '
+                    || coalesce(short_uuid, '') || ' ' || coalesce(uuid::text, '') || ' '
+                    || coalesce(description, '')
+                )
+            $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+            """
+        )
+        try:
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING GIN ("
+                "user_search_text(username, email, short_uuid, uuid, description) gin_trgm_ops)"
+            )
+        except Exception as e:
+            logger.info("Migration: pg_trgm unavailable, user search stays unindexed: %s", e)
+
+        # Аналог alembic-миграции 0106: активность юзеров по периодам пишет
+        # коллектор в той же транзакции, что и подключения — таблица нужна
+        # до первого батча.
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_activity_periods (
+                granularity VARCHAR(8) NOT NULL,
+                period DATE NOT NULL,
+                user_uuid UUID NOT NULL,
+                PRIMARY KEY (granularity, period, user_uuid)
+            )
+            """
+        )
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+
+        # Аналог alembic-миграции 0107: суточный гео-агрегат подключений,
+        # его наполняет refresh_geo_rollup из цикла обслуживания.
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geo_daily_rollup (
+                day DATE NOT NULL,
+                user_uuid UUID NOT NULL,
+                node_uuid UUID,
+                ip_address VARCHAR(45) NOT NULL,
+                country_code VARCHAR(2),
+                country_name VARCHAR(100),
+                city VARCHAR(100),
+                latitude NUMERIC(9,6),
+                longitude NUMERIC(9,6),
+                connections INTEGER NOT NULL
+            )
+            """
+        )
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_geo_daily_rollup_day ON geo_daily_rollup (day)")
+
+        # Аналог alembic-миграции 0108: счётчики для Prometheus-гейджей.
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS panel_counters (
+                name VARCHAR(64) NOT NULL,
+                label VARCHAR(64) NOT NULL DEFAULT '',
+                value DOUBLE PRECISION NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (name, label)
+            )
+            """
+        )
+
+        # Аналог alembic-миграции 0109: монитор скорости трафика выбирает
+        # историю дельт по окну recorded_at.
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_unt_history_recorded "
+                "ON user_node_traffic_history (recorded_at)"
+            )
+        except Exception as e:
+            logger.warning("Migration: skip recorded_at index on user_node_traffic_history: %s", e)
+
         # Remove stale tokens sync metadata (tokens sync removed)
         await conn.execute("DELETE FROM sync_metadata WHERE key = 'tokens'")
 
@@ -476,6 +625,7 @@ class DatabaseBase:
         ALLOWED_TABLES = frozenset({
             "user_connections", "violations",
             "node_metrics_snapshots", "torrent_events",
+            "geo_daily_rollup",
         })
 
         for table in ALLOWED_TABLES:
@@ -486,6 +636,105 @@ class DatabaseBase:
             except Exception as e:
                 logger.warning("VACUUM ANALYZE %s failed: %s", table, e)
 
+    async def _estimate_count(self, conn, query: str, *args) -> int:
+        """Planner's row estimate for ``query`` — EXPLAIN only, nothing is scanned.
+
+        Для списков с total_mode="estimate": точный COUNT(*) по 100k+ строк
+        на каждую страницу обходится дороже самой страницы.
+        """
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    # ── Посуточные секции (node_metrics_snapshots и др.) ──────────
+    # Секции именуются {parent}_pYYYYMMDD и покрывают сутки по UTC. Таблица
+    # секционируется alembic-миграцией; на инсталляции без alembic она
+    # остаётся кучей — тогда helpers ничего не делают, а вызывающий откатывается
+    # на пакетный DELETE.
+
+    async def _is_partitioned(self, conn, table: str) -> bool:
+        relkind = await conn.fetchval(
+            "SELECT relkind::text FROM pg_class "
+            "WHERE relname = $1 AND relnamespace = 'public'::regnamespace",
+            table,
+        )
+        return relkind == "p"
+
+    async def _ensure_daily_partitions(self, parent: str, days_ahead: int = 7) -> int:
+        """Create daily partitions of ``parent`` for today and ``days_ahead`` days forward."""
+        if not self.is_connected:
+            return 0
+        from datetime import timedelta
+        created = 0
+        async with self.acquire() as conn:
+            if not await self._is_partitioned(conn, parent):
+                return 0
+            today = datetime.now(timezone.utc).date()
+            for offset in range(days_ahead + 1):
+                day = today + timedelta(days=offset)
+                name = f"{parent}_p{day:%Y%m%d}"
+                if await conn.fetchval("SELECT 1 FROM pg_class WHERE relname = $1", name):
+                    continue
+                nxt = day + timedelta(days=1)
+                try:
+                    await conn.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {name}
+                        PARTITION OF {parent}
+                        FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{nxt.isoformat()} 00:00:00+00')
+                    """)
+                except Exception as e:
+                    # Строки за этот день уже осели в _default — секцию не создать,
+                    # но остальные дни от этого не зависят.
+                    logger.warning("Failed to create partition %s: %s", name, e)
+                    continue
+                created += 1
+                logger.info("Created partition %s", name)
+        return created
+
+    async def _drop_daily_partitions_before(self, parent: str, retention_days: int) -> Optional[int]:
+        """Drop daily partitions of ``parent`` lying entirely outside the retention window.
+
+        Returns the number of dropped partitions, or None when ``parent`` is
+        not partitioned and the caller has to fall back to row-level DELETE.
+        """
+        import re
+        from datetime import timedelta
+        name_re = re.compile(rf"^{re.escape(parent)}_p(\d{{8}})$")
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+        dropped = 0
+        async with self.acquire() as conn:
+            if not await self._is_partitioned(conn, parent):
+                return None
+            children = await conn.fetch(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class p ON i.inhparent = p.oid
+                JOIN pg_class c ON i.inhrelid = c.oid
+                WHERE p.relname = $1
+                ORDER BY c.relname
+                """,
+                parent,
+            )
+            for child in children:
+                name = child["relname"]
+                match = name_re.match(name)
+                if not match:
+                    continue
+                try:
+                    day = datetime.strptime(match.group(1), "%Y%m%d").date()
+                except ValueError:
+                    continue
+                # Секция покрывает [day, day+1) — дропаем, только если вся она старше cutoff
+                if day + timedelta(days=1) > cutoff:
+                    continue
+                await conn.execute(f"ALTER TABLE {parent} DETACH PARTITION {name}")
+                await conn.execute(f"DROP TABLE {name}")
+                logger.info("Dropped partition %s", name)
+                dropped += 1
+        return dropped
+
     async def get_table_stats(self) -> List[Dict[str, Any]]:
         """Get size and dead tuple stats for monitoring."""
         if not self.is_connected:
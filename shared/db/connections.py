@@ -10,9 +10,48 @@ from typing import Any, Dict, List, Optional
 import asyncpg
 
 from shared.logger import logger
-from shared.db_schema import USER_CONNECTIONS_TABLE, VIOLATIONS_TABLE, USERS_TABLE, NODES_TABLE
+from shared.db_schema import (
+    USER_ACTIVITY_PERIODS_TABLE, USER_CONNECTIONS_TABLE, VIOLATIONS_TABLE, USERS_TABLE, NODES_TABLE,
+    TORRENT_EVENTS_TABLE, GEO_DAILY_ROLLUP_TABLE, IP_METADATA_TABLE,
+)
 from shared.db_query import select_sql, insert_sql, update_sql, delete_sql
 
+# С какого размера батча писать через COPY вместо UNNEST. На малых батчах
+# лишний round-trip COPY съедает выигрыш, на больших бинарный COPY в разы
+# дешевле и для asyncpg (без кодирования массивов), и для Postgres.
+# Порог — по замерам scripts/bench_ingest.py.
+COPY_INGEST_THRESHOLD = 1000
+
+# Промежуточная таблица для COPY-пути batch_upsert_connections. Временная:
+# в WAL не пишется (как UNLOGGED), у каждого соединения пула своя — параллельные
+# батчи разных нод друг другу не мешают, а ON COMMIT DELETE ROWS чистит её
+# после каждой транзакции без пересоздания.
+_CONNECTIONS_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS _ingest_connections (
+        user_uuid UUID,
+        ip_address TEXT,
+        node_uuid UUID,
+        device_info JSONB,
+        connected_at TIMESTAMPTZ
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Отметка активности юзеров по неделям и месяцам (alembic 0106) — из неё
+# строятся матрица когорт и отток. {source} — строки батча с uid и ca;
+# ORDER BY — единый порядок блокировок для параллельных батчей.
+_ACTIVITY_UPSERT = f"""
+    INSERT INTO {USER_ACTIVITY_PERIODS_TABLE} (granularity, period, user_uuid)
+    SELECT DISTINCT g.granularity, DATE_TRUNC(g.granularity, batch.ca)::date, batch.uid
+    FROM ({{source}}) batch
+    CROSS JOIN (VALUES ('week'), ('month')) AS g(granularity)
+    ORDER BY 1, 2, 3
+    ON CONFLICT DO NOTHING
+"""
+
+# Когорты и отток смотрят назад до 24 месяцев (months<=24 в API) — отметки
+# активности живут дольше самих подключений, но не вечно.
+ACTIVITY_PERIODS_RETENTION_DAYS = 750
+
 
 class ConnectionsMixin:
     # ==================== User Connections (for future device tracking) ====================
@@ -135,6 +174,11 @@ class ConnectionsMixin:
                         insert_time
                     )
 
+                await conn.execute(
+                    _ACTIVITY_UPSERT.format(source="SELECT $1::uuid AS uid, $2::timestamptz AS ca"),
+                    user_uuid, connected_at or datetime.utcnow(),
+                )
+
                 # Закрываем старые подключения с другими IP (общее для обоих веток)
                 await conn.execute(
                     update_sql(
@@ -184,39 +228,52 @@ class ConnectionsMixin:
         # and prevent deadlocks when concurrent batches touch the same rows
         connections = [deduped[k] for k in sorted(deduped.keys())]
 
-        user_uuids = []
-        ip_addresses = []
-        node_uuids = []
-        device_infos = []
-        connected_ats = []
-
+        rows = []
         for c in connections:
-            user_uuids.append(str(c["user_uuid"]))
             ip = str(c["ip_address"])
             if '/' in ip:
                 ip = ip.split('/')[0]
-            ip_addresses.append(ip)
-            node_uuids.append(str(c["node_uuid"]) if c.get("node_uuid") else None)
-            device_infos.append(json.dumps(c["device_info"]) if c.get("device_info") else None)
             ca = c.get("connected_at")
             if ca and isinstance(ca, str):
                 try:
                     ca = datetime.fromisoformat(ca.replace('Z', '+00:00'))
                 except ValueError:
                     ca = None
-            connected_ats.append(ca or datetime.utcnow())
+            rows.append((
+                str(c["user_uuid"]),
+                ip,
+                str(c["node_uuid"]) if c.get("node_uuid") else None,
+                json.dumps(c["device_info"]) if c.get("device_info") else None,
+                ca or datetime.utcnow(),
+            ))
 
         async with self.acquire() as conn:
             async with conn.transaction():
-                # Detect ip_address column type (INET vs VARCHAR) — cache once
-                if not hasattr(self, '_ip_col_is_inet'):
-                    col_type = await conn.fetchval(
-                        "SELECT data_type FROM information_schema.columns "
-                        "WHERE table_name = 'user_connections' AND column_name = 'ip_address'"
-                    )
-                    self._ip_col_is_inet = (col_type == 'inet')
+                ip_cast = "::inet" if await self._connections_ip_is_inet(conn) else ""
 
-                ip_cast = "::inet" if self._ip_col_is_inet else ""
+                # Источник строк батча для трёх шагов ниже: либо UNNEST по
+                # массивам-параметрам, либо временная таблица, залитая COPY.
+                if len(rows) >= COPY_INGEST_THRESHOLD:
+                    await conn.execute(_CONNECTIONS_STAGING_DDL)
+                    await conn.copy_records_to_table(
+                        "_ingest_connections",
+                        records=rows,
+                        columns=["user_uuid", "ip_address", "node_uuid", "device_info", "connected_at"],
+                    )
+                    source = f"""
+                        SELECT user_uuid AS uid, ip_address{ip_cast} AS ip,
+                               node_uuid AS n, device_info AS d, COALESCE(connected_at, NOW()) AS ca
+                        FROM _ingest_connections
+                    """
+                    args: list = []
+                else:
+                    source = f"""
+                        SELECT u::uuid AS uid, u_ip{ip_cast} AS ip,
+                               n::uuid AS n, d::jsonb AS d, COALESCE(t, NOW()) AS ca
+                        FROM UNNEST($1::text[], $2::text[], $3::text[], $4::text[], $5::timestamptz[])
+                            AS t(u, u_ip, n, d, t)
+                    """
+                    args = [list(col) for col in zip(*rows)]
 
                 # 1a. Update existing active connections (match by user_uuid + ip_address)
                 # Two-step approach: partitioned tables require partition key in
@@ -228,17 +285,12 @@ class ConnectionsMixin:
                     SET connected_at = GREATEST(uc.connected_at, batch.ca),
                         node_uuid = COALESCE(batch.n, uc.node_uuid),
                         device_info = COALESCE(batch.d, uc.device_info)
-                    FROM (
-                        SELECT u::uuid AS uid, u_ip{ip_cast} AS ip,
-                               n::uuid AS n, d::jsonb AS d, COALESCE(t, NOW()) AS ca
-                        FROM UNNEST($1::text[], $2::text[], $3::text[], $4::text[], $5::timestamptz[])
-                            AS t(u, u_ip, n, d, t)
-                    ) batch
+                    FROM ({source}) batch
                     WHERE uc.user_uuid = batch.uid
                       AND uc.ip_address::text = batch.ip::text
                       AND uc.disconnected_at IS NULL
                     """,
-                    user_uuids, ip_addresses, node_uuids, device_infos, connected_ats,
+                    *args,
                 )
                 updated = int(update_result.split()[-1]) if update_result else 0
 
@@ -246,37 +298,35 @@ class ConnectionsMixin:
                 insert_result = await conn.execute(
                     f"""
                     INSERT INTO {USER_CONNECTIONS_TABLE} (user_uuid, ip_address, node_uuid, device_info, connected_at)
-                    SELECT u::uuid, u_ip{ip_cast}, n::uuid, d::jsonb, COALESCE(t, NOW())
-                    FROM UNNEST($1::text[], $2::text[], $3::text[], $4::text[], $5::timestamptz[])
-                        AS t(u, u_ip, n, d, t)
+                    SELECT batch.uid, batch.ip, batch.n, batch.d, batch.ca
+                    FROM ({source}) batch
                     WHERE NOT EXISTS (
                         SELECT 1 FROM {USER_CONNECTIONS_TABLE} uc
-                        WHERE uc.user_uuid = u::uuid
-                          AND uc.ip_address::text = u_ip::text
+                        WHERE uc.user_uuid = batch.uid
+                          AND uc.ip_address::text = batch.ip::text
                           AND uc.disconnected_at IS NULL
                     )
                     """,
-                    user_uuids, ip_addresses, node_uuids, device_infos, connected_ats,
+                    *args,
                 )
                 inserted = int(insert_result.split()[-1]) if insert_result else 0
                 upserted = updated + inserted
 
+                await conn.execute(_ACTIVITY_UPSERT.format(source=source), *args)
+
                 # 2. Close stale connections — IPs not in this batch, older than threshold
                 # Cast ip_address to text for comparison (works with both INET and VARCHAR)
                 close_result = await conn.execute(
                     f"""
                     UPDATE {USER_CONNECTIONS_TABLE} uc
                     SET disconnected_at = NOW()
-                    FROM (
-                        SELECT DISTINCT u::uuid AS uid, i{ip_cast} AS ip
-                        FROM UNNEST($1::text[], $2::text[]) AS t(u, i)
-                    ) batch
+                    FROM (SELECT DISTINCT uid, ip FROM ({source}) s) batch
                     WHERE uc.user_uuid = batch.uid
                       AND uc.ip_address::text != batch.ip::text
                       AND uc.disconnected_at IS NULL
-                      AND uc.connected_at < NOW() - make_interval(mins => $3)
+                      AND uc.connected_at < NOW() - make_interval(mins => ${len(args) + 1})
                     """,
-                    user_uuids, ip_addresses, stale_threshold_minutes,
+                    *args, stale_threshold_minutes,
                 )
                 closed = int(close_result.split()[-1]) if close_result else 0
 
@@ -522,10 +572,35 @@ class ConnectionsMixin:
             return int(result.split()[-1]) if result else 0
 
     async def cleanup_old_connections(self, retention_days: int = 30, batch_size: int = 5000) -> int:
-        """Drop old partitions or delete old rows from user_connections."""
+        """Drop old partitions or delete old rows from user_connections.
+
+        Суточный гео-агрегат (geo_daily_rollup) подрезается по тому же сроку,
+        отметки активности (user_activity_periods) — по горизонту аналитики
+        ACTIVITY_PERIODS_RETENTION_DAYS, но не раньше самих подключений.
+        """
         if not self.is_connected:
             return 0
         total = 0
+        try:
+            async with self.acquire() as conn:
+                await conn.execute(
+                    delete_sql(GEO_DAILY_ROLLUP_TABLE,
+                        "day < (NOW() AT TIME ZONE 'UTC')::date - $1::int"),
+                    retention_days,
+                )
+        except Exception as e:
+            logger.warning("geo_daily_rollup retention failed: %s", e)
+        try:
+            async with self.acquire() as conn:
+                # granularity в условии — чтобы удаление шло по первичному ключу
+                await conn.execute(
+                    delete_sql(USER_ACTIVITY_PERIODS_TABLE,
+                        "granularity IN ('week', 'month') "
+                        "AND period < (NOW() AT TIME ZONE 'UTC')::date - $1::int"),
+                    max(retention_days, ACTIVITY_PERIODS_RETENTION_DAYS),
+                )
+        except Exception as e:
+            logger.warning("user_activity_periods retention failed: %s", e)
         try:
             async with self.acquire() as conn:
                 # Try partition-based cleanup: find and detach+drop old partitions
@@ -646,6 +721,72 @@ class ConnectionsMixin:
             logger.warning("ensure_connection_partitions failed: %s", e)
             return 0
 
+    async def _connections_ip_is_inet(self, conn) -> bool:
+        """Detect user_connections.ip_address type (INET vs VARCHAR) — cached once.
+
+        Таблица из _run_migrations создаётся с INET, из alembic (и после
+        секционирования) — VARCHAR.
+        """
+        if not hasattr(self, '_ip_col_is_inet'):
+            col_type = await conn.fetchval(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'user_connections' AND column_name = 'ip_address'"
+            )
+            self._ip_col_is_inet = (col_type == 'inet')
+        return self._ip_col_is_inet
+
+    async def refresh_geo_rollup(self, days: int = 2) -> int:
+        """Пересчитать суточный гео-агрегат подключений за последние days суток.
+
+        Сутки пересчитываются целиком (DELETE + INSERT в одной транзакции):
+        connected_at активных подключений сдвигается вперёд, а ip_metadata
+        дозаполняется уже после ingest — строки без геопозиции сегодня
+        получат её при следующем проходе. Джойн — прямое сравнение строк,
+        по PK ip_metadata; INET-колонка (установки без alembic) сначала
+        приводится к тексту без маски через host(). Старые сутки удаляет
+        cleanup_old_connections вместе с самими подключениями.
+
+        Returns:
+            Сколько строк агрегата записано.
+        """
+        if not self.is_connected:
+            return 0
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    # Несколько реплик с одним циклом обслуживания не должны
+                    # пересчитывать одни и те же сутки одновременно — задвоят строки.
+                    if not await conn.fetchval(
+                        "SELECT pg_try_advisory_xact_lock(hashtext($1))", GEO_DAILY_ROLLUP_TABLE,
+                    ):
+                        return 0
+                    ip = "host(uc.ip_address)" if await self._connections_ip_is_inet(conn) else "uc.ip_address"
+                    start = await conn.fetchval(
+                        "SELECT (NOW() AT TIME ZONE 'UTC')::date - $1::int", max(1, days) - 1,
+                    )
+                    await conn.execute(delete_sql(GEO_DAILY_ROLLUP_TABLE, "day >= $1"), start)
+                    result = await conn.execute(
+                        f"""
+                        INSERT INTO {GEO_DAILY_ROLLUP_TABLE} (
+                            day, user_uuid, node_uuid, ip_address, country_code, country_name,
+                            city, latitude, longitude, connections
+                        )
+                        SELECT (uc.connected_at AT TIME ZONE 'UTC')::date, uc.user_uuid, uc.node_uuid,
+                               {ip}, im.country_code, im.country_name, im.city,
+                               im.latitude, im.longitude, COUNT(*)
+                        FROM {USER_CONNECTIONS_TABLE} uc
+                        LEFT JOIN {IP_METADATA_TABLE} im ON im.ip_address = {ip}
+                        WHERE uc.connected_at >= $1::date AT TIME ZONE 'UTC'
+                          AND uc.ip_address IS NOT NULL
+                        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+                        """,
+                        start,
+                    )
+            return int(result.split()[-1]) if result and result.split() else 0
+        except Exception as e:
+            logger.warning("refresh_geo_rollup failed: %s", e)
+            return 0
+
     # ==================== Torrent Events ====================
 
     async def save_torrent_event(
@@ -681,7 +822,8 @@ class ConnectionsMixin:
 
     async def batch_save_torrent_events(self, events: list) -> int:
         """
-        Batch INSERT торрент-событий через UNNEST (один round-trip вместо N).
+        Batch INSERT торрент-событий через UNNEST (один round-trip вместо N),
+        для больших батчей — через COPY.
 
         Args:
             events: Список словарей с ключами:
@@ -714,13 +856,31 @@ class ConnectionsMixin:
                 detected_bys.append(ev.get("detected_by") or "xray_routing")
 
             async with self.acquire() as conn:
+                if len(events) >= COPY_INGEST_THRESHOLD:
+                    # Таблица только дописывается — сливать нечего, COPY прямо в неё
+                    # (в нужные суточные секции строки разложит сам Postgres).
+                    now = datetime.now(timezone.utc)
+                    result = await conn.copy_records_to_table(
+                        TORRENT_EVENTS_TABLE,
+                        records=zip(
+                            user_uuids, node_uuids, ip_addresses, destinations,
+                            inbound_tags, outbound_tags,
+                            (da or now for da in detected_ats), detected_bys,
+                        ),
+                        columns=[
+                            "user_uuid", "node_uuid", "ip_address", "destination",
+                            "inbound_tag", "outbound_tag", "detected_at", "detected_by",
+                        ],
+                    )
+                    return int(result.split()[-1]) if result else 0
+
                 result = await conn.execute(
                     """
                     INSERT INTO torrent_events (
                         user_uuid, node_uuid, ip_address, destination,
                         inbound_tag, outbound_tag, detected_at, detected_by
                     )
-                    SELECT u, n, ip, dst, itag, otag, COALESCE(da, NOW()), db
+                    SELECT u::uuid, n::uuid, ip, dst, itag, otag, COALESCE(da, NOW()), db
                     FROM UNNEST(
                         $1::text[], $2::text[], $3::text[], $4::text[],
                         $5::text[], $6::text[], $7::timestamptz[], $8::text[]
@@ -853,25 +1013,38 @@ class ConnectionsMixin:
             logger.error("get_torrent_top_destinations failed: %s", e)
             return []
 
+    async def ensure_torrent_partitions(self, days_ahead: int = 7) -> int:
+        """Auto-create future daily partitions for torrent_events."""
+        try:
+            return await self._ensure_daily_partitions(TORRENT_EVENTS_TABLE, days_ahead)
+        except Exception as e:
+            logger.warning("ensure_torrent_partitions failed: %s", e)
+            return 0
+
     async def cleanup_old_torrent_events(self, retention_days: int = 90, batch_size: int = 5000) -> int:
-        """Delete torrent events older than retention_days in batches."""
+        """Drop expired daily partitions (or delete old rows) of torrent_events."""
         if not self.is_connected:
             return 0
         total = 0
         max_batches = 1000
         try:
+            dropped = await self._drop_daily_partitions_before(TORRENT_EVENTS_TABLE, retention_days)
+            if dropped is not None:
+                return dropped
+
+            # Fallback: таблица не секционирована (инсталляция без alembic) — batched DELETE
             for _ in range(max_batches):
                 async with self.acquire() as conn:
                     result = await conn.execute(
-                        """
-                        DELETE FROM torrent_events
-                        WHERE id IN (
-                            SELECT id FROM torrent_events
-                            WHERE detected_at < NOW() - make_interval(days => $1)
-                            ORDER BY detected_at
-                            LIMIT $2
-                        )
-                        """,
+                        delete_sql(
+                            TORRENT_EVENTS_TABLE,
+                            f"""id IN (
+                                SELECT id FROM {TORRENT_EVENTS_TABLE}
+                                WHERE detected_at < NOW() - make_interval(days => $1)
+                                ORDER BY detected_at
+                                LIMIT $2
+                            )""",
+                        ),
                         retention_days, batch_size,
                     )
                     deleted = int(result.split()[-1]) if result and result.split() else 0
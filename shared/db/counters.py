@@ -0,0 +1,309 @@
+"""Счётчики панели для Prometheus-гейджей — panel_counters.
+
+Гейджи раньше каждые 15 с пересчитывались дюжиной COUNT(*) по users,
+user_connections, violations, user_hwid_devices и torrent_events. Теперь
+апдейтер читает только эту таблицу, а значения в неё пишут:
+
+- violations — инкрементально, сразу после записи/разбора нарушения
+  (bump_panel_counters);
+- users и hwid — после цикла синхронизации с панелью, а точечные записи
+  (вебхуки панели, создание/удаление из веба и бота, синк одного юзера)
+  ставят отложенный пересчёт (schedule_panel_counters_refresh);
+- connections — коллектор после батча, не чаще раза в min_interval;
+- всё вместе — периодическая сверка, она же чинит дрейф инкрементов и
+  окна по времени (torrent за 24 ч, SRH за час/сутки), которые
+  инкрементами не ведутся.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from shared.db_schema import (
+    PANEL_COUNTERS_TABLE, USERS_TABLE, USER_CONNECTIONS_TABLE, USER_HWID_DEVICES_TABLE,
+    VIOLATIONS_TABLE, TORRENT_EVENTS_TABLE, SUBSCRIPTION_REQUEST_HISTORY_TABLE,
+)
+from shared.logger import logger
+
+# Группа → имена счётчиков, которые она пишет. При пересчёте группы её
+# строки заменяются целиком — метки, упавшие до нуля, исчезают.
+PANEL_COUNTER_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "users": (
+        "total_users", "active_users", "users_traffic_limit_reached",
+        "users_by_status", "users_created", "users_expiring", "users_by_traffic_bucket",
+    ),
+    "hwid": (
+        "hwid_devices_total", "hwid_by_platform", "hwid_devices_per_user_avg",
+        "users_hwid_limit_reached",
+    ),
+    "violations": ("violations_open", "violations_by_action"),
+    "connections": ("online_users", "active_connections"),
+    "windows": ("torrent_events_24h", "subscription_requests"),
+}
+
+# Канал LISTEN/NOTIFY об изменениях, видимых на дашборде. Payload — источник:
+# группа счётчиков ("users", "violations", ...) или "nodes".
+PANEL_CHANGES_CHANNEL = "panel_changes"
+
+# Задержка отложенного пересчёта: записи за это время схлопываются в один.
+PANEL_COUNTERS_DEBOUNCE = 5.0
+
+_COUNTER_DELTA_SQL = f"""
+    INSERT INTO {PANEL_COUNTERS_TABLE} AS c (name, label, value, updated_at)
+    SELECT name, label, value, NOW()
+    FROM UNNEST($1::text[], $2::text[], $3::float8[]) AS d(name, label, value)
+    ORDER BY name, label
+    ON CONFLICT (name, label) DO UPDATE
+        SET value = c.value + EXCLUDED.value, updated_at = NOW()
+"""
+
+_TB = 1099511627776
+_GB = 1073741824
+
+Counter = Tuple[str, str, float]
+
+
+async def bump_panel_counters(conn, deltas: Iterable[Counter]) -> None:
+    """Прибавить дельты к счётчикам одним statement'ом.
+
+    Зовётся после коммита основной записи: сбой счётчика не должен
+    откатывать нарушение, а потерянную дельту поправит сверка. Строки
+    блокируются в порядке (name, label), как и в refresh_panel_counters.
+    """
+    deltas = [d for d in deltas if d[2]]
+    if not deltas:
+        return
+    names, labels, values = zip(*deltas)
+    await conn.execute(_COUNTER_DELTA_SQL, list(names), list(labels), [float(v) for v in values])
+    for group in {g for g, group_names in PANEL_COUNTER_GROUPS.items() if set(names) & set(group_names)}:
+        await notify_panel_change(conn, group)
+
+
+async def notify_panel_change(conn, source: str) -> None:
+    """Сообщить подписчикам канала panel_changes (в т.ч. другим репликам).
+
+    Внутри транзакции уведомление уходит при коммите; одинаковые
+    уведомления одной транзакции Postgres схлопывает сам.
+    """
+    await conn.execute("SELECT pg_notify($1, $2)", PANEL_CHANGES_CHANNEL, source)
+
+
+async def _users_counters(conn) -> List[Counter]:
+    row = await conn.fetchrow(
+        f"""
+        SELECT
+            COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE UPPER(status) = 'ACTIVE') AS active,
+            COUNT(*) FILTER (WHERE traffic_limit_bytes > 0
+                               AND used_traffic_bytes >= traffic_limit_bytes) AS limit_reached,
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours') AS created_24h,
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '7 days') AS created_7d,
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '30 days') AS created_30d,
+            COUNT(*) FILTER (WHERE expire_at > NOW() AND expire_at < NOW() + INTERVAL '1 day') AS expiring_1d,
+            COUNT(*) FILTER (WHERE expire_at > NOW() AND expire_at < NOW() + INTERVAL '7 days') AS expiring_7d,
+            COUNT(*) FILTER (WHERE expire_at > NOW() AND expire_at < NOW() + INTERVAL '30 days') AS expiring_30d,
+            COUNT(*) FILTER (WHERE used_traffic_bytes < 10 * {_GB}::bigint) AS traffic_lt_10gb,
+            COUNT(*) FILTER (WHERE used_traffic_bytes >= 10 * {_GB}::bigint
+                               AND used_traffic_bytes < 100 * {_GB}::bigint) AS traffic_10_100gb,
+            COUNT(*) FILTER (WHERE used_traffic_bytes >= 100 * {_GB}::bigint
+                               AND used_traffic_bytes < {_TB}::bigint) AS traffic_100gb_1tb,
+            COUNT(*) FILTER (WHERE used_traffic_bytes >= {_TB}::bigint) AS traffic_gt_1tb
+        FROM {USERS_TABLE}
+        """
+    )
+    statuses = await conn.fetch(
+        f"SELECT LOWER(status) AS status, COUNT(*) AS n FROM {USERS_TABLE} "
+        f"WHERE status IS NOT NULL GROUP BY LOWER(status)"
+    )
+    counters: List[Counter] = [
+        ("total_users", "", row["total"]),
+        ("active_users", "", row["active"]),
+        ("users_traffic_limit_reached", "", row["limit_reached"]),
+    ]
+    counters += [("users_created", w, row[f"created_{w}"]) for w in ("24h", "7d", "30d")]
+    counters += [("users_expiring", w, row[f"expiring_{w}"]) for w in ("1d", "7d", "30d")]
+    counters += [
+        ("users_by_traffic_bucket", b, row[f"traffic_{b}"])
+        for b in ("lt_10gb", "10_100gb", "100gb_1tb", "gt_1tb")
+    ]
+    counters += [("users_by_status", r["status"], r["n"]) for r in statuses]
+    return counters
+
+
+async def _hwid_counters(conn) -> List[Counter]:
+    platforms = await conn.fetch(
+        f"SELECT COALESCE(NULLIF(LOWER(platform), ''), 'unknown') AS platform, COUNT(*) AS n "
+        f"FROM {USER_HWID_DEVICES_TABLE} GROUP BY 1"
+    )
+    per_user = await conn.fetchrow(
+        f"""
+        SELECT AVG(d.n)::float AS avg_n,
+               COUNT(*) FILTER (WHERE u.hwid_device_limit > 0 AND d.n >= u.hwid_device_limit) AS limit_reached
+        FROM (SELECT user_uuid, COUNT(*) AS n FROM {USER_HWID_DEVICES_TABLE} GROUP BY user_uuid) d
+        LEFT JOIN {USERS_TABLE} u ON u.uuid = d.user_uuid
+        """
+    )
+    counters: List[Counter] = [("hwid_by_platform", r["platform"], r["n"]) for r in platforms]
+    counters += [
+        ("hwid_devices_total", "", sum(r["n"] for r in platforms)),
+        ("hwid_devices_per_user_avg", "", per_user["avg_n"] or 0),
+        ("users_hwid_limit_reached", "", per_user["limit_reached"] or 0),
+    ]
+    return counters
+
+
+async def _violations_counters(conn) -> List[Counter]:
+    rows = await conn.fetch(
+        f"SELECT COALESCE(LOWER(recommended_action), 'unknown') AS action, COUNT(*) AS n "
+        f"FROM {VIOLATIONS_TABLE} WHERE action_taken IS NULL GROUP BY 1"
+    )
+    counters: List[Counter] = [("violations_by_action", r["action"], r["n"]) for r in rows]
+    counters.append(("violations_open", "", sum(r["n"] for r in rows)))
+    return counters
+
+
+async def _connections_counters(conn) -> List[Counter]:
+    # Только открытые подключения — частичный индекс по disconnected_at IS NULL;
+    # стоимость — размер онлайна, а не всей истории. connected_at открытого
+    # подключения коллектор сдвигает каждым батчем.
+    row = await conn.fetchrow(
+        f"""
+        SELECT COUNT(*) AS active,
+               COUNT(DISTINCT user_uuid) FILTER (
+                   WHERE connected_at >= NOW() - INTERVAL '2 minutes'
+               ) AS online
+        FROM {USER_CONNECTIONS_TABLE}
+        WHERE disconnected_at IS NULL
+        """
+    )
+    return [("active_connections", "", row["active"]), ("online_users", "", row["online"])]
+
+
+async def _windows_counters(conn) -> List[Counter]:
+    torrent = await conn.fetchval(
+        f"SELECT COUNT(*) FROM {TORRENT_EVENTS_TABLE} WHERE detected_at >= NOW() - INTERVAL '24 hours'"
+    )
+    counters: List[Counter] = [("torrent_events_24h", "", torrent or 0)]
+    # SRH-таблица может отсутствовать на старых инсталляциях
+    try:
+        srh = await conn.fetchrow(
+            f"""
+            SELECT
+                COUNT(*) FILTER (WHERE request_at >= NOW() - INTERVAL '1 hour') AS req_1h,
+                COUNT(*) AS req_24h
+            FROM {SUBSCRIPTION_REQUEST_HISTORY_TABLE}
+            WHERE request_at >= NOW() - INTERVAL '24 hours'
+            """
+        )
+        counters += [("subscription_requests", "1h", srh["req_1h"]),
+                     ("subscription_requests", "24h", srh["req_24h"])]
+    except Exception:
+        pass
+    return counters
+
+
+_GROUP_LOADERS = {
+    "users": _users_counters,
+    "hwid": _hwid_counters,
+    "violations": _violations_counters,
+    "connections": _connections_counters,
+    "windows": _windows_counters,
+}
+
+
+class CountersMixin:
+    async def refresh_panel_counters(
+        self,
+        groups: Optional[Sequence[str]] = None,
+        min_interval: float = 0,
+    ) -> bool:
+        """Пересчитать группы счётчиков и записать абсолютные значения.
+
+        Args:
+            groups: Группы из PANEL_COUNTER_GROUPS; None — все (сверка).
+            min_interval: Не пересчитывать группу чаще, чем раз в столько
+                секунд в этом процессе — для вызовов с горячего пути.
+
+        Returns:
+            True, если хоть одна группа пересчитана.
+        """
+        if not self.is_connected:
+            return False
+        now = time.monotonic()
+        last = self._panel_counters_at
+        due = [
+            g for g in (groups or PANEL_COUNTER_GROUPS)
+            if not min_interval or now - last.get(g, float("-inf")) >= min_interval
+        ]
+        if not due:
+            return False
+        for g in due:
+            last[g] = now
+
+        try:
+            async with self.acquire() as conn:
+                counters: List[Counter] = []
+                for g in due:
+                    counters += await _GROUP_LOADERS[g](conn)
+                names = [n for g in due for n in PANEL_COUNTER_GROUPS[g]]
+                async with conn.transaction():
+                    await conn.execute(
+                        f"""
+                        DELETE FROM {PANEL_COUNTERS_TABLE} WHERE (name, label) IN (
+                            SELECT name, label FROM {PANEL_COUNTERS_TABLE}
+                            WHERE name = ANY($1::text[])
+                            ORDER BY name, label
+                            FOR UPDATE
+                        )
+                        """,
+                        names,
+                    )
+                    if counters:
+                        await conn.execute(
+                            f"""
+                            INSERT INTO {PANEL_COUNTERS_TABLE} AS c (name, label, value, updated_at)
+                            SELECT name, label, value, NOW()
+                            FROM UNNEST($1::text[], $2::text[], $3::float8[]) AS d(name, label, value)
+                            ORDER BY name, label
+                            ON CONFLICT (name, label) DO UPDATE
+                                SET value = EXCLUDED.value, updated_at = NOW()
+                            """,
+                            [c[0] for c in counters], [c[1] or "" for c in counters],
+                            [float(c[2] or 0) for c in counters],
+                        )
+                    for g in due:
+                        await notify_panel_change(conn, g)
+            return True
+        except Exception as e:
+            logger.warning("refresh_panel_counters(%s) failed: %s", ",".join(due), e)
+            return False
+
+    def schedule_panel_counters_refresh(
+        self, groups: Sequence[str], delay: float = PANEL_COUNTERS_DEBOUNCE,
+    ) -> None:
+        """Пересчитать группы в фоне через delay секунд.
+
+        Для точечных записей вне полного синка: пачка вебхуков или правок
+        даёт один пересчёт, а цифры отстают не больше чем на delay, а не до
+        следующей сверки.
+        """
+        self._panel_counters_pending.update(groups)
+        task = self._panel_counters_task
+        if task is not None and not task.done():
+            return
+        self._panel_counters_task = asyncio.create_task(self._refresh_pending_panel_counters(delay))
+
+    async def _refresh_pending_panel_counters(self, delay: float) -> None:
+        # Записи, пришедшие во время пересчёта, — ещё один круг
+        while self._panel_counters_pending:
+            await asyncio.sleep(delay)
+            groups = tuple(sorted(self._panel_counters_pending))
+            self._panel_counters_pending.clear()
+            await self.refresh_panel_counters(groups)
+
+    async def get_panel_counters(self) -> List[Dict[str, Any]]:
+        """Все счётчики панели: [{name, label, value}]."""
+        if not self.is_connected:
+            return []
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"SELECT name, label, value FROM {PANEL_COUNTERS_TABLE}")
+        return [dict(r) for r in rows]
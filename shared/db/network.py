@@ -2154,47 +2154,31 @@ class NetworkMixin:
             logger.debug("get_user_uuids_by_nodes failed: %s", e)
             return set()
 
-    async def get_user_uuids_by_squads(self, squad_uuids: List[str]) -> Set[str]:
+    async def get_user_uuids_by_squads(
+        self, squad_uuids: List[str], include_external: bool = False,
+    ) -> Set[str]:
         """User UUIDs that belong to any of the given internal squads.
 
-        Parses users.raw_data -> activeInternalSquads (list of uuid strings
-        or dicts with uuid field). Case-insensitive comparison.
+        Membership comes from user_internal_squads(raw_data::jsonb) — the GIN-indexed
+        expression over activeInternalSquads (alembic 0104), so this is one
+        index lookup instead of parsing every user's raw_data. With
+        include_external, users whose external squad is in the list count too.
         """
         if not self.is_connected or not squad_uuids:
             return set()
-        squad_lower = {s.lower() for s in squad_uuids}
+        squad_lower = sorted({str(s).strip().lower() for s in squad_uuids if s})
+        where = "WHERE user_internal_squads(raw_data::jsonb) && $1::text[]"
+        params: list = [squad_lower]
+        if include_external:
+            where += " OR external_squad_uuid = ANY($2::uuid[])"
+            params.append(squad_lower)
         try:
             async with self.acquire() as conn:
-                rows = await conn.fetch(
-                    select_sql(USERS_TABLE, "uuid::text AS uuid, raw_data", "WHERE raw_data IS NOT NULL")
-                )
+                rows = await conn.fetch(select_sql(USERS_TABLE, "uuid::text AS uuid", where), *params)
         except Exception as e:
             logger.debug("get_user_uuids_by_squads fetch failed: %s", e)
             return set()
-        result: Set[str] = set()
-        for r in rows:
-            raw = r["raw_data"]
-            if isinstance(raw, str):
-                try:
-                    import json as _json
-                    raw = _json.loads(raw)
-                except (ValueError, TypeError):
-                    continue
-            if not isinstance(raw, dict):
-                continue
-            sqs = raw.get("activeInternalSquads") or []
-            if not isinstance(sqs, list):
-                continue
-            for sq in sqs:
-                sq_uuid = None
-                if isinstance(sq, str):
-                    sq_uuid = sq
-                elif isinstance(sq, dict):
-                    sq_uuid = sq.get("uuid") or sq.get("squadUuid")
-                if sq_uuid and str(sq_uuid).lower() in squad_lower:
-                    result.add(str(r["uuid"]).lower())
-                    break
-        return result
+        return {str(r["uuid"]).lower() for r in rows}
 
     async def get_uuids_by_tag(self, resource_type: str, tag: str) -> List[str]:
         """Return UUIDs of nodes/hosts of a given type whose tags include the tag.
@@ -2298,6 +2282,49 @@ class NetworkMixin:
                 )
             return [dict(r) for r in rows]
 
+    async def get_user_traffic_in_window(
+        self, window_minutes: int, threshold_bytes: int, interval_seconds: int = 300
+    ) -> List[Dict[str, Any]]:
+        """Users whose traffic over the last window_minutes reached threshold_bytes.
+
+        Sums the per-node deltas the node traffic sync records, so the rate
+        survives restarts and needs no Panel API calls. Each delta covers the
+        sync interval before its recorded_at, so elapsed_seconds starts one
+        interval_seconds before the user's first delta (but not before the
+        window start) and runs to now.
+
+        Returns list of dicts with user_uuid, username, delta_bytes, elapsed_seconds.
+        """
+        if not self.is_connected:
+            return []
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT h.user_uuid::text AS user_uuid, u.username,
+                       SUM(h.delta_bytes) AS delta_bytes,
+                       EXTRACT(EPOCH FROM NOW() - GREATEST(
+                           MIN(h.recorded_at) - make_interval(secs := $3),
+                           NOW() - make_interval(mins := $1)
+                       )) AS elapsed_seconds
+                FROM {USER_NODE_TRAFFIC_HISTORY_TABLE} h
+                JOIN {USERS_TABLE} u ON u.uuid = h.user_uuid
+                WHERE h.recorded_at >= NOW() - make_interval(mins := $1)
+                GROUP BY h.user_uuid, u.username
+                HAVING SUM(h.delta_bytes) >= $2
+                ORDER BY delta_bytes DESC
+                """,
+                window_minutes, threshold_bytes, interval_seconds,
+            )
+        return [
+            {
+                "user_uuid": r["user_uuid"],
+                "username": r["username"],
+                "delta_bytes": int(r["delta_bytes"]),
+                "elapsed_seconds": float(r["elapsed_seconds"]),
+            }
+            for r in rows
+        ]
+
     async def cleanup_old_user_node_traffic_history(self, keep_hours: int = 48) -> int:
         """Delete user-node traffic history older than keep_hours."""
         if not self.is_connected:
@@ -8,10 +8,13 @@ from typing import Any, Dict, List, Optional
 
 from shared.logger import logger
 from shared.db._base import _db_row_to_api_format
+from shared.db.counters import notify_panel_change
 from shared.db_schema import (
     NODES_TABLE,
     USER_NODE_TRAFFIC_TABLE,
     NODE_METRICS_SNAPSHOTS_TABLE,
+    NODE_METRICS_ROLLUP_1M_TABLE,
+    NODE_METRICS_ROLLUP_1H_TABLE,
     USERS_TABLE,
 )
 from shared.db_query import select_sql, insert_sql, update_sql, delete_sql
@@ -33,6 +36,80 @@ _NETWORK_METRIC_COLUMNS: dict[str, str] = {
     "tcp_listen_drop_ps": "tcp_listen_drop_ps",
 }
 
+# Типы колонок network-метрик — для UNNEST в save_node_heartbeats
+_NETWORK_METRIC_TYPES: dict[str, str] = {
+    column: ("int4" if column.startswith(("conntrack_", "tcp_")) else "int8")
+    for column in _NETWORK_METRIC_COLUMNS
+}
+
+# Системные метрики из отчёта агента: колонка БД (в nodes и в снимках) → тип
+_SYSTEM_METRIC_TYPES: dict[str, str] = {
+    "cpu_usage": "float8",
+    "cpu_cores": "int4",
+    "memory_usage": "float8",
+    "memory_total_bytes": "int8",
+    "memory_used_bytes": "int8",
+    "disk_usage": "float8",
+    "disk_total_bytes": "int8",
+    "disk_used_bytes": "int8",
+    "disk_read_speed_bps": "int8",
+    "disk_write_speed_bps": "int8",
+    "uptime_seconds": "int4",
+}
+
+# Агрегаты метрик: таблица → шаг бакета (date_trunc) и сколько дней хранить.
+# Минутные нужны только для коротких окон, часовые — для всей истории.
+_METRICS_ROLLUPS: dict[str, tuple[str, int]] = {
+    NODE_METRICS_ROLLUP_1M_TABLE: ("minute", 3),
+    NODE_METRICS_ROLLUP_1H_TABLE: ("hour", 365),
+}
+
+# Период графика → (источник, окно в часах, шаг бакета на графике)
+_METRICS_PERIODS: dict[str, tuple[str, int, str]] = {
+    "1h": (NODE_METRICS_ROLLUP_1M_TABLE, 1, "minute"),
+    "24h": (NODE_METRICS_ROLLUP_1H_TABLE, 24, "hour"),
+    "7d": (NODE_METRICS_ROLLUP_1H_TABLE, 24 * 7, "6 hours"),
+    "30d": (NODE_METRICS_ROLLUP_1H_TABLE, 24 * 30, "day"),
+    "all": (NODE_METRICS_ROLLUP_1H_TABLE, 24 * 365, "day"),
+}
+
+
+def _rollup_upsert_sql(table: str, trunc: str, source: str) -> str:
+    """INSERT … ON CONFLICT, доливающий снимки из CTE ``source`` в агрегат ``table``.
+
+    По одному снимку на ноду: две строки с одним ключом в одном INSERT …
+    ON CONFLICT Postgres не примет.
+    """
+    return f"""
+        INSERT INTO {table} AS r (
+            node_uuid, bucket, samples,
+            cpu_sum, cpu_max, memory_sum, memory_max, disk_sum, disk_max
+        )
+        SELECT node_uuid, date_trunc('{trunc}', created_at), 1,
+               COALESCE(cpu_usage, 0), cpu_usage,
+               COALESCE(memory_usage, 0), memory_usage,
+               COALESCE(disk_usage, 0), disk_usage
+        FROM {source}
+        ON CONFLICT (node_uuid, bucket) DO UPDATE SET
+            samples = r.samples + 1,
+            cpu_sum = r.cpu_sum + EXCLUDED.cpu_sum,
+            cpu_max = GREATEST(r.cpu_max, EXCLUDED.cpu_max),
+            memory_sum = r.memory_sum + EXCLUDED.memory_sum,
+            memory_max = GREATEST(r.memory_max, EXCLUDED.memory_max),
+            disk_sum = r.disk_sum + EXCLUDED.disk_sum,
+            disk_max = GREATEST(r.disk_max, EXCLUDED.disk_max)
+    """
+
+
+def _bucket_expr(step: str, column: str) -> str:
+    """SQL-выражение бакета графика поверх колонки бакета агрегата."""
+    if step == "6 hours":
+        return (
+            f"date_trunc('day', {column}) "
+            f"+ floor(extract(hour from {column}) / 6) * interval '6 hours'"
+        )
+    return f"date_trunc('{step}', {column})"
+
 
 class NodesMixin:
     # ==================== Nodes ====================
@@ -226,6 +303,7 @@ class NodesMixin:
                 users_online,
                 json.dumps(response),
             )
+            await notify_panel_change(conn, "nodes")
     
     async def bulk_upsert_nodes(self, nodes: List[Dict[str, Any]]) -> int:
         """Bulk insert or update nodes. Returns number of records processed."""
@@ -254,174 +332,125 @@ class NodesMixin:
                 delete_sql(NODES_TABLE, "uuid = $1"),
                 uuid
             )
+            if result == "DELETE 1":
+                await notify_panel_change(conn, "nodes")
             return result == "DELETE 1"
     
-    async def update_node_metrics(
-        self,
-        node_uuid: str,
-        cpu_usage: float | None = None,
-        cpu_cores: int | None = None,
-        memory_usage: float | None = None,
-        memory_total_bytes: int | None = None,
-        memory_used_bytes: int | None = None,
-        disk_usage: float | None = None,
-        disk_total_bytes: int | None = None,
-        disk_used_bytes: int | None = None,
-        disk_read_speed_bps: int | None = None,
-        disk_write_speed_bps: int | None = None,
-        uptime_seconds: int | None = None,
-        network: dict[str, Any] | None = None,
-    ) -> bool:
-        """Update system metrics for a node (from Node Agent)."""
-        if not self.is_connected:
-            return False
-
-        assignments = [
-            "cpu_usage = $2",
-            "cpu_cores = $3",
-            "memory_usage = $4",
-            "memory_total_bytes = $5",
-            "memory_used_bytes = $6",
-            "disk_usage = $7",
-            "disk_total_bytes = $8",
-            "disk_used_bytes = $9",
-            "disk_read_speed_bps = $10",
-            "disk_write_speed_bps = $11",
-            "uptime_seconds = $12",
-        ]
-        params: list[Any] = [
-            node_uuid,
-            cpu_usage,
-            cpu_cores,
-            memory_usage,
-            memory_total_bytes,
-            memory_used_bytes,
-            disk_usage,
-            disk_total_bytes,
-            disk_used_bytes,
-            disk_read_speed_bps,
-            disk_write_speed_bps,
-            uptime_seconds,
-        ]
-
-        if network is not None:
-            for column, field in _NETWORK_METRIC_COLUMNS.items():
-                params.append(network.get(field))
-                assignments.append(f"{column} = ${len(params)}")
+    # ==================== Node Heartbeats & Metrics Snapshots ====================
 
-        assignments.append("metrics_updated_at = NOW()")
-
-        async with self.acquire() as conn:
-            result = await conn.execute(
-                update_sql(NODES_TABLE, ", ".join(assignments), "uuid = $1"),
-                *params,
-            )
-            return result == "UPDATE 1"
+    async def save_node_heartbeats(self, beats: list[dict[str, Any]]) -> int:
+        """Записать накопленные heartbeat'ы нод одним запросом.
 
-    async def update_node_agent_version(self, node_uuid: str, version: str) -> bool:
-        """Записать версию node-agent (репортится в каждом батче).
+        Каждый элемент — последний отчёт ноды за интервал сброса:
+        node_uuid, agent_version (или None), received_at и metrics — словарь
+        колонок _SYSTEM_METRIC_TYPES (None, если агент метрик не прислал) —
+        плюс network в полях агента (None у агентов до 1.3.0).
 
-        UPDATE срабатывает только при отличии — коллектор зовёт это на каждый
-        батч, и без гарда мы бы дёргали строку ноды раз в несколько секунд.
+        Одним statement'ом обновляются строки nodes, пишутся снимки метрик и
+        доливаются оба агрегата. Возвращает число записанных снимков.
         """
-        if not self.is_connected:
-            return False
-        async with self.acquire() as conn:
-            result = await conn.execute(
-                update_sql(
-                    NODES_TABLE,
-                    "agent_version = $2",
-                    "uuid = $1 AND agent_version IS DISTINCT FROM $2",
-                ),
-                node_uuid,
-                version,
-            )
-            return result == "UPDATE 1"
-
-    # ==================== Node Metrics Snapshots ====================
-
-    async def insert_node_metrics_snapshot(
-        self,
-        node_uuid: str,
-        cpu_usage: float | None = None,
-        cpu_cores: int | None = None,
-        memory_usage: float | None = None,
-        memory_total_bytes: int | None = None,
-        memory_used_bytes: int | None = None,
-        disk_usage: float | None = None,
-        disk_total_bytes: int | None = None,
-        disk_used_bytes: int | None = None,
-        disk_read_speed_bps: int | None = None,
-        disk_write_speed_bps: int | None = None,
-        uptime_seconds: int | None = None,
-        network: dict[str, Any] | None = None,
-    ) -> bool:
-        """Insert a snapshot of node metrics for historical tracking."""
-        if not self.is_connected:
-            return False
+        if not self.is_connected or not beats:
+            return 0
 
-        columns = [
-            "node_uuid", "cpu_usage", "cpu_cores", "memory_usage",
-            "memory_total_bytes", "memory_used_bytes",
-            "disk_usage", "disk_total_bytes", "disk_used_bytes",
-            "disk_read_speed_bps", "disk_write_speed_bps", "uptime_seconds",
+        arrays: dict[str, list] = {
+            "node_uuid": [], "agent_version": [], "has_metrics": [],
+            "has_network": [], "received_at": [],
+        }
+        for column in (*_SYSTEM_METRIC_TYPES, *_NETWORK_METRIC_COLUMNS):
+            arrays[column] = []
+        for beat in beats:
+            metrics = beat.get("metrics")
+            network = beat.get("network") if metrics is not None else None
+            arrays["node_uuid"].append(str(beat["node_uuid"]))
+            arrays["agent_version"].append(beat.get("agent_version"))
+            arrays["has_metrics"].append(metrics is not None)
+            arrays["has_network"].append(network is not None)
+            arrays["received_at"].append(beat.get("received_at") or datetime.now(timezone.utc))
+            for column in _SYSTEM_METRIC_TYPES:
+                arrays[column].append((metrics or {}).get(column))
+            for column, field in _NETWORK_METRIC_COLUMNS.items():
+                arrays[column].append((network or {}).get(field))
+
+        types = {
+            "node_uuid": "uuid", "agent_version": "text", "has_metrics": "bool",
+            "has_network": "bool", "received_at": "timestamptz",
+            **_SYSTEM_METRIC_TYPES, **_NETWORK_METRIC_TYPES,
+        }
+        unnest = ", ".join(f"${i}::{types[c]}[]" for i, c in enumerate(arrays, start=1))
+
+        # Без метрик строка ноды трогается только ради смены версии агента;
+        # сетевые колонки — только если агент их прислал (см. _NETWORK_METRIC_COLUMNS)
+        assignments = ["agent_version = COALESCE(b.agent_version, n.agent_version)"]
+        assignments += [
+            f"{c} = CASE WHEN b.has_metrics THEN b.{c} ELSE n.{c} END" for c in _SYSTEM_METRIC_TYPES
         ]
-        values: list[Any] = [
-            node_uuid, cpu_usage, cpu_cores, memory_usage,
-            memory_total_bytes, memory_used_bytes,
-            disk_usage, disk_total_bytes, disk_used_bytes,
-            disk_read_speed_bps, disk_write_speed_bps, uptime_seconds,
+        assignments += [
+            f"{c} = CASE WHEN b.has_network THEN b.{c} ELSE n.{c} END" for c in _NETWORK_METRIC_COLUMNS
         ]
-
-        if network is not None:
-            for column, field in _NETWORK_METRIC_COLUMNS.items():
-                columns.append(column)
-                values.append(network.get(field))
-
-        try:
-            async with self.acquire() as conn:
-                await conn.execute(
-                    insert_sql(NODE_METRICS_SNAPSHOTS_TABLE, columns),
-                    *values,
-                )
-                return True
-        except Exception as e:
-            logger.debug("Failed to insert metrics snapshot: %s", e)
-            return False
+        assignments.append(
+            "metrics_updated_at = CASE WHEN b.has_metrics THEN b.received_at ELSE n.metrics_updated_at END"
+        )
+
+        snapshot_columns = ", ".join((*_SYSTEM_METRIC_TYPES, *_NETWORK_METRIC_COLUMNS))
+        minute_trunc = _METRICS_ROLLUPS[NODE_METRICS_ROLLUP_1M_TABLE][0]
+        hour_trunc = _METRICS_ROLLUPS[NODE_METRICS_ROLLUP_1H_TABLE][0]
+        query = f"""
+            WITH b AS (
+                SELECT * FROM UNNEST({unnest}) AS t({", ".join(arrays)})
+            ),
+            u AS (
+                UPDATE {NODES_TABLE} AS n SET {", ".join(assignments)}
+                FROM b
+                WHERE n.uuid = b.node_uuid
+                  AND (b.has_metrics OR n.agent_version IS DISTINCT FROM b.agent_version)
+                  AND (b.has_metrics OR b.agent_version IS NOT NULL)
+            ),
+            s AS (
+                INSERT INTO {NODE_METRICS_SNAPSHOTS_TABLE} (node_uuid, {snapshot_columns}, created_at)
+                SELECT node_uuid, {snapshot_columns}, received_at FROM b
+                WHERE has_metrics
+                  AND EXISTS (SELECT 1 FROM {NODES_TABLE} e WHERE e.uuid = b.node_uuid)
+                RETURNING node_uuid, created_at, cpu_usage, memory_usage, disk_usage
+            ),
+            m AS ({_rollup_upsert_sql(NODE_METRICS_ROLLUP_1M_TABLE, minute_trunc, "s")})
+            {_rollup_upsert_sql(NODE_METRICS_ROLLUP_1H_TABLE, hour_trunc, "s")}
+        """
+        async with self.acquire() as conn:
+            await conn.execute(query, *arrays.values())
+        return sum(arrays["has_metrics"])
 
     async def get_node_metrics_history(
         self,
         period: str = "24h",
         node_uuid: str | None = None,
     ) -> list:
-        """Get averaged node metrics for the given period."""
+        """Get averaged node metrics for the given period (from rollups)."""
         if not self.is_connected:
             return []
 
-        delta_map = {"24h": 1, "7d": 7, "30d": 30, "all": 3650}
-        days = delta_map.get(period, 1)
+        table, hours, _ = _METRICS_PERIODS.get(period, _METRICS_PERIODS["24h"])
 
         columns = """
-            s.node_uuid,
+            r.node_uuid,
             n.name as node_name,
-            ROUND(AVG(s.cpu_usage)::numeric, 1) as avg_cpu,
-            ROUND(AVG(s.memory_usage)::numeric, 1) as avg_memory,
-            ROUND(AVG(s.disk_usage)::numeric, 1) as avg_disk,
-            ROUND(MAX(s.cpu_usage)::numeric, 1) as max_cpu,
-            ROUND(MAX(s.memory_usage)::numeric, 1) as max_memory,
-            ROUND(MAX(s.disk_usage)::numeric, 1) as max_disk,
-            COUNT(*) as samples_count
+            ROUND((SUM(r.cpu_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_cpu,
+            ROUND((SUM(r.memory_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_memory,
+            ROUND((SUM(r.disk_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_disk,
+            ROUND(MAX(r.cpu_max)::numeric, 1) as max_cpu,
+            ROUND(MAX(r.memory_max)::numeric, 1) as max_memory,
+            ROUND(MAX(r.disk_max)::numeric, 1) as max_disk,
+            SUM(r.samples) as samples_count
         """
-        suffix = "s JOIN nodes n ON n.uuid = s.node_uuid WHERE s.created_at >= NOW() - make_interval(days => $1)"
-        params: list = [days]
+        suffix = "r JOIN nodes n ON n.uuid = r.node_uuid WHERE r.bucket >= NOW() - make_interval(hours => $1)"
+        params: list = [hours]
 
         if node_uuid:
-            suffix += " AND s.node_uuid = $2::uuid"
+            suffix += " AND r.node_uuid = $2::uuid"
             params.append(node_uuid)
 
-        suffix += " GROUP BY s.node_uuid, n.name ORDER BY n.name"
+        suffix += " GROUP BY r.node_uuid, n.name ORDER BY n.name"
 
-        query = select_sql(NODE_METRICS_SNAPSHOTS_TABLE, columns, suffix)
+        query = select_sql(table, columns, suffix)
 
         try:
             async with self.acquire() as conn:
@@ -438,56 +467,66 @@ class NodesMixin:
     ) -> list:
         """Get time-bucketed average metrics for charting.
 
-        24h -> hourly, 7d -> 6h, 30d -> daily.
+        1h -> minutely, 24h -> hourly, 7d -> 6h, 30d -> daily.
         """
         if not self.is_connected:
             return []
 
-        delta_map = {"24h": 1, "7d": 7, "30d": 30, "all": 3650}
-        trunc_map = {"24h": "hour", "7d": "hour", "30d": "day", "all": "day"}
-        # For 7d we truncate to hour then floor to 6h in Python for simplicity
-        days = delta_map.get(period, 1)
-        trunc = trunc_map.get(period, "hour")
+        table, hours, step = _METRICS_PERIODS.get(period, _METRICS_PERIODS["24h"])
+        bucket = _bucket_expr(step, "r.bucket")
 
         columns = f"""
-            date_trunc('{trunc}', s.created_at) as bucket,
-            s.node_uuid,
+            {bucket} as bucket,
+            r.node_uuid,
             n.name as node_name,
-            ROUND(AVG(s.cpu_usage)::numeric, 1) as avg_cpu,
-            ROUND(AVG(s.memory_usage)::numeric, 1) as avg_memory,
-            ROUND(AVG(s.disk_usage)::numeric, 1) as avg_disk
+            ROUND((SUM(r.cpu_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_cpu,
+            ROUND((SUM(r.memory_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_memory,
+            ROUND((SUM(r.disk_sum) / NULLIF(SUM(r.samples), 0))::numeric, 1) as avg_disk
         """
-        suffix = "s JOIN nodes n ON n.uuid = s.node_uuid WHERE s.created_at >= NOW() - make_interval(days => $1)"
-        params: list = [days]
+        suffix = "r JOIN nodes n ON n.uuid = r.node_uuid WHERE r.bucket >= NOW() - make_interval(hours => $1)"
+        params: list = [hours]
         if node_uuid:
-            suffix += " AND s.node_uuid = $2::uuid"
+            suffix += " AND r.node_uuid = $2::uuid"
             params.append(node_uuid)
-        suffix += f" GROUP BY bucket, s.node_uuid, n.name ORDER BY bucket"
+        suffix += " GROUP BY 1, r.node_uuid, n.name ORDER BY 1"
 
-        query = select_sql(NODE_METRICS_SNAPSHOTS_TABLE, columns, suffix)
+        query = select_sql(table, columns, suffix)
 
         try:
             async with self.acquire() as conn:
                 rows = await conn.fetch(query, *params)
-                result = [dict(r) for r in rows]
-                # For 7d period, floor hourly buckets to 6h
-                if period == "7d":
-                    for row in result:
-                        b = row["bucket"]
-                        if b:
-                            row["bucket"] = b.replace(hour=(b.hour // 6) * 6, minute=0, second=0, microsecond=0)
-                return result
+                return [dict(r) for r in rows]
         except Exception as e:
             logger.error("get_node_metrics_timeseries failed: %s", e)
             return []
 
+    async def ensure_metrics_partitions(self, days_ahead: int = 7) -> int:
+        """Auto-create future daily partitions for node_metrics_snapshots."""
+        try:
+            return await self._ensure_daily_partitions(NODE_METRICS_SNAPSHOTS_TABLE, days_ahead)
+        except Exception as e:
+            logger.warning("ensure_metrics_partitions failed: %s", e)
+            return 0
+
     async def cleanup_old_metrics_snapshots(self, retention_days: int = 30, batch_size: int = 5000) -> int:
-        """Delete metrics snapshots older than retention_days in batches."""
+        """Drop expired daily partitions (or delete old rows) and prune metrics rollups."""
         if not self.is_connected:
             return 0
         total = 0
-        max_batches = 1000
         try:
+            for table, (_, keep_days) in _METRICS_ROLLUPS.items():
+                async with self.acquire() as conn:
+                    await conn.execute(
+                        delete_sql(table, "bucket < NOW() - make_interval(days => $1)"),
+                        keep_days,
+                    )
+
+            dropped = await self._drop_daily_partitions_before(NODE_METRICS_SNAPSHOTS_TABLE, retention_days)
+            if dropped is not None:
+                return dropped
+
+            # Fallback: таблица не секционирована (инсталляция без alembic) — batched DELETE
+            max_batches = 1000
             for _ in range(max_batches):
                 async with self.acquire() as conn:
                     result = await conn.execute(
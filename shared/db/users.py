@@ -2,6 +2,7 @@
 Users mixin — user baselines, CRUD, search, bulk operations.
 """
 import json
+import re
 import time
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
@@ -9,7 +10,52 @@ from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 from shared.logger import logger
 from shared.db._base import _db_row_to_api_format, _parse_timestamp
 from shared.db_schema import ADMIN_TABLE, USERS_TABLE, USER_BASELINES_TABLE, USER_CONNECTIONS_TABLE, USER_HWID_DEVICES_TABLE
-from shared.db_query import select_sql, insert_sql, update_sql, delete_sql
+from shared.db_query import (
+    select_sql, insert_sql, update_sql, delete_sql,
+    cursor_fingerprint, decode_cursor, encode_cursor, keyset_sql,
+)
+
+_UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_NUMERIC_ID_RE = re.compile(r"^[0-9]{1,18}$")
+
+# Склейка искомых полей; GIN gin_trgm_ops по этому выражению — alembic 0105
+_USER_SEARCH_TEXT = "user_search_text(username, email, short_uuid, uuid, description)"
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def user_search_sql(query: str, start: int = 1) -> Tuple[str, str, list]:
+    """Build the user search condition and its rank.
+
+    Returns ``(condition, rank, params)`` with placeholders numbered from
+    ``$start``; ``rank`` uses only those placeholders, so the condition can
+    be reused on its own (e.g. in a COUNT). A full UUID short-circuits to an
+    exact uuid lookup. Anything else is a substring match over
+    user_search_text() (trigram-indexed); a numeric query additionally
+    matches telegram_id and the panel id exactly. ``rank`` orders exact
+    matches first (0), then username prefixes (1), then other substrings (2).
+    """
+    q = query.strip()
+    if _UUID_RE.match(q):
+        return f"uuid = ${start}::uuid", "0::int", [q]
+
+    # Экранированный запрос без % и _ — LIKE по нему и есть точное сравнение
+    token = f"${start}"
+    params: list = [_like_escape(q.lower())]
+    exact = (
+        f"lower(username) LIKE {token} OR lower(email) LIKE {token}"
+        f" OR lower(short_uuid) LIKE {token}"
+    )
+    condition = f"{_USER_SEARCH_TEXT} LIKE '%' || {token} || '%'"
+    if _NUMERIC_ID_RE.match(q):
+        params.append(int(q))
+        numeric = f"telegram_id = ${start + 1} OR id = ${start + 1}"
+        exact += f" OR {numeric}"
+        condition += f" OR {numeric}"
+    rank = f"CASE WHEN {exact} THEN 0 WHEN lower(username) LIKE {token} || '%' THEN 1 ELSE 2 END"
+    return f"({condition})", rank, params
 
 
 class UsersMixin:
@@ -283,30 +329,34 @@ class UsersMixin:
         offset: int = 0
     ) -> List[Dict[str, Any]]:
         """
-        Search users by username, email, short_uuid, or UUID.
-        Returns list of matching users in API format.
+        Search users by username, email, short_uuid, UUID, telegram_id or id.
+        Returns list of matching users in API format, best matches first.
+
+        If anything matches exactly (uuid, short_uuid, telegram_id, id,
+        username or email), only the exact matches are returned.
         """
-        if not self.is_connected:
+        if not self.is_connected or not query.strip():
             return []
-        
-        search_pattern = f"%{query}%"
-        
+
+        condition, rank, params = user_search_sql(query)
+        n = len(params)
         async with self.acquire() as conn:
             rows = await conn.fetch(
-                f"""
-                SELECT {self._USER_LIST_COLUMNS} FROM {USERS_TABLE}
-                WHERE
-                    LOWER(username) LIKE LOWER($1) OR
-                    LOWER(email) LIKE LOWER($1) OR
-                    short_uuid LIKE $1 OR
-                    uuid::text LIKE $1
-                ORDER BY username
-                LIMIT $2 OFFSET $3
-                """,
-                search_pattern, limit, offset
+                select_sql(
+                    USERS_TABLE,
+                    f"{self._USER_LIST_COLUMNS}, {rank} AS _rank",
+                    f"WHERE {condition} ORDER BY _rank, length(username), username"
+                    f" LIMIT ${n + 1} OFFSET ${n + 2}",
+                ),
+                *params, limit, offset,
             )
-            return [_db_row_to_api_format(row) for row in rows]
-    
+        if rows and rows[0]["_rank"] == 0:
+            rows = [r for r in rows if r["_rank"] == 0]
+        return [
+            _db_row_to_api_format({k: v for k, v in r.items() if k != "_rank"})
+            for r in rows
+        ]
+
     async def get_users_count(self) -> int:
         """Get total number of users in database."""
         if not self.is_connected:
@@ -432,7 +482,15 @@ class UsersMixin:
         ),
     }
 
-    async def get_users_paginated(
+    async def get_users_paginated(self, *args, **kwargs) -> tuple:
+        """
+        Get paginated users with server-side filtering and sorting.
+        Returns (users_list, total_count). See get_users_page().
+        """
+        users, total, _ = await self.get_users_page(*args, **kwargs)
+        return users, total
+
+    async def get_users_page(
         self,
         page: int = 1,
         per_page: int = 20,
@@ -448,17 +506,30 @@ class UsersMixin:
         admin_id: Optional[int] = None,
         external_squad_uuid: Optional[str] = None,
         tag: Optional[str] = None,
+        user_scope: Optional[Any] = None,
+        cursor: Optional[str] = None,
+        total_mode: str = "exact",
     ) -> tuple:
         """
-        Get paginated users with server-side filtering and sorting.
-        Returns (users_list, total_count).
+        Get a page of users with server-side filtering and sorting.
+        Returns (users_list, total_count, next_cursor).
+
+        Pages are addressed either by `page` (LIMIT/OFFSET) or by `cursor` —
+        the opaque next_cursor of the previous page. The cursor is a keyset
+        on (sort key, uuid), so walking the whole list costs linear total
+        time; `page` is ignored when a cursor is given. next_cursor is None
+        on the last page. A cursor made for another sort raises ValueError.
+
+        `total_mode`: "exact" — COUNT over the filter; "estimate" — the
+        planner's row estimate (no scan).
 
         If `uuid_whitelist` is provided (access-policy scope), only users
         with matching UUID are returned. An empty list means no access —
-        returns ([], 0).
+        returns ([], 0). `user_scope` (shared.rbac.UserScope) does the same
+        as an SQL predicate, without materializing the UUIDs.
         """
         if not self.is_connected:
-            return [], 0
+            return [], 0, None
 
         conditions = []
         args = []
@@ -467,24 +538,25 @@ class UsersMixin:
         # Access-policy scope filter
         if uuid_whitelist is not None:
             if not uuid_whitelist:
-                return [], 0
+                return [], 0, None
             param_idx += 1
             args.append(uuid_whitelist)
             conditions.append(f"uuid::text = ANY(${param_idx})")
-
-        # Filter: search
-        if search:
-            param_idx += 1
-            like_param = f"${param_idx}"
-            args.append(f"%{search}%")
-            conditions.append(
-                f"(LOWER(username) LIKE LOWER({like_param})"
-                f" OR LOWER(email) LIKE LOWER({like_param})"
-                f" OR uuid::text LIKE {like_param}"
-                f" OR short_uuid LIKE {like_param}"
-                f" OR telegram_id::text LIKE {like_param}"
-                f" OR LOWER(COALESCE(description, raw_data->>'description', '')) LIKE LOWER({like_param}))"
-            )
+        if user_scope is not None:
+            if user_scope.is_empty:
+                return [], 0, None
+            scope_sql, scope_args = user_scope.sql("uuid", start=param_idx + 1, users_row=True)
+            param_idx += len(scope_args)
+            args.extend(scope_args)
+            conditions.append(scope_sql)
+
+        # Filter: search (trigram index, exact matches ranked first)
+        search_rank = None
+        if search and search.strip():
+            search_sql, search_rank, search_args = user_search_sql(search, start=param_idx + 1)
+            param_idx += len(search_args)
+            args.extend(search_args)
+            conditions.append(search_sql)
 
         # Filter: status
         if status:
@@ -558,14 +630,36 @@ class UsersMixin:
 
         where_clause = " AND ".join(conditions) if conditions else "TRUE"
 
-        # Sort
-        sort_expr = self._PAGINATED_SORT_MAP.get(sort_by, "created_at")
-        direction = "DESC" if sort_order == "desc" else "ASC"
-        nulls = "NULLS LAST" if direction == "DESC" else "NULLS FIRST"
-        order_clause = f"{sort_expr} {direction} {nulls}"
+        # Sort: a unique key (… , uuid) so that pages never overlap
+        sort_key = sort_by if sort_by in self._PAGINATED_SORT_MAP else "created_at"
+        descending = sort_order == "desc"
+        keys = [(self._PAGINATED_SORT_MAP[sort_key], descending), ("uuid", descending)]
+        if search_rank is not None:
+            keys.insert(0, (search_rank, False))
+        order_clause = ", ".join(
+            f"{expr} {'DESC NULLS LAST' if desc else 'ASC NULLS FIRST'}" for expr, desc in keys
+        )
+        key_columns = ", ".join(f"{expr} AS _k{i}" for i, (expr, _) in enumerate(keys))
+        filter_args = list(args)
+        # Курсор привязан к сортировке и фильтрам (включая поиск)
+        cursor_head = [sort_key, sort_order, cursor_fingerprint(where_clause, filter_args)]
+
+        page_conditions = [where_clause]
+        if cursor:
+            values = decode_cursor(cursor)
+            if values[:3] != cursor_head or len(values) != len(keys) + 3:
+                raise ValueError("cursor does not match the requested sort or filters")
+            after_sql, after_args = keyset_sql(
+                [(expr, desc, v) for (expr, desc), v in zip(keys, values[3:])],
+                start=param_idx + 1,
+            )
+            param_idx += len(after_args)
+            args.extend(after_args)
+            page_conditions.append(after_sql)
 
-        # Pagination
-        offset = (page - 1) * per_page
+        # Окно COUNT(*) OVER() точно только на странице без курсора
+        window_count = total_mode == "exact" and not cursor
+        offset = 0 if cursor else (page - 1) * per_page
         param_idx += 1
         args.append(per_page)
         limit_param = f"${param_idx}"
@@ -574,28 +668,33 @@ class UsersMixin:
         offset_param = f"${param_idx}"
 
         query = f"""
-            SELECT *, COUNT(*) OVER() AS _total_count
+            SELECT *, {key_columns}{", COUNT(*) OVER() AS _total_count" if window_count else ""}
             FROM {USERS_TABLE}
-            WHERE {where_clause}
+            WHERE {" AND ".join(page_conditions)}
             ORDER BY {order_clause}
             LIMIT {limit_param} OFFSET {offset_param}
         """
 
+        count_query = select_sql(USERS_TABLE, "COUNT(*)", f"WHERE {where_clause}")
         async with self.acquire() as conn:
             rows = await conn.fetch(query, *args)
+            if window_count and rows:
+                total = rows[0]["_total_count"]
+            elif total_mode == "estimate":
+                total = await self._estimate_count(
+                    conn, select_sql(USERS_TABLE, "1", f"WHERE {where_clause}"), *filter_args,
+                )
+            else:
+                total = await conn.fetchval(count_query, *filter_args) or 0
 
-        if not rows:
-            # No results — still need total count for empty filter results
-            count_query = select_sql(USERS_TABLE, "COUNT(*)", f"WHERE {where_clause}")
-            # Remove limit/offset args for count query
-            count_args = args[:-2]
-            async with self.acquire() as conn:
-                total = await conn.fetchval(count_query, *count_args)
-            return [], total or 0
-
-        total = rows[0]["_total_count"]
+        next_cursor = None
+        if len(rows) == per_page:
+            last = rows[-1]
+            next_cursor = encode_cursor(
+                cursor_head + [last[f"_k{i}"] for i in range(len(keys))]
+            )
         users = [_db_row_to_api_format(row) for row in rows]
-        return users, total
+        return users, total, next_cursor
 
     async def get_distinct_user_tags(self) -> List[str]:
         """Return sorted list of distinct non-empty user tags (for filter dropdown)."""
@@ -650,6 +749,54 @@ class UsersMixin:
             )
             return [_db_row_to_api_format(row) for row in rows]
     
+    # Операторы threshold-правил автоматизаций → SQL (allowlist)
+    _THRESHOLD_SQL_OPERATORS = {"==": "=", "!=": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<="}
+
+    async def get_users_by_traffic_percent(self, operator: str, percent: float) -> List[Dict[str, Any]]:
+        """Юзеры с лимитом трафика, у которых used/limit в процентах `operator` percent.
+
+        Возвращает uuid, username, percent — отбор целиком в SQL, без выгрузки
+        всех юзеров. Неподдерживаемый оператор — пустой список.
+        """
+        sql_op = self._THRESHOLD_SQL_OPERATORS.get(operator)
+        if not self.is_connected or sql_op is None:
+            return []
+
+        percent_expr = "COALESCE(used_traffic_bytes, 0) * 100.0 / traffic_limit_bytes"
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                select_sql(USERS_TABLE,
+                    f"uuid, username, {percent_expr} AS percent",
+                    f"WHERE traffic_limit_bytes > 0 AND {percent_expr} {sql_op} $1 "
+                    f"ORDER BY percent DESC"),
+                float(percent),
+            )
+            return [
+                {"uuid": str(r["uuid"]), "username": r["username"] or "", "percent": float(r["percent"])}
+                for r in rows
+            ]
+
+    async def get_users_over_traffic_limit(self) -> List[Dict[str, Any]]:
+        """Юзеры, израсходовавшие больше лимита трафика."""
+        if not self.is_connected:
+            return []
+
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                select_sql(USERS_TABLE,
+                    "uuid, username, traffic_limit_bytes, used_traffic_bytes",
+                    "WHERE traffic_limit_bytes > 0 AND used_traffic_bytes > traffic_limit_bytes"),
+            )
+            return [
+                {
+                    "uuid": str(r["uuid"]),
+                    "username": r["username"] or "",
+                    "traffic_limit_bytes": r["traffic_limit_bytes"],
+                    "used_traffic_bytes": r["used_traffic_bytes"],
+                }
+                for r in rows
+            ]
+
     @staticmethod
     async def _adopt_legacy_rows(conn, pairs: Sequence[Tuple[int, Optional[str]]]) -> None:
         """Привязывает строки от панели v2 к их панельным id по short_uuid.
@@ -8,6 +8,7 @@ from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Set, Tuple
 
 from shared.db._base import _db_row_to_api_format
+from shared.db.counters import bump_panel_counters
 
 from shared.db_schema import (
     USERS_TABLE,
@@ -18,12 +19,30 @@ from shared.db_schema import (
     VIOLATION_REPORTS_TABLE,
     VIOLATION_WHITELIST_TABLE,
 )
-from shared.db_query import delete_sql, insert_sql, select_sql, update_sql
+from shared.db_query import delete_sql, insert_sql, keyset_sql, select_sql, update_sql
 
 from shared.logger import logger
 from shared.metrics import VIOLATIONS_DETECTED
 
 
+def _open_violation_deltas(actions: List[Optional[str]], sign: int) -> List[Tuple[str, str, float]]:
+    """Дельты счётчиков открытых нарушений для panel_counters."""
+    by_action: Dict[str, int] = {}
+    for action in actions:
+        key = (action or "unknown").lower()
+        by_action[key] = by_action.get(key, 0) + 1
+    deltas = [("violations_by_action", a, sign * n) for a, n in by_action.items()]
+    deltas.append(("violations_open", "", sign * len(actions)))
+    return deltas
+
+
+async def _bump_open_violations(conn, actions: List[Optional[str]], sign: int) -> None:
+    try:
+        await bump_panel_counters(conn, _open_violation_deltas(actions, sign))
+    except Exception as e:
+        logger.debug("Violation counters update failed: %s", e)
+
+
 class ViolationsMixin:
     # ==================== Violations ====================
 
@@ -128,11 +147,12 @@ class ViolationsMixin:
                         impossible_travel, is_mobile, is_datacenter, is_vpn,
                         raw_breakdown, hwid_matched_users, suspicious_user_agents
                     )
-                    if result is not None:
-                        VIOLATIONS_DETECTED.labels(
-                            action=(recommended_action or "unknown").lower()
-                        ).inc()
-                    return result, result is not None
+                if result is not None:
+                    VIOLATIONS_DETECTED.labels(
+                        action=(recommended_action or "unknown").lower()
+                    ).inc()
+                    await _bump_open_violations(conn, [recommended_action], +1)
+                return result, result is not None
 
         except Exception as e:
             logger.error("Error saving violation for user %s: %s", user_uuid, e, exc_info=True)
@@ -156,6 +176,8 @@ class ViolationsMixin:
         username: Optional[str] = None,
         user_uuid_whitelist: Optional[List[str]] = None,
         include_annulled: bool = False,
+        user_scope: Optional[Any] = None,
+        after: Optional[Tuple[Any, int]] = None,
     ) -> List[Dict[str, Any]]:
         """
         Получить нарушения за указанный период с фильтрацией на стороне БД.
@@ -171,6 +193,10 @@ class ViolationsMixin:
             resolved: Фильтр по статусу разрешения
             ip: Фильтр по IP адресу
             country: Фильтр по коду страны
+            user_scope: Скоуп видимости админа (shared.rbac.UserScope) —
+                фильтр подзапросом в SQL вместо списка UUID
+            after: Keyset-пагинация — (значение sort_by, id) последней строки
+                предыдущей страницы; offset при этом не нужен. Не для user_count.
 
         Returns:
             Список нарушений
@@ -181,6 +207,8 @@ class ViolationsMixin:
         # Access-policy short-circuit: empty whitelist means no access
         if user_uuid_whitelist is not None and not user_uuid_whitelist:
             return []
+        if user_scope is not None and user_scope.is_empty:
+            return []
 
         try:
             async with self.acquire() as conn:
@@ -197,6 +225,12 @@ class ViolationsMixin:
                     params.append(user_uuid_whitelist)
                     idx += 1
 
+                if user_scope is not None:
+                    scope_sql, scope_params = user_scope.sql("user_uuid", start=idx)
+                    conditions.append(scope_sql)
+                    params.extend(scope_params)
+                    idx += len(scope_params)
+
                 if user_uuid:
                     conditions.append(f"user_uuid = ${idx}::uuid")
                     params.append(user_uuid)
@@ -245,13 +279,22 @@ class ViolationsMixin:
                     params.append(f"%{username}%")
                     idx += 1
 
-                where = " AND ".join(conditions)
-                params.extend([limit, offset])
-
                 # Validate sort params (whitelist to prevent SQL injection)
                 valid_sort = sort_by if sort_by in ('detected_at', 'score', 'user_count') else 'detected_at'
                 valid_order = order if order in ('asc', 'desc') else 'desc'
 
+                if after is not None and valid_sort != 'user_count':
+                    after_sql, after_params = keyset_sql(
+                        [(valid_sort, valid_order == 'desc', after[0]), ("id", False, after[1])],
+                        start=idx,
+                    )
+                    conditions.append(after_sql)
+                    params.extend(after_params)
+                    idx += len(after_params)
+
+                where = " AND ".join(conditions)
+                params.extend([limit, offset])
+
                 if valid_sort == 'user_count':
                     # Sort by number of violations per user using window function
                     rows = await conn.fetch(
@@ -269,7 +312,7 @@ class ViolationsMixin:
                         f"""
                         SELECT * FROM {VIOLATIONS_TABLE}
                         WHERE {where}
-                        ORDER BY {valid_sort} {valid_order}, id ASC
+                        ORDER BY {valid_sort} {valid_order} {'NULLS LAST' if valid_order == 'desc' else 'NULLS FIRST'}, id ASC
                         LIMIT ${idx} OFFSET ${idx + 1}
                         """,
                         *params
@@ -294,14 +337,21 @@ class ViolationsMixin:
         username: Optional[str] = None,
         user_uuid_whitelist: Optional[List[str]] = None,
         include_annulled: bool = False,
+        user_scope: Optional[Any] = None,
+        estimate: bool = False,
     ) -> int:
-        """Подсчитать количество нарушений за период с фильтрами (для пагинации)."""
+        """Подсчитать количество нарушений за период с фильтрами (для пагинации).
+
+        estimate=True — оценка планировщика вместо COUNT(*) (без скана).
+        """
         if not self.is_connected:
             return 0
 
         # Access-policy short-circuit
         if user_uuid_whitelist is not None and not user_uuid_whitelist:
             return 0
+        if user_scope is not None and user_scope.is_empty:
+            return 0
 
         try:
             async with self.acquire() as conn:
@@ -318,6 +368,12 @@ class ViolationsMixin:
                     params.append(user_uuid_whitelist)
                     idx += 1
 
+                if user_scope is not None:
+                    scope_sql, scope_params = user_scope.sql("user_uuid", start=idx)
+                    conditions.append(scope_sql)
+                    params.extend(scope_params)
+                    idx += len(scope_params)
+
                 if user_uuid:
                     conditions.append(f"user_uuid = ${idx}::uuid")
                     params.append(user_uuid)
@@ -366,6 +422,10 @@ class ViolationsMixin:
                     idx += 1
 
                 where = " AND ".join(conditions)
+                if estimate:
+                    return await self._estimate_count(
+                        conn, select_sql(VIOLATIONS_TABLE, "1", f"WHERE {where}"), *params,
+                    )
                 row = await conn.fetchval(
                     select_sql(VIOLATIONS_TABLE, "COUNT(*)", f"WHERE {where}"),
                     *params
@@ -794,6 +854,10 @@ class ViolationsMixin:
 
         try:
             async with self.acquire() as conn:
+                prev = await conn.fetchrow(
+                    select_sql(VIOLATIONS_TABLE, "recommended_action, action_taken IS NULL AS is_open", "WHERE id = $1"),
+                    violation_id,
+                )
                 if action_taken == "annulled":
                     # При аннулировании обнуляем скор — ложное срабатывание
                     result = await conn.execute(
@@ -817,6 +881,8 @@ class ViolationsMixin:
                         ),
                         action_taken, admin_telegram_id, admin_comment, violation_id
                     )
+                if result == "UPDATE 1" and prev and prev["is_open"]:
+                    await _bump_open_violations(conn, [prev["recommended_action"]], -1)
                 return result == "UPDATE 1"
 
         except Exception as e:
@@ -840,7 +906,7 @@ class ViolationsMixin:
 
         try:
             async with self.acquire() as conn:
-                result = await conn.execute(
+                rows = await conn.fetch(
                     update_sql(
                         VIOLATIONS_TABLE,
                         "action_taken = 'annulled', action_taken_at = NOW(), action_taken_by = $1, "
@@ -848,12 +914,13 @@ class ViolationsMixin:
                         "asn_score = 0, profile_score = 0, device_score = 0, hwid_score = 0, "
                         "user_agent_score = 0",
                         "user_uuid = $3 AND action_taken IS NULL",
+                        returning="recommended_action",
                     ),
                     admin_telegram_id, admin_comment, user_uuid,
                 )
-                # result format: "UPDATE N"
-                count = int(result.split()[-1]) if result else 0
-                return count
+                if rows:
+                    await _bump_open_violations(conn, [r["recommended_action"] for r in rows], -1)
+                return len(rows)
 
         except Exception as e:
             logger.error("Error annulling violations for user %s: %s", user_uuid, e, exc_info=True)
@@ -875,7 +942,7 @@ class ViolationsMixin:
 
         try:
             async with self.acquire() as conn:
-                result = await conn.execute(
+                rows = await conn.fetch(
                     update_sql(
                         VIOLATIONS_TABLE,
                         "action_taken = 'annulled', action_taken_at = NOW(), action_taken_by = $1, "
@@ -883,11 +950,13 @@ class ViolationsMixin:
                         "asn_score = 0, profile_score = 0, device_score = 0, hwid_score = 0, "
                         "user_agent_score = 0",
                         "action_taken IS NULL",
+                        returning="recommended_action",
                     ),
                     admin_telegram_id, admin_comment,
                 )
-                count = int(result.split()[-1]) if result else 0
-                return count
+                if rows:
+                    await _bump_open_violations(conn, [r["recommended_action"] for r in rows], -1)
+                return len(rows)
 
         except Exception as e:
             logger.error("Error annulling all violations: %s", e, exc_info=True)
@@ -1464,6 +1533,18 @@ class ViolationsMixin:
 
         return result
 
+    async def get_whitelist_excluded(self, user_uuids: List[str], analyzer: str) -> Set[str]:
+        """Юзеры из списка, которых whitelist освобождает от проверки analyzer.
+
+        Полный whitelist (excluded_analyzers пуст) освобождает от всех проверок,
+        частичный — только от перечисленных. Один запрос на весь список.
+        """
+        status = await self.batch_get_whitelist_status(list(user_uuids))
+        return {
+            uid for uid, (whitelisted, excluded) in status.items()
+            if whitelisted and (excluded is None or analyzer in excluded)
+        }
+
     async def batch_get_user_devices_counts(
         self, user_uuids: List[str]
     ) -> Dict[str, int]:
@@ -4,6 +4,12 @@ Provides reusable functions for building parameterized SQL queries
 that work with any table. All SQL commands built by these functions
 use $N placeholders compatible with asyncpg/psycopg parameter binding.
 """
+import base64
+import hashlib
+import json
+from datetime import datetime
+from decimal import Decimal
+from uuid import UUID
 
 
 def _reject_where_prefix(where: str) -> None:
@@ -146,3 +152,90 @@ def join_sql(
         "{join_type} JOIN {table} {alias} ON {on}"
     """
     return f"{join_type.upper()} JOIN {table} {alias} ON {on}"
+
+
+# ── Keyset (cursor) pagination ───────────────────────────────────
+
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def _cursor_restore(value):
+    if isinstance(value, dict):
+        if "$dt" in value:
+            return datetime.fromisoformat(value["$dt"])
+        if "$dec" in value:
+            return Decimal(value["$dec"])
+        raise ValueError("malformed cursor value")
+    return value
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the last row's sort key into an opaque cursor string.
+
+    The cursor is URL-safe base64 of a JSON list; datetimes and Decimals
+    survive the round trip so they bind to the same parameter types.
+    """
+    raw = json.dumps([_cursor_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a cursor made by encode_cursor(). Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("malformed cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("malformed cursor")
+    return [_cursor_restore(v) for v in values]
+
+
+def cursor_fingerprint(*parts) -> str:
+    """Short digest of the filters a cursor was issued for.
+
+    Stored in the cursor and compared on the next request: a cursor reused
+    with another search or filter would point into a different list.
+    """
+    raw = json.dumps(parts, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def keyset_sql(keys: list, start: int = 1) -> tuple:
+    """Build the "rows after this key" predicate for keyset pagination.
+
+    Args:
+        keys:  [(expression, descending, last_value), ...] in ORDER BY order.
+               NULL sorts as the smallest value, i.e. the query must order
+               DESC NULLS LAST / ASC NULLS FIRST.
+        start: Number of the first $N placeholder
+
+    Returns:
+        (predicate, params) — lexicographic "after" over all keys
+    """
+    params: list = []
+    equal: list = []
+    branches: list = []
+    for expr, descending, value in keys:
+        if value is None:
+            after = "FALSE" if descending else f"{expr} IS NOT NULL"
+            same = f"{expr} IS NULL"
+        else:
+            params.append(value)
+            ph = f"${start + len(params) - 1}"
+            after = f"({expr} < {ph} OR {expr} IS NULL)" if descending else f"{expr} > {ph}"
+            same = f"{expr} = {ph}"
+        if after != "FALSE":
+            branches.append(" AND ".join(equal + [after]))
+        equal.append(same)
+    if not branches:
+        return "FALSE", params
+    return "(" + " OR ".join(f"({b})" for b in branches) + ")", params
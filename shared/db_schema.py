@@ -24,14 +24,20 @@ USERS_TABLE = "users"
 NODES_TABLE = "nodes"
 HOSTS_TABLE = "hosts"
 USER_CONNECTIONS_TABLE = "user_connections"
+USER_ACTIVITY_PERIODS_TABLE = "user_activity_periods"
 IP_METADATA_TABLE = "ip_metadata"
+GEO_DAILY_ROLLUP_TABLE = "geo_daily_rollup"
+PANEL_COUNTERS_TABLE = "panel_counters"
 VIOLATIONS_TABLE = "violations"
 USER_BASELINES_TABLE = "user_baselines"
 USER_HWID_DEVICES_TABLE = "user_hwid_devices"
 VIOLATION_REPORTS_TABLE = "violation_reports"
 VIOLATION_WHITELIST_TABLE = "violation_whitelist"
 NODE_METRICS_SNAPSHOTS_TABLE = "node_metrics_snapshots"
+NODE_METRICS_ROLLUP_1M_TABLE = "node_metrics_rollup_1m"
+NODE_METRICS_ROLLUP_1H_TABLE = "node_metrics_rollup_1h"
 NODE_ATTACK_EVENTS_TABLE = "node_attack_events"
+TORRENT_EVENTS_TABLE = "torrent_events"
 USER_NODE_TRAFFIC_TABLE = "user_node_traffic"
 NODE_SCRIPTS_TABLE = "node_scripts"
 SETTINGS_TABLE = "settings"
@@ -6,8 +6,8 @@ the Telegram bot and web backend from a single codebase.
 Designed to be imported directly by the bot process, and
 re-exported/extended by web/backend/core/rbac.py for the web API.
 """
-import json
 import time
+from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Set, Tuple
 
 from shared.database import db_service
@@ -233,26 +233,85 @@ def filter_by_scope(items: List[dict], scope: Optional[Set[str]], uuid_key: str
     return [it for it in items if (val := it.get(uuid_key)) and str(val).lower() in scope]
 
 
-async def get_visible_user_uuids(
+@dataclass(frozen=True)
+class UserScope:
+    """Users an admin may see, as inputs for an SQL predicate.
+
+    Видимость = свои созданные (creator_id) ∪ юзеры разрешённых нод и
+    сквадов. Вместо материализации списка UUID и передачи его обратно в
+    `uuid = ANY($1)` фильтр собирается в подзапросы по индексам
+    (created_by_admin_id, user_node_traffic, GIN по сквадам) — стоимость
+    запроса не растёт с размером скоупа. Пустой скоуп — нет доступа.
+    """
+
+    creator_id: Optional[int] = None
+    node_uuids: Tuple[str, ...] = ()
+    squad_uuids: Tuple[str, ...] = ()
+
+    @property
+    def is_empty(self) -> bool:
+        return self.creator_id is None and not self.node_uuids and not self.squad_uuids
+
+    def sql(self, column: str = "uuid", start: int = 1, users_row: bool = False) -> Tuple[str, list]:
+        """Build ``(predicate, params)`` restricting ``column`` to visible users.
+
+        Placeholders are numbered from ``$start``. With ``users_row`` the
+        predicate runs on a users row directly (``column`` is users.uuid and
+        the creator/squad checks use the row's own columns); otherwise
+        ``column`` is any user-uuid column and membership goes through
+        subqueries on users.
+        """
+        if self.is_empty:
+            return "FALSE", []
+        parts: List[str] = []
+        params: list = []
+        idx = start
+        if self.creator_id is not None:
+            if users_row:
+                parts.append(f"created_by_admin_id = ${idx}")
+            else:
+                parts.append(
+                    f"{column} IN ("
+                    + select_sql(USERS_TABLE, "uuid", f"WHERE created_by_admin_id = ${idx}")
+                    + ")"
+                )
+            params.append(self.creator_id)
+            idx += 1
+        if self.node_uuids:
+            parts.append(
+                f"{column} IN ("
+                + select_sql(USER_NODE_TRAFFIC_TABLE, "user_uuid", f"WHERE node_uuid = ANY(${idx}::uuid[])")
+                + ")"
+            )
+            params.append(list(self.node_uuids))
+            idx += 1
+        if self.squad_uuids:
+            squads = (
+                f"user_internal_squads(raw_data::jsonb) && ${idx}::text[]"
+                f" OR external_squad_uuid = ANY(${idx + 1}::uuid[])"
+            )
+            if users_row:
+                parts.append(f"({squads})")
+            else:
+                parts.append(f"{column} IN (" + select_sql(USERS_TABLE, "uuid", f"WHERE {squads}") + ")")
+            params.extend([list(self.squad_uuids), list(self.squad_uuids)])
+        return "(" + " OR ".join(parts) + ")", params
+
+
+async def get_user_scope(
     account_id: Optional[int],
     role: Optional[str],
-) -> Optional[Set[str]]:
-    """Resolve which user UUIDs an admin can see.
-
-    Superadmins / unknown admins see all users (return None).
-    Creator scope is always applied when unrestricted_user_access = False.
-    Access policies расширяют видимость: к своим созданным добавляются
-    юзеры разрешённых нод и сквадов.
+) -> Optional[UserScope]:
+    """Resolve which users an admin can see, without materializing them.
 
-    Returns:
-        None — no restrictions (superadmin, or unrestricted + no policies)
-        set[str] — whitelist of user UUIDs (lowercase, possibly empty)
+    Same rules as get_visible_user_uuids(): None — no restriction,
+    otherwise a UserScope (empty on errors / unavailable DB — fail-closed).
     """
     if role == "superadmin" or account_id is None:
         return None
 
     if not db_service.is_connected:
-        return set()
+        return UserScope()
     try:
         async with db_service.acquire() as conn:
             row = await conn.fetchrow(
@@ -263,85 +322,106 @@ async def get_visible_user_uuids(
                 ),
                 account_id,
             )
-            if not row:
-                return None
-            unrestricted = row.get("unrestricted_user_access", True)
-            role_id = row["role_id"]
-
-        creator_uuids: Optional[Set[str]] = None
-        if not unrestricted:
-            async with db_service.acquire() as conn:
-                rows = await conn.fetch(
-                    select_sql(USERS_TABLE, "uuid", "WHERE created_by_admin_id = $1"),
-                    account_id,
-                )
-                creator_uuids = {str(row["uuid"]).lower() for row in rows}
+        if not row:
+            return None
+        unrestricted = row.get("unrestricted_user_access", True)
+        role_id = row["role_id"]
 
         node_scope = await get_scope(account_id, role_id, role, "node", "view")
         squad_scope = await get_scope(account_id, role_id, role, "squad", "view")
 
-        if node_scope is None and squad_scope is None:
-            return None if unrestricted else creator_uuids
-
-        policy_uuids: Set[str] = set()
-
-        if node_scope is not None and node_scope:
-            async with db_service.acquire() as conn:
-                rows = await conn.fetch(
-                    select_sql(USER_NODE_TRAFFIC_TABLE, "DISTINCT user_uuid", "WHERE node_uuid = ANY($1::uuid[])"),
-                    list(node_scope),
-                )
-                policy_uuids.update(str(r["user_uuid"]).lower() for r in rows)
-
-        if squad_scope is not None and squad_scope:
-            squad_list = list(squad_scope)
-            async with db_service.acquire() as conn:
-                rows = await conn.fetch(
-                    select_sql(USERS_TABLE, "uuid", "WHERE external_squad_uuid = ANY($1::uuid[])"),
-                    squad_list,
-                )
-                policy_uuids.update(str(r["uuid"]).lower() for r in rows)
-
-                internal_rows = await conn.fetch(
-                    select_sql(USERS_TABLE, "uuid::text AS uuid, raw_data", "WHERE raw_data IS NOT NULL")
-                )
-                squad_lower = {s.lower() for s in squad_list}
-                for r in internal_rows:
-                    raw = r["raw_data"]
-                    if isinstance(raw, str):
-                        try:
-                            raw = json.loads(raw)
-                        except (ValueError, TypeError):
-                            continue
-                    if not isinstance(raw, dict):
-                        continue
-                    sqs = raw.get("activeInternalSquads") or []
-                    if not isinstance(sqs, list):
-                        continue
-                    for sq in sqs:
-                        sq_uuid = None
-                        if isinstance(sq, str):
-                            sq_uuid = sq
-                        elif isinstance(sq, dict):
-                            sq_uuid = sq.get("uuid") or sq.get("squadUuid")
-                        if sq_uuid and str(sq_uuid).lower() in squad_lower:
-                            policy_uuids.add(str(r["uuid"]).lower())
-                            break
-
-        if unrestricted:
-            return policy_uuids if policy_uuids else set()
-
-        if creator_uuids is None:
-            return policy_uuids if policy_uuids else set()
+        if node_scope is None and squad_scope is None and unrestricted:
+            return None
 
         # Объединение, а не пересечение (#261). Пересечение отбирало у
-        # админа его же свежесозданных юзеров: в policy_uuids юзер
+        # админа его же свежесозданных юзеров: в policy-набор юзер
         # попадает через трафик по разрешённой ноде или через сквад, а
         # только что созданный ещё ни разу не подключался и сквада может
         # не иметь. Выходило «создал, квота списалась, а в списке пусто»
         # — управлять юзером нельзя до его первого подключения.
-        return creator_uuids | policy_uuids
+        return UserScope(
+            creator_id=None if unrestricted else account_id,
+            node_uuids=tuple(sorted(node_scope or ())),
+            squad_uuids=tuple(sorted(squad_scope or ())),
+        )
+    except Exception as e:
+        logger.warning("get_user_scope failed: %s", e)
+        return UserScope()
 
+
+async def filter_visible_user_uuids(
+    account_id: Optional[int],
+    role: Optional[str],
+    user_uuids: List[str],
+) -> List[str]:
+    """Keep only the given user UUIDs the admin can see (input order kept).
+
+    One query over the candidates — for point checks and bulk actions,
+    where the full visible set is not needed.
+    """
+    scope = await get_user_scope(account_id, role)
+    if scope is None or not user_uuids:
+        return list(user_uuids)
+    if scope.is_empty:
+        return []
+    try:
+        predicate, params = scope.sql("u", start=2)
+        async with db_service.acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT u::text AS uuid FROM UNNEST($1::uuid[]) AS u WHERE {predicate}",
+                list(user_uuids), *params,
+            )
+    except Exception as e:
+        logger.warning("filter_visible_user_uuids failed: %s", e)
+        return []
+    visible = {str(r["uuid"]).lower() for r in rows}
+    return [u for u in user_uuids if str(u).lower() in visible]
+
+
+async def get_visible_user_uuids(
+    account_id: Optional[int],
+    role: Optional[str],
+) -> Optional[Set[str]]:
+    """Resolve which user UUIDs an admin can see.
+
+    Superadmins / unknown admins see all users (return None).
+    Creator scope is always applied when unrestricted_user_access = False.
+    Access policies расширяют видимость: к своим созданным добавляются
+    юзеры разрешённых нод и сквадов.
+
+    Материализует get_user_scope() в множество — для путей, которым оно
+    действительно нужно (фильтрация данных из Panel API). SQL-запросам
+    лучше передавать сам UserScope.
+
+    Returns:
+        None — no restrictions (superadmin, or unrestricted + no policies)
+        set[str] — whitelist of user UUIDs (lowercase, possibly empty)
+    """
+    scope = await get_user_scope(account_id, role)
+    if scope is None:
+        return None
+    if scope.is_empty:
+        return set()
+    try:
+        visible: Set[str] = set()
+        async with db_service.acquire() as conn:
+            if scope.creator_id is not None:
+                rows = await conn.fetch(
+                    select_sql(USERS_TABLE, "uuid", "WHERE created_by_admin_id = $1"),
+                    scope.creator_id,
+                )
+                visible.update(str(r["uuid"]).lower() for r in rows)
+            if scope.node_uuids:
+                rows = await conn.fetch(
+                    select_sql(USER_NODE_TRAFFIC_TABLE, "DISTINCT user_uuid", "WHERE node_uuid = ANY($1::uuid[])"),
+                    list(scope.node_uuids),
+                )
+                visible.update(str(r["user_uuid"]).lower() for r in rows)
+        if scope.squad_uuids:
+            visible.update(
+                await db_service.get_user_uuids_by_squads(list(scope.squad_uuids), include_external=True)
+            )
+        return visible
     except Exception as e:
         logger.warning("get_visible_user_uuids failed: %s", e)
         return set()
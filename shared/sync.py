@@ -294,6 +294,13 @@ class SyncService:
         except Exception as e:
             logger.debug("User-node traffic history cleanup failed: %s", e)
 
+        # Счётчики Prometheus-гейджей по юзерам и HWID — после массового синка;
+        # точечные записи (вебхуки, веб, бот) ставят отложенный пересчёт сами.
+        try:
+            await db_service.refresh_panel_counters(("users", "hwid"))
+        except Exception as e:
+            logger.debug("Panel counters refresh failed: %s", e)
+
         logger.debug("Full sync completed: %s", results)
         return results
     
@@ -914,6 +921,11 @@ class SyncService:
                 result["is_new"] = True
                 logger.debug("Webhook %s: user %s (new)", event, uuid or panel_id)
 
+        # Статусы, лимиты, число юзеров — для гейджей и дашборда; удаление
+        # юзера уносит и его устройства
+        db_service.schedule_panel_counters_refresh(
+            ("users", "hwid") if event == "user.deleted" else ("users",)
+        )
         return result
     
     async def _handle_node_webhook_with_diff(self, event: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -1058,6 +1070,8 @@ class SyncService:
             await db_service.delete_hwid_device(user_uuid=user_uuid, hwid=hwid)
             logger.info("Deleted HWID device %s for user %s (webhook)", hwid[:20], user_uuid)
 
+        if event in ("user_hwid_devices.added", "user_hwid_devices.deleted"):
+            db_service.schedule_panel_counters_refresh(("hwid",))
         return result
 
     # ==================== Node Traffic Sync ====================
@@ -1231,6 +1245,7 @@ class SyncService:
                 identifier = panel_id
             user = await api_client.get_user_by_id(identifier)
             await db_service.upsert_user(user)
+            db_service.schedule_panel_counters_refresh(("users",))
             logger.debug("Synced single user %s", uuid)
             return True
         except Exception as e:
@@ -1307,6 +1322,7 @@ class SyncService:
             if not devices:
                 # Если устройств нет - удаляем все из БД
                 await db_service.delete_all_user_hwid_devices(user_uuid)
+                db_service.schedule_panel_counters_refresh(("hwid",))
                 return 0
 
             # Validate that devices is a proper list of dicts/strings, not a misparse
@@ -1318,6 +1334,7 @@ class SyncService:
                 return 0
 
             synced = await db_service.sync_user_hwid_devices(user_uuid, devices)
+            db_service.schedule_panel_counters_refresh(("hwid",))
             logger.debug("Synced %d HWID devices for user %s", synced, user_uuid)
             return synced
 
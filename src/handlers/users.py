@@ -687,6 +687,7 @@ async def _create_user(target: Message | CallbackQuery, data: dict, admin: BotAd
     try:
         if db_service.is_connected:
             await db_service.upsert_user(user)
+            db_service.schedule_panel_counters_refresh(("users",))
             if admin and admin.account_id:
                 # v3: панель не шлёт uuid — локальный uuid генерируется при
                 # upsert'е. Резолвим его по панельному id, чтобы записать владельца.
@@ -13,7 +13,7 @@ from web.backend.core.rate_limit import limiter, RATE_ANALYTICS
 from shared.db_schema import (
     USERS_TABLE, NODES_TABLE, HOSTS_TABLE, USER_CONNECTIONS_TABLE,
     IP_METADATA_TABLE, VIOLATIONS_TABLE, NODE_METRICS_SNAPSHOTS_TABLE,
-    USER_NODE_TRAFFIC_TABLE,
+    USER_NODE_TRAFFIC_TABLE, USER_ACTIVITY_PERIODS_TABLE, GEO_DAILY_ROLLUP_TABLE,
 )
 from shared.db_query import select_sql
 
@@ -74,16 +74,19 @@ async def _compute_geo(period: str = "7d", date_from: Optional[str] = None, date
             delta_map = {"24h": 1, "7d": 7, "30d": 30, "all": 3650}
             days = delta_map.get(period, 7)
             since = now - timedelta(days=days)
+        until = datetime.fromisoformat(date_to.replace("Z", "+00:00")) if date_to else now
 
+        # Суточный агрегат (refresh_geo_rollup): геопозиция IP уже подставлена,
+        # объём — юзеры × IP × сутки, а не подключения с джойном на ip_metadata.
         async with db_service.acquire() as conn:
-            # Get country distribution from ip_metadata table
             country_rows = await conn.fetch(
                 select_sql(
-                    IP_METADATA_TABLE,
-                    "country_name, country_code, COUNT(*) as count",
-                    "WHERE created_at >= $1 AND country_name IS NOT NULL GROUP BY country_name, country_code ORDER BY count DESC LIMIT 50",
+                    GEO_DAILY_ROLLUP_TABLE,
+                    "country_name, country_code, SUM(connections) as count",
+                    "WHERE day >= $1 AND day <= $2 AND country_name IS NOT NULL "
+                    "GROUP BY country_name, country_code ORDER BY count DESC LIMIT 50",
                 ),
-                since,
+                since.date(), until.date(),
             )
 
             countries = [
@@ -98,11 +101,13 @@ async def _compute_geo(period: str = "7d", date_from: Optional[str] = None, date
             # Get city distribution (AVG coords to merge same city with different lat/lon)
             city_rows = await conn.fetch(
                 select_sql(
-                    IP_METADATA_TABLE,
-                    "city, country_name, AVG(latitude) as latitude, AVG(longitude) as longitude, COUNT(*) as count",
-                    "WHERE created_at >= $1 AND city IS NOT NULL AND latitude IS NOT NULL GROUP BY city, country_name ORDER BY count DESC LIMIT 100",
+                    GEO_DAILY_ROLLUP_TABLE,
+                    "city, country_name, AVG(latitude) as latitude, AVG(longitude) as longitude, "
+                    "SUM(connections) as count",
+                    "WHERE day >= $1 AND day <= $2 AND city IS NOT NULL AND latitude IS NOT NULL "
+                    "GROUP BY city, country_name ORDER BY count DESC LIMIT 100",
                 ),
-                since,
+                since.date(), until.date(),
             )
 
             cities = []
@@ -110,24 +115,20 @@ async def _compute_geo(period: str = "7d", date_from: Optional[str] = None, date
             # Fetch all users grouped by city in a single query (avoids N+1)
             city_users_map: dict = {}
             try:
-                # Join user_connections (INET) with ip_metadata (VARCHAR)
-                # Use host() to strip CIDR mask from INET, with text fallback
                 user_city_rows = await conn.fetch(
                     f"""
-                    SELECT im.city, im.country_name,
+                    SELECT g.city, g.country_name,
                            u.username, u.uuid::text as uuid, u.status,
-                           COUNT(uc.id) as connections,
-                           array_agg(DISTINCT SPLIT_PART(uc.ip_address::text, '/', 1)) as ips
-                    FROM {USER_CONNECTIONS_TABLE} uc
-                    JOIN {IP_METADATA_TABLE} im
-                        ON SPLIT_PART(uc.ip_address::text, '/', 1) = TRIM(im.ip_address)
-                    JOIN {USERS_TABLE} u ON uc.user_uuid = u.uuid
-                    WHERE im.city IS NOT NULL AND im.country_name IS NOT NULL
-                          AND im.created_at >= $1
-                    GROUP BY im.city, im.country_name, u.uuid, u.username, u.status
-                    ORDER BY im.city, connections DESC
+                           SUM(g.connections) as connections,
+                           array_agg(DISTINCT g.ip_address) as ips
+                    FROM {GEO_DAILY_ROLLUP_TABLE} g
+                    JOIN {USERS_TABLE} u ON g.user_uuid = u.uuid
+                    WHERE g.city IS NOT NULL AND g.country_name IS NOT NULL
+                          AND g.day >= $1 AND g.day <= $2
+                    GROUP BY g.city, g.country_name, u.uuid, u.username, u.status
+                    ORDER BY g.city, connections DESC
                     """,
-                    since,
+                    since.date(), until.date(),
                 )
                 for ur in user_city_rows:
                     key = (ur["city"], ur["country_name"])
@@ -214,21 +215,26 @@ async def get_top_users_by_traffic(
     admin: AdminUser = Depends(require_permission("analytics", "view")),
 ):
     """Get top users by traffic consumption, optionally for a date range."""
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
+    from web.backend.core.rbac import filter_visible_user_uuids, get_user_scope
+    scope = await get_user_scope(admin)
 
     if date_from and date_to:
         date_from = date_from[:10]
         date_to = date_to[:10]
         result = await _compute_top_users_range(date_from, date_to, limit)
-        if visible is not None and isinstance(result, dict):
+        if scope is not None and isinstance(result, dict):
             items = result.get("items") or []
+            allowed = {
+                u.lower() for u in await filter_visible_user_uuids(
+                    admin, [str(it["uuid"]) for it in items if it.get("uuid")],
+                )
+            }
             result = {**result, "items": [
-                it for it in items if str(it.get("uuid", "")).lower() in visible
+                it for it in items if str(it.get("uuid", "")).lower() in allowed
             ]}
     else:
-        if visible is not None:
-            result = await _compute_top_users_scoped(list(visible), limit)
+        if scope is not None:
+            result = await _compute_top_users_scoped(scope, limit)
         else:
             result = await _compute_top_users(limit=limit)
     return result
@@ -278,23 +284,24 @@ async def _compute_top_users(limit: int = 20):
         return {"items": []}
 
 
-async def _compute_top_users_scoped(uuids: list[str], limit: int = 20):
-    """Compute top users by traffic scoped to a set of user UUIDs."""
+async def _compute_top_users_scoped(scope, limit: int = 20):
+    """Compute top users by traffic within an admin's UserScope (filtered in SQL)."""
     try:
         from shared.database import db_service
-        if not db_service.is_connected or not uuids:
+        if not db_service.is_connected or scope.is_empty:
             return {"items": []}
 
+        scope_sql, scope_params = scope.sql("uuid", start=2, users_row=True)
         async with db_service.acquire() as conn:
             rows = await conn.fetch(
                 select_sql(
                     USERS_TABLE,
                     "uuid, username, status, used_traffic_bytes, traffic_limit_bytes, "
                     "COALESCE(raw_data->'userTraffic'->>'onlineAt', raw_data->>'onlineAt') as online_at",
-                    "WHERE used_traffic_bytes > 0 AND uuid = ANY($1::uuid[]) ORDER BY used_traffic_bytes DESC LIMIT $2",
+                    f"WHERE used_traffic_bytes > 0 AND {scope_sql} ORDER BY used_traffic_bytes DESC LIMIT $1",
                 ),
-                uuids,
                 limit,
+                *scope_params,
             )
 
             items = []
@@ -477,12 +484,13 @@ async def get_trends(
     """Get trend data — growth of users, traffic, violations over time."""
     # If admin has an access-policy scope, compute fresh (cache is shared
     # across admins). For unrestricted admins (most cases) use cached path.
-    from web.backend.core.rbac import get_visible_user_uuids, get_scope
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None and metric in ("users", "violations"):
-        return await _compute_trends(
+    # Скоуп в ключ кэша не входит, поэтому scoped-расчёт идёт мимо кэша.
+    from web.backend.core.rbac import get_user_scope, get_scope
+    user_scope = await get_user_scope(admin)
+    if user_scope is not None and metric in ("users", "violations"):
+        return await _compute_trends.__wrapped__(
             metric=metric, period=period, date_from=date_from, date_to=date_to,
-            user_uuid_whitelist=list(visible),
+            user_scope=user_scope,
         )
     if metric == "traffic":
         node_scope = await get_scope(admin, "node", "view")
@@ -498,10 +506,10 @@ async def get_trends(
 async def _compute_trends(
     metric: str = "users", period: str = "30d",
     date_from: Optional[str] = None, date_to: Optional[str] = None,
-    user_uuid_whitelist: Optional[List[str]] = None,
+    user_scope=None,
     node_uuid_whitelist: Optional[List[str]] = None,
 ):
-    """Compute trends (cacheable when no whitelist; whitelist bypasses cache via extra params)."""
+    """Compute trends (cacheable when unscoped; user_scope is a shared.rbac.UserScope)."""
     try:
         from shared.database import db_service
         if not db_service.is_connected:
@@ -517,22 +525,24 @@ async def _compute_trends(
 
         async with db_service.acquire() as conn:
             if metric == "users":
-                if user_uuid_whitelist is not None:
+                if user_scope is not None:
+                    scope_sql, scope_params = user_scope.sql("uuid", start=2, users_row=True)
                     rows = await conn.fetch(
                         select_sql(
                             USERS_TABLE,
                             "DATE(created_at) as day, COUNT(*) as count",
-                            "WHERE created_at >= $1 AND uuid::text = ANY($2) GROUP BY DATE(created_at) ORDER BY day",
+                            f"WHERE created_at >= $1 AND {scope_sql} GROUP BY DATE(created_at) ORDER BY day",
                         ),
-                        since, user_uuid_whitelist,
+                        since, *scope_params,
                     )
                     total_before = await conn.fetchval(
-                        select_sql(USERS_TABLE, "COUNT(*)", "WHERE created_at < $1 AND uuid::text = ANY($2)"),
-                        since, user_uuid_whitelist,
+                        select_sql(USERS_TABLE, "COUNT(*)", f"WHERE created_at < $1 AND {scope_sql}"),
+                        since, *scope_params,
                     )
+                    scope_sql, scope_params = user_scope.sql("uuid", start=1, users_row=True)
                     total_now = await conn.fetchval(
-                        select_sql(USERS_TABLE, "COUNT(*)", "WHERE uuid::text = ANY($1)"),
-                        user_uuid_whitelist,
+                        select_sql(USERS_TABLE, "COUNT(*)", f"WHERE {scope_sql}"),
+                        *scope_params,
                     )
                 else:
                     rows = await conn.fetch(
@@ -551,14 +561,15 @@ async def _compute_trends(
                 growth = total_now - (total_before or 0)
 
             elif metric == "violations":
-                if user_uuid_whitelist is not None:
+                if user_scope is not None:
+                    scope_sql, scope_params = user_scope.sql("user_uuid", start=2)
                     rows = await conn.fetch(
                         select_sql(
                             VIOLATIONS_TABLE,
                             "DATE(detected_at) as day, COUNT(*) as count",
-                            "WHERE detected_at >= $1 AND user_uuid = ANY($2::uuid[]) GROUP BY DATE(detected_at) ORDER BY day",
+                            f"WHERE detected_at >= $1 AND {scope_sql} GROUP BY DATE(detected_at) ORDER BY day",
                         ),
-                        since, user_uuid_whitelist,
+                        since, *scope_params,
                     )
                 else:
                     rows = await conn.fetch(
@@ -967,7 +978,7 @@ async def _compute_retention(weeks: int = 12):
 @limiter.limit(RATE_ANALYTICS)
 async def get_node_metrics_history(
     request: Request,
-    period: str = Query("24h", description="Period: 24h, 7d, 30d"),
+    period: str = Query("24h", description="Period: 1h, 24h, 7d, 30d"),
     node_uuid: Optional[str] = Query(None, description="Filter by node UUID"),
     admin: AdminUser = Depends(require_permission("fleet", "view")),
 ):
@@ -1163,14 +1174,17 @@ async def _compute_cohort_matrix(granularity: str = "week", months: int = 3):
                     WHERE created_at >= $1
                 ),
                 activity AS (
+                    -- user_activity_periods: одна строка на юзера и период,
+                    -- пишется коллектором — COUNT(*) без DISTINCT по подключениям
                     SELECT
                         c.cohort,
-                        DATE_TRUNC('{trunc}', uc.connected_at)::date AS activity_period,
-                        COUNT(DISTINCT c.uuid) AS active_users
+                        a.period AS activity_period,
+                        COUNT(*) AS active_users
                     FROM cohorts c
-                    JOIN {USER_CONNECTIONS_TABLE} uc ON uc.user_uuid = c.uuid
-                    WHERE uc.connected_at >= $1
-                    GROUP BY c.cohort, activity_period
+                    JOIN {USER_ACTIVITY_PERIODS_TABLE} a ON a.user_uuid = c.uuid
+                    WHERE a.granularity = '{trunc}'
+                      AND a.period >= DATE_TRUNC('{trunc}', $1::timestamptz)::date
+                    GROUP BY c.cohort, a.period
                 ),
                 cohort_sizes AS (
                     SELECT cohort, COUNT(*) AS total_users FROM cohorts GROUP BY cohort
@@ -1244,10 +1258,11 @@ async def _compute_churn(period: str = "month", months: int = 6):
                 f"""
                 WITH periods AS (
                     SELECT
-                        DATE_TRUNC('{trunc}', connected_at)::date AS p,
-                        COUNT(DISTINCT user_uuid) AS active_users
-                    FROM {USER_CONNECTIONS_TABLE}
-                    WHERE connected_at >= $1
+                        period AS p,
+                        COUNT(*) AS active_users
+                    FROM {USER_ACTIVITY_PERIODS_TABLE}
+                    WHERE granularity = '{trunc}'
+                      AND period >= DATE_TRUNC('{trunc}', $1::timestamptz)::date
                     GROUP BY p
                     ORDER BY p
                 ),
@@ -1399,41 +1414,37 @@ async def _compute_geo_balance(days: int = 7):
                 )
             )
 
-            # User distribution by country per node (from connections + ip_metadata)
+            # User distribution by country per node (суточный гео-агрегат)
             geo_rows = await conn.fetch(
                 f"""
                 SELECT
-                    uc.node_uuid::text AS node_uuid,
-                    COALESCE(im.country_code, '??') AS country_code,
-                    COALESCE(im.country_name, 'Unknown') AS country_name,
-                    COUNT(DISTINCT uc.user_uuid) AS user_count,
-                    COUNT(*) AS connection_count
-                FROM {USER_CONNECTIONS_TABLE} uc
-                LEFT JOIN {IP_METADATA_TABLE} im
-                    ON SPLIT_PART(uc.ip_address::text, '/', 1) = TRIM(im.ip_address)
-                WHERE uc.connected_at >= $1
-                GROUP BY uc.node_uuid, im.country_code, im.country_name
+                    node_uuid::text AS node_uuid,
+                    COALESCE(country_code, '??') AS country_code,
+                    COALESCE(country_name, 'Unknown') AS country_name,
+                    COUNT(DISTINCT user_uuid) AS user_count,
+                    SUM(connections) AS connection_count
+                FROM {GEO_DAILY_ROLLUP_TABLE}
+                WHERE day >= $1
+                GROUP BY node_uuid, country_code, country_name
                 ORDER BY user_count DESC
                 """,
-                since,
+                since.date(),
             )
 
             # Total users per country (for unserved region detection)
             country_totals = await conn.fetch(
                 f"""
                 SELECT
-                    COALESCE(im.country_code, '??') AS country_code,
-                    COALESCE(im.country_name, 'Unknown') AS country_name,
-                    COUNT(DISTINCT uc.user_uuid) AS user_count
-                FROM {USER_CONNECTIONS_TABLE} uc
-                LEFT JOIN {IP_METADATA_TABLE} im
-                    ON SPLIT_PART(uc.ip_address::text, '/', 1) = TRIM(im.ip_address)
-                WHERE uc.connected_at >= $1
-                GROUP BY im.country_code, im.country_name
+                    COALESCE(country_code, '??') AS country_code,
+                    COALESCE(country_name, 'Unknown') AS country_name,
+                    COUNT(DISTINCT user_uuid) AS user_count
+                FROM {GEO_DAILY_ROLLUP_TABLE}
+                WHERE day >= $1
+                GROUP BY country_code, country_name
                 ORDER BY user_count DESC
                 LIMIT 30
                 """,
-                since,
+                since.date(),
             )
 
         # Build node data with geo breakdown
@@ -73,7 +73,7 @@ async def _broadcast_agent_status(node_uuid: str, connected: bool) -> None:
                 "connected": connected,
             },
             "timestamp": datetime.utcnow().isoformat(),
-        })
+        }, coalesce_key=f"agent_v2_status:{node_uuid}")
     except Exception as e:
         logger.debug("Failed to broadcast agent status: %s", e)
 
@@ -1,4 +1,5 @@
 """Analytics API endpoints."""
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
@@ -12,7 +13,7 @@ from web.backend.core.update_checker import get_latest_version
 from shared.db_query import select_sql
 from shared.db_schema import NODE_ATTACK_EVENTS_TABLE
 from web.backend.core.api_helper import (
-    fetch_users_from_api, fetch_nodes_from_api, fetch_hosts_from_api,
+    fetch_system_stats, fetch_nodes_from_api, fetch_hosts_from_api,
     fetch_bandwidth_stats, fetch_nodes_realtime_usage,
     fetch_nodes_usage_by_range, _normalize,
 )
@@ -39,6 +40,8 @@ class OverviewStats(BaseModel):
     violations_week: int = 0
     total_traffic_bytes: int = 0
     users_online: int = 0
+    # Источники, не ответившие вовремя: их плитки показывают нули
+    degraded: List[str] = []
 
 
 class TrafficStats(BaseModel):
@@ -172,20 +175,34 @@ class PanelConfigurationResponse(BaseModel):
     warnings: List[PanelConfigWarning] = []
 
 
-async def _get_users_data() -> List[Dict[str, Any]]:
-    """Get users from DB (normalized), fall back to API if DB is empty/unavailable."""
-    try:
-        from shared.database import db_service
-        if db_service.is_connected:
-            users = await db_service.get_all_users(limit=50000)
-            if users:
-                # Normalize: flatten nested userTraffic, add snake_case aliases
-                return [_normalize(u) for u in users]
-    except Exception as e:
-        logger.debug("DB users fetch failed: %s", e)
+# Таймауты источников overview: медленная панель гасит только свою плитку
+_PANEL_API_TIMEOUT = 3.0
+_OVERVIEW_SOURCE_TIMEOUT = 5.0
+# Неполный ответ кэшируется ненадолго: источник поднимется — плитка оживёт
+_DEGRADED_CACHE_TTL = 5
 
-    # Fall back to Remnawave API (already normalized)
-    return await fetch_users_from_api()
+
+async def _gather_sources(sources: Dict[str, Any]) -> tuple:
+    """Await {name: (coroutine, default)} concurrently, each with a timeout.
+
+    Returns ({name: result}, [names that failed or timed out]); a failed
+    source yields its default instead of failing the whole response.
+    """
+    names = list(sources)
+    results = await asyncio.gather(
+        *(asyncio.wait_for(sources[n][0], timeout=_OVERVIEW_SOURCE_TIMEOUT) for n in names),
+        return_exceptions=True,
+    )
+    values: Dict[str, Any] = {}
+    degraded: List[str] = []
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.warning("Overview source %s failed: %r", name, result)
+            values[name] = sources[name][1]
+            degraded.append(name)
+        else:
+            values[name] = result
+    return values, degraded
 
 
 async def _get_nodes_data() -> List[Dict[str, Any]]:
@@ -204,9 +221,9 @@ async def _get_nodes_data() -> List[Dict[str, Any]]:
 
 
 async def _get_hosts_data() -> List[Dict[str, Any]]:
-    """Get hosts from API first, fall back to DB if API is unavailable."""
+    """Get hosts from API first, fall back to DB if API is unavailable or slow."""
     try:
-        hosts = await fetch_hosts_from_api()
+        hosts = await asyncio.wait_for(fetch_hosts_from_api(), timeout=_PANEL_API_TIMEOUT)
         if hosts:
             return hosts
     except Exception as e:
@@ -234,13 +251,15 @@ async def _get_violation_counts() -> Dict[str, int]:
             today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
             week_start = today_start - timedelta(days=7)
 
-            today_stats = await db_service.get_violations_stats_for_period(
-                start_date=today_start,
-                end_date=now,
-            )
-            week_stats = await db_service.get_violations_stats_for_period(
-                start_date=week_start,
-                end_date=now,
+            today_stats, week_stats = await asyncio.gather(
+                db_service.get_violations_stats_for_period(
+                    start_date=today_start,
+                    end_date=now,
+                ),
+                db_service.get_violations_stats_for_period(
+                    start_date=week_start,
+                    end_date=now,
+                ),
             )
             return {
                 'today': today_stats.get('total', 0),
@@ -251,14 +270,6 @@ async def _get_violation_counts() -> Dict[str, int]:
     return {'today': 0, 'week': 0}
 
 
-def _get_user_status(user: Dict[str, Any]) -> str:
-    """Extract user status from user data (handles both DB and API formats).
-    Always returns lowercase for consistent comparison.
-    """
-    status = user.get('status') or user.get('Status') or ''
-    return status.lower().strip()
-
-
 def _is_node_connected(node: Dict[str, Any]) -> bool:
     """Check if node is connected (handles both DB and API formats)."""
     return bool(node.get('is_connected') or node.get('isConnected'))
@@ -269,30 +280,6 @@ def _is_node_disabled(node: Dict[str, Any]) -> bool:
     return bool(node.get('is_disabled') or node.get('isDisabled'))
 
 
-def _get_traffic_bytes(user: Dict[str, Any]) -> int:
-    """Extract used traffic bytes from user data (handles all formats)."""
-    # Direct fields (snake_case or camelCase)
-    val = user.get('used_traffic_bytes') or user.get('usedTrafficBytes')
-    # Nested userTraffic object (raw API response from DB)
-    if not val:
-        user_traffic = user.get('userTraffic')
-        if isinstance(user_traffic, dict):
-            val = user_traffic.get('usedTrafficBytes') or user_traffic.get('used_traffic_bytes')
-    # Lifetime traffic as fallback
-    if not val:
-        val = user.get('lifetimeUsedTrafficBytes')
-        if not val:
-            user_traffic = user.get('userTraffic')
-            if isinstance(user_traffic, dict):
-                val = user_traffic.get('lifetimeUsedTrafficBytes')
-    if not val:
-        return 0
-    try:
-        return int(val)
-    except (ValueError, TypeError):
-        return 0
-
-
 def _get_node_traffic(node: Dict[str, Any]) -> int:
     """Extract traffic bytes from node data."""
     val = (
@@ -328,26 +315,54 @@ async def _get_users_overview_stats() -> Dict[str, Any]:
     except Exception as e:
         logger.debug("DB user count stats failed: %s", e)
 
-    # Fallback: load from API (API has its own limits, acceptable)
-    users = await fetch_users_from_api()
-    total = len(users)
-    active = sum(1 for u in users if _get_user_status(u) == 'active')
-    disabled = sum(1 for u in users if _get_user_status(u) == 'disabled')
-    expired = sum(1 for u in users if _get_user_status(u) == 'expired')
-    traffic = sum(_get_traffic_bytes(u) for u in users)
+    # Fallback: готовые агрегаты панели (/system/stats), без выгрузки юзеров
+    return await _get_panel_user_stats()
+
+
+async def _get_panel_user_stats() -> Dict[str, Any]:
+    """User counts and total traffic from the panel's /system/stats."""
+    stats = await fetch_system_stats() or {}
+    users = stats.get('users') or {}
+    counts = {str(k).lower(): int(v or 0) for k, v in (users.get('statusCounts') or {}).items()}
+    try:
+        traffic = int(users.get('totalTrafficBytes') or 0)
+    except (ValueError, TypeError):
+        traffic = 0
     return {
-        'total': total, 'active': active, 'disabled': disabled,
-        'expired': expired, 'limited': 0, 'total_used_traffic_bytes': traffic,
+        'total': int(users.get('totalUsers') or sum(counts.values())),
+        'active': counts.get('active', 0),
+        'disabled': counts.get('disabled', 0),
+        'expired': counts.get('expired', 0),
+        'limited': counts.get('limited', 0),
+        'total_used_traffic_bytes': traffic,
     }
 
 
-@cached("analytics:overview", ttl=CACHE_TTL_SHORT)
+def _degraded_ttl(stats: OverviewStats) -> Optional[int]:
+    return _DEGRADED_CACHE_TTL if stats.degraded else None
+
+
+@cached("analytics:overview", ttl=CACHE_TTL_SHORT, ttl_for=_degraded_ttl)
 async def _compute_overview() -> OverviewStats:
-    """Compute overview stats (cacheable)."""
-    user_stats = await _get_users_overview_stats()
-    nodes = await _get_nodes_data()
-    hosts = await _get_hosts_data()
-    violations = await _get_violation_counts()
+    """Compute overview stats (cacheable).
+
+    Sources are independent, so they are fetched concurrently: cold load
+    takes as long as the slowest one, not the sum.
+    """
+    data, degraded = await _gather_sources({
+        'users': (_get_users_overview_stats(), {
+            'total': 0, 'active': 0, 'disabled': 0, 'expired': 0,
+            'limited': 0, 'total_used_traffic_bytes': 0,
+        }),
+        'nodes': (_get_nodes_data(), []),
+        'hosts': (_get_hosts_data(), []),
+        'violations': (_get_violation_counts(), {'today': 0, 'week': 0}),
+        'bandwidth': (fetch_bandwidth_stats(), None),
+    })
+    user_stats = data['users']
+    nodes = data['nodes']
+    hosts = data['hosts']
+    violations = data['violations']
 
     total_users = user_stats['total']
     active_users = user_stats['active']
@@ -361,7 +376,7 @@ async def _compute_overview() -> OverviewStats:
     total_hosts = len(hosts)
 
     total_traffic_bytes = 0
-    bw_stats = await fetch_bandwidth_stats()
+    bw_stats = data['bandwidth']
     if bw_stats:
         current_year = bw_stats.get('bandwidthCurrentYear', {})
         try:
@@ -388,6 +403,7 @@ async def _compute_overview() -> OverviewStats:
         violations_week=violations['week'],
         total_traffic_bytes=total_traffic_bytes,
         users_online=users_online,
+        degraded=degraded,
     )
 
 
@@ -504,12 +520,10 @@ async def _compute_traffic() -> TrafficStats:
             if db_service.is_connected:
                 stats = await db_service.get_users_count_by_status()
                 user_traffic = stats.get('total_used_traffic_bytes', 0)
-        except Exception:
-            users = await fetch_users_from_api()
-            user_traffic = sum(_get_traffic_bytes(u) for u in users)
+        except Exception as e:
+            logger.debug("DB user traffic total failed: %s", e)
         if not user_traffic:
-            users = await fetch_users_from_api()
-            user_traffic = sum(_get_traffic_bytes(u) for u in users)
+            user_traffic = (await _get_panel_user_stats())['total_used_traffic_bytes']
         nodes = await _get_nodes_data()
         node_traffic = sum(_get_node_traffic(n) for n in nodes)
         total_bytes = max(user_traffic, node_traffic)
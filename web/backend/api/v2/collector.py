@@ -31,6 +31,7 @@ from shared.metrics import (
     COLLECTOR_BATCHES_REJECTED,
     COLLECTOR_CONNECTIONS_PROCESSED,
 )
+from web.backend.core import node_heartbeat
 from web.backend.core.webhook_security import fire_event
 
 logger = logging.getLogger(__name__)
@@ -56,6 +57,7 @@ _last_violation_cleanup: datetime = datetime.min
 
 # Periodic cleanup of old metrics snapshots and connections
 _last_metrics_cleanup: datetime = datetime.min
+_cleanup_task: Optional[asyncio.Task] = None
 CLEANUP_INTERVAL_HOURS = 24
 METRICS_RETENTION_DAYS = 30
 CONNECTIONS_RETENTION_DAYS = 30
@@ -173,6 +175,43 @@ _NODE_NAME_TTL_MINUTES = 30
 _node_last_batch: dict[str, float] = {}
 MIN_BATCH_INTERVAL = 1.0  # seconds
 
+# ── Flow control: темп и размер батчей для агентов ───────────
+# Очередь бэкенда агенту не видна, поэтому темп задаёт бэкенд: каждый ответ
+# /batch (и 429 тоже) несёт рекомендуемый интервал и предельный размер
+# батча. Пока очередь в норме — подсказки нейтральные и агент живёт по своему
+# AGENT_INTERVAL_SECONDS; когда бэкенд отстаёт — флот нод сам сбавляет темп
+# вместо того, чтобы долбить его повторами.
+MAX_BATCH_CONNECTIONS = 5000     # = max_length у BatchReport.connections
+_FLOW_BACKLOG_SOFT = 2000        # очередь нарушений, с которой начинаем тормозить агентов
+_FLOW_BASE_INTERVAL = 30.0       # интервал агента по умолчанию — от него растёт рекомендация
+_FLOW_MAX_INTERVAL = 300.0
+_FLOW_MIN_BATCH_SIZE = 500
+
+
+def _ingest_pressure() -> float:
+    """Загрузка приёма: 1.0 — граница нормы, больше — бэкенд отстаёт."""
+    max_tasks = config_service.get("violation_max_background_tasks", _MAX_BACKGROUND_TASKS) or _MAX_BACKGROUND_TASKS
+    return max(
+        len(_pending_violation_users) / _FLOW_BACKLOG_SOFT,
+        len(_background_tasks) / max_tasks,
+    )
+
+
+def _flow_control_hints() -> dict:
+    """Подсказки агенту: минимальный интервал отправки и предельный размер батча."""
+    pressure = _ingest_pressure()
+    if pressure <= 1.0:
+        interval = MIN_BATCH_INTERVAL
+        max_batch = MAX_BATCH_CONNECTIONS
+    else:
+        interval = round(min(_FLOW_MAX_INTERVAL, _FLOW_BASE_INTERVAL * pressure), 1)
+        max_batch = max(_FLOW_MIN_BATCH_SIZE, int(MAX_BATCH_CONNECTIONS / pressure))
+    return {
+        "recommended_interval_seconds": interval,
+        "max_batch_size": max_batch,
+        "min_interval_seconds": MIN_BATCH_INTERVAL,
+    }
+
 
 async def _get_node_name(node_uuid: str) -> str:
     """Вернуть имя ноды по UUID (с кэшем и TTL). Fallback — первые 8 символов UUID."""
@@ -262,7 +301,7 @@ class BatchReport(BaseModel):
     """Батч подключений от одной ноды."""
     node_uuid: str
     timestamp: datetime
-    connections: list[ConnectionReport] = Field(default=[], max_length=5000)
+    connections: list[ConnectionReport] = Field(default=[], max_length=MAX_BATCH_CONNECTIONS)
     torrent_events: list[TorrentEventReport] = Field(default=[], max_length=1000)
     system_metrics: Optional[SystemMetricsReport] = None
     network_metrics: Optional[NetworkMetricsReport] = None
@@ -393,6 +432,59 @@ async def _remember_agent_ip(node_uuid: str, client_ip: Optional[str]) -> None:
         logger.debug("Failed to store agent_ip for %s: %s", node_uuid, e)
 
 
+async def _periodic_cleanup() -> None:
+    """Retention и секции наперёд — раз в CLEANUP_INTERVAL_HOURS, вне пути батча."""
+    try:
+        deleted = await db_service.cleanup_old_metrics_snapshots(METRICS_RETENTION_DAYS)
+        if deleted > 0:
+            logger.info("Cleaned up old metrics snapshots (%d partitions or rows)", deleted)
+    except Exception as e:
+        logger.warning("Failed to cleanup old metrics snapshots: %s", e)
+    try:
+        c_days = int(config_service.get("connections_retention_days", CONNECTIONS_RETENTION_DAYS) or CONNECTIONS_RETENTION_DAYS)
+        deleted = await db_service.cleanup_old_connections(c_days)
+        if deleted > 0:
+            logger.info("Cleaned up %d old connections", deleted)
+    except Exception as e:
+        logger.warning("Failed to cleanup old connections: %s", e)
+    try:
+        created = await db_service.ensure_connection_partitions(months_ahead=3)
+        if created > 0:
+            logger.info("Created %d new connection partitions", created)
+    except Exception as e:
+        logger.debug("Failed to ensure connection partitions: %s", e)
+    try:
+        created = await db_service.ensure_metrics_partitions(days_ahead=7)
+        if created > 0:
+            logger.info("Created %d new metrics partitions", created)
+    except Exception as e:
+        logger.debug("Failed to ensure metrics partitions: %s", e)
+    try:
+        created = await db_service.ensure_torrent_partitions(days_ahead=7)
+        if created > 0:
+            logger.info("Created %d new torrent event partitions", created)
+    except Exception as e:
+        logger.debug("Failed to ensure torrent event partitions: %s", e)
+    try:
+        t_days = int(config_service.get("torrent_retention_days", 90) or 90)
+        deleted = await db_service.cleanup_old_torrent_events(t_days)
+        if deleted > 0:
+            logger.info("Cleaned up old torrent events (%d partitions or rows)", deleted)
+    except Exception as e:
+        logger.warning("Failed to cleanup old torrent events: %s", e)
+
+
+def _maybe_start_periodic_cleanup() -> None:
+    global _last_metrics_cleanup, _cleanup_task
+    now = datetime.utcnow()
+    if (now - _last_metrics_cleanup).total_seconds() <= CLEANUP_INTERVAL_HOURS * 3600:
+        return
+    if _cleanup_task and not _cleanup_task.done():
+        return
+    _last_metrics_cleanup = now
+    _cleanup_task = asyncio.create_task(_periodic_cleanup())
+
+
 # ── Endpoints ────────────────────────────────────────────────────
 
 
@@ -409,7 +501,14 @@ async def receive_connections(
     if now_ts - last_ts < MIN_BATCH_INTERVAL:
         _stats["total_batches_rejected"] += 1
         COLLECTOR_BATCHES_REJECTED.labels(reason="rate_limit").inc()
-        raise HTTPException(status_code=429, detail="Too many requests: batch interval too short")
+        # Не HTTPException: агенту нужны подсказки темпа и в отказе, иначе
+        # он повторит вслепую через свой фиксированный retry_delay
+        hints = _flow_control_hints()
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests: batch interval too short", **hints},
+            headers={"Retry-After": str(max(1, int(hints["recommended_interval_seconds"])))},
+        )
     _node_last_batch[node_uuid] = now_ts
     _stats["total_batches_received"] += 1
     COLLECTOR_BATCHES_RECEIVED.inc()
@@ -426,94 +525,38 @@ async def receive_connections(
         COLLECTOR_BATCHES_REJECTED.labels(reason="mismatch").inc()
         raise HTTPException(status_code=403, detail="Token does not match the reported node UUID")
 
-    # Версия агента (UPDATE только при изменении — не дёргаем БД каждым батчем)
-    if report.agent_version:
-        try:
-            await db_service.update_node_agent_version(node_uuid, report.agent_version)
-        except Exception as e:
-            logger.debug("Failed to update agent version for node %s: %s", node_uuid, e)
-
-    # System metrics
+    # Версия агента и метрики — в буфер heartbeat'ов: пишутся раз в несколько
+    # секунд одним запросом на все ноды, а не в критическом пути батча
+    metrics = None
+    network = None
     if report.system_metrics:
+        sm = report.system_metrics
+        metrics = {
+            "cpu_usage": sm.cpu_percent,
+            "cpu_cores": sm.cpu_cores,
+            "memory_usage": sm.memory_percent,
+            "memory_total_bytes": sm.memory_total_bytes,
+            "memory_used_bytes": sm.memory_used_bytes,
+            "disk_usage": sm.disk_percent,
+            "disk_total_bytes": sm.disk_total_bytes,
+            "disk_used_bytes": sm.disk_used_bytes,
+            "disk_read_speed_bps": sm.disk_read_speed_bps,
+            "disk_write_speed_bps": sm.disk_write_speed_bps,
+            "uptime_seconds": sm.uptime_seconds,
+        }
         # Агенты до 1.3.0 сетевых метрик не шлют — тогда None, и колонки не трогаем
         network = report.network_metrics.model_dump() if report.network_metrics else None
-        try:
-            await db_service.update_node_metrics(
-                node_uuid=node_uuid,
-                cpu_usage=report.system_metrics.cpu_percent,
-                cpu_cores=report.system_metrics.cpu_cores,
-                memory_usage=report.system_metrics.memory_percent,
-                memory_total_bytes=report.system_metrics.memory_total_bytes,
-                memory_used_bytes=report.system_metrics.memory_used_bytes,
-                disk_usage=report.system_metrics.disk_percent,
-                disk_total_bytes=report.system_metrics.disk_total_bytes,
-                disk_used_bytes=report.system_metrics.disk_used_bytes,
-                disk_read_speed_bps=report.system_metrics.disk_read_speed_bps,
-                disk_write_speed_bps=report.system_metrics.disk_write_speed_bps,
-                uptime_seconds=report.system_metrics.uptime_seconds,
-                network=network,
-            )
-            logger.debug("System metrics updated for node %s", node_uuid)
+    if report.agent_version or metrics is not None:
+        node_heartbeat.record(node_uuid, agent_version=report.agent_version, metrics=metrics, network=network)
 
-            # Save snapshot for historical analytics
-            try:
-                await db_service.insert_node_metrics_snapshot(
-                    node_uuid=node_uuid,
-                    cpu_usage=report.system_metrics.cpu_percent,
-                    cpu_cores=report.system_metrics.cpu_cores,
-                    memory_usage=report.system_metrics.memory_percent,
-                    memory_total_bytes=report.system_metrics.memory_total_bytes,
-                    memory_used_bytes=report.system_metrics.memory_used_bytes,
-                    disk_usage=report.system_metrics.disk_percent,
-                    disk_total_bytes=report.system_metrics.disk_total_bytes,
-                    disk_used_bytes=report.system_metrics.disk_used_bytes,
-                    disk_read_speed_bps=report.system_metrics.disk_read_speed_bps,
-                    disk_write_speed_bps=report.system_metrics.disk_write_speed_bps,
-                    uptime_seconds=report.system_metrics.uptime_seconds,
-                    network=network,
-                )
-            except Exception as e:
-                logger.debug("Failed to save metrics snapshot for node %s: %s", node_uuid, e)
-        except Exception as e:
-            logger.warning("Failed to update system metrics for node %s: %s", node_uuid, e)
-
-    # Periodic cleanup of old data (once per 24h)
-    global _last_metrics_cleanup
-    now = datetime.utcnow()
-    if (now - _last_metrics_cleanup).total_seconds() > CLEANUP_INTERVAL_HOURS * 3600:
-        _last_metrics_cleanup = now
-        try:
-            deleted = await db_service.cleanup_old_metrics_snapshots(METRICS_RETENTION_DAYS)
-            if deleted > 0:
-                logger.info("Cleaned up %d old metrics snapshots", deleted)
-        except Exception as e:
-            logger.warning("Failed to cleanup old metrics snapshots: %s", e)
-        try:
-            c_days = int(config_service.get("connections_retention_days", CONNECTIONS_RETENTION_DAYS) or CONNECTIONS_RETENTION_DAYS)
-            deleted = await db_service.cleanup_old_connections(c_days)
-            if deleted > 0:
-                logger.info("Cleaned up %d old connections", deleted)
-        except Exception as e:
-            logger.warning("Failed to cleanup old connections: %s", e)
-        try:
-            created = await db_service.ensure_connection_partitions(months_ahead=3)
-            if created > 0:
-                logger.info("Created %d new connection partitions", created)
-        except Exception as e:
-            logger.debug("Failed to ensure connection partitions: %s", e)
-        try:
-            t_days = int(config_service.get("torrent_retention_days", 90) or 90)
-            deleted = await db_service.cleanup_old_torrent_events(t_days)
-            if deleted > 0:
-                logger.info("Cleaned up %d old torrent events", deleted)
-        except Exception as e:
-            logger.warning("Failed to cleanup old torrent events: %s", e)
+    _maybe_start_periodic_cleanup()
 
     if not report.connections and not report.torrent_events:
         return JSONResponse(
             status_code=200,
             content={"status": "ok", "processed": 0, "message": "No connections to process",
-                     "metrics_updated": report.system_metrics is not None},
+                     "metrics_updated": report.system_metrics is not None,
+                     **_flow_control_hints()},
         )
 
     # ── Batch resolve all user identifiers to UUIDs ──────────────
@@ -619,6 +662,9 @@ async def receive_connections(
             _enqueue_violation_users(affected_user_uuids)
         except Exception as e:
             logger.warning("Error in post-processing: %s", e)
+        # Онлайн и открытые подключения для гейджей — по открытым строкам,
+        # не чаще раза в 15 с на процесс, сколько бы нод ни слали батчи
+        await db_service.refresh_panel_counters(("connections",), min_interval=15)
 
     # ── Torrent events processing ──────────────────────────
     torrent_processed = 0
@@ -661,6 +707,7 @@ async def receive_connections(
         content={
             "status": "ok", "processed": processed, "errors": errors,
             "torrent_events": torrent_processed, "node_uuid": node_uuid,
+            **_flow_control_hints(),
         },
     )
 
@@ -1294,6 +1341,8 @@ async def collector_stats(request: Request):
                 "dropped": _stats["total_tasks_dropped"],
             },
             "cooldown_cache_size": cooldown_size,
+            "heartbeat_pending_nodes": node_heartbeat.pending_count(),
+            "flow_control": {"pressure": round(_ingest_pressure(), 2), **_flow_control_hints()},
             "config": {
                 "drain_interval_sec": config_service.get("violation_drain_interval", _VIOLATION_DRAIN_INTERVAL),
                 "chunk_size": config_service.get("violation_chunk_size", _VIOLATION_CHUNK_SIZE),
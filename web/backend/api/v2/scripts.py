@@ -22,6 +22,7 @@ from shared.db_query import select_sql, insert_sql, update_sql, delete_sql
 from web.backend.api.deps import AdminUser, require_permission
 from web.backend.core.agent_manager import agent_manager
 from web.backend.core.agent_hmac import sign_command_with_ts
+from web.backend.core.task_scheduler import invalidate_schedule
 from web.backend.core.rate_limit import limiter, RATE_ANALYTICS
 
 logger = logging.getLogger(__name__)
@@ -742,11 +743,9 @@ async def create_scheduled_task(
 ):
     """Create a new scheduled task."""
     # Validate cron expression
-    from web.backend.core.automation_engine import cron_matches_now
+    from web.backend.core.automation_engine import parse_cron
     try:
-        parts = body.cron_expression.strip().split()
-        if len(parts) != 5:
-            raise ValueError("Expected 5 parts")
+        parse_cron(body.cron_expression)
     except Exception:
         raise api_error(400, "INVALID_CRON", "Invalid CRON expression, expected 5 fields: min hour dom month dow")
 
@@ -761,6 +760,7 @@ async def create_scheduled_task(
             body.script_id, body.node_uuid, body.cron_expression,
             body.is_enabled, env_json, admin.account_id,
         )
+    invalidate_schedule()
     return ScheduledTaskItem(**_normalize_scheduled_task_row(row))
 
 
@@ -777,8 +777,10 @@ async def update_scheduled_task(
     idx = 1
 
     if body.cron_expression is not None:
-        parts = body.cron_expression.strip().split()
-        if len(parts) != 5:
+        from web.backend.core.automation_engine import parse_cron
+        try:
+            parse_cron(body.cron_expression)
+        except Exception:
             raise api_error(400, "INVALID_CRON", "Invalid CRON expression")
         idx += 1
         updates.append(f"cron_expression = ${idx}")
@@ -806,6 +808,7 @@ async def update_scheduled_task(
         )
     if not row:
         raise api_error(404, "NOT_FOUND")
+    invalidate_schedule()
 
     return ScheduledTaskItem(**_normalize_scheduled_task_row(row))
 
@@ -823,6 +826,7 @@ async def delete_scheduled_task(
         )
     if not row:
         raise api_error(404, "NOT_FOUND")
+    invalidate_schedule()
     return {"status": "ok"}
 
 
@@ -840,4 +844,5 @@ async def toggle_scheduled_task(
         )
     if not row:
         raise api_error(404, "NOT_FOUND")
+    invalidate_schedule()
     return ScheduledTaskItem(**_normalize_scheduled_task_row(row))
@@ -4,7 +4,7 @@ import logging
 import sys
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional, List, Set
+from typing import Optional, List
 
 from fastapi import APIRouter, Depends, Query, HTTPException, Request
 from pydantic import BaseModel, Field
@@ -32,10 +32,12 @@ from web.backend.api.deps import (  # noqa: F401  get_current_admin — точк
     get_client_ip,
     get_current_admin,
 )
-from web.backend.core.api_helper import fetch_users_from_api
+from web.backend.core.api_helper import fetch_users_page_from_api
 from web.backend.core.audit import write_audit_log
 from web.backend.core.admin_accounts import get_admin_account_by_id
-from web.backend.core.rbac import get_visible_user_uuids, get_scope
+from web.backend.core.rbac import (
+    filter_visible_user_uuids, get_scope, get_user_scope, is_user_visible,
+)
 from web.backend.core.webhook_security import fire_event
 from web.backend.schemas.user import UserListItem, UserDetail, UserCreate, UserUpdate, HwidDevice
 from web.backend.schemas.common import PaginatedResponse, SuccessResponse
@@ -49,8 +51,7 @@ router = APIRouter()
 
 async def _ensure_user_visible(admin: AdminUser, user_uuid: str) -> None:
     """Raise 403 if the admin's access-policy scope hides this user."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None and user_uuid.lower() not in visible:
+    if not await is_user_visible(admin, user_uuid):
         raise api_error(403, E.FORBIDDEN)
 
 
@@ -314,159 +315,17 @@ def _ensure_snake_case(user: dict) -> dict:
     return result
 
 
-async def _get_users_list():
-    """Get users from DB, fall back to API."""
-    try:
-        from shared.database import db_service
-        if db_service.is_connected:
-            users = await db_service.get_all_users(limit=50000)
-            if users:
-                logger.debug("Loaded %d users from database", len(users))
-                return users
-            else:
-                logger.info("Database connected but no users found, trying API")
-    except Exception as e:
-        logger.warning("DB users fetch failed: %s", e)
+async def _get_users_page_from_api(page: int, per_page: int) -> tuple:
+    """Одна страница юзеров напрямую из панели — пока БД недоступна.
 
-    try:
-        users = await fetch_users_from_api()
-        logger.debug("Loaded %d users from API", len(users))
-        return users
-    except Exception as e:
-        logger.warning("API users fetch failed: %s", e)
-        return []
-
-
-def _parse_dt(val) -> Optional[datetime]:
-    """Parse a datetime value from various formats."""
-    if val is None:
-        return None
-    if isinstance(val, datetime):
-        return val
-    if isinstance(val, str):
-        try:
-            # Try ISO format
-            return datetime.fromisoformat(val.replace('Z', '+00:00'))
-        except (ValueError, TypeError):
-            return None
-    return None
-
-
-def _filter_users_in_memory(
-    users: list, *, search=None, status=None, traffic_type=None,
-    expire_filter=None, online_filter=None, traffic_usage=None,
-    sort_by="created_at", sort_order="desc", page=1, per_page=20,
-    visible_uuids: Optional[Set[str]] = None,
-    external_squad_uuid=None, tag=None,
-) -> tuple:
-    """In-memory filtering/sorting/pagination fallback for API path."""
-    now = datetime.now(timezone.utc)
-    if visible_uuids is not None:
-        users = [u for u in users if u.get("uuid") and u["uuid"].lower() in visible_uuids]
-
-    def _get(u, *keys, default=''):
-        for k in keys:
-            v = u.get(k)
-            if v is not None:
-                return v
-        return default
-
-    if search:
-        sl = search.lower()
-        users = [
-            u for u in users
-            if sl in str(_get(u, 'username')).lower()
-            or sl in str(_get(u, 'email')).lower()
-            or sl in str(_get(u, 'uuid')).lower()
-            or sl in str(_get(u, 'short_uuid')).lower()
-            or sl in str(_get(u, 'telegram_id')).lower()
-            or sl in str(_get(u, 'description')).lower()
-        ]
-
-    if status:
-        status_lower = status.lower()
-        users = [u for u in users if str(_get(u, 'status')).lower() == status_lower]
-
-    if traffic_type == 'unlimited':
-        users = [u for u in users if not u.get('traffic_limit_bytes')]
-    elif traffic_type == 'limited':
-        users = [u for u in users if u.get('traffic_limit_bytes') and u['traffic_limit_bytes'] > 0]
-
-    if expire_filter:
-        def _expire_match(u):
-            expire = _parse_dt(u.get('expire_at'))
-            if expire_filter == 'no_expiry':
-                return expire is None
-            if expire is None:
-                return False
-            if expire.tzinfo is None:
-                expire = expire.replace(tzinfo=timezone.utc)
-            if expire_filter == 'expired':
-                return expire < now
-            if expire_filter == 'expiring_7d':
-                return now <= expire <= now + timedelta(days=7)
-            if expire_filter == 'expiring_30d':
-                return now <= expire <= now + timedelta(days=30)
-            return True
-        users = [u for u in users if _expire_match(u)]
-
-    if online_filter:
-        def _online_match(u):
-            online = _parse_dt(u.get('online_at'))
-            if online_filter == 'never':
-                return online is None
-            if online is None:
-                return False
-            if online.tzinfo is None:
-                online = online.replace(tzinfo=timezone.utc)
-            if online_filter == 'online_24h':
-                return online >= now - timedelta(hours=24)
-            if online_filter == 'online_7d':
-                return online >= now - timedelta(days=7)
-            if online_filter == 'online_30d':
-                return online >= now - timedelta(days=30)
-            return True
-        users = [u for u in users if _online_match(u)]
-
-    if traffic_usage:
-        def _traffic_usage_match(u):
-            used = u.get('used_traffic_bytes', 0) or 0
-            limit_val = u.get('traffic_limit_bytes')
-            if traffic_usage == 'zero':
-                return used == 0
-            if not limit_val or limit_val == 0:
-                return False
-            pct = (used / limit_val) * 100
-            thresholds = {'above_90': 90, 'above_70': 70, 'above_50': 50}
-            return pct >= thresholds.get(traffic_usage, 0)
-        users = [u for u in users if _traffic_usage_match(u)]
-
-    if external_squad_uuid:
-        esq = str(external_squad_uuid).lower()
-        users = [u for u in users if str(_get(u, 'external_squad_uuid', 'externalSquadUuid')).lower() == esq]
-
-    if tag:
-        users = [u for u in users if _get(u, 'tag') == tag]
-
-    reverse = sort_order == "desc"
-    if sort_by in ('used_traffic_bytes', 'raw_used_traffic_bytes', 'lifetime_used_traffic_bytes', 'hwid_device_limit'):
-        users.sort(key=lambda x: x.get(sort_by, 0) or 0, reverse=reverse)
-    elif sort_by == 'traffic_limit_bytes':
-        def _tlk(u):
-            val = u.get('traffic_limit_bytes')
-            return val if val else float('inf')
-        users.sort(key=_tlk, reverse=reverse)
-    elif sort_by in ('online_at', 'expire_at'):
-        def _dsk(u):
-            val = _parse_dt(u.get(sort_by))
-            return val.isoformat() if val else ('' if not reverse else 'zzzz')
-        users.sort(key=_dsk, reverse=reverse)
-    else:
-        users.sort(key=lambda x: _get(x, sort_by) or '', reverse=reverse)
-
-    total = len(users)
-    start = (page - 1) * per_page
-    return users[start:start + per_page], total
+    Панель умеет только start/size: ни фильтров, ни сортировки, ни скоупа
+    админки она не знает, поэтому так отдаётся лишь простой список без
+    фильтров. Память — одна страница, а не вся таблица юзеров.
+    """
+    data = await fetch_users_page_from_api(start=(page - 1) * per_page, size=per_page)
+    if data is None:
+        raise api_error(503, E.DB_UNAVAILABLE)
+    return data["users"], int(data["total"] or 0)
 
 
 @router.get("", response_model=PaginatedResponse[UserListItem])
@@ -484,17 +343,25 @@ async def list_users(
     admin_id: Optional[int] = Query(None, description="Filter by creator admin ID (superadmin only)"),
     external_squad_uuid: Optional[str] = Query(None, description="Filter by external squad UUID"),
     tag: Optional[str] = Query(None, description="Filter by user tag"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (keyset pagination, overrides page)"),
+    total_mode: str = Query("exact", regex="^(exact|estimate)$", description="exact COUNT or planner estimate"),
     admin: AdminUser = Depends(require_permission("users", "view")),
 ):
-    """List users with pagination and filtering."""
+    """List users with pagination and filtering.
+
+    Supports two pagination modes:
+    - offset-based: ?page=3&per_page=50
+    - cursor-based (constant cost per page): ?cursor=<next_cursor>&per_page=50
+    """
     try:
         users = []
         total = 0
+        next_cursor = None
         db_available = False
 
-        # Access-policy scope: only users tied to allowed nodes/squads
-        visible_uuids = await get_visible_user_uuids(admin)
-        uuid_whitelist = list(visible_uuids) if visible_uuids is not None else None
+        # Access-policy scope: only users tied to allowed nodes/squads.
+        # Фильтр уходит в SQL предикатом, список UUID не собирается.
+        user_scope = await get_user_scope(admin)
 
         # Restrict admin_id filter to superadmin and unrestricted admins
         resolved_admin_id = admin_id if (admin.role == "superadmin" or getattr(admin, "unrestricted_user_access", False)) else None
@@ -503,7 +370,7 @@ async def list_users(
         try:
             from shared.database import db_service
             if db_service.is_connected:
-                users, total = await db_service.get_users_paginated(
+                users, total, next_cursor = await db_service.get_users_page(
                     page=page, per_page=per_page,
                     search=search, status=status,
                     traffic_type=traffic_type,
@@ -511,31 +378,30 @@ async def list_users(
                     online_filter=online_filter,
                     traffic_usage=traffic_usage,
                     sort_by=sort_by, sort_order=sort_order,
-                    uuid_whitelist=uuid_whitelist,
+                    user_scope=user_scope,
                     admin_id=resolved_admin_id,
                     external_squad_uuid=external_squad_uuid,
                     tag=tag,
+                    cursor=cursor,
+                    total_mode=total_mode,
                 )
                 db_available = True
         except Exception as e:
-            logger.warning("DB paginated users failed, falling back to API: %s", e)
+            if cursor and isinstance(e, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            logger.warning("DB paginated users failed: %s", e)
 
         if not db_available:
-            # Fallback: API with in-memory filtering (old behavior)
-            users = await _get_users_list()
-            if uuid_whitelist is not None:
-                wh = {u.lower() for u in uuid_whitelist}
-                users = [u for u in users if u.get("uuid") and u["uuid"].lower() in wh]
-            users, total = _filter_users_in_memory(
-                users, search=search, status=status,
-                traffic_type=traffic_type, expire_filter=expire_filter,
-                online_filter=online_filter, traffic_usage=traffic_usage,
-                sort_by=sort_by, sort_order=sort_order,
-                page=page, per_page=per_page,
-                visible_uuids=visible_uuids,
-                external_squad_uuid=external_squad_uuid,
-                tag=tag,
-            )
+            # Без БД — только страница панели как есть. Фильтры, поиск, курсор
+            # и скоуп доступа работают лишь в SQL: выгружать ради них всю
+            # таблицу юзеров в память больше не будем.
+            filtered = any((
+                search, status, traffic_type, expire_filter, online_filter,
+                traffic_usage, resolved_admin_id, external_squad_uuid, tag, cursor,
+            ))
+            if filtered or user_scope is not None:
+                raise api_error(503, E.DB_UNAVAILABLE)
+            users, total = await _get_users_page_from_api(page, per_page)
 
         # Normalize to snake_case
         users = [_ensure_snake_case(u) for u in users]
@@ -596,8 +462,11 @@ async def list_users(
             page=page,
             per_page=per_page,
             pages=(total + per_page - 1) // per_page if total > 0 else 1,
+            next_cursor=next_cursor,
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Error listing users: %s", e, exc_info=True)
         return PaginatedResponse(
@@ -1027,6 +896,7 @@ async def create_user(
                     )
                 else:
                     await db_service.upsert_user(user)
+                    db_service.schedule_panel_counters_refresh(("users",))
                     if not user_uuid and panel_id is not None:
                         user_uuid = await db_service.get_user_uuid_by_panel_id(int(panel_id)) or ''
                         if not user_uuid:
@@ -1307,6 +1177,7 @@ async def delete_user(
         try:
             if db_service.is_connected:
                 await db_service.delete_user(user_uuid)
+                db_service.schedule_panel_counters_refresh(("users", "hwid"))
         except Exception as e:
             logger.debug("Non-critical: failed to delete user from local DB: %s", e)
 
@@ -1476,9 +1347,7 @@ async def get_hwid_device_counts(
     admin: AdminUser = Depends(require_permission("users", "view")),
 ):
     """Get HWID device counts for multiple users in one call."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        user_uuids = [u for u in user_uuids if u.lower() in visible]
+    user_uuids = await filter_visible_user_uuids(admin, user_uuids)
     import asyncio
 
     async def _get_count(uuid: str) -> tuple:
@@ -1806,6 +1675,7 @@ async def delete_user_hwid_device(
         # Delete from local DB (parameter is hwid, not device_id)
         if db_service.is_connected:
             await db_service.delete_hwid_device(user_uuid=user_uuid, hwid=device_id)
+            db_service.schedule_panel_counters_refresh(("hwid",))
 
         # Also delete from main API
         try:
@@ -1857,9 +1727,7 @@ async def bulk_enable_users(
     admin: AdminUser = Depends(require_permission("users", "bulk_operations")),
 ):
     """Enable multiple users at once (max 100)."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        body.uuids = [u for u in body.uuids if u.lower() in visible]
+    body.uuids = await filter_visible_user_uuids(admin, body.uuids)
 
     try:
         from shared.api_client import api_client
@@ -1892,9 +1760,7 @@ async def bulk_disable_users(
     admin: AdminUser = Depends(require_permission("users", "bulk_operations")),
 ):
     """Disable multiple users at once (max 100)."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        body.uuids = [u for u in body.uuids if u.lower() in visible]
+    body.uuids = await filter_visible_user_uuids(admin, body.uuids)
 
     try:
         from shared.api_client import api_client
@@ -1927,9 +1793,7 @@ async def bulk_delete_users(
     admin: AdminUser = Depends(require_permission("users", "bulk_operations")),
 ):
     """Delete multiple users at once (max 100)."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        body.uuids = [u for u in body.uuids if u.lower() in visible]
+    body.uuids = await filter_visible_user_uuids(admin, body.uuids)
 
     try:
         from shared.api_client import api_client
@@ -1954,6 +1818,7 @@ async def bulk_delete_users(
             if db_service.is_connected:
                 try:
                     await db_service.delete_user(uuid)
+                    db_service.schedule_panel_counters_refresh(("users", "hwid"))
                 except Exception as e:
                     logger.debug("Non-critical: failed to delete user from local DB: %s", e)
 
@@ -1987,9 +1852,7 @@ async def bulk_reset_traffic(
     admin: AdminUser = Depends(require_permission("users", "bulk_operations")),
 ):
     """Reset traffic for multiple users at once (max 100)."""
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        body.uuids = [u for u in body.uuids if u.lower() in visible]
+    body.uuids = await filter_visible_user_uuids(admin, body.uuids)
 
     try:
         from shared.api_client import api_client
@@ -2250,9 +2113,7 @@ async def bulk_unassign_admin(
     """Clear created_by_admin_id for multiple users at once (superadmin only, max 100)."""
     if admin.role != "superadmin":
         raise api_error(403, E.FORBIDDEN)
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        body.uuids = [u for u in body.uuids if u.lower() in visible]
+    body.uuids = await filter_visible_user_uuids(admin, body.uuids)
 
     try:
         from shared.database import db_service
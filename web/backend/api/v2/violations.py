@@ -32,6 +32,7 @@ from web.backend.schemas.violation import (
     WhitelistListResponse,
 )
 from shared.database import DatabaseService
+from shared.db_query import cursor_fingerprint, decode_cursor, encode_cursor
 from shared.geoip import get_geoip_service
 
 logger = logging.getLogger(__name__)
@@ -100,6 +101,8 @@ async def list_violations(
     recommended_action: Optional[str] = Query(None, description="Filter by recommended action"),
     username: Optional[str] = Query(None, description="Search by username (partial match)"),
     include_annulled: bool = Query(False, description="Include annulled (false-positive) violations"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (keyset pagination, overrides page)"),
+    total_mode: str = Query("exact", regex="^(exact|estimate)$", description="exact COUNT or planner estimate"),
     admin: AdminUser = Depends(require_permission("violations", "view")),
     db: DatabaseService = Depends(get_db),
 ):
@@ -117,6 +120,9 @@ async def list_violations(
     - **date_to**: Фильтр до даты (ISO формат)
     - **include_annulled**: Показывать аннулированные (по умолчанию скрыты, чтобы
       список совпадал со счётчиками статистики)
+    - **cursor**: next_cursor предыдущей страницы — keyset по (sort_by, id),
+      стоимость страницы не растёт с глубиной (кроме sort_by=user_count)
+    - **total_mode**: exact — COUNT(*), estimate — оценка планировщика
     """
     try:
         if not db.is_connected:
@@ -143,10 +149,9 @@ async def list_violations(
                     detail="Invalid date_to format. Use ISO format (e.g. 2024-01-15T23:59:59)",
                 )
 
-        # Access-policy scope: filter violations to visible users
-        from web.backend.core.rbac import get_visible_user_uuids
-        visible = await get_visible_user_uuids(admin)
-        user_uuid_whitelist = list(visible) if visible is not None else None
+        # Access-policy scope: filter violations to visible users (in SQL)
+        from web.backend.core.rbac import get_user_scope
+        user_scope = await get_user_scope(admin)
 
         filter_kwargs = dict(
             start_date=start_date,
@@ -159,24 +164,49 @@ async def list_violations(
             country=country,
             recommended_action=recommended_action,
             username=username,
-            user_uuid_whitelist=user_uuid_whitelist,
+            user_scope=user_scope,
             include_annulled=include_annulled,
         )
 
+        keyset = sort_by in ("detected_at", "score") and order in ("asc", "desc")
+        # Курсор привязан к сортировке и фильтрам запроса (период — как задан,
+        # а не вычисленные от текущего времени границы; scope — свойство админа)
+        cursor_head = [sort_by, order, cursor_fingerprint(
+            days, date_from, date_to,
+            {k: v for k, v in filter_kwargs.items()
+             if k not in ("start_date", "end_date", "user_scope")},
+        )]
+        after = None
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+            except ValueError:
+                values = []
+            if not keyset or len(values) != 5 or values[:3] != cursor_head:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            after = (values[3], values[4])
+
         # Подсчёт для пагинации
         # KNOWN LIMITATION: count и data — два отдельных запроса без общей транзакции.
         # При concurrent INSERT/DELETE возможен race condition: total=0 но items не пустой
         # (или наоборот). Для admin-панели это приемлемо.
-        total = await db.count_violations_for_period(**filter_kwargs)
+        total = await db.count_violations_for_period(
+            **filter_kwargs, estimate=total_mode == "estimate",
+        )
 
         # Получаем страницу данных
         violations = await db.get_violations_for_period(
             **filter_kwargs,
             limit=per_page,
-            offset=(page - 1) * per_page,
+            offset=0 if after else (page - 1) * per_page,
             sort_by=sort_by,
             order=order,
+            after=after,
         )
+        next_cursor = None
+        if keyset and len(violations) == per_page:
+            last = violations[-1]
+            next_cursor = encode_cursor(cursor_head + [last.get(sort_by), last.get("id")])
 
         # Преобразуем в модели
         items = []
@@ -192,6 +222,7 @@ async def list_violations(
             page=page,
             per_page=per_page,
             pages=(total + per_page - 1) // per_page if total > 0 else 1,
+            next_cursor=next_cursor,
         )
     except HTTPException:
         raise
@@ -506,10 +537,10 @@ async def annul_all_violations(
 ):
     """Аннулировать все нерассмотренные нарушения (глобально)."""
     # Access-policy: глобальное аннулирование затрагивает ВСЕХ юзеров, поэтому
-    # доступно только админам без ограничения видимости (visible is None).
+    # доступно только админам без ограничения видимости (scope is None).
     # Scoped-админ должен использовать per-user annul-all в пределах своего scope.
-    from web.backend.core.rbac import get_visible_user_uuids
-    if await get_visible_user_uuids(admin) is not None:
+    from web.backend.core.rbac import get_user_scope
+    if await get_user_scope(admin) is not None:
         raise api_error(403, E.FORBIDDEN)
 
     comment = data.comment if data else None
@@ -540,9 +571,8 @@ async def annul_user_violations(
     db: DatabaseService = Depends(get_db),
 ):
     """Аннулировать все нерассмотренные нарушения пользователя."""
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None and user_uuid.lower() not in visible:
+    from web.backend.core.rbac import is_user_visible
+    if not await is_user_visible(admin, user_uuid):
         raise api_error(403, E.FORBIDDEN)
     comment = data.comment if data else None
     count = await db.annul_pending_violations(
@@ -572,9 +602,8 @@ async def get_user_violations(
     db: DatabaseService = Depends(get_db),
 ):
     """Нарушения конкретного пользователя."""
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None and user_uuid.lower() not in visible:
+    from web.backend.core.rbac import is_user_visible
+    if not await is_user_visible(admin, user_uuid):
         raise api_error(403, E.FORBIDDEN)
     violations = await db.get_user_violations(
         user_uuid=user_uuid,
@@ -617,9 +646,8 @@ async def get_user_timeline(
     db: DatabaseService = Depends(get_db),
 ):
     """Единая лента событий юзера: нарушения + сессии подключений + HWID-устройства."""
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None and user_uuid.lower() not in visible:
+    from web.backend.core.rbac import is_user_visible
+    if not await is_user_visible(admin, user_uuid):
         raise api_error(403, E.FORBIDDEN)
 
     events: list[dict] = []
@@ -690,9 +718,8 @@ async def export_violations_csv(
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
 
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
-    user_uuid_whitelist = list(visible) if visible is not None else None
+    from web.backend.core.rbac import get_user_scope
+    user_scope = await get_user_scope(admin)
 
     violations = await db.get_violations_for_period(
         start_date=start_date,
@@ -702,7 +729,7 @@ async def export_violations_csv(
         user_uuid=user_uuid,
         resolved=resolved,
         limit=10000,
-        user_uuid_whitelist=user_uuid_whitelist,
+        user_scope=user_scope,
     )
 
     output = io.StringIO()
@@ -906,12 +933,9 @@ async def get_violation(
         raise api_error(404, E.VIOLATION_NOT_FOUND)
 
     # Access-policy: hide if violation's user is not in admin's scope
-    from web.backend.core.rbac import get_visible_user_uuids
-    visible = await get_visible_user_uuids(admin)
-    if visible is not None:
-        uuser = str(violation.get("user_uuid", "")).lower()
-        if uuser not in visible:
-            raise api_error(404, E.VIOLATION_NOT_FOUND)
+    from web.backend.core.rbac import is_user_visible
+    if not await is_user_visible(admin, str(violation.get("user_uuid", ""))):
+        raise api_error(404, E.VIOLATION_NOT_FOUND)
 
     return ViolationDetail(
         id=int(violation.get('id', 0)),
@@ -963,12 +987,9 @@ async def resolve_violation(
     # Access-policy: refuse if violation's user is not in admin's scope
     violation_check = await db.get_violation_by_id(violation_id)
     if violation_check:
-        from web.backend.core.rbac import get_visible_user_uuids
-        visible = await get_visible_user_uuids(admin)
-        if visible is not None:
-            uuser = str(violation_check.get("user_uuid", "")).lower()
-            if uuser not in visible:
-                raise api_error(403, E.FORBIDDEN)
+        from web.backend.core.rbac import is_user_visible
+        if not await is_user_visible(admin, str(violation_check.get("user_uuid", ""))):
+            raise api_error(403, E.FORBIDDEN)
 
     # При блокировке — реально отключаем пользователя через Panel API
     if action_value == "block":
@@ -1049,12 +1070,9 @@ async def annul_violation(
     # (как в resolve/annul-user; раньше этот путь scope не проверял).
     violation_check = await db.get_violation_by_id(violation_id)
     if violation_check:
-        from web.backend.core.rbac import get_visible_user_uuids
-        visible = await get_visible_user_uuids(admin)
-        if visible is not None:
-            uuser = str(violation_check.get("user_uuid", "")).lower()
-            if uuser not in visible:
-                raise api_error(403, E.FORBIDDEN)
+        from web.backend.core.rbac import is_user_visible
+        if not await is_user_visible(admin, str(violation_check.get("user_uuid", ""))):
+            raise api_error(403, E.FORBIDDEN)
 
     comment = data.comment if data else None
     success = await db.update_violation_action(
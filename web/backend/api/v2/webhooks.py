@@ -15,6 +15,7 @@ from web.backend.core.webhook_security import (
     check_url_safety,
     deliver_once,
     dispatch_event as _dispatch_event,
+    invalidate_subscriptions,
     sign_payload,
 )
 
@@ -150,6 +151,7 @@ async def create_webhook(
             body.name, body.url, body.secret, body.events, admin_id,
             body.signature_version or "v2", body.description,
         )
+    invalidate_subscriptions()
     return _row_to_response(row)
 
 
@@ -196,6 +198,7 @@ async def update_webhook(
         )
     if not row:
         raise api_error(404, E.ADMIN_NOT_FOUND, "Webhook not found")
+    invalidate_subscriptions()
     return _row_to_response(row)
 
 
@@ -213,6 +216,7 @@ async def delete_webhook(
         )
     if result == "DELETE 0":
         raise api_error(404, E.ADMIN_NOT_FOUND, "Webhook not found")
+    invalidate_subscriptions()
 
 
 # ── Test & Delivery History ──────────────────────────────────────
@@ -2,10 +2,12 @@
 import asyncio
 import json
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from typing import Set, Dict, Any, Optional, Tuple
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from prometheus_client import Counter
 
 from web.backend.api.deps import get_current_admin_ws, ws_auth_invalid, AdminUser
 
@@ -13,13 +15,85 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+# Исходящая очередь одного клиента. Переполнилась — выбрасываем самые старые
+# сообщения; не принял одно сообщение за SEND_TIMEOUT — клиент отключается.
+OUTBOX_MAX_MESSAGES = 256
+SEND_TIMEOUT = 3.0
+
+WS_MESSAGES_DROPPED = Counter(
+    "panel_ws_messages_dropped_total",
+    "Admin WebSocket messages dropped for slow consumers.",
+    ["reason"],
+)
+
+
+class _Outbox:
+    """Очередь исходящих сообщений клиента и задача, которая её отправляет.
+
+    Сообщения с одинаковым coalesce_key, ещё не ушедшие клиенту, заменяются
+    последним (статус ноды, статистика дашборда) — медленный клиент получает
+    актуальное состояние, а не хвост устаревших снимков.
+    """
+
+    def __init__(self, websocket: WebSocket, on_dead):
+        self.websocket = websocket
+        self._pending: "OrderedDict[Any, str]" = OrderedDict()
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._on_dead = on_dead
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, data: str, coalesce_key: Optional[str] = None) -> None:
+        if coalesce_key is None:
+            self._seq += 1
+            key: Any = self._seq
+        else:
+            key = ("c", coalesce_key)
+        if key not in self._pending and len(self._pending) >= OUTBOX_MAX_MESSAGES:
+            self._pending.popitem(last=False)
+            WS_MESSAGES_DROPPED.labels(reason="queue_full").inc()
+        self._pending[key] = data  # существующий ключ сохраняет место в очереди
+        self._ready.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending:
+                _, data = self._pending.popitem(last=False)
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(data), timeout=SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Клиент не успевает читать — отключаем, он переподключится
+                    WS_MESSAGES_DROPPED.labels(reason="slow_consumer").inc(len(self._pending) + 1)
+                    await self._on_dead(self.websocket)
+                    try:
+                        await asyncio.wait_for(self.websocket.close(code=1013), timeout=SEND_TIMEOUT)
+                    except Exception as e:
+                        logger.debug("Non-critical: %s", e)
+                    return
+                except Exception as e:
+                    logger.debug(f"Failed to send to client: {e}")
+                    await self._on_dead(self.websocket)
+                    return
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
 class ConnectionManager:
-    """Менеджер WebSocket подключений с topic-based подписками."""
+    """Менеджер WebSocket подключений с topic-based подписками.
+
+    broadcast не ждёт клиентов: сообщение сериализуется один раз и
+    кладётся в очереди адресатов (_Outbox), отправляют их задачи клиентов.
+    """
 
     def __init__(self):
         self.active_connections: Set[WebSocket] = set()
         self._subscriptions: Dict[WebSocket, Set[str]] = {}
+        self._topic_subscribers: Dict[str, Set[WebSocket]] = {}
         self._admins: Dict[WebSocket, AdminUser] = {}
+        self._outboxes: Dict[WebSocket, _Outbox] = {}
         self._lock = asyncio.Lock()
 
     async def connect(self, websocket: WebSocket, admin: AdminUser):
@@ -31,17 +105,29 @@ class ConnectionManager:
             self.active_connections.add(websocket)
             self._subscriptions[websocket] = set()
             self._admins[websocket] = admin  # для RBAC-фильтра рассылки
+            self._outboxes[websocket] = _Outbox(websocket, self.disconnect)
         logger.info(f"WebSocket connected: admin {admin.telegram_id or admin.username} ({admin.auth_method})")
         logger.info(f"Active connections: {len(self.active_connections)}")
 
     async def disconnect(self, websocket: WebSocket):
         """Отключить клиента."""
         async with self._lock:
-            self.active_connections.discard(websocket)
-            self._subscriptions.pop(websocket, None)
-            self._admins.pop(websocket, None)
+            self._forget(websocket)
         logger.info(f"WebSocket disconnected. Active: {len(self.active_connections)}")
 
+    def _forget(self, websocket: WebSocket) -> None:
+        self.active_connections.discard(websocket)
+        for topic in self._subscriptions.pop(websocket, ()):
+            subscribers = self._topic_subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self._topic_subscribers[topic]
+        self._admins.pop(websocket, None)
+        outbox = self._outboxes.pop(websocket, None)
+        if outbox is not None and outbox._task is not asyncio.current_task():
+            outbox.close()
+
     @staticmethod
     def _admin_can(admin: Optional[AdminUser], permission: Optional[Tuple[str, str]]) -> bool:
         """Есть ли у админа право на событие (superadmin/legacy — всегда)."""
@@ -57,51 +143,41 @@ class ConnectionManager:
         """Подписать клиента на topics."""
         if websocket in self._subscriptions:
             self._subscriptions[websocket].update(topics)
+            for topic in topics:
+                self._topic_subscribers.setdefault(topic, set()).add(websocket)
 
     def has_subscribers(self, topic: str) -> bool:
         """Проверить есть ли подписчики на topic."""
-        return any(topic in subs for subs in self._subscriptions.values())
+        return bool(self._topic_subscribers.get(topic))
 
     async def broadcast(self, message: Dict[str, Any], topic: str = None,
-                        permission: Optional[Tuple[str, str]] = None):
-        """Отправить сообщение клиентам (параллельно).
+                        permission: Optional[Tuple[str, str]] = None,
+                        coalesce_key: Optional[str] = None):
+        """Поставить сообщение в очереди клиентов.
 
         topic — только подписчикам; permission (resource, action) — только тем,
         у кого есть право (RBAC-фильтр, чтобы события не текли между скоупами).
+        coalesce_key — ещё не отправленное сообщение с тем же ключом заменяется.
+        Адресаты отбираются до сериализации: без них JSON не собирается вовсе.
         """
-        if not self.active_connections:
-            return
-
-        # Filter by topic if specified
         if topic:
-            targets = {ws for ws in self.active_connections
-                       if topic in self._subscriptions.get(ws, set())}
+            targets = self._topic_subscribers.get(topic, ())
         else:
-            targets = self.active_connections.copy()
+            targets = self.active_connections
+        if not targets:
+            return
 
         # RBAC-фильтр: событие уходит только админам с нужным правом
         if permission is not None:
-            targets = {ws for ws in targets if self._admin_can(self._admins.get(ws), permission)}
-
-        if not targets:
-            return
+            targets = [ws for ws in targets if self._admin_can(self._admins.get(ws), permission)]
+            if not targets:
+                return
 
         data = json.dumps(message, default=str)
-
-        async def _send_one(ws: WebSocket):
-            try:
-                await asyncio.wait_for(ws.send_text(data), timeout=3.0)
-                return None
-            except Exception:
-                return ws
-
-        results = await asyncio.gather(*(_send_one(c) for c in targets))
-        disconnected = {ws for ws in results if ws is not None}
-        if disconnected:
-            async with self._lock:
-                self.active_connections -= disconnected
-                for ws in disconnected:
-                    self._subscriptions.pop(ws, None)
+        for ws in list(targets):
+            outbox = self._outboxes.get(ws)
+            if outbox is not None:
+                outbox.put(data, coalesce_key)
 
     async def send_to(self, websocket: WebSocket, message: Dict[str, Any]):
         """Отправить сообщение конкретному клиенту."""
@@ -186,6 +262,8 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {e}")
     finally:
         await manager.disconnect(websocket)
+        # Последний подписчик ушёл — publisher отпустит LISTEN-соединение
+        _dashboard_wakeup.set()
 
 
 async def handle_client_message(
@@ -205,6 +283,20 @@ async def handle_client_message(
             "type": "subscribed",
             "data": {"topics": topics}
         })
+        if "dashboard" in topics:
+            # Текущие цифры — сразу этому клиенту; дальше — по изменениям
+            _dashboard_wakeup.set()
+            try:
+                stats = await _compute_dashboard_stats()
+            except Exception as e:
+                logger.debug("Dashboard stats for new subscriber failed: %s", e)
+                stats = None
+            if stats is not None:
+                await manager.send_to(websocket, {
+                    "type": "dashboard_stats",
+                    "data": stats,
+                    "timestamp": datetime.utcnow().isoformat(),
+                })
 
     elif msg_type == "ping":
         await manager.send_to(websocket, {"type": "pong"})
@@ -212,6 +304,12 @@ async def handle_client_message(
 
 # ==================== Функции для отправки событий ====================
 
+def _coalesce_key(event_type: str, data: Dict[str, Any]) -> Optional[str]:
+    """Ключ схлопывания для снимков состояния: важен только последний."""
+    uuid = data.get("uuid")
+    return f"{event_type}:{uuid}" if uuid else None
+
+
 async def broadcast_violation(violation_data: Dict[str, Any]):
     """Отправить событие о нарушении."""
     await manager.broadcast({
@@ -242,7 +340,7 @@ async def broadcast_node_status(node_data: Dict[str, Any]):
         "type": "node_status",
         "data": node_data,
         "timestamp": datetime.utcnow().isoformat(),
-    }, permission=("nodes", "view"))
+    }, permission=("nodes", "view"), coalesce_key=_coalesce_key("node_status", node_data))
     # Dispatch to automation engine (fire-and-forget)
     try:
         from web.backend.core.automation_engine import engine as automation_engine
@@ -259,7 +357,7 @@ async def broadcast_user_update(user_data: Dict[str, Any]):
         "type": "user_update",
         "data": user_data,
         "timestamp": datetime.utcnow().isoformat(),
-    }, permission=("users", "view"))
+    }, permission=("users", "view"), coalesce_key=_coalesce_key("user_update", user_data))
     # Dispatch traffic exceeded events to automation engine (fire-and-forget)
     try:
         from web.backend.core.automation_engine import engine as automation_engine
@@ -293,7 +391,7 @@ async def broadcast_agent_v2_status(node_uuid: str, is_connected: bool):
             "connected": is_connected,
         },
         "timestamp": datetime.utcnow().isoformat(),
-    }, permission=("nodes", "view"))
+    }, permission=("nodes", "view"), coalesce_key=f"agent_v2_status:{node_uuid}")
 
 
 async def broadcast_audit_event(
@@ -321,43 +419,132 @@ async def broadcast_dashboard_stats(stats: Dict[str, Any]):
         "type": "dashboard_stats",
         "data": stats,
         "timestamp": datetime.utcnow().isoformat(),
-    }, topic="dashboard")
+    }, topic="dashboard", coalesce_key="dashboard_stats")
 
 
-async def dashboard_publisher_loop():
-    """Background task: push dashboard stats every 15s to subscribed clients."""
-    await asyncio.sleep(5)  # initial delay for startup
-    while True:
+# Не чаще одной рассылки dashboard_stats за этот интервал — пачка изменений
+# (синк сотни нод, батч коллектора) схлопывается в одну.
+DASHBOARD_MIN_INTERVAL = 5.0
+# Страховка на случай потерянных уведомлений (обрыв LISTEN-соединения и т.п.)
+DASHBOARD_FALLBACK_INTERVAL = 300.0
+# Источники panel_changes, от которых зависят цифры дашборда
+_DASHBOARD_SOURCES = frozenset({"users", "nodes"})
+
+_dashboard_wakeup = asyncio.Event()
+
+
+def _on_panel_change(_conn, _pid, _channel, payload: str) -> None:
+    if payload in _DASHBOARD_SOURCES:
+        _dashboard_wakeup.set()
+
+
+def _on_listen_closed(_conn) -> None:
+    # Соединение с LISTEN умерло (рестарт Postgres и т.п.) — будим цикл,
+    # чтобы он заметил это и переподключился, а не ждал страховочного таймаута.
+    _dashboard_wakeup.set()
+
+
+async def _compute_dashboard_stats() -> Optional[Dict[str, Any]]:
+    """Цифры дашборда из panel_counters и nodes — без сканов users."""
+    from shared.database import db_service
+    if not db_service.is_connected:
+        return None
+    async with db_service.acquire() as conn:
+        counters = await conn.fetch(
+            "SELECT name, label, value FROM panel_counters "
+            "WHERE name IN ('total_users', 'users_by_status')"
+        )
+        node_row = await conn.fetchrow(
+            "SELECT COUNT(*) AS total, "
+            "COUNT(*) FILTER (WHERE is_connected AND NOT is_disabled) AS online, "
+            "COALESCE(SUM(users_online), 0) AS users_online "
+            "FROM nodes"
+        )
+    by_status = {c["label"]: int(c["value"]) for c in counters if c["name"] == "users_by_status"}
+    total = next((int(c["value"]) for c in counters if c["name"] == "total_users"), 0)
+    return {
+        "total_users": total,
+        "active_users": by_status.get("active", 0),
+        "disabled_users": by_status.get("disabled", 0),
+        "expired_users": by_status.get("expired", 0),
+        "total_nodes": node_row["total"],
+        "online_nodes": node_row["online"],
+        "users_online": node_row["users_online"],
+    }
+
+
+async def _publish_while_subscribed(publish_now: bool = False) -> None:
+    """Рассылать статистику по уведомлениям, пока есть подписчики dashboard.
+
+    publish_now — разослать сразу, не дожидаясь уведомления (после
+    переподключения: изменения за время обрыва могли потеряться).
+    """
+    from shared.database import db_service
+    from shared.db.counters import PANEL_CHANGES_CHANNEL
+
+    last_sent: Optional[Dict[str, Any]] = None
+    last_at = float("-inf")
+    loop = asyncio.get_running_loop()
+    async with db_service.acquire() as listen_conn:
+        listen_conn.add_termination_listener(_on_listen_closed)
+        await listen_conn.add_listener(PANEL_CHANGES_CHANNEL, _on_panel_change)
         try:
-            if manager.has_subscribers("dashboard"):
+            while manager.has_subscribers("dashboard"):
+                if not publish_now:
+                    try:
+                        await asyncio.wait_for(_dashboard_wakeup.wait(), DASHBOARD_FALLBACK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                publish_now = False
+                if listen_conn.is_closed():
+                    raise ConnectionError("panel_changes LISTEN connection closed")
+                delay = last_at + DASHBOARD_MIN_INTERVAL - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                _dashboard_wakeup.clear()
+                if not manager.has_subscribers("dashboard"):
+                    break
                 try:
-                    from shared.database import db_service
-                    if db_service.is_connected:
-                        async with db_service.acquire() as conn:
-                            user_row = await conn.fetchrow(
-                                "SELECT COUNT(*) AS total, "
-                                "COUNT(*) FILTER (WHERE LOWER(status) = 'active') AS active, "
-                                "COUNT(*) FILTER (WHERE LOWER(status) = 'disabled') AS disabled, "
-                                "COUNT(*) FILTER (WHERE LOWER(status) = 'expired') AS expired "
-                                "FROM users"
-                            )
-                            node_row = await conn.fetchrow(
-                                "SELECT COUNT(*) AS total, "
-                                "COUNT(*) FILTER (WHERE is_connected AND NOT is_disabled) AS online, "
-                                "COALESCE(SUM(users_online), 0) AS users_online "
-                                "FROM nodes"
-                            )
-                        await broadcast_dashboard_stats({
-                            "total_users": user_row["total"],
-                            "active_users": user_row["active"],
-                            "disabled_users": user_row["disabled"],
-                            "expired_users": user_row["expired"],
-                            "total_nodes": node_row["total"],
-                            "online_nodes": node_row["online"],
-                            "users_online": node_row["users_online"],
-                        })
+                    stats = await _compute_dashboard_stats()
                 except Exception as e:
                     logger.debug("Dashboard publisher error: %s", e)
+                    continue
+                last_at = loop.time()
+                if stats is not None and stats != last_sent:
+                    await broadcast_dashboard_stats(stats)
+                    last_sent = stats
+        finally:
+            listen_conn.remove_termination_listener(_on_listen_closed)
+            await listen_conn.remove_listener(PANEL_CHANGES_CHANNEL, _on_panel_change)
+
+
+async def dashboard_publisher_loop():
+    """Background task: push dashboard stats to subscribed clients on change.
+
+    Без подписчиков ничего не делает. С подписчиками держит LISTEN на
+    panel_changes (синк, коллектор, нарушения — с любой реплики) и шлёт
+    статистику не чаще DASHBOARD_MIN_INTERVAL и только если она изменилась.
+    Новый подписчик получает текущие цифры сразу при подписке. Если LISTEN
+    не удалось поднять или соединение оборвалось, переподключается, пока
+    подписчики есть.
+    """
+    from shared.database import db_service
+    retry = False
+    while True:
+        await _dashboard_wakeup.wait()
+        _dashboard_wakeup.clear()
+        if not manager.has_subscribers("dashboard"):
+            retry = False
+            continue
+        try:
+            if not db_service.is_connected:
+                raise ConnectionError("database not connected")
+            await _publish_while_subscribed(publish_now=retry)
+            retry = False
         except Exception as e:
             logger.debug("Dashboard publisher outer error: %s", e)
-        await asyncio.sleep(15)
+            await asyncio.sleep(DASHBOARD_MIN_INTERVAL)
+            # Событие уже сброшено, а новое придёт только с подпиской или
+            # отключением — без повтора текущие подписчики остались бы без обновлений.
+            retry = True
+            _dashboard_wakeup.set()
@@ -7,10 +7,11 @@ import logging
 from typing import Any, List, Optional
 from uuid import UUID as _UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field, model_validator
 
+from shared.db_query import cursor_fingerprint, decode_cursor, encode_cursor, keyset_sql
 from web.backend.api.v3.deps import ApiKeyUser, require_scope
 
 logger = logging.getLogger(__name__)
@@ -153,6 +154,17 @@ def _not_found(entity: str = "Resource"):
     return HTTPException(status_code=404, detail=f"{entity} not found")
 
 
+def _decode_page_cursor(cursor: str, tag: str, size: int) -> list:
+    """Decode an X-Next-Cursor value issued by the same listing (same tag)."""
+    try:
+        values = decode_cursor(cursor)
+    except ValueError:
+        values = []
+    if len(values) != size + 1 or values[0] != tag:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[1:]
+
+
 def _get_api_client():
     from shared.api_client import api_client
     return api_client
@@ -178,9 +190,16 @@ async def list_users(
     offset: int = Query(0, ge=0),
     status: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page (overrides offset)"),
+    response: Response = None,
     api_key: ApiKeyUser = Depends(require_scope("users:read")),
 ):
-    """List users with pagination and optional filtering."""
+    """List users with pagination and optional filtering.
+
+    A full page carries an X-Next-Cursor header; passing it back as `cursor`
+    continues right after the last row (keyset), so walking the whole list
+    costs the same per page at any depth.
+    """
     from shared.database import db_service
     if not db_service.is_connected:
         return []
@@ -194,15 +213,30 @@ async def list_users(
         conditions.append(f"LOWER(status) = LOWER(${idx})")
         args.append(status)
 
-    if search:
-        idx += 1
-        conditions.append(
-            f"(LOWER(username) LIKE LOWER(${idx}) OR LOWER(email) LIKE LOWER(${idx}) "
-            f"OR uuid::text LIKE ${idx})"
+    keys = [("username", False), ("uuid", False)]
+    if search and search.strip():
+        from shared.db.users import user_search_sql
+        search_sql, rank, search_args = user_search_sql(search, start=idx + 1)
+        idx += len(search_args)
+        conditions.append(search_sql)
+        args.extend(search_args)
+        keys.insert(0, (rank, False))
+
+    # Курсор привязан к фильтрам: с другим search/status он указывал бы в чужой список
+    tag = f"users:{cursor_fingerprint(conditions, args)}"
+    if cursor:
+        after = _decode_page_cursor(cursor, tag, len(keys))
+        after_sql, after_args = keyset_sql(
+            [(expr, desc, value) for (expr, desc), value in zip(keys, after)], start=idx + 1,
         )
-        args.append(f"%{search}%")
+        idx += len(after_args)
+        conditions.append(after_sql)
+        args.extend(after_args)
+        offset = 0
 
     where = " AND ".join(conditions) if conditions else "TRUE"
+    order = ", ".join(f"{expr} NULLS FIRST" for expr, _ in keys)
+    key_cols = "".join(f", {expr} AS _k{i}" for i, (expr, _) in enumerate(keys))
     idx += 1
     args.append(limit)
     idx += 1
@@ -211,11 +245,17 @@ async def list_users(
     async with db_service.acquire() as conn:
         rows = await conn.fetch(
             f"SELECT uuid, username, status, traffic_limit_bytes, "
-            f"used_traffic_bytes, expire_at "
-            f"FROM users WHERE {where} ORDER BY username LIMIT ${idx - 1} OFFSET ${idx}",
+            f"used_traffic_bytes, expire_at{key_cols} "
+            f"FROM users WHERE {where} ORDER BY {order} LIMIT ${idx - 1} OFFSET ${idx}",
             *args,
         )
 
+    if response is not None and len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            [tag] + [last[f"_k{i}"] for i in range(len(keys))]
+        )
+
     result = []
     for r in rows:
         d = dict(r)
@@ -622,9 +662,14 @@ async def list_violations(
     resolved: Optional[bool] = Query(None, description="true = action taken, false = open"),
     date_from: Optional[str] = Query(None, description="ISO date/datetime lower bound"),
     date_to: Optional[str] = Query(None, description="ISO date/datetime upper bound"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page (overrides offset)"),
+    response: Response = None,
     api_key: ApiKeyUser = Depends(require_scope("violations:read")),
 ):
-    """List anti-abuse violations, newest first."""
+    """List anti-abuse violations, newest first.
+
+    Cursor pagination works as in GET /users (X-Next-Cursor header).
+    """
     from shared.database import db_service
     if not db_service.is_connected:
         return []
@@ -657,6 +702,16 @@ async def list_violations(
         idx += 1
         conditions.append(f"detected_at <= ${idx}::timestamptz")
         args.append(date_to)
+    tag = f"violations:{cursor_fingerprint(conditions, args)}"
+    if cursor:
+        detected_at, last_id = _decode_page_cursor(cursor, tag, 2)
+        after_sql, after_args = keyset_sql(
+            [("detected_at", True, detected_at), ("id", True, last_id)], start=idx + 1,
+        )
+        idx += len(after_args)
+        conditions.append(after_sql)
+        args.extend(after_args)
+        offset = 0
 
     where = " AND ".join(conditions) if conditions else "TRUE"
     idx += 1
@@ -667,10 +722,16 @@ async def list_violations(
     async with db_service.acquire() as conn:
         rows = await conn.fetch(
             f"SELECT {_VIOLATION_LIST_COLUMNS} FROM violations WHERE {where} "
-            f"ORDER BY detected_at DESC LIMIT ${idx - 1} OFFSET ${idx}",
+            f"ORDER BY detected_at DESC NULLS LAST, id DESC LIMIT ${idx - 1} OFFSET ${idx}",
             *args,
         )
 
+    if response is not None and len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            [tag, last["detected_at"], last["id"]]
+        )
+
     return [ViolationPublic(**_violation_row_to_dict(r)) for r in rows]
 
 
@@ -217,6 +217,34 @@ async def fetch_users_from_api(size: int = 500) -> List[Dict[str, Any]]:
     return all_users
 
 
+async def fetch_users_page_from_api(start: int, size: int) -> Optional[Dict[str, Any]]:
+    """Fetch a single page of users from the Remnawave API.
+
+    Returns {"users": [...normalized...], "total": int} or None on error.
+    Unlike fetch_users_from_api() the memory cost is bounded by `size`.
+    """
+    data = await api_get("/api/users", params={"start": start, "size": size})
+    if not data:
+        return None
+    response = data.get("response", data)
+    if not isinstance(response, dict):
+        return None
+    users = [_normalize(u) for u in response.get("users", []) if isinstance(u, dict)]
+    return {"users": users, "total": response.get("total", len(users))}
+
+
+async def fetch_system_stats() -> Optional[Dict[str, Any]]:
+    """Fetch aggregated system stats from the Remnawave API.
+
+    Returns response with users.statusCounts, users.totalUsers,
+    users.totalTrafficBytes, onlineStats and nodes.
+    """
+    data = await api_get("/api/system/stats")
+    if not data:
+        return None
+    return data.get("response", data)
+
+
 async def fetch_nodes_from_api() -> List[Dict[str, Any]]:
     """Fetch nodes list from the Remnawave API.
 
@@ -1,60 +1,69 @@
 """Buffered last_used_at updates for API keys.
 
 Avoids UPDATE-per-request row lock under high RPS. Collects "key used" events
-in memory and flushes to DB every N seconds.
+in memory (last use wins per key) and flushes them to DB every N seconds with
+one UNNEST-based UPDATE, however many keys were active. The buffer holds at
+most _MAX_PENDING keys: reaching the cap wakes the loop for an early flush.
 """
 from __future__ import annotations
 
 import asyncio
 import logging
 import os
+import time
+from datetime import datetime, timezone
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 _FLUSH_INTERVAL_SEC = float(os.getenv("API_KEY_LAST_USED_FLUSH_SEC", "30"))
+_MAX_PENDING = int(os.getenv("API_KEY_USAGE_MAX_PENDING", "10000"))
 
 _pending: dict[int, float] = {}
-_lock = asyncio.Lock()
 _flush_task: Optional[asyncio.Task] = None
 _stop = asyncio.Event()
+_wake = asyncio.Event()
+
+_FLUSH_SQL = (
+    "UPDATE api_keys AS k SET last_used_at = v.used_at "
+    "FROM UNNEST($1::bigint[], $2::timestamptz[]) AS v(id, used_at) "
+    "WHERE k.id = v.id AND (k.last_used_at IS NULL OR k.last_used_at < v.used_at)"
+)
 
 
 async def mark_used(key_id: int) -> None:
     """Record that a key was used. Flushed asynchronously."""
-    async with _lock:
-        import time
-        _pending[key_id] = time.time()
+    if key_id not in _pending and len(_pending) >= _MAX_PENDING:
+        # Буфер полон — ключ не теряем, просим цикл сбросить всё досрочно.
+        _wake.set()
+    _pending[key_id] = time.time()
 
 
 async def _flush() -> None:
-    async with _lock:
-        if not _pending:
-            return
-        snapshot = dict(_pending)
-        _pending.clear()
+    global _pending
+    if not _pending:
+        return
+    snapshot, _pending = _pending, {}
     try:
         from shared.database import db_service
         if not db_service.is_connected:
             return
+        ids = list(snapshot)
+        used_at = [datetime.fromtimestamp(snapshot[i], tz=timezone.utc) for i in ids]
         async with db_service.acquire() as conn:
-            for key_id, ts in snapshot.items():
-                from datetime import datetime, timezone
-                await conn.execute(
-                    "UPDATE api_keys SET last_used_at = $2 WHERE id = $1",
-                    key_id, datetime.fromtimestamp(ts, tz=timezone.utc),
-                )
+            await conn.execute(_FLUSH_SQL, ids, used_at)
     except Exception as e:
-        logger.warning("Failed to flush API key last_used_at: %s", e)
+        logger.warning("Failed to flush API key last_used_at (%d keys): %s", len(snapshot), e)
 
 
 async def _loop() -> None:
     logger.debug("API key usage buffer started (interval=%ss)", _FLUSH_INTERVAL_SEC)
     while not _stop.is_set():
         try:
-            await asyncio.wait_for(_stop.wait(), timeout=_FLUSH_INTERVAL_SEC)
+            await asyncio.wait_for(_wake.wait(), timeout=_FLUSH_INTERVAL_SEC)
         except asyncio.TimeoutError:
             pass
+        _wake.clear()
         await _flush()
     await _flush()
     logger.info("API key usage buffer stopped")
@@ -70,8 +79,11 @@ def start() -> None:
 
 async def stop() -> None:
     _stop.set()
+    _wake.set()
     if _flush_task:
         try:
             await asyncio.wait_for(_flush_task, timeout=5)
         except asyncio.TimeoutError:
             _flush_task.cancel()
+    # Цикл не запускался или не успел — последние отметки всё равно пишем.
+    await _flush()
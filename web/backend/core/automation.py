@@ -3,10 +3,12 @@
 Provides CRUD operations for automation rules and logs,
 plus in-memory template definitions.
 """
+import asyncio
 import json
 import logging
 import math
-from typing import Optional, List, Tuple
+import time
+from typing import Dict, Optional, List, Tuple
 
 from shared.db_schema import AUTOMATION_RULES_TABLE, AUTOMATION_LOG_TABLE
 from shared.db_query import select_sql, insert_sql, update_sql, delete_sql, left_join_sql
@@ -240,6 +242,7 @@ async def create_automation_rule(
                 json.dumps(trigger_config), json.dumps(conditions),
                 action_type, json.dumps(action_config), created_by,
             )
+            invalidate_rule_index()
             return dict(row) if row else None
     except Exception as e:
         logger.error("Failed to create automation rule: %s", e)
@@ -277,6 +280,7 @@ async def update_automation_rule(rule_id: int, **fields) -> Optional[dict]:
                 update_sql(AUTOMATION_RULES_TABLE, ', '.join(set_parts), f"id = ${idx}", returning="*"),
                 *params,
             )
+            invalidate_rule_index()
             return dict(row) if row else None
     except Exception as e:
         logger.error("Failed to update automation rule %d: %s", rule_id, e)
@@ -294,6 +298,7 @@ async def toggle_automation_rule(rule_id: int) -> Optional[dict]:
                     "id = $1", returning="*"),
                 rule_id,
             )
+            invalidate_rule_index()
             return dict(row) if row else None
     except Exception as e:
         logger.error("Failed to toggle automation rule %d: %s", rule_id, e)
@@ -308,6 +313,7 @@ async def delete_automation_rule(rule_id: int) -> bool:
             result = await conn.execute(
                 delete_sql(AUTOMATION_RULES_TABLE, "id = $1"), rule_id
             )
+            invalidate_rule_index()
             return result == "DELETE 1"
     except Exception as e:
         logger.error("Failed to delete automation rule %d: %s", rule_id, e)
@@ -473,18 +479,56 @@ async def get_enabled_rules_by_trigger_type(trigger_type: str) -> List[dict]:
         return []
 
 
+# Индекс включённых event-правил: event -> правила (по id). handle_event
+# вызывается на каждый статус ноды, нарушение и апдейт юзера — без индекса
+# каждое событие стоило SELECT, даже когда правил на него нет. Сбрасывается
+# при создании/изменении/удалении правил, TTL — на случай правок с другой реплики.
+_EVENT_RULES_TTL_SEC = 60.0
+_event_rules_index: Optional[Dict[str, List[dict]]] = None
+_event_rules_loaded_at = 0.0
+_event_rules_lock = asyncio.Lock()
+
+
+def invalidate_rule_index() -> None:
+    """Сбросить индекс event-правил — следующее событие перечитает их."""
+    global _event_rules_index
+    _event_rules_index = None
+
+
+def _event_rules_stale() -> bool:
+    return (_event_rules_index is None
+            or time.monotonic() - _event_rules_loaded_at > _EVENT_RULES_TTL_SEC)
+
+
+async def _load_event_rules_index() -> Dict[str, List[dict]]:
+    from shared.database import db_service
+    async with db_service.acquire() as conn:
+        rows = await conn.fetch(
+            select_sql(AUTOMATION_RULES_TABLE, "*",
+                "WHERE is_enabled = true AND trigger_type = 'event' ORDER BY id"),
+        )
+    index: Dict[str, List[dict]] = {}
+    for r in rows:
+        rule = dict(r)
+        trigger_config = rule.get("trigger_config") or {}
+        if isinstance(trigger_config, str):
+            trigger_config = json.loads(trigger_config)
+        event = trigger_config.get("event")
+        if event:
+            index.setdefault(event, []).append(rule)
+    return index
+
+
 async def get_enabled_event_rules(event_type: str) -> List[dict]:
     """Get all enabled event-type rules matching a specific event."""
+    global _event_rules_index, _event_rules_loaded_at
     try:
-        from shared.database import db_service
-        async with db_service.acquire() as conn:
-            rows = await conn.fetch(
-                select_sql(AUTOMATION_RULES_TABLE, "*",
-                    "WHERE is_enabled = true AND trigger_type = 'event'"
-                    " AND trigger_config->>'event' = $1 ORDER BY id"),
-                event_type,
-            )
-            return [dict(r) for r in rows]
+        if _event_rules_stale():
+            async with _event_rules_lock:
+                if _event_rules_stale():
+                    _event_rules_index = await _load_event_rules_index()
+                    _event_rules_loaded_at = time.monotonic()
+        return list(_event_rules_index.get(event_type, ()))
     except Exception as e:
         logger.error("Failed to get event rules for %s: %s", event_type, e)
         return []
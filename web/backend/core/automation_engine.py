@@ -8,11 +8,12 @@ Manages three trigger mechanisms:
 All action execution is logged to the automation_log table.
 """
 import asyncio
+import functools
 import json
 import logging
 import operator as op_module
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import httpx
 
@@ -51,38 +52,132 @@ def _parse_cron_field(field: str, min_val: int, max_val: int) -> set:
     return values
 
 
-def cron_matches_now(cron_expr: str) -> bool:
-    """Check if a CRON expression matches the current minute.
+@functools.lru_cache(maxsize=512)
+def parse_cron(cron_expr: str) -> Tuple[frozenset, frozenset, frozenset, frozenset, frozenset]:
+    """Parse a CRON expression into (minutes, hours, days, months, weekdays).
 
     Supports: minute hour day-of-month month day-of-week
     With *, ranges (1-5), steps (*/5), and lists (1,3,5).
+    Raises ValueError on malformed or out-of-range expressions.
     """
+    parts = cron_expr.strip().split()
+    if len(parts) != 5:
+        raise ValueError(f"expected 5 fields, got {len(parts)}")
+    bounds = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+    fields = []
+    for part, (lo, hi) in zip(parts, bounds):
+        values = _parse_cron_field(part, lo, hi)
+        if not values or min(values) < lo or max(values) > hi:
+            raise ValueError(f"field '{part}' out of range {lo}-{hi}")
+        fields.append(frozenset(values))
+    return tuple(fields)
+
+
+def _cron_day_matches(spec, day: datetime) -> bool:
+    _, _, dom_set, month_set, dow_set = spec
+    # Python weekday (Mon=0..Sun=6) -> CRON weekday (Sun=0..Sat=6)
+    return day.month in month_set and day.day in dom_set and (day.weekday() + 1) % 7 in dow_set
+
+
+def cron_matches_now(cron_expr: str) -> bool:
+    """Check if a CRON expression matches the current minute."""
     try:
-        parts = cron_expr.strip().split()
-        if len(parts) != 5:
-            logger.warning("Invalid CRON expression (expected 5 parts): %s", cron_expr)
-            return False
-
-        now = datetime.now(timezone.utc)
-        minute_set = _parse_cron_field(parts[0], 0, 59)
-        hour_set = _parse_cron_field(parts[1], 0, 23)
-        dom_set = _parse_cron_field(parts[2], 1, 31)
-        month_set = _parse_cron_field(parts[3], 1, 12)
-        dow_set = _parse_cron_field(parts[4], 0, 6)
-
-        # Convert Python weekday (Mon=0..Sun=6) to CRON weekday (Sun=0..Sat=6)
-        cron_dow = (now.weekday() + 1) % 7
-
-        return (
-            now.minute in minute_set
-            and now.hour in hour_set
-            and now.day in dom_set
-            and now.month in month_set
-            and cron_dow in dow_set
-        )
+        spec = parse_cron(cron_expr)
     except Exception as e:
         logger.warning("CRON parse error for '%s': %s", cron_expr, e)
         return False
+    now = datetime.now(timezone.utc)
+    return now.minute in spec[0] and now.hour in spec[1] and _cron_day_matches(spec, now)
+
+
+def cron_next_fire(cron_expr: str, after: datetime) -> Optional[datetime]:
+    """Ближайшая минута строго после `after`, подходящая под CRON (UTC).
+
+    Перебираются дни, а внутри дня — только разрешённые часы и минуты,
+    так что даже «раз в год» считается за сотни итераций. None — выражение
+    некорректно или не срабатывает никогда (31 февраля).
+    """
+    try:
+        spec = parse_cron(cron_expr)
+    except Exception as e:
+        logger.warning("CRON parse error for '%s': %s", cron_expr, e)
+        return None
+    minutes, hours = sorted(spec[0]), sorted(spec[1])
+    start = after.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    first_day = day = start.replace(hour=0, minute=0)
+    for _ in range(366 * 5):  # високосные 29 февраля встречаются раз в 4 года
+        if _cron_day_matches(spec, day):
+            for hour in hours:
+                if day == first_day and hour < start.hour:
+                    continue
+                for minute in minutes:
+                    candidate = day.replace(hour=hour, minute=minute)
+                    if candidate >= start:
+                        return candidate
+        day += timedelta(days=1)
+    return None
+
+
+async def _load_nodes() -> List[Dict[str, Any]]:
+    """Ноды из локальной БД (синхронизированные), панель — если БД недоступна."""
+    from web.backend.core.api_helper import _normalize, fetch_nodes_from_api
+    try:
+        from shared.database import db_service
+        if db_service.is_connected:
+            nodes = await db_service.get_all_nodes()
+            if nodes:
+                return [_normalize(n) for n in nodes]
+    except Exception as e:
+        logger.debug("DB nodes fetch failed: %s", e)
+    return await fetch_nodes_from_api()
+
+
+async def _whitelist_excluded(user_uuids: List[str]) -> Set[str]:
+    """Юзеры, исключённые whitelist'ом из проверок трафика — одним запросом."""
+    if not user_uuids:
+        return set()
+    from shared.database import db_service
+    try:
+        return await db_service.get_whitelist_excluded(user_uuids, "traffic_rate")
+    except Exception:
+        return set()
+
+
+async def _users_by_traffic_percent(operator: str, threshold: float) -> List[Dict[str, Any]]:
+    """Юзеры, чей расход трафика в % от лимита проходит порог.
+
+    Отбор — SQL по локальной таблице users; выгрузка всех юзеров из панели
+    постранично — только без БД.
+    """
+    from shared.database import db_service
+    if db_service.is_connected:
+        return await db_service.get_users_by_traffic_percent(operator, threshold)
+
+    from web.backend.core.api_helper import fetch_users_from_api
+    op_fn = _OPERATORS[operator]
+    result = []
+    for user in await fetch_users_from_api():
+        limit = user.get("traffic_limit_bytes", 0)
+        if not limit:
+            continue
+        percent = ((user.get("used_traffic_bytes") or 0) / limit) * 100
+        if op_fn(percent, threshold):
+            result.append({
+                "uuid": user.get("uuid", user.get("short_uuid", "")),
+                "username": user.get("username", ""),
+                "percent": percent,
+            })
+    return result
+
+
+async def _users_over_traffic_limit() -> List[Dict[str, Any]]:
+    """Юзеры сверх лимита трафика: SQL по users, без БД — выгрузка из панели."""
+    from shared.database import db_service
+    if db_service.is_connected:
+        return await db_service.get_users_over_traffic_limit()
+
+    from web.backend.core.api_helper import fetch_users_from_api
+    return await fetch_users_from_api()
 
 
 class AutomationEngine:
@@ -213,10 +308,13 @@ class AutomationEngine:
     # ── Schedule loop ────────────────────────────────────────
 
     async def _schedule_loop(self):
-        """Check schedule-type rules every 60 seconds."""
+        """Check schedule-type rules at the start of every minute."""
         while self._running:
             try:
-                await asyncio.sleep(60)
+                # Проверка в начале каждой минуты — CRON срабатывает в :00, а не
+                # со случайным сдвигом до минуты от старта процесса
+                now = datetime.now(timezone.utc)
+                await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000 + 0.5)
                 if not self._running:
                     break
                 await self._check_scheduled_rules()
@@ -389,15 +487,16 @@ class AutomationEngine:
             try_acquire_trigger,
             write_automation_log,
         )
-        from web.backend.core.api_helper import fetch_users_from_api, fetch_nodes_from_api, enrich_nodes_traffic_today
+        from web.backend.core.api_helper import enrich_nodes_traffic_today
 
         rules = await get_enabled_rules_by_trigger_type("threshold")
         if not rules:
             return
 
-        # Pre-fetch data for threshold evaluation
-        users = None
+        # Ноды (и их трафик за сегодня) грузятся один раз на цикл; юзеры
+        # отбираются SQL по каждому правилу
         nodes = None
+        traffic_enriched = False
 
         for rule in rules:
             try:
@@ -418,23 +517,25 @@ class AutomationEngine:
                 # Evaluate metric against data
                 if metric == "users_online":
                     if nodes is None:
-                        nodes = await fetch_nodes_from_api()
-                    total_online = sum(n.get("users_online", 0) for n in nodes)
+                        nodes = await _load_nodes()
+                    total_online = sum((n.get("users_online") or 0) for n in nodes)
                     if op_fn(total_online, threshold_value):
                         targets.append(("system", None, {"users_online": total_online}))
 
                 elif metric == "traffic_today":
                     if nodes is None:
-                        nodes = await fetch_nodes_from_api()
+                        nodes = await _load_nodes()
+                    if not traffic_enriched:
                         await enrich_nodes_traffic_today(nodes)
-                    total_traffic = sum(n.get("traffic_today_bytes", 0) for n in nodes)
+                        traffic_enriched = True
+                    total_traffic = sum((n.get("traffic_today_bytes") or 0) for n in nodes)
                     total_gb = total_traffic / (1024 ** 3)
                     if op_fn(total_gb, threshold_value):
                         targets.append(("system", None, {"traffic_today_gb": round(total_gb, 2)}))
 
                 elif metric == "node_uptime_percent":
                     if nodes is None:
-                        nodes = await fetch_nodes_from_api()
+                        nodes = await _load_nodes()
                     for node in nodes:
                         is_connected = node.get("is_connected", False)
                         uptime = 100 if is_connected else 0
@@ -446,25 +547,18 @@ class AutomationEngine:
                             ))
 
                 elif metric == "user_traffic_percent":
-                    if users is None:
-                        users = await fetch_users_from_api()
-                    for user in users:
-                        limit = user.get("traffic_limit_bytes", 0)
-                        if not limit:
-                            continue
-                        used = user.get("used_traffic_bytes", 0)
-                        percent = (used / limit) * 100
-                        if op_fn(percent, threshold_value):
-                            targets.append((
-                                "user",
-                                user.get("uuid", user.get("short_uuid", "")),
-                                {
-                                    "username": user.get("username", ""),
-                                    "percent": round(percent, 1),
-                                    "threshold": threshold_value,
-                                    "over_percent": round(percent - threshold_value, 1),
-                                },
-                            ))
+                    for user in await _users_by_traffic_percent(operator_str, threshold_value):
+                        percent = user["percent"]
+                        targets.append((
+                            "user",
+                            user["uuid"],
+                            {
+                                "username": user["username"],
+                                "percent": round(percent, 1),
+                                "threshold": threshold_value,
+                                "over_percent": round(percent - threshold_value, 1),
+                            },
+                        ))
 
                 elif metric == "user_node_traffic_gb":
                     from shared.database import db_service
@@ -475,17 +569,12 @@ class AutomationEngine:
                         rows = await db_service.get_all_user_node_traffic_above(
                             int(threshold_value * (1024 ** 3))
                         )
+                    rows = [r for r in rows if op_fn(r["traffic_bytes"] / (1024 ** 3), threshold_value)]
+                    excluded = await _whitelist_excluded([str(r["user_uuid"]) for r in rows])
                     for row in rows:
                         traffic_gb = row["traffic_bytes"] / (1024 ** 3)
-                        if op_fn(traffic_gb, threshold_value):
-                            # Check whitelist
-                            uid = str(row["user_uuid"])
-                            try:
-                                wl, excl = await db_service.is_user_violation_whitelisted(uid)
-                                if wl and (excl is None or "traffic_rate" in excl):
-                                    continue
-                            except Exception:
-                                pass
+                        uid = str(row["user_uuid"])
+                        if uid not in excluded:
                             targets.append((
                                 "user",
                                 uid,
@@ -505,16 +594,12 @@ class AutomationEngine:
                         node_uuid=node_uuid,
                         threshold_bytes=int(threshold_value * (1024 ** 3)),
                     )
+                    rows = [r for r in rows if op_fn(r["traffic_bytes"] / (1024 ** 3), threshold_value)]
+                    excluded = await _whitelist_excluded([str(r["user_uuid"]) for r in rows])
                     for row in rows:
                         traffic_gb = row["traffic_bytes"] / (1024 ** 3)
-                        if op_fn(traffic_gb, threshold_value):
-                            uid = str(row["user_uuid"])
-                            try:
-                                wl, excl = await db_service.is_user_violation_whitelisted(uid)
-                                if wl and (excl is None or "traffic_rate" in excl):
-                                    continue
-                            except Exception:
-                                pass
+                        uid = str(row["user_uuid"])
+                        if uid not in excluded:
                             targets.append((
                                 "user",
                                 uid,
@@ -613,12 +698,11 @@ class AutomationEngine:
 
     async def _detect_events(self):
         """Single pass of event detection."""
-        from web.backend.core.api_helper import fetch_nodes_from_api, fetch_users_from_api
         from web.backend.core.automation import get_enabled_event_rules
 
         # ── Detect node offline transitions ───────────────
         try:
-            nodes = await fetch_nodes_from_api()
+            nodes = await _load_nodes()
             current_connected: Dict[str, bool] = {}
 
             for node in nodes:
@@ -683,7 +767,7 @@ class AutomationEngine:
             # Only fetch users if there are enabled rules for this event
             traffic_rules = await get_enabled_event_rules("user.traffic_exceeded")
             if traffic_rules:
-                users = await fetch_users_from_api()
+                users = await _users_over_traffic_limit()
                 current_exceeded: set = set()
 
                 for user in users:
@@ -1146,7 +1230,7 @@ class AutomationEngine:
     async def dry_run(self, rule_id: int) -> dict:
         """Simulate execution of a rule without performing side effects."""
         from web.backend.core.automation import get_automation_rule_by_id
-        from web.backend.core.api_helper import fetch_users_from_api, fetch_nodes_from_api, enrich_nodes_traffic_today
+        from web.backend.core.api_helper import enrich_nodes_traffic_today
 
         rule = await get_automation_rule_by_id(rule_id)
         if not rule:
@@ -1229,31 +1313,24 @@ class AutomationEngine:
             op_fn = _OPERATORS.get(operator_str)
 
             if metric == "user_traffic_percent" and op_fn:
-                users = await fetch_users_from_api()
-                for user in users:
-                    limit = user.get("traffic_limit_bytes", 0)
-                    if not limit:
-                        continue
-                    used = user.get("used_traffic_bytes", 0)
-                    percent = (used / limit) * 100
-                    if op_fn(percent, threshold_value):
-                        matching_targets.append({
-                            "type": "user",
-                            "id": user.get("uuid", ""),
-                            "name": user.get("username", ""),
-                            "value": round(percent, 1),
-                        })
+                for user in await _users_by_traffic_percent(operator_str, threshold_value):
+                    matching_targets.append({
+                        "type": "user",
+                        "id": user["uuid"],
+                        "name": user["username"],
+                        "value": round(user["percent"], 1),
+                    })
 
             elif metric in ("users_online", "traffic_today", "node_uptime_percent") and op_fn:
-                nodes = await fetch_nodes_from_api()
+                nodes = await _load_nodes()
                 if metric == "traffic_today":
                     await enrich_nodes_traffic_today(nodes)
                 if metric == "users_online":
-                    total = sum(n.get("users_online", 0) for n in nodes)
+                    total = sum((n.get("users_online") or 0) for n in nodes)
                     if op_fn(total, threshold_value):
                         matching_targets.append({"type": "system", "value": total})
                 elif metric == "traffic_today":
-                    total_gb = sum(n.get("traffic_today_bytes", 0) for n in nodes) / (1024 ** 3)
+                    total_gb = sum((n.get("traffic_today_bytes") or 0) for n in nodes) / (1024 ** 3)
                     if op_fn(total_gb, threshold_value):
                         matching_targets.append({"type": "system", "value": round(total_gb, 2)})
                 elif metric == "node_uptime_percent":
@@ -4,11 +4,14 @@ If REDIS_URL is configured, uses Redis for distributed caching.
 Otherwise, falls back to a simple in-memory TTL cache.
 """
 import asyncio
+import heapq
 import json
 import logging
 import time
+import uuid
+from collections import OrderedDict
 from functools import wraps
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 from prometheus_client import Counter, Gauge
 
@@ -20,56 +23,130 @@ CACHE_MISSES = Counter("panel_cache_misses_total", "Cache misses", ["backend"])
 CACHE_ERRORS = Counter("panel_cache_errors_total", "Cache operation errors", ["backend", "op"])
 CACHE_BACKEND = Gauge("panel_cache_redis_connected", "1 if Redis is active, 0 if in-memory fallback")
 CACHE_KEYS = Gauge("panel_cache_keys_total", "Approximate number of cached keys")
+CACHE_STALE_SERVED = Counter("panel_cache_stale_served_total", "Stale values served while refreshing")
+CACHE_COALESCED = Counter("panel_cache_coalesced_total", "Callers that awaited an in-flight computation")
+CACHE_EVICTIONS = Counter("panel_cache_evictions_total", "In-memory cache evictions", ["reason"])
+CACHE_MEMORY_BYTES = Gauge("panel_cache_memory_bytes", "Approximate size of the in-memory cache")
 
 # TTL presets (seconds)
 CACHE_TTL_SHORT = 60       # overview, fleet, system components (was 30)
 CACHE_TTL_MEDIUM = 120     # traffic, timeseries, deltas (was 60)
 CACHE_TTL_LONG = 600       # geo, trends, top-users (was 300)
 
+# Distributed recompute lock (Redis): how long a replica may hold it
+CACHE_LOCK_TTL = 30
+# Release the lock only if we still own it (it may have expired and been re-taken)
+_RELEASE_LOCK_LUA = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
 
 class _InMemoryCache:
-    """Simple in-memory TTL cache (fallback when Redis is unavailable)."""
+    """In-memory LRU cache with TTL (fallback when Redis is unavailable).
 
-    def __init__(self, max_size: int = 5000):
-        self._store: dict[str, tuple[float, str]] = {}
-        self._lock = asyncio.Lock()
-        self._max_size = max_size
+    Bounded by an approximate byte budget rather than an entry count: one
+    analytics payload can weigh as much as thousands of small keys. When over
+    budget, expired entries go first, then the least recently used ones.
 
-    async def get(self, key: str) -> Optional[str]:
-        async with self._lock:
+    No lock: every operation is synchronous between awaits, so it is atomic
+    on the event loop and readers never queue behind each other.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        # key -> (expires_at, value); order = recency (last = most recent)
+        self._store: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        # (expires_at, key) — lazy: entries may be outdated by later sets
+        self._expiry: list[tuple[float, str]] = []
+        # namespace (text before the first ':') -> keys, for flush_pattern
+        self._by_ns: dict[str, set[str]] = {}
+        self._max_bytes = max_bytes
+        self._bytes = 0
+
+    @staticmethod
+    def _size(key: str, value: str) -> int:
+        return len(key) + len(value) + 64  # + per-entry overhead, roughly
+
+    def _remove(self, key: str, reason: Optional[str] = None) -> None:
+        entry = self._store.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= self._size(key, entry[1])
+        ns = key.split(":", 1)[0]
+        keys = self._by_ns.get(ns)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_ns[ns]
+        if reason:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    def _purge_expired(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
             entry = self._store.get(key)
-            if entry is None:
-                return None
-            expires_at, value = entry
-            if time.monotonic() > expires_at:
-                del self._store[key]
-                return None
-            return value
+            if entry is not None and entry[0] == expires_at:
+                self._remove(key, "expired")
+
+    def _update_gauges(self) -> None:
+        CACHE_MEMORY_BYTES.set(self._bytes)
+        CACHE_KEYS.set(len(self._store))
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            self._remove(key, "expired")
+            return None
+        self._store.move_to_end(key)
+        return value
 
     async def set(self, key: str, value: str, ex: int = 60) -> None:
-        async with self._lock:
-            self._store[key] = (time.monotonic() + ex, value)
-            # Evict oldest entries if cache exceeds max_size
-            if len(self._store) > self._max_size:
-                evict_count = len(self._store) - self._max_size
-                for old_key in list(self._store.keys())[:evict_count]:
-                    del self._store[old_key]
+        now = time.monotonic()
+        self._remove(key)
+        size = self._size(key, value)
+        if size > self._max_bytes:
+            return
+        expires_at = now + ex
+        self._store[key] = (expires_at, value)
+        self._bytes += size
+        self._by_ns.setdefault(key.split(":", 1)[0], set()).add(key)
+        heapq.heappush(self._expiry, (expires_at, key))
+
+        if self._bytes > self._max_bytes:
+            self._purge_expired(now)
+        while self._bytes > self._max_bytes:
+            self._remove(next(iter(self._store)), "lru")
+        # Перезаписанные ключи оставляют в куче мусор — компактим изредка
+        if len(self._expiry) > 2 * len(self._store) + 1024:
+            self._expiry = [(e, k) for k, (e, _) in self._store.items()]
+            heapq.heapify(self._expiry)
+        self._update_gauges()
 
     async def delete(self, key: str) -> None:
-        async with self._lock:
-            self._store.pop(key, None)
+        self._remove(key)
+        self._update_gauges()
 
     async def flush_pattern(self, pattern: str) -> int:
         """Delete keys matching a glob pattern (simple prefix match)."""
         prefix = pattern.rstrip("*")
-        async with self._lock:
-            to_delete = [k for k in self._store if k.startswith(prefix)]
-            for k in to_delete:
-                del self._store[k]
-            return len(to_delete)
+        ns, sep, _ = prefix.partition(":")
+        # "analytics:*" touches only the analytics namespace; a prefix without
+        # ':' may span several namespaces and falls back to a full scan
+        candidates = self._by_ns.get(ns, ()) if sep else self._store
+        to_delete = [k for k in candidates if k.startswith(prefix)]
+        for k in to_delete:
+            self._remove(k)
+        self._update_gauges()
+        return len(to_delete)
 
     async def close(self) -> None:
         self._store.clear()
+        self._expiry.clear()
+        self._by_ns.clear()
+        self._bytes = 0
 
 
 class CacheService:
@@ -148,6 +225,30 @@ class CacheService:
                 logger.debug("Redis DELETE failed for key %s: %s", key, e)
         await self._fallback.delete(key)
 
+    async def acquire_lock(self, key: str, ttl: int = CACHE_LOCK_TTL) -> Optional[str]:
+        """Take a cross-replica lock; returns an owner token or None if held.
+
+        In-memory backend has a single process, where @cached already
+        coalesces callers, so the lock is always granted.
+        """
+        token = uuid.uuid4().hex
+        if self._using_redis:
+            try:
+                ok = await self._redis.set(f"lock:{key}", token, nx=True, ex=ttl)
+                return token if ok else None
+            except Exception as e:
+                CACHE_ERRORS.labels(backend="redis", op="lock").inc()
+                logger.debug("Redis lock failed for key %s: %s", key, e)
+        return token
+
+    async def release_lock(self, key: str, token: str) -> None:
+        if self._using_redis:
+            try:
+                await self._redis.eval(_RELEASE_LOCK_LUA, 1, f"lock:{key}", token)
+            except Exception as e:
+                CACHE_ERRORS.labels(backend="redis", op="unlock").inc()
+                logger.debug("Redis unlock failed for key %s: %s", key, e)
+
     async def flush_pattern(self, pattern: str) -> int:
         """Delete keys matching a glob pattern."""
         if self._using_redis:
@@ -216,7 +317,85 @@ class CacheService:
 cache = CacheService()
 
 
-def cached(prefix: str, ttl: int = CACHE_TTL_MEDIUM, key_args: tuple = ()):
+# Cached values are stored in an envelope with their own freshness deadline;
+# the backend TTL is longer (fresh + stale window), so an expired value can
+# still be served while one caller recomputes it.
+_ENVELOPE_VALUE = "__cached_value"
+_ENVELOPE_FRESH = "__fresh_until"
+
+# key -> in-flight computation in this process (single-flight)
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def _to_cacheable(result: Any) -> Any:
+    # Serialize: if result is a Pydantic model, convert to dict
+    if hasattr(result, "model_dump"):
+        return result.model_dump()
+    if hasattr(result, "dict"):
+        return result.dict()
+    return result
+
+
+async def _compute_and_store(
+    fn, args, kwargs, cache_key: str, ttl: int, stale_ttl: int, ttl_for=None,
+) -> Any:
+    """Run fn under the distributed lock and store the result.
+
+    If another replica holds the lock, wait for its value instead of
+    recomputing; compute anyway if the lock expires without a value.
+    """
+    token = await cache.acquire_lock(cache_key)
+    if token is None:
+        deadline = time.monotonic() + CACHE_LOCK_TTL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            envelope = await cache.get_json(cache_key)
+            if isinstance(envelope, dict) and envelope.get(_ENVELOPE_FRESH, 0) > time.time():
+                return envelope[_ENVELOPE_VALUE]
+            token = await cache.acquire_lock(cache_key)
+            if token is not None:
+                break
+    try:
+        result = await fn(*args, **kwargs)
+        override = ttl_for(result) if ttl_for else None
+        if override is not None:
+            ttl, stale_ttl = override, min(stale_ttl, override)
+        envelope = {_ENVELOPE_VALUE: _to_cacheable(result), _ENVELOPE_FRESH: time.time() + ttl}
+        await cache.set_json(cache_key, envelope, ex=ttl + stale_ttl)
+        return result
+    finally:
+        if token is not None:
+            await cache.release_lock(cache_key, token)
+
+
+def _single_flight(cache_key: str, factory) -> asyncio.Task:
+    task = _inflight.get(cache_key)
+    if task is not None:
+        CACHE_COALESCED.inc()
+        return task
+    task = asyncio.ensure_future(factory())
+    _inflight[cache_key] = task
+
+    def _forget(done: asyncio.Task) -> None:
+        if _inflight.get(cache_key) is done:
+            del _inflight[cache_key]
+
+    task.add_done_callback(_forget)
+    return task
+
+
+def _log_refresh_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background cache refresh failed: %s", task.exception())
+
+
+def cached(
+    prefix: str,
+    ttl: int = CACHE_TTL_MEDIUM,
+    key_args: tuple = (),
+    stale_ttl: Optional[int] = None,
+    ttl_for: Optional[Callable[[Any], Optional[int]]] = None,
+):
     """Decorator for caching async endpoint results.
 
     Usage:
@@ -225,7 +404,17 @@ def cached(prefix: str, ttl: int = CACHE_TTL_MEDIUM, key_args: tuple = ()):
 
         @cached("analytics:timeseries", ttl=60, key_args=("period", "metric"))
         async def get_timeseries(period, metric, ...): ...
+
+    Concurrent misses for one key share a single computation (single-flight;
+    across replicas via a Redis lock). After `ttl` the value stays servable
+    for `stale_ttl` more seconds (default: ttl): callers get it immediately
+    while one background task recomputes it.
+
+    `ttl_for(result)` may return a shorter ttl for a particular result
+    (e.g. a partial answer while a source is down); None keeps `ttl`.
     """
+    stale = ttl if stale_ttl is None else stale_ttl
+
     def decorator(fn):
         @wraps(fn)
         async def wrapper(*args, **kwargs):
@@ -236,23 +425,23 @@ def cached(prefix: str, ttl: int = CACHE_TTL_MEDIUM, key_args: tuple = ()):
                 parts.append(f"{arg_name}={val}")
             cache_key = ":".join(parts)
 
+            def factory():
+                return _compute_and_store(fn, args, kwargs, cache_key, ttl, stale, ttl_for)
+
             # Try cache first
             cached_val = await cache.get_json(cache_key)
+            if isinstance(cached_val, dict) and _ENVELOPE_VALUE in cached_val:
+                if cached_val.get(_ENVELOPE_FRESH, 0) <= time.time():
+                    CACHE_STALE_SERVED.inc()
+                    if cache_key not in _inflight:
+                        _single_flight(cache_key, factory).add_done_callback(_log_refresh_error)
+                return cached_val[_ENVELOPE_VALUE]
             if cached_val is not None:
+                # Value written before envelopes were introduced
                 return cached_val
 
-            # Call the original function
-            result = await fn(*args, **kwargs)
-
-            # Serialize: if result is a Pydantic model, convert to dict
-            to_cache = result
-            if hasattr(result, "model_dump"):
-                to_cache = result.model_dump()
-            elif hasattr(result, "dict"):
-                to_cache = result.dict()
-
-            await cache.set_json(cache_key, to_cache, ex=ttl)
-            return result
+            # shield: a cancelled caller must not cancel the shared computation
+            return await asyncio.shield(_single_flight(cache_key, factory))
 
         return wrapper
     return decorator
@@ -31,9 +31,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
 
-from shared.db_schema import USERS_TABLE, NODES_TABLE, VIOLATIONS_TABLE, \
-    USER_CONNECTIONS_TABLE, USER_HWID_DEVICES_TABLE, SYNC_METADATA_TABLE, \
-    SUBSCRIPTION_REQUEST_HISTORY_TABLE
+from shared.db_schema import NODES_TABLE, SYNC_METADATA_TABLE
 from shared.db_query import select_sql
 
 logger = logging.getLogger(__name__)
@@ -346,13 +344,46 @@ def render_metrics() -> tuple[bytes, str]:
 # ── Background gauge updater ─────────────────────────────────────
 
 
+# Счётчики из panel_counters (shared/db/counters.py) → гейджи.
+_COUNTER_GAUGES = {
+    "online_users": PANEL_ONLINE_USERS,
+    "total_users": PANEL_TOTAL_USERS,
+    "active_users": PANEL_ACTIVE_USERS,
+    "violations_open": PANEL_VIOLATIONS_OPEN,
+    "active_connections": PANEL_ACTIVE_CONNECTIONS,
+    "users_traffic_limit_reached": PANEL_USERS_TRAFFIC_LIMIT_REACHED,
+    "hwid_devices_total": PANEL_HWID_DEVICES_TOTAL,
+    "torrent_events_24h": PANEL_TORRENT_EVENTS_24H,
+    "users_hwid_limit_reached": PANEL_USERS_HWID_LIMIT_REACHED,
+    "hwid_devices_per_user_avg": PANEL_HWID_DEVICES_PER_USER_AVG,
+}
+
+_LABELED_COUNTER_GAUGES = {
+    "users_by_status": (PANEL_USERS_BY_STATUS, "status"),
+    "hwid_by_platform": (PANEL_HWID_BY_PLATFORM, "platform"),
+    "violations_by_action": (PANEL_VIOLATIONS_BY_ACTION, "action"),
+    "users_created": (PANEL_USERS_CREATED, "window"),
+    "users_expiring": (PANEL_USERS_EXPIRING, "window"),
+    "users_by_traffic_bucket": (PANEL_USERS_BY_TRAFFIC_BUCKET, "bucket"),
+    "subscription_requests": (PANEL_SUBSCRIPTION_REQUESTS, "window"),
+}
+
+
 class GaugeUpdater:
-    """Periodically refreshes panel_* gauges from the database."""
+    """Periodically refreshes panel_* gauges from the database.
+
+    Каждый тик читает только panel_counters, nodes и sync_metadata — цена
+    не зависит от размера users/user_connections/violations. Сами счётчики
+    ведут писатели (см. shared/db/counters.py), а апдейтер раз в
+    reconcile_seconds пересчитывает их целиком — сверка дрейфа и окон по времени.
+    """
 
-    def __init__(self, interval_seconds: int = 15):
+    def __init__(self, interval_seconds: int = 15, reconcile_seconds: int = 300):
         self.interval = interval_seconds
+        self.reconcile_interval = reconcile_seconds
         self._task: Optional[asyncio.Task] = None
         self._running = False
+        self._reconciled_at: Optional[float] = None
 
     async def start(self) -> None:
         if self._running:
@@ -377,6 +408,7 @@ class GaugeUpdater:
         await asyncio.sleep(5)
         while self._running:
             try:
+                await self._reconcile_if_due()
                 await self._refresh()
             except Exception as e:
                 logger.warning("Gauge refresh failed: %s", e)
@@ -385,56 +417,26 @@ class GaugeUpdater:
             except asyncio.CancelledError:
                 break
 
+    async def _reconcile_if_due(self) -> None:
+        from shared.database import db_service
+        now = time.monotonic()
+        if self._reconciled_at is not None and now - self._reconciled_at < self.reconcile_interval:
+            return
+        self._reconciled_at = now
+        await db_service.refresh_panel_counters()
+
     async def _refresh(self) -> None:
         from shared.database import db_service
         if not db_service.is_connected:
             return
 
-        async with db_service.acquire() as conn:
-            # Aggregates — single round-trip
-            row = await conn.fetchrow(
-                f"""
-                SELECT
-                    (SELECT COUNT(DISTINCT user_uuid) FROM {USER_CONNECTIONS_TABLE}
-                     WHERE user_uuid IS NOT NULL
-                       AND connected_at >= NOW() - INTERVAL '2 minutes'
-                    ) AS online_users,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}) AS total_users,
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE UPPER(status) = 'ACTIVE') AS active_users,
-                    (SELECT COUNT(*) FROM {NODES_TABLE}) AS total_nodes,
-                    (SELECT COUNT(*) FROM {NODES_TABLE}
-                     WHERE is_connected = true AND NOT is_disabled
-                    ) AS online_nodes,
-                    (SELECT COUNT(*) FROM {VIOLATIONS_TABLE}
-                     WHERE action_taken IS NULL
-                    ) AS violations_open,
-                    (SELECT COUNT(*) FROM {USER_CONNECTIONS_TABLE}
-                     WHERE disconnected_at IS NULL
-                    ) AS active_connections,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE expire_at > NOW()
-                       AND expire_at < NOW() + INTERVAL '7 days'
-                    ) AS expiring_soon,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE traffic_limit_bytes > 0
-                       AND used_traffic_bytes >= traffic_limit_bytes
-                    ) AS traffic_limit_reached,
-                    (SELECT COUNT(*) FROM {USER_HWID_DEVICES_TABLE}) AS hwid_total,
-                    (SELECT COUNT(*) FROM torrent_events
-                     WHERE detected_at >= NOW() - INTERVAL '24 hours'
-                    ) AS torrent_24h
-                """
-            )
-
-            users_by_status = await conn.fetch(
-                select_sql(USERS_TABLE, "UPPER(status) AS status, COUNT(*) AS n",
-                    "WHERE status IS NOT NULL GROUP BY UPPER(status)")
-            )
+        counters = await db_service.get_panel_counters()
 
-            hwid_by_platform = await conn.fetch(
-                select_sql(USER_HWID_DEVICES_TABLE,
-                    "COALESCE(NULLIF(LOWER(platform), ''), 'unknown') AS platform, COUNT(*) AS n",
-                    "GROUP BY 1")
+        async with db_service.acquire() as conn:
+            node_totals = await conn.fetchrow(
+                select_sql(NODES_TABLE,
+                    "COUNT(*) AS total, "
+                    "COUNT(*) FILTER (WHERE is_connected = true AND NOT is_disabled) AS online")
             )
 
             nodes = await conn.fetch(
@@ -452,85 +454,23 @@ class GaugeUpdater:
                     "WHERE last_sync_at IS NOT NULL")
             )
 
-            violations_by_action = await conn.fetch(
-                select_sql(VIOLATIONS_TABLE,
-                    "COALESCE(LOWER(recommended_action), 'unknown') AS action, COUNT(*) AS n",
-                    "WHERE action_taken IS NULL GROUP BY 1")
-            )
-
-            growth = await conn.fetchrow(
-                f"""
-                SELECT
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE created_at >= NOW() - INTERVAL '24 hours') AS created_24h,
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE created_at >= NOW() - INTERVAL '7 days')   AS created_7d,
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE created_at >= NOW() - INTERVAL '30 days')  AS created_30d,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE expire_at > NOW() AND expire_at < NOW() + INTERVAL '1 day')   AS expiring_1d,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE expire_at > NOW() AND expire_at < NOW() + INTERVAL '30 days') AS expiring_30d,
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE used_traffic_bytes < 10737418240) AS traffic_lt_10gb,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE used_traffic_bytes >= 10737418240 AND used_traffic_bytes < 107374182400) AS traffic_10_100gb,
-                    (SELECT COUNT(*) FROM {USERS_TABLE}
-                     WHERE used_traffic_bytes >= 107374182400 AND used_traffic_bytes < 1099511627776) AS traffic_100gb_1tb,
-                    (SELECT COUNT(*) FROM {USERS_TABLE} WHERE used_traffic_bytes >= 1099511627776) AS traffic_gt_1tb
-                """
-            )
-
-            hwid_limit_reached = await conn.fetchval(
-                f"""
-                SELECT COUNT(DISTINCT u.uuid)
-                FROM {USERS_TABLE} u
-                JOIN (
-                    SELECT user_uuid, COUNT(*) AS n FROM {USER_HWID_DEVICES_TABLE} GROUP BY user_uuid
-                ) d ON d.user_uuid = u.uuid
-                WHERE u.hwid_device_limit > 0 AND d.n >= u.hwid_device_limit
-                """
-            )
-
-            hwid_avg = await conn.fetchval(
-                f"SELECT AVG(n)::float FROM ("
-                f"  SELECT COUNT(*) AS n FROM {USER_HWID_DEVICES_TABLE} GROUP BY user_uuid"
-                f") s"
-            )
-
-            # SRH table может отсутствовать на старых инсталляциях — мягко fallback'имся
-            sub_req = None
-            try:
-                sub_req = await conn.fetchrow(
-                    f"""
-                    SELECT
-                        COUNT(*) FILTER (WHERE request_at >= NOW() - INTERVAL '1 hour') AS req_1h,
-                        COUNT(*) FILTER (WHERE request_at >= NOW() - INTERVAL '24 hours') AS req_24h
-                    FROM {SUBSCRIPTION_REQUEST_HISTORY_TABLE}
-                    """
-                )
-            except Exception:
-                sub_req = None
-
-        if row:
-            PANEL_ONLINE_USERS.set(int(row["online_users"] or 0))
-            PANEL_TOTAL_USERS.set(int(row["total_users"] or 0))
-            PANEL_ACTIVE_USERS.set(int(row["active_users"] or 0))
-            PANEL_TOTAL_NODES.set(int(row["total_nodes"] or 0))
-            PANEL_ONLINE_NODES.set(int(row["online_nodes"] or 0))
-            PANEL_VIOLATIONS_OPEN.set(int(row["violations_open"] or 0))
-            PANEL_ACTIVE_CONNECTIONS.set(int(row["active_connections"] or 0))
-            PANEL_USERS_EXPIRING_SOON.set(int(row["expiring_soon"] or 0))
-            PANEL_USERS_TRAFFIC_LIMIT_REACHED.set(int(row["traffic_limit_reached"] or 0))
-            PANEL_HWID_DEVICES_TOTAL.set(int(row["hwid_total"] or 0))
-            PANEL_TORRENT_EVENTS_24H.set(int(row["torrent_24h"] or 0))
-
-        # Per-label gauges — reset then set to drop stale labels (removed nodes,
-        # statuses that fell to 0, etc.)
-        PANEL_USERS_BY_STATUS.clear()
-        for r in users_by_status:
-            status = (r["status"] or "unknown").lower()
-            PANEL_USERS_BY_STATUS.labels(status=status).set(int(r["n"]))
-
-        PANEL_HWID_BY_PLATFORM.clear()
-        for r in hwid_by_platform:
-            PANEL_HWID_BY_PLATFORM.labels(platform=r["platform"]).set(int(r["n"]))
+        if node_totals:
+            PANEL_TOTAL_NODES.set(int(node_totals["total"] or 0))
+            PANEL_ONLINE_NODES.set(int(node_totals["online"] or 0))
+
+        # Per-label gauges — reset then set to drop stale labels (statuses that
+        # fell to 0 are removed from panel_counters when their group is rebuilt)
+        for gauge, _ in _LABELED_COUNTER_GAUGES.values():
+            gauge.clear()
+        for c in counters:
+            name, label, value = c["name"], c["label"], c["value"]
+            if name in _COUNTER_GAUGES:
+                _COUNTER_GAUGES[name].set(value)
+            elif name in _LABELED_COUNTER_GAUGES:
+                gauge, label_name = _LABELED_COUNTER_GAUGES[name]
+                gauge.labels(**{label_name: label}).set(value)
+                if name == "users_expiring" and label == "7d":
+                    PANEL_USERS_EXPIRING_SOON.set(value)
 
         PANEL_NODE_CPU_USAGE.clear()
         PANEL_NODE_CPU_CORES.clear()
@@ -573,29 +513,6 @@ class GaugeUpdater:
         for r in sync_rows:
             PANEL_SYNC_LAG_SECONDS.labels(kind=r["key"]).set(float(r["lag"] or 0))
 
-        PANEL_VIOLATIONS_BY_ACTION.clear()
-        for r in violations_by_action:
-            PANEL_VIOLATIONS_BY_ACTION.labels(action=r["action"]).set(int(r["n"]))
-
-        if growth:
-            PANEL_USERS_CREATED.labels(window="24h").set(int(growth["created_24h"] or 0))
-            PANEL_USERS_CREATED.labels(window="7d").set(int(growth["created_7d"] or 0))
-            PANEL_USERS_CREATED.labels(window="30d").set(int(growth["created_30d"] or 0))
-            PANEL_USERS_EXPIRING.labels(window="1d").set(int(growth["expiring_1d"] or 0))
-            PANEL_USERS_EXPIRING.labels(window="7d").set(int(row["expiring_soon"] or 0))
-            PANEL_USERS_EXPIRING.labels(window="30d").set(int(growth["expiring_30d"] or 0))
-            PANEL_USERS_BY_TRAFFIC_BUCKET.labels(bucket="lt_10gb").set(int(growth["traffic_lt_10gb"] or 0))
-            PANEL_USERS_BY_TRAFFIC_BUCKET.labels(bucket="10_100gb").set(int(growth["traffic_10_100gb"] or 0))
-            PANEL_USERS_BY_TRAFFIC_BUCKET.labels(bucket="100gb_1tb").set(int(growth["traffic_100gb_1tb"] or 0))
-            PANEL_USERS_BY_TRAFFIC_BUCKET.labels(bucket="gt_1tb").set(int(growth["traffic_gt_1tb"] or 0))
-
-        PANEL_USERS_HWID_LIMIT_REACHED.set(int(hwid_limit_reached or 0))
-        PANEL_HWID_DEVICES_PER_USER_AVG.set(float(hwid_avg or 0))
-
-        if sub_req:
-            PANEL_SUBSCRIPTION_REQUESTS.labels(window="1h").set(int(sub_req["req_1h"] or 0))
-            PANEL_SUBSCRIPTION_REQUESTS.labels(window="24h").set(int(sub_req["req_24h"] or 0))
-
         # asyncpg pool stats
         pool = getattr(db_service, "_pool", None) or getattr(db_service, "pool", None)
         if pool is not None:
@@ -0,0 +1,110 @@
+"""Coalesced node heartbeats: agent version and system metrics from collector batches.
+
+Keeps /batch on the connection path only. Each batch just records the node's
+latest report in memory (last value wins); a background loop writes all nodes
+every N seconds with one statement (DatabaseService.save_node_heartbeats).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_FLUSH_INTERVAL_SEC = float(os.getenv("NODE_HEARTBEAT_FLUSH_SEC", "10"))
+
+_pending: dict[str, dict[str, Any]] = {}
+_flush_task: Optional[asyncio.Task] = None
+_stop = asyncio.Event()
+
+
+def record(
+    node_uuid: str,
+    agent_version: Optional[str] = None,
+    metrics: Optional[dict[str, Any]] = None,
+    network: Optional[dict[str, Any]] = None,
+) -> None:
+    """Remember the node's latest heartbeat. Flushed asynchronously.
+
+    Without metrics the previous pending metrics are kept: a batch that
+    carries only the version must not erase a sample that has not been
+    written yet.
+    """
+    beat = _pending.setdefault(node_uuid, {"node_uuid": node_uuid, "metrics": None})
+    if agent_version:
+        beat["agent_version"] = agent_version
+    if metrics is not None:
+        beat["metrics"] = metrics
+        beat["network"] = network
+        beat["received_at"] = datetime.now(timezone.utc)
+
+
+def pending_count() -> int:
+    return len(_pending)
+
+
+def _requeue(beats: list[dict[str, Any]]) -> None:
+    """Return an unwritten batch to the buffer.
+
+    Reports that arrived during the write are newer and win; from the old
+    beat only what they lack is taken (version, metrics), as in record().
+    The buffer holds one entry per node, so it cannot grow unbounded.
+    """
+    for beat in beats:
+        newer = _pending.get(beat["node_uuid"])
+        if newer is None:
+            _pending[beat["node_uuid"]] = beat
+            continue
+        if not newer.get("agent_version") and beat.get("agent_version"):
+            newer["agent_version"] = beat["agent_version"]
+        if newer.get("metrics") is None and beat.get("metrics") is not None:
+            newer["metrics"] = beat["metrics"]
+            newer["network"] = beat.get("network")
+            newer["received_at"] = beat.get("received_at")
+
+
+async def _flush() -> None:
+    if not _pending:
+        return
+    from shared.database import db_service
+    if not db_service.is_connected:
+        return  # остаются в буфере до следующего сброса
+    beats = list(_pending.values())
+    _pending.clear()
+    try:
+        await db_service.save_node_heartbeats(beats)
+    except Exception as e:
+        logger.warning("Failed to flush node heartbeats (%d nodes): %s", len(beats), e)
+        _requeue(beats)
+
+
+async def _loop() -> None:
+    logger.debug("Node heartbeat buffer started (interval=%ss)", _FLUSH_INTERVAL_SEC)
+    while not _stop.is_set():
+        try:
+            await asyncio.wait_for(_stop.wait(), timeout=_FLUSH_INTERVAL_SEC)
+        except asyncio.TimeoutError:
+            pass
+        await _flush()
+    await _flush()
+    logger.info("Node heartbeat buffer stopped")
+
+
+def start() -> None:
+    global _flush_task
+    if _flush_task and not _flush_task.done():
+        return
+    _stop.clear()
+    _flush_task = asyncio.create_task(_loop(), name="node-heartbeat-flush")
+
+
+async def stop() -> None:
+    _stop.set()
+    if _flush_task:
+        try:
+            await asyncio.wait_for(_flush_task, timeout=5)
+        except asyncio.TimeoutError:
+            _flush_task.cancel()
@@ -24,6 +24,8 @@ from shared.rbac import (
     get_scope as _get_scope_shared,
     filter_by_scope as _filter_by_scope_shared,
     get_visible_user_uuids as _get_visible_user_uuids_shared,
+    get_user_scope as _get_user_scope_shared,
+    filter_visible_user_uuids as _filter_visible_user_uuids_shared,
     invalidate_scope_cache,
     check_quota as _check_quota_shared,
 )
@@ -40,6 +42,7 @@ from shared.rbac import (  # noqa: F401
     get_all_permissions_for_role_id,
     get_admin_account_by_telegram_id,
     invalidate_scope_cache,
+    UserScope,
 )
 
 logger = logging.getLogger(__name__)
@@ -394,6 +397,30 @@ async def get_visible_user_uuids(admin) -> Optional[Set[str]]:
     return await _get_visible_user_uuids_shared(account_id, role)
 
 
+async def get_user_scope(admin) -> Optional[UserScope]:
+    """Admin's user visibility as an SQL predicate (None — no restriction).
+
+    AdminUser-aware wrapper around shared/rbac.py get_user_scope().
+    """
+    if admin is None:
+        return None
+    return await _get_user_scope_shared(getattr(admin, "account_id", None), getattr(admin, "role", None))
+
+
+async def filter_visible_user_uuids(admin, user_uuids: List[str]) -> List[str]:
+    """Keep only the given user UUIDs the admin can see."""
+    if admin is None:
+        return list(user_uuids)
+    return await _filter_visible_user_uuids_shared(
+        getattr(admin, "account_id", None), getattr(admin, "role", None), user_uuids,
+    )
+
+
+async def is_user_visible(admin, user_uuid: str) -> bool:
+    """Single-user visibility check. True = allowed."""
+    return bool(await filter_visible_user_uuids(admin, [user_uuid]))
+
+
 async def resolve_allowed_actions_map(
     admin, resource_type: str, uuids: List[str],
 ) -> Dict[str, Optional[List[str]]]:
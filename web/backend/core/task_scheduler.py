@@ -1,142 +1,253 @@
-"""Background scheduler for cron-based script execution on nodes."""
+"""Background scheduler for cron-based script execution on nodes.
+
+Держит в памяти расписание включённых задач (id -> cron) и время следующего
+срабатывания каждой; спит до ближайшего. Расписание перечитывается сразу
+после изменения задач (invalidate_schedule), а правки с другой реплики
+ловит сверка отпечатка расписания раз в минуту — одна строка из БД.
+Подошедшие задачи грузятся одним запросом и уходят в фоновые таски, не
+больше NODE_TASK_CONCURRENCY одновременно на ноду: медленная нода не
+задерживает планирование остальных.
+"""
 import asyncio
 import json
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
 
 from shared.db_schema import NODES_TABLE, NODE_SCRIPTS_TABLE, NODE_COMMAND_LOG_TABLE, SCHEDULED_TASKS_TABLE
 from shared.db_query import select_sql, insert_sql, update_sql
 
 logger = logging.getLogger(__name__)
 
+NODE_TASK_CONCURRENCY = 2
+_CHANGE_CHECK_INTERVAL = timedelta(minutes=1)
+
+_schedule_changed = asyncio.Event()
+_node_slots: Dict[str, asyncio.Semaphore] = {}
+# Запущенные задачи: ссылки держат таски от GC, id — от повторного запуска,
+# пока предыдущий прогон ещё идёт.
+_running: Set[asyncio.Task] = set()
+_in_flight: Set[int] = set()
+
+# Отпечаток того, что влияет на план: id и cron включённых задач
+_SIGNATURE_SQL = (
+    f"SELECT md5(COALESCE(string_agg(id::text || ':' || cron_expression, ',' ORDER BY id), '')) "
+    f"FROM {SCHEDULED_TASKS_TABLE} WHERE is_enabled = true"
+)
+
+
+def invalidate_schedule() -> None:
+    """Задачи изменились — планировщик перечитает расписание сразу."""
+    _schedule_changed.set()
+
+
+def _node_slot(node_uuid: str) -> asyncio.Semaphore:
+    slot = _node_slots.get(node_uuid)
+    if slot is None:
+        slot = _node_slots[node_uuid] = asyncio.Semaphore(NODE_TASK_CONCURRENCY)
+    return slot
+
+
+async def _load_schedule(db_service) -> Tuple[Dict[int, str], Optional[str]]:
+    async with db_service.acquire() as conn:
+        rows = await conn.fetch(
+            select_sql(SCHEDULED_TASKS_TABLE, "id, cron_expression", "WHERE is_enabled = true")
+        )
+        signature = await conn.fetchval(_SIGNATURE_SQL)
+    return {r["id"]: r["cron_expression"] for r in rows}, signature
+
+
+async def _schedule_signature(db_service) -> Optional[str]:
+    async with db_service.acquire() as conn:
+        return await conn.fetchval(_SIGNATURE_SQL)
+
 
 async def task_scheduler_loop():
-    """Check scheduled_tasks every 60s and execute matching cron entries."""
+    """Execute scheduled_tasks at their cron fire times."""
+    from web.backend.core.automation_engine import cron_next_fire
+
     await asyncio.sleep(10)  # initial startup delay
+    schedule: Dict[int, str] = {}
+    signature: Optional[str] = None
+    next_fire: Dict[int, datetime] = {}
+    last_fired: Dict[int, datetime] = {}
+    checked_at = None
+
+    def _plan(task_id: int, now: datetime) -> None:
+        # Минута, уже начавшаяся до (пере)загрузки, ещё считается: правка задачи
+        # в момент срабатывания не должна его съесть. last_fired — от повтора.
+        after = now - timedelta(minutes=1)
+        if task_id in last_fired:
+            after = max(after, last_fired[task_id])
+        at = cron_next_fire(schedule[task_id], after)
+        if at is None:
+            next_fire.pop(task_id, None)
+        else:
+            next_fire[task_id] = at
+
     while True:
+        timeout = 60.0
         try:
             from shared.database import db_service
             if not db_service.is_connected:
                 await asyncio.sleep(60)
                 continue
 
-            from web.backend.core.automation_engine import cron_matches_now
-
-            async with db_service.acquire() as conn:
-                tasks = await conn.fetch(
-                    f"""
-                    SELECT st.id, st.script_id, st.node_uuid::text, st.cron_expression,
-                           st.env_vars, ns.script_content, ns.name AS script_name,
-                           ns.timeout_seconds, ns.requires_root
-                    FROM {SCHEDULED_TASKS_TABLE} st
-                    JOIN {NODE_SCRIPTS_TABLE} ns ON ns.id = st.script_id
-                    WHERE st.is_enabled = true
-                    """
-                )
+            now = datetime.now(timezone.utc)
+            reload = checked_at is None or _schedule_changed.is_set()
+            if not reload and now - checked_at >= _CHANGE_CHECK_INTERVAL:
+                checked_at = now
+                reload = await _schedule_signature(db_service) != signature
+            if reload:
+                _schedule_changed.clear()
+                schedule, signature = await _load_schedule(db_service)
+                checked_at = now
+                next_fire.clear()
+                for task_id in schedule:
+                    _plan(task_id, now)
+                last_fired = {k: v for k, v in last_fired.items() if k in schedule}
+
+            due = [task_id for task_id, at in next_fire.items() if at <= now]
+            if due:
+                for task_id in due:
+                    last_fired[task_id] = next_fire[task_id]
+                    _plan(task_id, now)
+                await _fire_due(db_service, due)
+                continue
 
-            for task in tasks:
-                try:
-                    if not cron_matches_now(task["cron_expression"]):
-                        continue
-
-                    task_id = task["id"]
-                    node_uuid = task["node_uuid"]
-                    script_name = task["script_name"]
-
-                    logger.info(
-                        "Scheduled task %d (%s) triggered for node %s",
-                        task_id, script_name, node_uuid,
-                    )
-
-                    status = "failed"
-                    try:
-                        from web.backend.core.agent_manager import agent_manager
-                        from web.backend.core.agent_hmac import sign_command_with_ts
-
-                        if not agent_manager.is_connected(node_uuid):
-                            logger.warning("Agent %s not connected, task %d skipped", node_uuid, task_id)
-                            await _update_task_status(db_service, task_id, "failed")
-                            continue
-
-                        agent_token = None
-                        async with db_service.acquire() as conn:
-                            row = await conn.fetchrow(
-                                select_sql(NODES_TABLE, "agent_token", "WHERE uuid = $1"), node_uuid
-                            )
-                            if row:
-                                agent_token = row["agent_token"]
-
-                        if not agent_token:
-                            logger.warning("No agent token for node %s, skipping task %d", node_uuid, task_id)
-                            await _update_task_status(db_service, task_id, "failed")
-                            continue
-
-                        env_vars = task["env_vars"]
-                        if isinstance(env_vars, str):
-                            env_vars = json.loads(env_vars)
-
-                        # Prepend env vars as export statements (same as exec-script endpoint)
-                        script_content = task["script_content"]
-                        if env_vars:
-                            import shlex
-                            exports = "\n".join(
-                                f"export {k}={shlex.quote(str(v))}"
-                                for k, v in env_vars.items()
-                                if k.isidentifier()
-                            )
-                            if exports:
-                                if script_content.startswith("#!"):
-                                    first_nl = script_content.index("\n")
-                                    script_content = (
-                                        script_content[:first_nl + 1]
-                                        + exports + "\n"
-                                        + script_content[first_nl + 1:]
-                                    )
-                                else:
-                                    script_content = exports + "\n" + script_content
-
-                        # Log command for result tracking (agent sends command_result by command_id)
-                        async with db_service.acquire() as conn:
-                            cmd_row = await conn.fetchrow(
-                                insert_sql(NODE_COMMAND_LOG_TABLE,
-                                    ["node_uuid", "admin_id", "admin_username", "command_type",
-                                     "command_data", "status"],
-                                    values="$1, NULL, 'scheduler', 'exec_script', $2, 'running'",
-                                    returning="id"),
-                                node_uuid,
-                                f"script={script_name} task_id={task_id}" + (
-                                    f" env={list(env_vars.keys())}" if env_vars else ""
-                                ),
-                            )
-                            exec_id = cmd_row["id"]
-
-                        cmd_payload = {
-                            "type": "exec_script",
-                            "command_id": exec_id,
-                            "script_content": script_content,
-                            "timeout": task["timeout_seconds"] or 300,
-                        }
-                        payload_with_ts, sig = sign_command_with_ts(cmd_payload, agent_token)
-                        payload_with_ts["_sig"] = sig
-
-                        sent = await agent_manager.send_command(node_uuid, payload_with_ts)
-                        status = "success" if sent else "failed"
-                        if not sent:
-                            logger.warning("Failed to send to agent %s, task %d", node_uuid, task_id)
-
-                    except Exception as e:
-                        logger.error("Failed to execute scheduled task %d: %s", task_id, e, exc_info=True)
-                        status = "failed"
-
-                    await _update_task_status(db_service, task_id, status)
-
-                except Exception as e:
-                    logger.error("Error processing scheduled task: %s", e, exc_info=True)
+            timeout = (checked_at + _CHANGE_CHECK_INTERVAL - now).total_seconds()
+            if next_fire:
+                timeout = min(timeout, (min(next_fire.values()) - now).total_seconds())
 
         except Exception as e:
             logger.error("Task scheduler loop error: %s", e, exc_info=True)
 
-        await asyncio.sleep(60)
+        try:
+            await asyncio.wait_for(_schedule_changed.wait(), timeout=max(timeout, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _fire_due(db_service, task_ids: List[int]) -> None:
+    """Загрузить подошедшие задачи одним запросом и запустить в фоне.
+
+    Задача, чей прошлый прогон ещё не закончился, пропускается.
+    """
+    skipped = [task_id for task_id in task_ids if task_id in _in_flight]
+    if skipped:
+        logger.warning("Scheduled tasks %s still running, skipping this fire", skipped)
+    task_ids = [task_id for task_id in task_ids if task_id not in _in_flight]
+    if not task_ids:
+        return
+    async with db_service.acquire() as conn:
+        tasks = await conn.fetch(
+            f"""
+            SELECT st.id, st.node_uuid::text, st.env_vars, ns.script_content,
+                   ns.name AS script_name, ns.timeout_seconds, n.agent_token
+            FROM {SCHEDULED_TASKS_TABLE} st
+            JOIN {NODE_SCRIPTS_TABLE} ns ON ns.id = st.script_id
+            LEFT JOIN {NODES_TABLE} n ON n.uuid = st.node_uuid
+            WHERE st.id = ANY($1::int[]) AND st.is_enabled = true
+            """,
+            task_ids,
+        )
+    for task in tasks:
+        _in_flight.add(task["id"])
+        bg = asyncio.create_task(_run_task(db_service, task))
+        _running.add(bg)
+        bg.add_done_callback(_running.discard)
+
+
+async def _run_task(db_service, task) -> None:
+    """Отправить одну задачу агенту ноды и записать её статус."""
+    task_id = task["id"]
+    node_uuid = task["node_uuid"]
+    script_name = task["script_name"]
+    try:
+        try:
+            async with _node_slot(node_uuid):
+                logger.info(
+                    "Scheduled task %d (%s) triggered for node %s",
+                    task_id, script_name, node_uuid,
+                )
+                status = await _send_task(db_service, task)
+        except Exception as e:
+            logger.error("Failed to execute scheduled task %d: %s", task_id, e, exc_info=True)
+            status = "failed"
+        await _update_task_status(db_service, task_id, status)
+    finally:
+        _in_flight.discard(task_id)
+
+
+async def _send_task(db_service, task) -> str:
+    from web.backend.core.agent_manager import agent_manager
+    from web.backend.core.agent_hmac import sign_command_with_ts
+
+    task_id = task["id"]
+    node_uuid = task["node_uuid"]
+    script_name = task["script_name"]
+
+    if not agent_manager.is_connected(node_uuid):
+        logger.warning("Agent %s not connected, task %d skipped", node_uuid, task_id)
+        return "failed"
+
+    agent_token = task["agent_token"]
+    if not agent_token:
+        logger.warning("No agent token for node %s, skipping task %d", node_uuid, task_id)
+        return "failed"
+
+    env_vars = task["env_vars"]
+    if isinstance(env_vars, str):
+        env_vars = json.loads(env_vars)
+
+    # Prepend env vars as export statements (same as exec-script endpoint)
+    script_content = task["script_content"]
+    if env_vars:
+        import shlex
+        exports = "\n".join(
+            f"export {k}={shlex.quote(str(v))}"
+            for k, v in env_vars.items()
+            if k.isidentifier()
+        )
+        if exports:
+            if script_content.startswith("#!"):
+                first_nl = script_content.index("\n")
+                script_content = (
+                    script_content[:first_nl + 1]
+                    + exports + "\n"
+                    + script_content[first_nl + 1:]
+                )
+            else:
+                script_content = exports + "\n" + script_content
+
+    # Log command for result tracking (agent sends command_result by command_id)
+    async with db_service.acquire() as conn:
+        cmd_row = await conn.fetchrow(
+            insert_sql(NODE_COMMAND_LOG_TABLE,
+                ["node_uuid", "admin_id", "admin_username", "command_type",
+                 "command_data", "status"],
+                values="$1, NULL, 'scheduler', 'exec_script', $2, 'running'",
+                returning="id"),
+            node_uuid,
+            f"script={script_name} task_id={task_id}" + (
+                f" env={list(env_vars.keys())}" if env_vars else ""
+            ),
+        )
+        exec_id = cmd_row["id"]
+
+    cmd_payload = {
+        "type": "exec_script",
+        "command_id": exec_id,
+        "script_content": script_content,
+        "timeout": task["timeout_seconds"] or 300,
+    }
+    payload_with_ts, sig = sign_command_with_ts(cmd_payload, agent_token)
+    payload_with_ts["_sig"] = sig
+
+    sent = await agent_manager.send_command(node_uuid, payload_with_ts)
+    if not sent:
+        logger.warning("Failed to send to agent %s, task %d", node_uuid, task_id)
+    return "success" if sent else "failed"
 
 
 async def _update_task_status(db_service, task_id: int, status: str):
@@ -1,13 +1,15 @@
 """Traffic Rate Monitor — отслеживание аномально высокого потребления трафика.
 
-Фоновая задача: периодически проверяет дельту raw_used_traffic_bytes per user
-за настраиваемое окно. Если за N минут юзер потребил > X GB — уведомление в Telegram.
+Фоновая задача: периодически суммирует дельты трафика per user за настраиваемое
+окно. Если за N минут юзер потребил > X GB — уведомление в Telegram.
+
+Дельты берутся из user_node_traffic_history — их пишет синхронизация трафика
+нод, так что монитор не ходит в Panel API, а история переживает рестарт.
 """
 import asyncio
 import logging
-from collections import defaultdict, deque
 from datetime import datetime, timezone
-from typing import Deque, Dict, Optional, Tuple
+from typing import Dict, Optional
 
 from shared.db_schema import USERS_TABLE, USER_CONNECTIONS_TABLE, NODES_TABLE
 from shared.db_query import select_sql
@@ -20,12 +22,6 @@ async def _resolve_user_key(user_uuid: str) -> str | int:
     from shared.data_access import resolve_panel_user_id
     return await resolve_panel_user_id(user_uuid)
 
-# (timestamp, raw_used_traffic_bytes) per user
-_UserSnapshot = Tuple[float, int]
-
-# Max snapshots per user (at 5-min intervals, 24 = 2 hours of history)
-_MAX_SNAPSHOTS = 24
-
 
 class TrafficRateMonitor:
     """Background monitor for traffic consumption rate per user."""
@@ -33,8 +29,6 @@ class TrafficRateMonitor:
     def __init__(self):
         self._task: Optional[asyncio.Task] = None
         self._running = False
-        # user_uuid -> deque of (timestamp, raw_bytes)
-        self._snapshots: Dict[str, Deque[_UserSnapshot]] = defaultdict(lambda: deque(maxlen=_MAX_SNAPSHOTS))
         # user_uuid -> last notification timestamp (cooldown)
         self._notified: Dict[str, float] = {}
 
@@ -81,8 +75,8 @@ class TrafficRateMonitor:
                 if not cfg["enabled"]:
                     continue
 
-                logger.debug("Traffic rate check: threshold=%.1f GB, window=%d min, users tracked=%d",
-                            cfg["threshold_gb"], cfg["window_minutes"], len(self._snapshots))
+                logger.debug("Traffic rate check: threshold=%.1f GB, window=%d min",
+                            cfg["threshold_gb"], cfg["window_minutes"])
                 await self._check_traffic_rates(cfg)
 
             except asyncio.CancelledError:
@@ -92,128 +86,68 @@ class TrafficRateMonitor:
                 await asyncio.sleep(30)
 
     async def _check_traffic_rates(self, cfg: dict):
-        """Take snapshot and check for rate violations."""
+        """Find users over the rate threshold from locally recorded traffic deltas."""
         from shared.database import db_service
         if not db_service.is_connected:
             return
 
         now = datetime.now(timezone.utc).timestamp()
         threshold_bytes = int(cfg["threshold_gb"] * 1024 ** 3)
-        window_seconds = cfg["window_minutes"] * 60
         cooldown_seconds = cfg["cooldown_minutes"] * 60
 
-        # Fetch fresh traffic from Panel API (most up-to-date source)
-        traffic_map: dict[str, int] = {}
-        username_map: dict[str, str] = {}
+        # Дельты по нодам пишет синхронизация трафика (user_node_traffic_history),
+        # порог отсекается в SQL — из базы приходят только кандидаты.
+        # Дельта покрывает интервал синхронизации до своей записи — его
+        # передаём, чтобы отсчёт времени начинался с предыдущего снимка.
+        from shared.sync import SyncService
         try:
-            from shared.api_client import api_client
-            page = 0
-            while True:
-                resp = await api_client.get_users(start=page * 100, size=100)
-                users_list = resp.get("response", resp) if isinstance(resp, dict) else resp
-                if isinstance(users_list, dict):
-                    users_list = users_list.get("users", [])
-                if not users_list:
-                    break
-                for u in users_list:
-                    uid = u.get("uuid")
-                    if not uid:
-                        # Panel v3 identifies users by numeric id — resolve to local uuid
-                        panel_id = u.get("id")
-                        if panel_id is None:
-                            continue
-                        try:
-                            uid = await db_service.get_user_uuid_by_panel_id(int(panel_id))
-                        except (TypeError, ValueError):
-                            continue
-                    if not uid:
-                        continue
-                    ut = u.get("userTraffic") or {}
-                    ut_val = ut.get("usedTrafficBytes")
-                    used = int(ut_val if ut_val is not None else (u.get("usedTrafficBytes") or 0))
-                    if used > 0:
-                        traffic_map[uid] = used
-                        username_map[uid] = u.get("username") or uid[:8]
-                page += 1
-                if len(users_list) < 100:
-                    break
+            rows = await db_service.get_user_traffic_in_window(
+                cfg["window_minutes"], threshold_bytes, SyncService._get_sync_interval(),
+            )
         except Exception as e:
-            logger.warning("Failed to fetch users from API, falling back to DB: %s", e)
-            # Fallback: use DB data
-            try:
-                async with db_service.acquire() as conn:
-                        rows = await conn.fetch(
-                            select_sql(USERS_TABLE, "uuid::text, username, used_traffic_bytes",
-                                "WHERE used_traffic_bytes > 0")
-                        )
-                for row in rows:
-                    traffic_map[row["uuid"]] = int(row["used_traffic_bytes"])
-                    username_map[row["uuid"]] = row["username"] or row["uuid"][:8]
-            except Exception as e2:
-                logger.warning("Failed to fetch user traffic from DB: %s", e2)
-                return
-
-        logger.info("Traffic rate check: %d users fetched, threshold=%.1f GB", len(traffic_map), cfg["threshold_gb"])
-
-        violators = []
-
-        for user_uuid, current_bytes in traffic_map.items():
-            username = username_map.get(user_uuid, user_uuid[:8])
-
-            # Record snapshot
-            self._snapshots[user_uuid].append((now, current_bytes))
+            logger.warning("Failed to fetch user traffic window from DB: %s", e)
+            return
 
-            # Need at least 2 snapshots to calculate delta
-            buf = self._snapshots[user_uuid]
-            if len(buf) < 2:
-                continue
+        logger.info("Traffic rate check: %d users over threshold=%.1f GB", len(rows), cfg["threshold_gb"])
+        if not rows:
+            return
 
-            # Check whitelist — skip fully whitelisted or traffic_rate-excluded users
-            try:
-                whitelisted, excluded = await db_service.is_user_violation_whitelisted(user_uuid)
-                if whitelisted and (excluded is None or "traffic_rate" in excluded):
-                    continue
-            except Exception:
-                pass
+        # Whitelist — одним запросом на всех кандидатов
+        try:
+            excluded = await db_service.get_whitelist_excluded(
+                [r["user_uuid"] for r in rows], "traffic_rate",
+            )
+        except Exception:
+            excluded = set()
 
-            # Find oldest snapshot within the window
-            cutoff = now - window_seconds
-            oldest_in_window = None
-            for ts, val in buf:
-                if ts >= cutoff:
-                    oldest_in_window = (ts, val)
-                    break
+        violators = []
 
-            if oldest_in_window is None:
+        for row in rows:
+            user_uuid = row["user_uuid"]
+            if user_uuid in excluded:
                 continue
 
-            old_ts, old_bytes = oldest_in_window
-            elapsed = now - old_ts
+            elapsed = row["elapsed_seconds"]
             if elapsed < 60:  # need at least 1 minute of data
                 continue
 
-            delta_bytes = current_bytes - old_bytes
-            if delta_bytes <= 0:
+            # Check cooldown
+            last_notified = self._notified.get(user_uuid, 0)
+            if now - last_notified < cooldown_seconds:
                 continue
 
-            if delta_bytes >= threshold_bytes:
-                # Check cooldown
-                last_notified = self._notified.get(user_uuid, 0)
-                if now - last_notified < cooldown_seconds:
-                    continue
-
-                delta_gb = delta_bytes / (1024 ** 3)
-                elapsed_min = elapsed / 60
-                rate_gbh = delta_gb / (elapsed_min / 60) if elapsed_min > 0 else delta_gb
-
-                violators.append({
-                    "user_uuid": user_uuid,
-                    "username": username,
-                    "delta_gb": round(delta_gb, 2),
-                    "elapsed_minutes": round(elapsed_min, 0),
-                    "rate_gb_per_hour": round(rate_gbh, 2),
-                })
-                self._notified[user_uuid] = now
+            delta_gb = row["delta_bytes"] / (1024 ** 3)
+            elapsed_min = elapsed / 60
+            rate_gbh = delta_gb / (elapsed_min / 60) if elapsed_min > 0 else delta_gb
+
+            violators.append({
+                "user_uuid": user_uuid,
+                "username": row["username"] or user_uuid[:8],
+                "delta_gb": round(delta_gb, 2),
+                "elapsed_minutes": round(elapsed_min, 0),
+                "rate_gb_per_hour": round(rate_gbh, 2),
+            })
+            self._notified[user_uuid] = now
 
         if not violators:
             return
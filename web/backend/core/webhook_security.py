@@ -1,8 +1,12 @@
 """Webhook security helpers: SSRF protection, HMAC v1/v2, retry queue.
 
 - `check_url_safety(url)` — rejects private IP ranges to prevent SSRF.
+- `resolve_webhook_url(url)` — same check with a TTL cache of validated IPs,
+  used by `deliver_once` to pin the connection to an approved address.
 - `sign_payload(secret, body, version)` — HMAC-SHA256, v2 prepends timestamp.
-- `webhook_retry_worker()` — background task consuming webhook_retry_queue.
+- `dispatch_event(event, payload)` — fan-out via an in-memory subscription index.
+- `webhook_retry_worker()` — background task consuming webhook_retry_queue and
+  flushing buffered delivery logs.
 """
 from __future__ import annotations
 
@@ -15,7 +19,10 @@ import logging
 import os
 import socket
 import time
-from typing import Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 from shared.db_schema import WEBHOOK_DELIVERIES_TABLE, WEBHOOK_SUBSCRIPTIONS_TABLE, WEBHOOK_RETRY_QUEUE_TABLE
@@ -34,6 +41,13 @@ WEBHOOK_BACKOFF_SECONDS = [60, 300, 1500]  # 1m, 5m, 25m
 WEBHOOK_RETRY_WORKER_INTERVAL = float(os.getenv("WEBHOOK_RETRY_WORKER_INTERVAL", "10"))
 WEBHOOK_ALLOW_PRIVATE_URL = os.getenv("WEBHOOK_ALLOW_PRIVATE_URL", "0") == "1"
 WEBHOOK_SIGNATURE_TOLERANCE_SEC = 300  # documented replay window
+WEBHOOK_DNS_CACHE_TTL_SEC = float(os.getenv("WEBHOOK_DNS_CACHE_TTL_SEC", "60"))
+WEBHOOK_MAX_CLIENTS = 256  # пулов соединений (по одному на origin получателя)
+WEBHOOK_ENDPOINT_CONCURRENCY = int(os.getenv("WEBHOOK_ENDPOINT_CONCURRENCY", "4"))
+WEBHOOK_SUBSCRIPTIONS_TTL_SEC = 30.0  # страховка для изменений с других реплик
+WEBHOOK_LOG_FLUSH_SEC = 2.0
+WEBHOOK_LOG_BUFFER_MAX = 10_000
+WEBHOOK_DELIVERIES_KEEP = 200  # история на подписку
 
 # ── SSRF protection ──────────────────────────────────────────────
 
@@ -64,40 +78,113 @@ def _ip_is_blocked(addr) -> bool:
     return any(addr in net for net in _PRIVATE_NETWORKS)
 
 
-def check_url_safety(url: str) -> Tuple[bool, Optional[str]]:
-    """Validate a webhook URL. Returns (ok, error_message)."""
+def _precheck_url(url: str):
+    """Синтаксическая часть проверки. Returns (parsed, error_message)."""
     if not url:
-        return False, "URL is empty"
+        return None, "URL is empty"
     try:
         parsed = urlparse(url)
     except Exception as e:
-        return False, f"Malformed URL: {e}"
+        return None, f"Malformed URL: {e}"
     if parsed.scheme not in ("http", "https"):
-        return False, "URL must use http or https"
+        return None, "URL must use http or https"
     if not parsed.hostname:
-        return False, "URL has no host"
-    if WEBHOOK_ALLOW_PRIVATE_URL:
-        return True, None
+        return None, "URL has no host"
+    return parsed, None
 
-    host = parsed.hostname
+
+def _literal_ip(host: str) -> Optional[str]:
     try:
         ipaddress.ip_address(host)
-        hosts_to_check = [host]
+        return host
     except ValueError:
-        try:
-            infos = socket.getaddrinfo(host, None)
-            hosts_to_check = list({info[4][0] for info in infos})
-        except socket.gaierror as e:
-            return False, f"Cannot resolve host: {e}"
+        return None
+
 
+def _unique_addresses(infos) -> List[str]:
+    """IP из ответа getaddrinfo — без дублей, в порядке резолвера."""
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+def _check_addresses(hosts_to_check) -> Optional[str]:
+    """Ошибка, если хоть один адрес приватный/служебный, иначе None."""
     for h in hosts_to_check:
         try:
             addr = ipaddress.ip_address(h)
         except ValueError:
             continue
         if _ip_is_blocked(addr):
-            return False, f"URL resolves to blocked address {addr}"
-    return True, None
+            return f"URL resolves to blocked address {addr}"
+    return None
+
+
+def check_url_safety(url: str) -> Tuple[bool, Optional[str]]:
+    """Validate a webhook URL. Returns (ok, error_message)."""
+    parsed, error = _precheck_url(url)
+    if error:
+        return False, error
+    if WEBHOOK_ALLOW_PRIVATE_URL:
+        return True, None
+
+    host = parsed.hostname
+    literal = _literal_ip(host)
+    if literal:
+        hosts_to_check = [literal]
+    else:
+        try:
+            hosts_to_check = _unique_addresses(socket.getaddrinfo(host, None))
+        except socket.gaierror as e:
+            return False, f"Cannot resolve host: {e}"
+
+    error = _check_addresses(hosts_to_check)
+    return (False, error) if error else (True, None)
+
+
+# host -> (expires_at, проверенные IP). Кэшируются только прошедшие проверку
+# резолвы: отказ пересчитывается на каждой доставке.
+_resolve_cache: Dict[str, Tuple[float, List[str]]] = {}
+
+
+async def resolve_webhook_url(url: str) -> Tuple[bool, Optional[str], List[str]]:
+    """check_url_safety для доставки: (ok, error_message, проверенные IP).
+
+    Резолв асинхронный (не блокирует event loop) и кэшируется на
+    WEBHOOK_DNS_CACHE_TTL_SEC. deliver_once соединяется именно с этими IP,
+    поэтому DNS-rebind между проверкой и отправкой невозможен. Пустой список
+    IP при ok=True — проверка отключена (WEBHOOK_ALLOW_PRIVATE_URL).
+    """
+    parsed, error = _precheck_url(url)
+    if error:
+        return False, error, []
+    if WEBHOOK_ALLOW_PRIVATE_URL:
+        return True, None, []
+
+    host = parsed.hostname
+    literal = _literal_ip(host)
+    if literal:
+        error = _check_addresses([literal])
+        return (False, error, []) if error else (True, None, [literal])
+
+    now = time.monotonic()
+    cached = _resolve_cache.get(host)
+    if cached and cached[0] > now:
+        return True, None, cached[1]
+
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, None, type=socket.SOCK_STREAM,
+        )
+    except socket.gaierror as e:
+        return False, f"Cannot resolve host: {e}", []
+    addresses = _unique_addresses(infos)
+    if not addresses:
+        return False, "Cannot resolve host: no addresses", []
+    error = _check_addresses(addresses)
+    if error:
+        _resolve_cache.pop(host, None)
+        return False, error, []
+    _resolve_cache[host] = (now + WEBHOOK_DNS_CACHE_TTL_SEC, addresses)
+    return True, None, addresses
 
 
 # ── HMAC ─────────────────────────────────────────────────────────
@@ -128,6 +215,12 @@ def sign_payload(secret: str, body: str, version: str = "v1") -> Tuple[dict, int
 
 # ── Delivery + retry queue ───────────────────────────────────────
 
+# Попытки доставки пишутся пачками: буфер сбрасывает _flush_delivery_logs
+# (multi-row INSERT + одна подрезка истории на пачку).
+_delivery_log: List[tuple] = []
+_succeeded: set = set()
+
+
 async def _log_delivery(
     webhook_id: int,
     event: str,
@@ -136,28 +229,67 @@ async def _log_delivery(
     error: Optional[str],
     duration_ms: int,
 ) -> None:
-    """Persist a delivery attempt. Best-effort — never raises."""
+    """Buffer a delivery attempt for the next batch write. Never raises."""
+    if len(_delivery_log) >= WEBHOOK_LOG_BUFFER_MAX:
+        del _delivery_log[0]  # БД недоступна дольше буфера — теряем самые старые
+    _delivery_log.append((
+        webhook_id, event, status_code,
+        (response_body[:5000] if response_body else None),
+        (error[:500] if error else None),
+        duration_ms, datetime.now(timezone.utc),
+    ))
+
+
+async def _flush_delivery_logs() -> int:
+    """Записать накопленные попытки и отметки успеха. Returns rows written."""
+    global _delivery_log, _succeeded
+    if not _delivery_log and not _succeeded:
+        return 0
+    from shared.database import db_service
+    if not db_service.is_connected:
+        return 0
+    # Буферы подменяются до первого await: попытки, пришедшие во время записи,
+    # (и подрезка буфера по размеру) касаются уже нового списка.
+    batch, _delivery_log = _delivery_log, []
+    succeeded, _succeeded = _succeeded, set()
     try:
-        from shared.database import db_service
-        if not db_service.is_connected:
-            return
         async with db_service.acquire() as conn:
-            await conn.execute(
-                insert_sql(WEBHOOK_DELIVERIES_TABLE,
-                    ["webhook_id", "event", "status_code", "response_body", "error", "duration_ms"]),
-                webhook_id, event, status_code,
-                (response_body[:5000] if response_body else None),
-                (error[:500] if error else None),
-                duration_ms,
-            )
-            await conn.execute(
-                f"DELETE FROM {WEBHOOK_DELIVERIES_TABLE} WHERE webhook_id = $1 "
-                f"AND id NOT IN (SELECT id FROM {WEBHOOK_DELIVERIES_TABLE} "
-                f"WHERE webhook_id = $1 ORDER BY sent_at DESC LIMIT 200)",
-                webhook_id,
-            )
+            async with conn.transaction():
+                if batch:
+                    ids, events, codes, bodies, errors, durations, sent = zip(*batch)
+                    await conn.execute(
+                        f"INSERT INTO {WEBHOOK_DELIVERIES_TABLE} "
+                        f"(webhook_id, event, status_code, response_body, error, duration_ms, sent_at) "
+                        f"SELECT * FROM UNNEST($1::int[], $2::text[], $3::int[], $4::text[], "
+                        f"$5::text[], $6::int[], $7::timestamptz[])",
+                        list(ids), list(events), list(codes), list(bodies),
+                        list(errors), list(durations), list(sent),
+                    )
+                    await conn.execute(
+                        f"DELETE FROM {WEBHOOK_DELIVERIES_TABLE} WHERE id IN ("
+                        f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                        f"(PARTITION BY webhook_id ORDER BY sent_at DESC, id DESC) AS rn "
+                        f"FROM {WEBHOOK_DELIVERIES_TABLE} WHERE webhook_id = ANY($1::int[])) t "
+                        f"WHERE rn > $2)",
+                        sorted(set(ids)), WEBHOOK_DELIVERIES_KEEP,
+                    )
+                if succeeded:
+                    await conn.execute(
+                        update_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
+                            "last_triggered_at = NOW(), consecutive_failures = 0",
+                            "id = ANY($1::int[])"),
+                        sorted(succeeded),
+                    )
     except Exception as e:
-        logger.warning("Failed to log webhook delivery %d: %s", webhook_id, e)
+        logger.warning("Failed to flush %d webhook delivery logs: %s", len(batch), e)
+        # Вернуть несохранённое в начало буфера, не превышая лимит
+        _delivery_log[:0] = batch
+        overflow = len(_delivery_log) - WEBHOOK_LOG_BUFFER_MAX
+        if overflow > 0:
+            del _delivery_log[:overflow]
+        _succeeded |= succeeded
+        return 0
+    return len(batch)
 
 
 async def _bump_failure(webhook_id: int) -> bool:
@@ -168,10 +300,16 @@ async def _bump_failure(webhook_id: int) -> bool:
     from shared.database import db_service
     if not db_service.is_connected:
         return False
+    if webhook_id in _succeeded:
+        # Успех ещё не записан — серия неудач начинается заново с этой
+        _succeeded.discard(webhook_id)
+        streak = "consecutive_failures = 1, last_triggered_at = NOW()"
+    else:
+        streak = "consecutive_failures = consecutive_failures + 1"
     async with db_service.acquire() as conn:
         row = await conn.fetchrow(
             update_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
-                "failure_count = failure_count + 1, consecutive_failures = consecutive_failures + 1",
+                f"failure_count = failure_count + 1, {streak}",
                 "id = $1", returning="consecutive_failures, is_active"),
             webhook_id,
         )
@@ -186,21 +324,14 @@ async def _bump_failure(webhook_id: int) -> bool:
                 f"Auto-disabled after {WEBHOOK_AUTO_DISABLE_AFTER} consecutive failures",
             )
             logger.warning("Webhook %d auto-disabled after repeated failures", webhook_id)
+            invalidate_subscriptions()
             return True
     return False
 
 
 async def _mark_success(webhook_id: int) -> None:
-    from shared.database import db_service
-    if not db_service.is_connected:
-        return
-    async with db_service.acquire() as conn:
-        await conn.execute(
-            update_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
-                "last_triggered_at = NOW(), consecutive_failures = 0",
-                "id = $1"),
-            webhook_id,
-        )
+    """Отметка успеха уходит в БД со следующей пачкой логов."""
+    _succeeded.add(webhook_id)
 
 
 async def _enqueue_retry(
@@ -223,14 +354,52 @@ async def _enqueue_retry(
         )
 
 
+# Пулы соединений по origin получателя: keep-alive вместо TCP+TLS на каждую
+# доставку. LRU — вытесненный клиент закрывается.
+_clients: "OrderedDict[Tuple[str, str, Optional[int]], httpx.AsyncClient]" = OrderedDict()
+
+
+def _client_for(parsed) -> httpx.AsyncClient:
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    client = _clients.get(key)
+    if client is not None:
+        _clients.move_to_end(key)
+        return client
+    # Клиент общий для всех подписок на этот origin — куки одного получателя
+    # не должны уходить с доставками другого, поэтому не храним их вовсе.
+    client = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT_SEC,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+    )
+    _clients[key] = client
+    while len(_clients) > WEBHOOK_MAX_CLIENTS:
+        _, evicted = _clients.popitem(last=False)
+        asyncio.get_running_loop().create_task(evicted.aclose())
+    return client
+
+
+async def close_delivery_clients() -> None:
+    """Закрыть пулы соединений (shutdown)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug("Non-critical: %s", e)
+
+
 async def deliver_once(
     webhook_id: int, url: str, secret: Optional[str], signature_version: str,
     event: str, payload: dict,
 ) -> Tuple[bool, int, Optional[str], Optional[str], int]:
     """Execute one HTTP attempt. Returns (success, status_code, response_body, error, duration_ms)."""
-    # SSRF-ревалидация прямо перед доставкой: ловит DNS-rebind, когда URL был
-    # безопасен при создании, а к моменту отправки резолвится в приватный адрес.
-    ok, reason = check_url_safety(url)
+    # SSRF-проверка перед доставкой: URL мог быть безопасен при создании, а
+    # теперь резолвиться в приватный адрес. Соединение идёт на проверенный IP
+    # (Host и SNI — исходного хоста), так что повторный резолв httpx не
+    # подменит адрес между проверкой и отправкой.
+    ok, reason, addresses = await resolve_webhook_url(url)
     if not ok:
         logger.warning("Webhook %s blocked by SSRF re-check: %s", webhook_id, reason)
         return (False, 0, None, f"blocked: {reason}", 0)
@@ -241,10 +410,34 @@ async def deliver_once(
         sig_headers, _ = sign_payload(secret, body, signature_version or "v1")
         headers.update(sig_headers)
 
+    parsed = urlparse(url)
+    client = _client_for(parsed)
+    # Пустой список — проверка отключена, httpx резолвит сам. Иначе пробуем
+    # проверенные адреса по очереди: у dual-stack получателя первый (часто
+    # IPv6) может быть недоступен.
+    pinned = [a for a in addresses if a != parsed.hostname] or [None]
     start = time.perf_counter()
-    try:
-        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SEC) as hc:
-            resp = await hc.post(url, content=body, headers=headers)
+    for address in pinned:
+        target = httpx.URL(url)
+        request_headers = dict(headers)
+        extensions = {}
+        if address is not None:
+            request_headers["Host"] = parsed.netloc.rsplit("@", 1)[-1]
+            target = target.copy_with(host=address)
+            if parsed.scheme == "https":
+                extensions["sni_hostname"] = parsed.hostname
+        try:
+            resp = await client.post(
+                target, content=body, headers=request_headers, extensions=extensions,
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            error = e
+            continue
+        except Exception as e:
+            elapsed = int((time.perf_counter() - start) * 1000)
+            return (False, 0, None, str(e)[:500], elapsed)
+        if address is not None and address != pinned[0]:
+            _prefer_address(parsed.hostname, address)
         elapsed = int((time.perf_counter() - start) * 1000)
         return (
             resp.is_success,
@@ -253,9 +446,18 @@ async def deliver_once(
             None,
             elapsed,
         )
-    except Exception as e:
-        elapsed = int((time.perf_counter() - start) * 1000)
-        return (False, 0, None, str(e)[:500], elapsed)
+    # Ни один адрес не ответил — адреса могли смениться, следующая попытка резолвит заново
+    _resolve_cache.pop(parsed.hostname, None)
+    elapsed = int((time.perf_counter() - start) * 1000)
+    return (False, 0, None, str(error)[:500], elapsed)
+
+
+def _prefer_address(host: str, address: str) -> None:
+    """Поставить ответивший адрес первым в кэше резолва — следующие доставки
+    не ждут таймаута на недоступном."""
+    cached = _resolve_cache.get(host)
+    if cached and address in cached[1]:
+        _resolve_cache[host] = (cached[0], [address] + [a for a in cached[1] if a != address])
 
 
 # Держим ссылки на fire-and-forget таски, иначе GC может убить их на лету
@@ -279,6 +481,48 @@ def fire_event(event: str, payload: dict) -> None:
         logger.warning("fire_event(%s) skipped: no running event loop", event)
 
 
+# event -> активные подписки (id, url, secret, signature_version). Строится
+# одним SELECT, сбрасывается при изменении подписок (invalidate_subscriptions)
+# и по TTL — изменения с других реплик.
+_subscriptions_by_event: Optional[Dict[str, List[tuple]]] = None
+_subscriptions_loaded_at = 0.0
+_subscriptions_lock = asyncio.Lock()
+
+
+def invalidate_subscriptions() -> None:
+    """Сбросить индекс подписок — следующий dispatch перечитает их."""
+    global _subscriptions_by_event
+    _subscriptions_by_event = None
+
+
+async def _get_subscriptions(event: str) -> List[tuple]:
+    global _subscriptions_by_event, _subscriptions_loaded_at
+    if (_subscriptions_by_event is None
+            or time.monotonic() - _subscriptions_loaded_at > WEBHOOK_SUBSCRIPTIONS_TTL_SEC):
+        async with _subscriptions_lock:
+            if (_subscriptions_by_event is None
+                    or time.monotonic() - _subscriptions_loaded_at > WEBHOOK_SUBSCRIPTIONS_TTL_SEC):
+                from shared.database import db_service
+                async with db_service.acquire() as conn:
+                    rows = await conn.fetch(
+                        select_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
+                            "id, url, secret, signature_version, events",
+                            "WHERE is_active = true"),
+                    )
+                index: Dict[str, List[tuple]] = {}
+                for r in rows:
+                    sub = (r["id"], r["url"], r["secret"], r["signature_version"] or "v1")
+                    for ev in set(r["events"] or ()):
+                        index.setdefault(ev, []).append(sub)
+                _subscriptions_by_event = index
+                _subscriptions_loaded_at = time.monotonic()
+                # Семафоры удалённых и выключенных подписок больше не нужны
+                active = {r["id"] for r in rows}
+                for webhook_id in [k for k in _endpoint_slots if k not in active]:
+                    del _endpoint_slots[webhook_id]
+    return _subscriptions_by_event.get(event, [])
+
+
 async def dispatch_event(event: str, payload: dict) -> None:
     """Fan out an event to all active subscriptions. First attempt synchronous;
     failures enqueue to webhook_retry_queue.
@@ -287,35 +531,41 @@ async def dispatch_event(event: str, payload: dict) -> None:
         from shared.database import db_service
         if not db_service.is_connected:
             return
-        async with db_service.acquire() as conn:
-            rows = await conn.fetch(
-                select_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
-                    "id, url, secret, signature_version",
-                    "WHERE is_active = true AND $1 = ANY(events)"),
-                event,
-            )
-        if not rows:
+        subs = await _get_subscriptions(event)
+        if not subs:
             return
 
         tasks = [
             _attempt_and_handle(
-                r["id"], r["url"], r["secret"],
-                r["signature_version"] or "v1", event, payload, attempt=1,
+                webhook_id, url, secret, signature_version, event, payload, attempt=1,
             )
-            for r in rows
+            for webhook_id, url, secret, signature_version in subs
         ]
         await asyncio.gather(*tasks, return_exceptions=True)
     except Exception as e:
         logger.error("dispatch_event failed: %s", e)
 
 
+# Не больше WEBHOOK_ENDPOINT_CONCURRENCY одновременных доставок на подписку:
+# медленный получатель копит очередь у себя, не занимая пул остальных.
+_endpoint_slots: Dict[int, asyncio.Semaphore] = {}
+
+
+def _endpoint_slot(webhook_id: int) -> asyncio.Semaphore:
+    slot = _endpoint_slots.get(webhook_id)
+    if slot is None:
+        slot = _endpoint_slots[webhook_id] = asyncio.Semaphore(WEBHOOK_ENDPOINT_CONCURRENCY)
+    return slot
+
+
 async def _attempt_and_handle(
     webhook_id: int, url: str, secret: Optional[str], signature_version: str,
     event: str, payload: dict, attempt: int,
 ) -> None:
-    ok, status_code, response_body, error, elapsed = await deliver_once(
-        webhook_id, url, secret, signature_version, event, payload,
-    )
+    async with _endpoint_slot(webhook_id):
+        ok, status_code, response_body, error, elapsed = await deliver_once(
+            webhook_id, url, secret, signature_version, event, payload,
+        )
     await _log_delivery(webhook_id, event, status_code, response_body, error, elapsed)
     if ok:
         await _mark_success(webhook_id)
@@ -350,32 +600,33 @@ async def _process_retry_batch() -> int:
                 SELECT id FROM {WEBHOOK_RETRY_QUEUE_TABLE}
                 WHERE next_try_at <= NOW()
                 ORDER BY next_try_at ASC
-                LIMIT 20
+                LIMIT 200
                 FOR UPDATE SKIP LOCKED
             )
             RETURNING id, webhook_id, event, payload, attempt, max_attempts
             """
         )
-    if not rows:
-        return 0
-
-    async def _one(row):
-        webhook_id = row["webhook_id"]
-        async with db_service.acquire() as conn:
-            wh = await conn.fetchrow(
+        if not rows:
+            return 0
+        subs = {
+            r["id"]: r for r in await conn.fetch(
                 select_sql(WEBHOOK_SUBSCRIPTIONS_TABLE,
-                    "url, secret, signature_version, is_active",
-                    "WHERE id = $1"),
-                webhook_id,
+                    "id, url, secret, signature_version",
+                    "WHERE id = ANY($1::int[]) AND is_active = true"),
+                list({r["webhook_id"] for r in rows}),
             )
-        if not wh or not wh["is_active"]:
+        }
+
+    async def _one(row):
+        wh = subs.get(row["webhook_id"])
+        if not wh:
             return
         try:
             payload = json.loads(row["payload"]) if isinstance(row["payload"], str) else row["payload"]
         except Exception:
             payload = {}
         await _attempt_and_handle(
-            webhook_id, wh["url"], wh["secret"],
+            wh["id"], wh["url"], wh["secret"],
             wh["signature_version"] or "v1",
             row["event"], payload, attempt=row["attempt"],
         )
@@ -386,15 +637,20 @@ async def _process_retry_batch() -> int:
 
 async def _worker_loop() -> None:
     logger.debug("Webhook retry worker started (interval=%ss)", WEBHOOK_RETRY_WORKER_INTERVAL)
+    next_retry = 0.0
     while not _worker_stop.is_set():
+        if time.monotonic() >= next_retry:
+            try:
+                await _process_retry_batch()
+            except Exception as e:
+                logger.exception("Retry worker iteration failed: %s", e)
+            next_retry = time.monotonic() + WEBHOOK_RETRY_WORKER_INTERVAL
+        await _flush_delivery_logs()
         try:
-            await _process_retry_batch()
-        except Exception as e:
-            logger.exception("Retry worker iteration failed: %s", e)
-        try:
-            await asyncio.wait_for(_worker_stop.wait(), timeout=WEBHOOK_RETRY_WORKER_INTERVAL)
+            await asyncio.wait_for(_worker_stop.wait(), timeout=WEBHOOK_LOG_FLUSH_SEC)
         except asyncio.TimeoutError:
             pass
+    await _flush_delivery_logs()
     logger.info("Webhook retry worker stopped")
 
 
@@ -413,3 +669,4 @@ async def stop_retry_worker() -> None:
             await asyncio.wait_for(_worker_task, timeout=5)
         except asyncio.TimeoutError:
             _worker_task.cancel()
+    await close_delivery_clients()
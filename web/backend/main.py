@@ -697,10 +697,26 @@ async def lifespan(app: FastAPI):
                             t = await db_service.cleanup_old_torrent_events(t_days)
                             if (v or 0) + (c or 0) + (t or 0) > 0:
                                 logger.info("Retention cleanup: %s violations, %s connections, %s torrent events", v, c, t)
+                            # Посуточные секции вперёд — по той же причине
+                            await db_service.ensure_metrics_partitions()
+                            await db_service.ensure_torrent_partitions()
                         except Exception as exc:
                             logger.warning("Retention cleanup failed: %s", exc)
                 _bg("table_maintenance", _maintenance_loop())
 
+                # Суточный гео-агрегат для карты и гео-балансировки. Чаще, чем
+                # обслуживание таблиц: последние сутки пересчитываются, пока
+                # ip_metadata дозаполняется после ingest.
+                async def _geo_rollup_loop():
+                    await asyncio.sleep(60)
+                    while True:
+                        try:
+                            await db_service.refresh_geo_rollup(days=2)
+                        except Exception as exc:
+                            logger.warning("Geo rollup refresh failed: %s", exc)
+                        await asyncio.sleep(900)
+                _bg("geo_rollup", _geo_rollup_loop())
+
                 # ── Plugins (api and full only) ──
                 if app_mode in ("api", "full"):
                     installed = []
@@ -839,6 +855,11 @@ async def lifespan(app: FastAPI):
         start_usage_buffer()
     except Exception as e:
         logger.warning("API key usage buffer start failed: %s", e)
+    try:
+        from web.backend.core.node_heartbeat import start as start_heartbeat_buffer
+        start_heartbeat_buffer()
+    except Exception as e:
+        logger.warning("Node heartbeat buffer start failed: %s", e)
 
     # Ensure MaxMind GeoLite2 databases are downloaded
     # Supports: license key (official), GitHub mirror (ltsdev/maxmind), or auto
@@ -896,7 +917,7 @@ async def lifespan(app: FastAPI):
     _bg_tasks.clear()
     _bg_names.clear()
 
-    # Stop webhook retry worker + API key usage buffer
+    # Stop webhook retry worker + API key usage / node heartbeat buffers
     try:
         from web.backend.core.webhook_security import stop_retry_worker
         await stop_retry_worker()
@@ -907,6 +928,11 @@ async def lifespan(app: FastAPI):
         await stop_usage_buffer()
     except Exception:
         pass
+    try:
+        from web.backend.core.node_heartbeat import stop as stop_heartbeat_buffer
+        await stop_heartbeat_buffer()
+    except Exception:
+        pass
 
     try:
         from web.backend.core.cache import cache
@@ -13,6 +13,8 @@ class PaginatedResponse(BaseModel, Generic[T]):
     page: int
     per_page: int
     pages: int
+    # Keyset-курсор следующей страницы (где поддерживается); None — страница последняя
+    next_cursor: Optional[str] = None
 
 
 class ErrorResponse(BaseModel):
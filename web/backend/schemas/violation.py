@@ -84,6 +84,7 @@ class ViolationListResponse(BaseModel):
     page: int
     per_page: int
     pages: int
+    next_cursor: Optional[str] = None
 
 
 class ViolationStats(BaseModel):
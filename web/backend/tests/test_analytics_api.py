@@ -63,6 +63,76 @@ class TestOverview:
                             assert resp.status_code == 200
 
 
+class TestOverviewConcurrency:
+    """Источники overview опрашиваются параллельно, сбой одного не роняет остальные."""
+
+    @pytest.mark.asyncio
+    async def test_slow_source_degrades_only_its_tile(self):
+        import asyncio
+        from web.backend.api.v2 import analytics
+        from web.backend.core.cache import cache
+        await cache.delete("analytics:overview")
+
+        async def slow_hosts():
+            await asyncio.sleep(10)
+
+        async def slow_stats():
+            await asyncio.sleep(0.2)
+            return {"total": 3, "active": 2, "disabled": 1, "expired": 0,
+                    "limited": 0, "total_used_traffic_bytes": 0}
+
+        async def slow_nodes():
+            await asyncio.sleep(0.2)
+            return MOCK_NODES
+
+        with patch.object(analytics, "_OVERVIEW_SOURCE_TIMEOUT", 0.5), \
+             patch.object(analytics, "_get_users_overview_stats", slow_stats), \
+             patch.object(analytics, "_get_nodes_data", slow_nodes), \
+             patch.object(analytics, "_get_hosts_data", slow_hosts), \
+             patch.object(analytics, "_get_violation_counts", AsyncMock(side_effect=RuntimeError)), \
+             patch.object(analytics, "fetch_bandwidth_stats", AsyncMock(return_value=None)):
+            started = asyncio.get_running_loop().time()
+            result = await analytics._compute_overview.__wrapped__()
+            elapsed = asyncio.get_running_loop().time() - started
+
+        assert elapsed < 0.9  # параллельно: ~таймаут, а не сумма задержек
+        assert result.total_users == 3
+        assert result.total_nodes == 2
+        assert result.total_hosts == 0
+        assert result.violations_today == 0
+        assert sorted(result.degraded) == ["hosts", "violations"]
+
+    def test_degraded_result_cached_briefly(self):
+        from web.backend.api.v2 import analytics
+        assert analytics._degraded_ttl(analytics.OverviewStats(degraded=["hosts"])) == analytics._DEGRADED_CACHE_TTL
+        assert analytics._degraded_ttl(analytics.OverviewStats()) is None
+
+
+class TestPanelUserStats:
+    """Без БД счётчики берутся из агрегатов панели, а не из выгрузки всех юзеров."""
+
+    @pytest.mark.asyncio
+    @patch("web.backend.api.v2.analytics.fetch_system_stats", new_callable=AsyncMock,
+           return_value={"users": {"totalUsers": 5, "totalTrafficBytes": "4096",
+                                   "statusCounts": {"ACTIVE": 3, "DISABLED": 1, "EXPIRED": 1}}})
+    async def test_overview_stats_fallback(self, mock_stats):
+        from web.backend.api.v2.analytics import _get_users_overview_stats
+        with patch("shared.database.db_service") as mock_db:
+            mock_db.is_connected = False
+            stats = await _get_users_overview_stats()
+        assert stats == {
+            "total": 5, "active": 3, "disabled": 1, "expired": 1,
+            "limited": 0, "total_used_traffic_bytes": 4096,
+        }
+
+    @pytest.mark.asyncio
+    @patch("web.backend.api.v2.analytics.fetch_system_stats", new_callable=AsyncMock, return_value=None)
+    async def test_panel_unavailable(self, mock_stats):
+        from web.backend.api.v2.analytics import _get_panel_user_stats
+        stats = await _get_panel_user_stats()
+        assert stats["total"] == 0 and stats["total_used_traffic_bytes"] == 0
+
+
 class TestAnalyticsRBAC:
     """RBAC tests for analytics endpoints."""
 
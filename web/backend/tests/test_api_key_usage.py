@@ -0,0 +1,91 @@
+"""Tests for web.backend.core.api_key_usage — buffered last_used_at flush."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from web.backend.core import api_key_usage
+
+
+@pytest.fixture(autouse=True)
+def _reset_pending():
+    api_key_usage._pending.clear()
+    api_key_usage._wake.clear()
+    yield
+    api_key_usage._pending.clear()
+    api_key_usage._wake.clear()
+
+
+def _db_mock():
+    db = MagicMock()
+    db.is_connected = True
+    conn = AsyncMock()
+    cm = AsyncMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db.acquire = MagicMock(return_value=cm)
+    db.conn = conn
+    return db
+
+
+class TestFlush:
+    @pytest.mark.asyncio
+    async def test_all_keys_in_one_statement(self):
+        db = _db_mock()
+        for key_id in range(1, 51):
+            await api_key_usage.mark_used(key_id)
+        await api_key_usage.mark_used(7)  # повтор — одна запись на ключ
+
+        with patch("shared.database.db_service", db):
+            await api_key_usage._flush()
+
+        db.conn.execute.assert_awaited_once()
+        sql, ids, used_at = db.conn.execute.await_args.args
+        assert "UNNEST" in sql
+        assert sorted(ids) == list(range(1, 51))
+        assert len(used_at) == 50
+        assert api_key_usage._pending == {}
+
+    @pytest.mark.asyncio
+    async def test_empty_buffer_no_query(self):
+        db = _db_mock()
+        with patch("shared.database.db_service", db):
+            await api_key_usage._flush()
+        db.acquire.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_db_error_is_tolerated(self):
+        db = _db_mock()
+        db.conn.execute.side_effect = RuntimeError("db down")
+        await api_key_usage.mark_used(1)
+        with patch("shared.database.db_service", db):
+            await api_key_usage._flush()
+        assert api_key_usage._pending == {}
+
+
+class TestBuffer:
+    @pytest.mark.asyncio
+    async def test_full_buffer_wakes_flush(self):
+        with patch.object(api_key_usage, "_MAX_PENDING", 3):
+            for key_id in range(3):
+                await api_key_usage.mark_used(key_id)
+            assert not api_key_usage._wake.is_set()
+            await api_key_usage.mark_used(2)  # уже в буфере — не новый ключ
+            assert not api_key_usage._wake.is_set()
+            await api_key_usage.mark_used(99)
+        assert api_key_usage._wake.is_set()
+        assert 99 in api_key_usage._pending
+
+    @pytest.mark.asyncio
+    async def test_stop_flushes_pending(self):
+        db = _db_mock()
+        with patch("shared.database.db_service", db), \
+             patch.object(api_key_usage, "_FLUSH_INTERVAL_SEC", 3600):
+            api_key_usage.start()
+            await asyncio.sleep(0)
+            await api_key_usage.mark_used(5)
+            await api_key_usage.stop()
+
+        db.conn.execute.assert_awaited_once()
+        assert db.conn.execute.await_args.args[1] == [5]
+        assert api_key_usage._flush_task.done()
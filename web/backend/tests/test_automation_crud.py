@@ -25,6 +25,7 @@ from web.backend.core.automation import (
     get_automation_logs,
     get_enabled_rules_by_trigger_type,
     get_enabled_event_rules,
+    invalidate_rule_index,
 )
 
 
@@ -419,15 +420,39 @@ class TestGetEnabledRulesByTriggerType:
 
 class TestGetEnabledEventRules:
 
+    @pytest.fixture(autouse=True)
+    def _fresh_index(self):
+        invalidate_rule_index()
+        yield
+        invalidate_rule_index()
+
     async def test_returns_matching_rules(self):
-        rows = [{"id": 1, "trigger_type": "event"}]
+        rows = [
+            {"id": 1, "trigger_type": "event", "trigger_config": '{"event": "violation.detected"}'},
+            {"id": 2, "trigger_type": "event", "trigger_config": {"event": "node.went_offline"}},
+        ]
         conn = _conn(fetch=AsyncMock(return_value=rows))
         db = _make_db(conn)
 
         with patch("shared.database.db_service", db):
             result = await get_enabled_event_rules("violation.detected")
 
-        assert len(result) == 1
+        assert [r["id"] for r in result] == [1]
+
+    async def test_index_reused_until_invalidated(self):
+        rows = [{"id": 1, "trigger_type": "event", "trigger_config": {"event": "node.went_offline"}}]
+        conn = _conn(fetch=AsyncMock(return_value=rows))
+        db = _make_db(conn)
+
+        with patch("shared.database.db_service", db):
+            for _ in range(5):
+                assert await get_enabled_event_rules("user.updated") == []
+            assert len(await get_enabled_event_rules("node.went_offline")) == 1
+            assert conn.fetch.await_count == 1
+
+            await delete_automation_rule(1)  # правки правил сбрасывают индекс
+            await get_enabled_event_rules("node.went_offline")
+            assert conn.fetch.await_count == 2
 
     async def test_on_error(self):
         db = MagicMock()
@@ -8,6 +8,8 @@ import pytest
 from web.backend.core.automation_engine import (
     _parse_cron_field,
     cron_matches_now,
+    cron_next_fire,
+    parse_cron,
     AutomationEngine,
 )
 
@@ -88,6 +90,40 @@ class TestCronMatchesNow:
         assert not cron_matches_now("0 15 * * *")
 
 
+class TestCronNextFire:
+    """Next fire time computation (strictly after the given moment, UTC)."""
+
+    AFTER = datetime(2026, 2, 11, 10, 30, 20, tzinfo=timezone.utc)
+
+    def test_every_minute(self):
+        assert cron_next_fire("* * * * *", self.AFTER) == datetime(2026, 2, 11, 10, 31, tzinfo=timezone.utc)
+
+    def test_step_minutes(self):
+        assert cron_next_fire("*/15 * * * *", self.AFTER) == datetime(2026, 2, 11, 10, 45, tzinfo=timezone.utc)
+
+    def test_rolls_over_to_next_day(self):
+        assert cron_next_fire("0 3 * * *", self.AFTER) == datetime(2026, 2, 12, 3, 0, tzinfo=timezone.utc)
+
+    def test_weekday(self):
+        # 2026-02-11 — среда; ближайшее воскресенье — 15-е
+        assert cron_next_fire("0 9 * * 0", self.AFTER) == datetime(2026, 2, 15, 9, 0, tzinfo=timezone.utc)
+
+    def test_dom_and_dow(self):
+        # Как и cron_matches_now: день месяца и день недели должны совпасть оба
+        assert cron_next_fire("0 0 20 * 5", self.AFTER) == datetime(2026, 2, 20, 0, 0, tzinfo=timezone.utc)
+
+    def test_leap_day(self):
+        assert cron_next_fire("0 0 29 2 *", self.AFTER) == datetime(2028, 2, 29, 0, 0, tzinfo=timezone.utc)
+
+    def test_never_fires(self):
+        assert cron_next_fire("0 0 31 2 *", self.AFTER) is None
+
+    def test_invalid_expression(self):
+        assert cron_next_fire("bad", self.AFTER) is None
+        with pytest.raises(ValueError):
+            parse_cron("61 * * * *")
+
+
 class TestConditionEvaluation:
     """AutomationEngine._evaluate_conditions."""
 
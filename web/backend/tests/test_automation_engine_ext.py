@@ -420,3 +420,90 @@ class TestDryRun:
         assert result["would_trigger"] is True
         assert len(result["matching_targets"]) == 1
         assert result["matching_targets"][0]["name"] == "alice"
+
+
+# ── Threshold / detection по локальной БД ─────────────────────
+
+
+class TestLocalThresholdEvaluation:
+
+    @staticmethod
+    def _db():
+        db = MagicMock()
+        db.is_connected = True
+        db.get_users_by_traffic_percent = AsyncMock(return_value=[
+            {"uuid": "u1", "username": "alice", "percent": 95.0},
+        ])
+        db.get_users_over_traffic_limit = AsyncMock(return_value=[
+            {"uuid": "u2", "username": "bob", "traffic_limit_bytes": 1000, "used_traffic_bytes": 1500},
+        ])
+        db.get_all_nodes = AsyncMock(return_value=[{"uuid": "n1", "name": "EU", "isConnected": True}])
+        return db
+
+    async def test_threshold_users_selected_in_sql(self):
+        engine = AutomationEngine()
+        engine._execute_action = AsyncMock(return_value=("success", {}))
+        rule = {
+            "id": 5, "name": "Traffic", "action_type": "notify",
+            "trigger_config": {"metric": "user_traffic_percent", "operator": ">=", "value": 90},
+        }
+        db = self._db()
+        fetch_users = AsyncMock()
+        with patch("shared.database.db_service", db), \
+             patch("web.backend.core.automation.get_enabled_rules_by_trigger_type",
+                   new_callable=AsyncMock, return_value=[rule]), \
+             patch("web.backend.core.automation.try_acquire_trigger",
+                   new_callable=AsyncMock, return_value=True), \
+             patch("web.backend.core.automation.write_automation_log", new_callable=AsyncMock), \
+             patch("web.backend.core.api_helper.fetch_users_from_api", fetch_users):
+            await engine._check_threshold_rules()
+
+        db.get_users_by_traffic_percent.assert_awaited_once_with(">=", 90)
+        fetch_users.assert_not_awaited()
+        _, target_type, target_id, ctx = engine._execute_action.await_args.args
+        assert (target_type, target_id, ctx["percent"], ctx["over_percent"]) == ("user", "u1", 95.0, 5.0)
+
+    async def test_traffic_today_enriched_once_per_cycle(self):
+        engine = AutomationEngine()
+        engine._execute_action = AsyncMock(return_value=("success", {}))
+        rules = [
+            {"id": i, "name": f"Traffic {i}", "action_type": "notify",
+             "trigger_config": {"metric": "traffic_today", "operator": ">=", "value": 0}}
+            for i in (6, 7, 8)
+        ]
+
+        async def enrich(nodes):
+            for n in nodes:
+                n["traffic_today_bytes"] = 2 * 1024 ** 3
+
+        enrich_mock = AsyncMock(side_effect=enrich)
+        with patch("shared.database.db_service", self._db()), \
+             patch("web.backend.core.automation.get_enabled_rules_by_trigger_type",
+                   new_callable=AsyncMock, return_value=rules), \
+             patch("web.backend.core.automation.try_acquire_trigger",
+                   new_callable=AsyncMock, return_value=True), \
+             patch("web.backend.core.automation.write_automation_log", new_callable=AsyncMock), \
+             patch("web.backend.core.api_helper.enrich_nodes_traffic_today", enrich_mock):
+            await engine._check_threshold_rules()
+
+        enrich_mock.assert_awaited_once()
+        assert engine._execute_action.await_count == 3
+        assert all(c.args[3]["traffic_today_gb"] == 2.0 for c in engine._execute_action.await_args_list)
+
+    async def test_detection_reads_local_tables(self):
+        engine = AutomationEngine()
+        engine.handle_event = AsyncMock()
+        db = self._db()
+        fetch_users, fetch_nodes = AsyncMock(), AsyncMock()
+        with patch("shared.database.db_service", db), \
+             patch("web.backend.core.automation.get_enabled_event_rules",
+                   new_callable=AsyncMock, return_value=[{"id": 1}]), \
+             patch("web.backend.core.api_helper.fetch_users_from_api", fetch_users), \
+             patch("web.backend.core.api_helper.fetch_nodes_from_api", fetch_nodes):
+            await engine._detect_events()
+
+        fetch_users.assert_not_awaited()
+        fetch_nodes.assert_not_awaited()
+        engine.handle_event.assert_awaited_once()
+        assert engine.handle_event.await_args.args[0] == "user.traffic_exceeded"
+        assert engine._user_traffic_exceeded == {"u2"}
@@ -80,6 +80,52 @@ class TestInMemoryCache:
         assert await mem_cache.get("analytics:overview") is None
         assert await mem_cache.get("users:list") == "v3"
 
+    @pytest.mark.asyncio
+    async def test_flush_prefix_without_namespace(self, mem_cache):
+        await mem_cache.set("analytics:overview", "v1")
+        await mem_cache.set("analytics-old", "v2")
+        await mem_cache.set("users:list", "v3")
+
+        assert await mem_cache.flush_pattern("analytics*") == 2
+        assert await mem_cache.get("users:list") == "v3"
+
+    @pytest.mark.asyncio
+    async def test_lru_keeps_recently_read_keys(self):
+        mem_cache = _InMemoryCache(max_bytes=3 * _InMemoryCache._size("k:0", "x" * 100))
+        for i in range(3):
+            await mem_cache.set(f"k:{i}", "x" * 100)
+        await mem_cache.get("k:0")  # k:0 становится самым свежим
+
+        await mem_cache.set("k:3", "x" * 100)
+
+        assert await mem_cache.get("k:1") is None
+        assert await mem_cache.get("k:0") is not None
+        assert await mem_cache.get("k:3") is not None
+
+    @pytest.mark.asyncio
+    async def test_expired_entries_evicted_before_lru(self):
+        mem_cache = _InMemoryCache(max_bytes=2 * _InMemoryCache._size("k:0", "x" * 100))
+        await mem_cache.set("k:0", "x" * 100, ex=60)
+        await mem_cache.set("k:1", "x" * 100, ex=0)
+        await asyncio.sleep(0.01)
+
+        await mem_cache.set("k:2", "x" * 100, ex=60)
+
+        # k:0 — самый старый по LRU, но вытеснен истёкший k:1
+        assert await mem_cache.get("k:0") is not None
+        assert await mem_cache.get("k:2") is not None
+
+    @pytest.mark.asyncio
+    async def test_byte_budget_tracks_overwrites(self):
+        mem_cache = _InMemoryCache(max_bytes=10_000)
+        for _ in range(100):
+            await mem_cache.set("k:0", "x" * 1000)
+        assert mem_cache._bytes == _InMemoryCache._size("k:0", "x" * 1000)
+
+        await mem_cache.set("huge", "x" * 20_000)  # больше всего бюджета — не кэшируется
+        assert await mem_cache.get("huge") is None
+        assert await mem_cache.get("k:0") is not None
+
     @pytest.mark.asyncio
     async def test_close_clears_store(self, mem_cache):
         await mem_cache.set("key1", "value1")
@@ -164,6 +210,21 @@ class TestCacheService:
         result = await svc._fallback.get("key")
         assert result == "val"
 
+    @pytest.mark.asyncio
+    async def test_redis_lock_is_exclusive_and_owned(self, svc):
+        svc._using_redis = True
+        svc._redis = AsyncMock()
+        svc._redis.set = AsyncMock(side_effect=[True, None])
+
+        token = await svc.acquire_lock("analytics:geo")
+        assert token
+        assert await svc.acquire_lock("analytics:geo") is None
+        assert svc._redis.set.call_args.kwargs == {"nx": True, "ex": 30}
+
+        await svc.release_lock("analytics:geo", token)
+        _, numkeys, key, owner = svc._redis.eval.call_args.args
+        assert (numkeys, key, owner) == (1, "lock:analytics:geo", token)
+
     @pytest.mark.asyncio
     async def test_close(self, svc):
         await svc.connect(None)
@@ -222,3 +283,97 @@ class TestCachedDecorator:
         # Same period again → cache hit
         await my_func(period="day")
         assert call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_compute_once(self):
+        call_count = 0
+
+        @cached("test:single-flight", ttl=60)
+        async def my_func():
+            nonlocal call_count
+            call_count += 1
+            await asyncio.sleep(0.05)
+            return {"n": call_count}
+
+        results = await asyncio.gather(*(my_func() for _ in range(10)))
+        assert call_count == 1
+        assert all(r == {"n": 1} for r in results)
+
+    @pytest.mark.asyncio
+    async def test_stale_value_served_while_refreshing(self):
+        from web.backend.core.cache import cache
+        call_count = 0
+
+        @cached("test:swr", ttl=60)
+        async def my_func():
+            nonlocal call_count
+            call_count += 1
+            return {"n": call_count}
+
+        await cache.delete("test:swr")
+        assert await my_func() == {"n": 1}
+
+        # Свежесть истекла, но значение ещё в кэше
+        envelope = await cache.get_json("test:swr")
+        envelope["__fresh_until"] = time.time() - 1
+        await cache.set_json("test:swr", envelope, ex=60)
+
+        stale = await asyncio.gather(my_func(), my_func(), my_func())
+        assert stale == [{"n": 1}] * 3
+        await asyncio.sleep(0.01)
+        assert call_count == 2  # один фоновый пересчёт на всех
+        assert await my_func() == {"n": 2}
+
+    @pytest.mark.asyncio
+    async def test_waits_for_value_when_lock_is_held_elsewhere(self):
+        from web.backend.core.cache import cache
+        fn = AsyncMock(return_value={"mine": True})
+
+        @cached("test:locked", ttl=60)
+        async def my_func():
+            return await fn()
+
+        await cache.delete("test:locked")
+
+        async def other_replica_writes():
+            await asyncio.sleep(0.05)
+            await cache.set_json(
+                "test:locked", {"__cached_value": {"theirs": True}, "__fresh_until": time.time() + 60},
+            )
+
+        with patch.object(cache, "acquire_lock", AsyncMock(return_value=None)):
+            writer = asyncio.create_task(other_replica_writes())
+            result = await my_func()
+            await writer
+
+        assert result == {"theirs": True}
+        fn.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_legacy_plain_value_is_served(self):
+        from web.backend.core.cache import cache
+
+        @cached("test:legacy", ttl=60)
+        async def my_func():
+            return {"fresh": True}
+
+        await cache.set_json("test:legacy", {"old": True})
+        assert await my_func() == {"old": True}
+
+    @pytest.mark.asyncio
+    async def test_ttl_for_shortens_partial_results(self):
+        from web.backend.core.cache import cache
+
+        @cached("test:ttl-for", ttl=60, ttl_for=lambda r: 2 if r["partial"] else None)
+        async def my_func(partial):
+            return {"partial": partial}
+
+        await cache.delete("test:ttl-for")
+        await my_func(True)
+        fresh_for = (await cache.get_json("test:ttl-for"))["__fresh_until"] - time.time()
+        assert 0 < fresh_for <= 2
+
+        await cache.delete("test:ttl-for")
+        await my_func(False)
+        fresh_for = (await cache.get_json("test:ttl-for"))["__fresh_until"] - time.time()
+        assert fresh_for > 50
@@ -10,6 +10,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
 import web.backend.api.v2.collector as collector
+from web.backend.core import node_heartbeat
 
 NODE_UUID = "aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee"
 USER_UUID = "11111111-2222-3333-4444-555555555555"
@@ -41,12 +42,11 @@ def make_db_mock():
     db = MagicMock()
     db.is_connected = True
     db.get_node_by_uuid = AsyncMock(return_value={"name": "test-node"})
-    db.update_node_metrics = AsyncMock()
-    db.update_node_agent_version = AsyncMock()
-    db.insert_node_metrics_snapshot = AsyncMock()
     db.cleanup_old_metrics_snapshots = AsyncMock(return_value=0)
     db.cleanup_old_connections = AsyncMock(return_value=0)
     db.ensure_connection_partitions = AsyncMock()
+    db.ensure_metrics_partitions = AsyncMock(return_value=0)
+    db.ensure_torrent_partitions = AsyncMock(return_value=0)
     db.cleanup_old_torrent_events = AsyncMock(return_value=0)
     db.get_email_to_uuid_map = AsyncMock(return_value={"alice@example.com": USER_UUID})
     db.get_short_uuid_to_uuid_map = AsyncMock(return_value={})
@@ -55,6 +55,7 @@ def make_db_mock():
     db.get_user_uuid_by_id_from_raw_data = AsyncMock(return_value=None)
     db.batch_upsert_connections = AsyncMock(return_value={"upserted": 1, "closed_stale": 0})
     db.batch_save_torrent_events = AsyncMock(return_value=0)
+    db.refresh_panel_counters = AsyncMock(return_value=True)
 
     conn = AsyncMock()
     conn.fetchrow = AsyncMock(return_value=None)
@@ -72,9 +73,12 @@ def reset_collector_state():
     collector._pending_violation_users.clear()
     collector._violation_check_cooldown.clear()
     collector._node_name_cache.clear()
-    # Гасим часовой таймер чистки нарушений, чтобы не дёргал db в тестах
+    node_heartbeat._pending.clear()
+    # Гасим часовой таймер чистки нарушений и суточный retention, чтобы не дёргали db в тестах
     collector._last_violation_cleanup = datetime.utcnow()
+    collector._last_metrics_cleanup = datetime.utcnow()
     yield
+    node_heartbeat._pending.clear()
     collector._node_last_batch.clear()
     collector._pending_violation_users.clear()
     collector._violation_check_cooldown.clear()
@@ -164,6 +168,22 @@ class TestReceiveBatch:
             )
         assert first.status_code == 200
         assert second.status_code == 429
+        # Отказ несёт подсказки темпа — агент не повторяет вслепую
+        assert second.headers["Retry-After"] == "1"
+        assert second.json()["recommended_interval_seconds"] == collector.MIN_BATCH_INTERVAL
+
+    @pytest.mark.asyncio
+    async def test_flow_hints_neutral_when_queue_is_empty(self, anon_client):
+        db = make_db_mock()
+        with patch.object(collector, "db_service", db), \
+             patch.object(collector, "get_node_by_token", AsyncMock(return_value=NODE_UUID)):
+            resp = await anon_client.post(
+                "/api/v2/collector/batch", json=make_batch(), headers=AGENT_HEADERS,
+            )
+        data = resp.json()
+        assert data["recommended_interval_seconds"] == collector.MIN_BATCH_INTERVAL
+        assert data["max_batch_size"] == collector.MAX_BATCH_CONNECTIONS
+        assert data["min_interval_seconds"] == collector.MIN_BATCH_INTERVAL
 
     @pytest.mark.asyncio
     async def test_connections_processed_and_enqueued(self, anon_client):
@@ -203,7 +223,7 @@ class TestReceiveBatch:
 
     @pytest.mark.asyncio
     async def test_network_metrics_reach_db(self, anon_client):
-        """Сетевые метрики агента 1.3.0+ доезжают и до ноды, и до истории."""
+        """Сетевые метрики агента 1.3.0+ попадают в буфер heartbeat'ов вместе с системными."""
         db = make_db_mock()
         batch = make_batch()
         batch["system_metrics"] = {"cpu_percent": 5.0}
@@ -216,11 +236,11 @@ class TestReceiveBatch:
             )
 
         assert resp.status_code == 200
-        network = db.update_node_metrics.await_args.kwargs["network"]
+        network = node_heartbeat._pending[NODE_UUID]["network"]
         assert network["rx_bps"] == 1_250_000
         assert network["rx_pps"] == 90_000
         assert network["conntrack_count"] == 42
-        assert db.insert_node_metrics_snapshot.await_args.kwargs["network"] == network
+        assert node_heartbeat._pending[NODE_UUID]["metrics"]["cpu_usage"] == 5.0
 
     @pytest.mark.asyncio
     async def test_agent_without_network_metrics_leaves_columns_alone(self, anon_client):
@@ -236,8 +256,7 @@ class TestReceiveBatch:
             )
 
         assert resp.status_code == 200
-        assert db.update_node_metrics.await_args.kwargs["network"] is None
-        assert db.insert_node_metrics_snapshot.await_args.kwargs["network"] is None
+        assert node_heartbeat._pending[NODE_UUID]["network"] is None
 
     @pytest.mark.asyncio
     async def test_oversized_batch_rejected(self, anon_client):
@@ -249,6 +268,22 @@ class TestReceiveBatch:
         assert resp.status_code == 422  # max_length=5000
 
 
+class TestFlowControlHints:
+    """Подсказки темпа растут вместе с очередью бэкенда."""
+
+    def test_backlog_slows_agents_down(self):
+        collector._pending_violation_users.update(str(i) for i in range(collector._FLOW_BACKLOG_SOFT * 4))
+        hints = collector._flow_control_hints()
+        assert hints["recommended_interval_seconds"] == collector._FLOW_BASE_INTERVAL * 4
+        assert hints["max_batch_size"] == collector.MAX_BATCH_CONNECTIONS // 4
+
+    def test_hints_are_clamped(self):
+        collector._pending_violation_users.update(str(i) for i in range(collector._FLOW_BACKLOG_SOFT * 100))
+        hints = collector._flow_control_hints()
+        assert hints["recommended_interval_seconds"] == collector._FLOW_MAX_INTERVAL
+        assert hints["max_batch_size"] == collector._FLOW_MIN_BATCH_SIZE
+
+
 # ── Кулдаун batch-пайплайна нарушений ─────────────────────────
 
 
@@ -442,7 +477,7 @@ class TestSharedHwidUserUuids:
 
 
 class TestAgentVersion:
-    """Версия агента из батча пишется в ноду (и не пишется, если не прислана)."""
+    """Версия агента из батча уходит в буфер heartbeat'ов (и не уходит, если не прислана)."""
 
     @pytest.mark.asyncio
     async def test_agent_version_saved(self, anon_client):
@@ -454,7 +489,7 @@ class TestAgentVersion:
                 "/api/v2/collector/batch", json=batch, headers=AGENT_HEADERS,
             )
         assert resp.status_code == 200
-        db.update_node_agent_version.assert_awaited_once_with(NODE_UUID, "1.1.0")
+        assert node_heartbeat._pending[NODE_UUID]["agent_version"] == "1.1.0"
 
     @pytest.mark.asyncio
     async def test_no_version_no_update(self, anon_client):
@@ -464,19 +499,22 @@ class TestAgentVersion:
                 "/api/v2/collector/batch", json=make_batch(), headers=AGENT_HEADERS,
             )
         assert resp.status_code == 200
-        db.update_node_agent_version.assert_not_awaited()
+        assert NODE_UUID not in node_heartbeat._pending
 
     @pytest.mark.asyncio
-    async def test_db_error_does_not_break_batch(self, anon_client):
+    async def test_batch_does_not_write_heartbeat_inline(self, anon_client):
+        """Версия и метрики пишутся фоном — в самом /batch к ним БД не трогается."""
         db = make_db_mock()
-        db.update_node_agent_version = AsyncMock(side_effect=RuntimeError("db down"))
+        db.save_node_heartbeats = AsyncMock(side_effect=RuntimeError("db down"))
         batch = make_batch()
         batch["agent_version"] = "1.1.0"
+        batch["system_metrics"] = {"cpu_percent": 5.0}
         with patch.object(collector, "db_service", db),              patch.object(collector, "get_node_by_token", AsyncMock(return_value=NODE_UUID)):
             resp = await anon_client.post(
                 "/api/v2/collector/batch", json=batch, headers=AGENT_HEADERS,
             )
-        assert resp.status_code == 200  # батч не падает из-за версии
+        assert resp.status_code == 200
+        db.save_node_heartbeats.assert_not_awaited()
 
 
 class TestConsoleNoiseFilter:
@@ -0,0 +1,199 @@
+"""Tests for the collector write path in shared/db/connections.py.
+
+Батч пишется либо UNNEST'ом по массивам-параметрам, либо COPY (для
+соединений — во временную таблицу со слиянием оттуда). Проверяем выбор пути
+по порогу и то, что оба пути получают одни и те же строки.
+"""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import shared.db.connections as connections_mod
+from shared.db import DatabaseService
+
+
+def _make_conn():
+    conn = MagicMock()
+    conn.execute = AsyncMock(return_value="UPDATE 0")
+    conn.fetchval = AsyncMock(return_value="character varying")
+    conn.copy_records_to_table = AsyncMock(return_value="COPY 2")
+    tx = AsyncMock()
+    tx.__aenter__ = AsyncMock()
+    tx.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=tx)
+    return conn
+
+
+def _make_db(conn):
+    db = DatabaseService()
+    db._pool = MagicMock(_closed=False)
+    cm = AsyncMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db.acquire = MagicMock(return_value=cm)
+    return db
+
+
+CONNECTIONS = [
+    {"user_uuid": "u1", "ip_address": "10.0.0.1/32", "node_uuid": "n1", "device_info": {"a": 1}},
+    {"user_uuid": "u1", "ip_address": "10.0.0.2", "node_uuid": None, "device_info": None},
+]
+
+EVENTS = [
+    {"user_uuid": "u1", "node_uuid": "n1", "ip_address": "10.0.0.1", "destination": "d1"},
+    {"user_uuid": "u2", "node_uuid": "n1", "ip_address": "10.0.0.2", "destination": "d2",
+     "detected_by": "ndpi"},
+]
+
+
+class TestBatchUpsertConnections:
+    @pytest.mark.asyncio
+    async def test_small_batch_uses_unnest(self):
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        await db.batch_upsert_connections(CONNECTIONS)
+
+        conn.copy_records_to_table.assert_not_awaited()
+        update_sql, user_uuids, ips, *_ = conn.execute.await_args_list[0].args
+        assert "UNNEST" in update_sql
+        assert user_uuids == ["u1", "u1"]
+        assert ips == ["10.0.0.1", "10.0.0.2"]
+
+    @pytest.mark.asyncio
+    async def test_batch_marks_user_activity_periods(self):
+        """Активность по неделям/месяцам пишется из тех же строк батча (для когорт)."""
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        await db.batch_upsert_connections(CONNECTIONS)
+
+        activity = [c for c in conn.execute.await_args_list if "user_activity_periods" in c.args[0]]
+        assert len(activity) == 1
+        sql, user_uuids, *_ = activity[0].args
+        assert "ON CONFLICT DO NOTHING" in sql
+        assert "('week'), ('month')" in sql
+        assert user_uuids == ["u1", "u1"]
+
+    @pytest.mark.asyncio
+    async def test_large_batch_stages_via_copy(self):
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        with patch.object(connections_mod, "COPY_INGEST_THRESHOLD", 2):
+            await db.batch_upsert_connections(CONNECTIONS)
+
+        conn.copy_records_to_table.assert_awaited_once()
+        table = conn.copy_records_to_table.await_args.args[0]
+        records = conn.copy_records_to_table.await_args.kwargs["records"]
+        assert table == "_ingest_connections"
+        assert [r[:4] for r in records] == [
+            ("u1", "10.0.0.1", "n1", '{"a": 1}'),
+            ("u1", "10.0.0.2", None, None),
+        ]
+        statements = [c.args[0] for c in conn.execute.await_args_list]
+        assert "CREATE TEMP TABLE" in statements[0]
+        assert all("UNNEST" not in sql for sql in statements[1:])
+        assert all("_ingest_connections" in sql for sql in statements[1:])
+        # Порог устаревания — единственный параметр, и нумерация с $1
+        assert conn.execute.await_args_list[-1].args[1:] == (2,)
+        assert "$1" in statements[-1]
+
+
+class TestBatchSaveTorrentEvents:
+    @pytest.mark.asyncio
+    async def test_small_batch_uses_unnest(self):
+        conn = _make_conn()
+        conn.execute = AsyncMock(return_value="INSERT 0 2")
+        db = _make_db(conn)
+
+        assert await db.batch_save_torrent_events(EVENTS) == 2
+        conn.copy_records_to_table.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_large_batch_copies_into_table(self):
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        with patch.object(connections_mod, "COPY_INGEST_THRESHOLD", 2):
+            assert await db.batch_save_torrent_events(EVENTS) == 2
+
+        conn.execute.assert_not_awaited()
+        args = conn.copy_records_to_table.await_args
+        assert args.args[0] == "torrent_events"
+        records = list(args.kwargs["records"])
+        # Пустой detected_at подменяется текущим временем, detected_by — умолчанием
+        assert all(r[6] is not None for r in records)
+        assert [r[7] for r in records] == ["xray_routing", "ndpi"]
+
+
+class TestRefreshGeoRollup:
+    @pytest.mark.asyncio
+    async def test_recomputes_recent_days_with_plain_ip_join(self):
+        conn = _make_conn()
+        conn.fetchval = AsyncMock(side_effect=[True, "character varying", "2026-10-17"])
+        conn.execute = AsyncMock(side_effect=["DELETE 3", "INSERT 0 5"])
+        db = _make_db(conn)
+
+        assert await db.refresh_geo_rollup(days=2) == 5
+
+        delete, insert = conn.execute.await_args_list
+        assert delete.args == ("DELETE FROM geo_daily_rollup WHERE day >= $1", "2026-10-17")
+        assert "im.ip_address = uc.ip_address" in insert.args[0]
+        assert "SPLIT_PART" not in insert.args[0]
+        conn.transaction.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_inet_column_joined_by_host(self):
+        """На INET-колонке (установки без alembic) IP сравнивается без маски /32."""
+        conn = _make_conn()
+        conn.fetchval = AsyncMock(side_effect=[True, "inet", "2026-10-17"])
+        conn.execute = AsyncMock(side_effect=["DELETE 0", "INSERT 0 2"])
+        db = _make_db(conn)
+
+        assert await db.refresh_geo_rollup(days=2) == 2
+
+        insert = conn.execute.await_args_list[1].args[0]
+        assert "im.ip_address = host(uc.ip_address)" in insert
+        assert insert.count("host(uc.ip_address)") == 2  # и в самом агрегате — без маски
+
+    @pytest.mark.asyncio
+    async def test_skips_when_another_replica_holds_lock(self):
+        conn = _make_conn()
+        conn.fetchval = AsyncMock(return_value=False)
+        db = _make_db(conn)
+
+        assert await db.refresh_geo_rollup() == 0
+        conn.execute.assert_not_awaited()
+
+
+class TestCleanupOldConnections:
+    @pytest.mark.asyncio
+    async def test_prunes_geo_rollup_with_same_retention(self):
+        conn = _make_conn()
+        conn.fetch = AsyncMock(return_value=[])
+        conn.execute = AsyncMock(side_effect=["DELETE 4", "DELETE 0", "DELETE 0"])
+        db = _make_db(conn)
+
+        await db.cleanup_old_connections(retention_days=14)
+
+        rollup = conn.execute.await_args_list[0].args
+        assert rollup[0].startswith("DELETE FROM geo_daily_rollup WHERE day <")
+        assert rollup[1] == 14
+
+    @pytest.mark.asyncio
+    async def test_prunes_activity_periods_past_analytics_horizon(self):
+        conn = _make_conn()
+        conn.fetch = AsyncMock(return_value=[])
+        conn.execute = AsyncMock(return_value="DELETE 0")
+        db = _make_db(conn)
+
+        await db.cleanup_old_connections(retention_days=14)
+        activity = conn.execute.await_args_list[1].args
+        assert activity[0].startswith("DELETE FROM user_activity_periods WHERE granularity IN")
+        # когорты смотрят на 24 месяца назад — короткий срок подключений их не режет
+        assert activity[1] == connections_mod.ACTIVITY_PERIODS_RETENTION_DAYS
+
+        conn.execute.reset_mock()
+        await db.cleanup_old_connections(retention_days=1000)
+        assert conn.execute.await_args_list[1].args[1] == 1000
@@ -0,0 +1,76 @@
+"""Tests for keyset (cursor) pagination helpers in shared/db_query.py."""
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from shared.db import DatabaseService
+from shared.db_query import cursor_fingerprint, decode_cursor, encode_cursor, keyset_sql
+
+
+class TestCursor:
+    def test_round_trip_keeps_types(self):
+        values = ["created_at", "desc", datetime(2026, 10, 18, 12, 30), Decimal("1.50"), None, 7]
+        assert decode_cursor(encode_cursor(values)) == values
+
+    def test_cursor_is_url_safe(self):
+        cursor = encode_cursor(["username", "asc", "??>>~~" * 10])
+        assert "+" not in cursor and "/" not in cursor and "=" not in cursor
+
+    @pytest.mark.parametrize("cursor", ["%%%", "bm90LWpzb24", "eyJhIjoxfQ", "W3siJHgiOjF9XQ"])
+    def test_malformed_cursor_raises(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+class TestKeysetSql:
+    def test_desc_then_asc(self):
+        sql, params = keyset_sql([("score", True, 5.0), ("id", False, 10)], start=3)
+        assert params == [5.0, 10]
+        assert sql == "(((score < $3 OR score IS NULL)) OR (score = $3 AND id > $4))"
+
+    def test_null_value_on_desc_key(self):
+        # NULLS LAST: после NULL по убыванию идут только другие NULL
+        sql, params = keyset_sql([("expire_at", True, None), ("uuid", True, "u1")])
+        assert params == ["u1"]
+        assert sql == "((expire_at IS NULL AND (uuid < $1 OR uuid IS NULL)))"
+
+    def test_null_value_on_asc_key(self):
+        # NULLS FIRST: после NULL по возрастанию — любые не-NULL
+        sql, params = keyset_sql([("expire_at", False, None), ("uuid", False, "u1")])
+        assert params == ["u1"]
+        assert sql == "((expire_at IS NOT NULL) OR (expire_at IS NULL AND uuid > $1))"
+
+
+class TestUsersPageCursor:
+    @staticmethod
+    def _db(rows):
+        conn = MagicMock()
+        conn.fetch = AsyncMock(return_value=rows)
+        conn.fetchval = AsyncMock(return_value=len(rows))
+        cm = AsyncMock()
+        cm.__aenter__ = AsyncMock(return_value=conn)
+        cm.__aexit__ = AsyncMock(return_value=False)
+        db = DatabaseService()
+        db._pool = MagicMock(_closed=False)
+        db.acquire = MagicMock(return_value=cm)
+        return db, conn
+
+    def test_fingerprint_depends_on_filters(self):
+        assert cursor_fingerprint("a = $1", ["x"]) == cursor_fingerprint("a = $1", ["x"])
+        assert cursor_fingerprint("a = $1", ["x"]) != cursor_fingerprint("a = $1", ["y"])
+
+    @pytest.mark.asyncio
+    async def test_cursor_bound_to_search_and_filters(self):
+        db, conn = self._db([{"_k0": datetime(2026, 10, 18), "_k1": "u1", "_total_count": 1}])
+        with patch("shared.db.users._db_row_to_api_format", dict):
+            _, _, cursor = await db.get_users_page(per_page=1, status="active")
+            assert cursor
+
+            await db.get_users_page(per_page=1, status="active", cursor=cursor)
+            # тот же курсор с другим фильтром или поиском указывал бы в чужой список
+            with pytest.raises(ValueError):
+                await db.get_users_page(per_page=1, status="disabled", cursor=cursor)
+            with pytest.raises(ValueError):
+                await db.get_users_page(per_page=1, status="active", search="bob", cursor=cursor)
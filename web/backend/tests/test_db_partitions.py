@@ -0,0 +1,147 @@
+"""Tests for daily-partition helpers in shared/db/_base.py and retention of partitioned tables.
+
+Секции создаются и дропаются по имени ``{parent}_pYYYYMMDD`` — проверяем, что
+дропаются только дни целиком за окном хранения, а для несекционированной
+таблицы вызывающий получает None и уходит в построчный DELETE.
+"""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from shared.db import DatabaseService
+
+
+class FakeConn:
+    """Minimal asyncpg connection: pg_class/pg_inherits lookups + executed SQL log."""
+
+    def __init__(self, partitioned=True, children=(), existing=()):
+        self.partitioned = partitioned
+        self.children = list(children)
+        self.existing = set(existing)
+        self.executed = []
+
+    async def fetchval(self, sql, *args):
+        if "relkind" in sql:
+            return "p" if self.partitioned else "r"
+        if "FROM pg_class WHERE relname" in sql:
+            return 1 if args[0] in self.existing else None
+        return None
+
+    async def fetch(self, sql, *args):
+        if "pg_inherits" in sql:
+            return [{"relname": name} for name in self.children]
+        return []
+
+    async def execute(self, sql, *args):
+        self.executed.append(" ".join(sql.split()))
+        return "DELETE 0"
+
+
+def _make_db(conn):
+    db = DatabaseService()
+    db._pool = MagicMock(_closed=False)
+    cm = AsyncMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db.acquire = MagicMock(return_value=cm)
+    return db
+
+
+def _day(offset: int) -> str:
+    return f"{datetime.now(timezone.utc).date() + timedelta(days=offset):%Y%m%d}"
+
+
+class TestEnsureDailyPartitions:
+    @pytest.mark.asyncio
+    async def test_creates_only_missing_days(self):
+        conn = FakeConn(existing={f"node_metrics_snapshots_p{_day(0)}"})
+        db = _make_db(conn)
+
+        created = await db._ensure_daily_partitions("node_metrics_snapshots", days_ahead=2)
+
+        assert created == 2
+        assert all("PARTITION OF node_metrics_snapshots" in sql for sql in conn.executed)
+        assert f"node_metrics_snapshots_p{_day(1)}" in conn.executed[0]
+
+    @pytest.mark.asyncio
+    async def test_noop_for_regular_table(self):
+        conn = FakeConn(partitioned=False)
+        db = _make_db(conn)
+
+        assert await db._ensure_daily_partitions("node_metrics_snapshots") == 0
+        assert conn.executed == []
+
+
+class TestDropDailyPartitions:
+    @pytest.mark.asyncio
+    async def test_drops_only_days_outside_window(self):
+        parent = "node_metrics_snapshots"
+        conn = FakeConn(children=[
+            f"{parent}_p{_day(-40)}",
+            f"{parent}_p{_day(-31)}",
+            f"{parent}_p{_day(-30)}",
+            f"{parent}_p{_day(0)}",
+            f"{parent}_default",
+        ])
+        db = _make_db(conn)
+
+        dropped = await db._drop_daily_partitions_before(parent, retention_days=30)
+
+        assert dropped == 2
+        drops = [sql for sql in conn.executed if sql.startswith("DROP TABLE")]
+        assert drops == [
+            f"DROP TABLE {parent}_p{_day(-40)}",
+            f"DROP TABLE {parent}_p{_day(-31)}",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_returns_none_for_regular_table(self):
+        db = _make_db(FakeConn(partitioned=False))
+        assert await db._drop_daily_partitions_before("node_metrics_snapshots", 30) is None
+
+
+class TestMetricsCleanup:
+    @pytest.mark.asyncio
+    async def test_prunes_rollups_and_drops_partitions(self):
+        conn = FakeConn(children=[f"node_metrics_snapshots_p{_day(-45)}"])
+        db = _make_db(conn)
+
+        dropped = await db.cleanup_old_metrics_snapshots(retention_days=30)
+
+        assert dropped == 1
+        pruned = [sql for sql in conn.executed if sql.startswith("DELETE FROM node_metrics_rollup")]
+        assert {sql.split()[2] for sql in pruned} == {"node_metrics_rollup_1m", "node_metrics_rollup_1h"}
+        assert not any(sql.startswith("DELETE FROM node_metrics_snapshots") for sql in conn.executed)
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_row_delete(self):
+        conn = FakeConn(partitioned=False)
+        db = _make_db(conn)
+
+        await db.cleanup_old_metrics_snapshots(retention_days=30)
+
+        assert any(sql.startswith("DELETE FROM node_metrics_snapshots") for sql in conn.executed)
+
+
+class TestTorrentEventsCleanup:
+    @pytest.mark.asyncio
+    async def test_drops_partitions_past_retention(self):
+        conn = FakeConn(children=[
+            f"torrent_events_p{_day(-100)}",
+            f"torrent_events_p{_day(-10)}",
+        ])
+        db = _make_db(conn)
+
+        assert await db.cleanup_old_torrent_events(retention_days=90) == 1
+        assert f"DROP TABLE torrent_events_p{_day(-100)}" in conn.executed
+        assert not any(sql.startswith("DELETE") for sql in conn.executed)
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_row_delete(self):
+        conn = FakeConn(partitioned=False)
+        db = _make_db(conn)
+
+        await db.cleanup_old_torrent_events(retention_days=90)
+
+        assert any(sql.startswith("DELETE FROM torrent_events") for sql in conn.executed)
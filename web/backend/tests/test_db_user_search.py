@@ -0,0 +1,67 @@
+"""Tests for user search SQL in shared/db/users.py.
+
+Поиск — подстрока по user_search_text() (trigram GIN, alembic 0105) плюс
+точные совпадения по uuid / telegram_id / id. Проверяем сборку условия,
+экранирование LIKE и отсечку по точному совпадению в search_users.
+"""
+import re
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from shared.db import DatabaseService
+from shared.db.users import user_search_sql
+
+
+def _placeholders(sql: str) -> set:
+    return {int(n) for n in re.findall(r"\$(\d+)", sql)}
+
+
+class TestUserSearchSql:
+    def test_full_uuid_is_exact_lookup(self):
+        uuid = "AAAAAAAA-0000-0000-0000-000000000001"
+        condition, rank, params = user_search_sql(f"  {uuid} ", start=3)
+        assert condition == "uuid = $3::uuid"
+        assert params == [uuid]
+        assert "LIKE" not in condition
+
+    def test_text_query_uses_search_expression(self):
+        condition, rank, params = user_search_sql("Alice", start=2)
+        assert "user_search_text(username, email, short_uuid, uuid, description) LIKE" in condition
+        assert params == ["alice"]
+        assert "telegram_id" not in condition
+        # rank не вводит новых параметров — условие годится и для COUNT
+        assert _placeholders(rank) <= _placeholders(condition) == {2}
+
+    def test_numeric_query_matches_ids_exactly(self):
+        condition, rank, params = user_search_sql("777", start=1)
+        assert params == ["777", 777]
+        assert "telegram_id = $2 OR id = $2" in condition
+        assert "telegram_id = $2" in rank
+
+    def test_like_wildcards_are_escaped(self):
+        _, _, params = user_search_sql("50%_off\\")
+        assert params == ["50\\%\\_off\\\\"]
+
+
+class TestSearchUsers:
+    @pytest.mark.asyncio
+    async def test_exact_match_short_circuits(self):
+        conn = MagicMock()
+        conn.fetch = AsyncMock(return_value=[
+            {"uuid": "u1", "username": "bob", "_rank": 0},
+            {"uuid": "u2", "username": "bobby", "_rank": 1},
+        ])
+        db = DatabaseService()
+        db._pool = MagicMock(_closed=False)
+        cm = AsyncMock()
+        cm.__aenter__ = AsyncMock(return_value=conn)
+        cm.__aexit__ = AsyncMock(return_value=False)
+        db.acquire = MagicMock(return_value=cm)
+
+        result = await db.search_users("bob", limit=10)
+
+        assert [u["uuid"] for u in result] == ["u1"]
+        sql, *args = conn.fetch.await_args.args
+        assert "ORDER BY _rank" in sql
+        assert args == ["bob", 10, 0]
@@ -0,0 +1,119 @@
+"""Tests for web.backend.core.node_heartbeat — coalescing and flush of node heartbeats."""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from web.backend.core import node_heartbeat
+
+
+@pytest.fixture(autouse=True)
+def _reset_pending():
+    node_heartbeat._pending.clear()
+    yield
+    node_heartbeat._pending.clear()
+
+
+def _db_mock():
+    db = MagicMock()
+    db.is_connected = True
+    db.save_node_heartbeats = AsyncMock(return_value=1)
+    return db
+
+
+class TestRecord:
+    def test_last_value_wins_per_node(self):
+        node_heartbeat.record("n1", agent_version="1.5.0", metrics={"cpu_usage": 10.0})
+        node_heartbeat.record("n1", agent_version="1.6.0", metrics={"cpu_usage": 20.0}, network={"rx_bps": 1})
+
+        assert node_heartbeat.pending_count() == 1
+        beat = node_heartbeat._pending["n1"]
+        assert beat["agent_version"] == "1.6.0"
+        assert beat["metrics"] == {"cpu_usage": 20.0}
+        assert beat["network"] == {"rx_bps": 1}
+
+    def test_version_only_batch_keeps_pending_metrics(self):
+        node_heartbeat.record("n1", metrics={"cpu_usage": 10.0})
+        node_heartbeat.record("n1", agent_version="1.6.0")
+
+        beat = node_heartbeat._pending["n1"]
+        assert beat["metrics"] == {"cpu_usage": 10.0}
+        assert beat["agent_version"] == "1.6.0"
+
+    def test_metrics_without_network_reset_network(self):
+        """Агент перестал видеть сеть хоста — старые сетевые значения не тянем."""
+        node_heartbeat.record("n1", metrics={"cpu_usage": 1.0}, network={"rx_bps": 1})
+        node_heartbeat.record("n1", metrics={"cpu_usage": 2.0})
+
+        assert node_heartbeat._pending["n1"]["network"] is None
+
+
+class TestFlush:
+    @pytest.mark.asyncio
+    async def test_flush_writes_all_nodes_in_one_call(self):
+        db = _db_mock()
+        node_heartbeat.record("n1", metrics={"cpu_usage": 1.0})
+        node_heartbeat.record("n2", agent_version="1.6.0")
+
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+
+        db.save_node_heartbeats.assert_awaited_once()
+        beats = db.save_node_heartbeats.await_args.args[0]
+        assert {b["node_uuid"] for b in beats} == {"n1", "n2"}
+        assert node_heartbeat.pending_count() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_batch(self):
+        db = _db_mock()
+        db.save_node_heartbeats = AsyncMock(side_effect=RuntimeError("db down"))
+        node_heartbeat.record("n1", metrics={"cpu_usage": 1.0})
+
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+
+        assert node_heartbeat._pending["n1"]["metrics"] == {"cpu_usage": 1.0}
+
+        db.save_node_heartbeats = AsyncMock(return_value=1)
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+        assert db.save_node_heartbeats.await_args.args[0][0]["metrics"] == {"cpu_usage": 1.0}
+        assert node_heartbeat.pending_count() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_does_not_override_newer_reports(self):
+        db = _db_mock()
+
+        async def fail_after_new_reports(beats):
+            node_heartbeat.record("n1", metrics={"cpu_usage": 5.0})
+            node_heartbeat.record("n2", agent_version="1.7.0")
+            raise RuntimeError("db down")
+
+        db.save_node_heartbeats = AsyncMock(side_effect=fail_after_new_reports)
+        node_heartbeat.record("n1", agent_version="1.6.0", metrics={"cpu_usage": 1.0})
+        node_heartbeat.record("n2", metrics={"cpu_usage": 2.0})
+
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+
+        n1, n2 = node_heartbeat._pending["n1"], node_heartbeat._pending["n2"]
+        assert (n1["agent_version"], n1["metrics"]) == ("1.6.0", {"cpu_usage": 5.0})
+        assert (n2["agent_version"], n2["metrics"]) == ("1.7.0", {"cpu_usage": 2.0})
+
+    @pytest.mark.asyncio
+    async def test_db_disconnected_keeps_batch(self):
+        db = _db_mock()
+        db.is_connected = False
+        node_heartbeat.record("n1", metrics={"cpu_usage": 1.0})
+
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+
+        db.save_node_heartbeats.assert_not_awaited()
+        assert node_heartbeat.pending_count() == 1
+
+    @pytest.mark.asyncio
+    async def test_nothing_pending_no_db_call(self):
+        db = _db_mock()
+        with patch("shared.database.db_service", db):
+            await node_heartbeat._flush()
+        db.save_node_heartbeats.assert_not_awaited()
@@ -0,0 +1,134 @@
+"""Tests for panel_counters — счётчики Prometheus-гейджей (shared/db/counters.py)."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from shared.db import DatabaseService
+from shared.db.violations import _open_violation_deltas
+
+
+def _make_db(conn):
+    db = DatabaseService()
+    db._pool = MagicMock(_closed=False)
+    cm = AsyncMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db.acquire = MagicMock(return_value=cm)
+    return db
+
+
+def _make_conn():
+    conn = MagicMock()
+    conn.execute = AsyncMock(return_value="INSERT 0 2")
+    conn.fetchrow = AsyncMock(return_value={"active": 7, "online": 3})
+    tx = AsyncMock()
+    tx.__aenter__ = AsyncMock()
+    tx.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=tx)
+    return conn
+
+
+class TestViolationDeltas:
+    def test_groups_by_action(self):
+        deltas = _open_violation_deltas(["hard_block", "HARD_BLOCK", None], -1)
+        assert sorted(deltas) == [
+            ("violations_by_action", "hard_block", -2),
+            ("violations_by_action", "unknown", -1),
+            ("violations_open", "", -3),
+        ]
+
+
+class TestRefreshPanelCounters:
+    @pytest.mark.asyncio
+    async def test_rewrites_group_rows(self):
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        assert await db.refresh_panel_counters(("connections",)) is True
+
+        delete, insert, notify = conn.execute.await_args_list
+        assert delete.args[1] == ["online_users", "active_connections"]
+        _, names, labels, values = insert.args
+        assert dict(zip(names, values)) == {"active_connections": 7.0, "online_users": 3.0}
+        assert notify.args[1:] == ("panel_changes", "connections")
+
+    @pytest.mark.asyncio
+    async def test_min_interval_throttles_hot_path(self):
+        conn = _make_conn()
+        db = _make_db(conn)
+
+        assert await db.refresh_panel_counters(("connections",), min_interval=15) is True
+        assert await db.refresh_panel_counters(("connections",), min_interval=15) is False
+        assert conn.fetchrow.await_count == 1
+
+
+class TestScheduledRefresh:
+    @pytest.mark.asyncio
+    async def test_burst_of_writes_coalesced(self):
+        db = _make_db(_make_conn())
+        db.refresh_panel_counters = AsyncMock(return_value=True)
+
+        db.schedule_panel_counters_refresh(("users",), delay=0.01)
+        db.schedule_panel_counters_refresh(("hwid",), delay=0.01)
+        db.schedule_panel_counters_refresh(("users",), delay=0.01)
+        await db._panel_counters_task
+
+        db.refresh_panel_counters.assert_awaited_once_with(("hwid", "users"))
+
+    @pytest.mark.asyncio
+    async def test_write_during_refresh_not_lost(self):
+        db = _make_db(_make_conn())
+
+        async def slow_refresh(groups):
+            await asyncio.sleep(0.02)
+            return True
+
+        db.refresh_panel_counters = AsyncMock(side_effect=slow_refresh)
+        db.schedule_panel_counters_refresh(("users",), delay=0.01)
+        await asyncio.sleep(0.02)  # первый пересчёт идёт
+        db.schedule_panel_counters_refresh(("hwid",), delay=0.01)
+        await db._panel_counters_task
+
+        assert [c.args[0] for c in db.refresh_panel_counters.await_args_list] == [("users",), ("hwid",)]
+
+    @pytest.mark.asyncio
+    async def test_webhook_user_change_schedules_refresh(self):
+        from shared.sync import SyncService
+
+        db = MagicMock()
+        db.get_user_by_uuid = AsyncMock(return_value=None)
+        db.upsert_user = AsyncMock()
+        db.delete_user = AsyncMock()
+        with patch("shared.sync.db_service", db):
+            await SyncService()._handle_user_webhook_with_diff("user.modified", {"uuid": "u1"})
+            db.schedule_panel_counters_refresh.assert_called_once_with(("users",))
+            await SyncService()._handle_user_webhook_with_diff("user.deleted", {"uuid": "u1"})
+            db.schedule_panel_counters_refresh.assert_called_with(("users", "hwid"))
+
+
+class TestGaugeUpdater:
+    @pytest.mark.asyncio
+    async def test_refresh_reads_counters_only(self):
+        from web.backend.core import metrics
+
+        conn = MagicMock()
+        conn.fetchrow = AsyncMock(return_value={"total": 2, "online": 1})
+        conn.fetch = AsyncMock(return_value=[])
+        db = _make_db(conn)
+        db.get_panel_counters = AsyncMock(return_value=[
+            {"name": "total_users", "label": "", "value": 42.0},
+            {"name": "users_by_status", "label": "active", "value": 40.0},
+            {"name": "users_expiring", "label": "7d", "value": 5.0},
+        ])
+
+        with patch("shared.database.db_service", db):
+            await metrics.GaugeUpdater()._refresh()
+
+        assert metrics.PANEL_TOTAL_USERS._value.get() == 42
+        assert metrics.PANEL_USERS_BY_STATUS.labels(status="active")._value.get() == 40
+        assert metrics.PANEL_USERS_EXPIRING_SOON._value.get() == 5
+        assert metrics.PANEL_ONLINE_NODES._value.get() == 1
+        queried = " ".join(c.args[0] for c in conn.fetch.await_args_list + conn.fetchrow.await_args_list)
+        for table in ("users", "user_connections", "violations", "user_hwid_devices"):
+            assert f"FROM {table} " not in queried + " "
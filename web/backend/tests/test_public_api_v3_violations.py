@@ -142,6 +142,38 @@ class TestListViolationsV3:
         # limit/offset идут последними параметрами
         assert conn.fetch.call_args.args[-2:] == (10, 5)
 
+    @pytest.mark.asyncio
+    @patch("web.backend.core.api_key_auth.validate_api_key", new_callable=AsyncMock, return_value=VALID_KEY)
+    async def test_cursor_pagination(self, _mock_validate, v3_client):
+        db, conn = _mock_db(fetch_result=[MOCK_VIOLATION_ROW])
+        with patch("shared.database.db_service", db):
+            resp = await v3_client.get(
+                "/api/v3/violations", params={"limit": 1}, headers={"X-API-Key": "rwa_test"},
+            )
+            cursor = resp.headers["X-Next-Cursor"]
+            resp = await v3_client.get(
+                "/api/v3/violations",
+                params={"limit": 1, "offset": 40, "cursor": cursor},
+                headers={"X-API-Key": "rwa_test"},
+            )
+            assert resp.status_code == 200
+            sql, *args = conn.fetch.call_args.args
+            assert "detected_at < $1" in sql and "id < $2" in sql
+            assert args == [MOCK_VIOLATION_ROW["detected_at"], 9123, 1, 0]
+
+            resp = await v3_client.get(
+                "/api/v3/violations", params={"cursor": "bogus"}, headers={"X-API-Key": "rwa_test"},
+            )
+            assert resp.status_code == 400
+
+            # курсор с другим фильтром указывал бы в чужой список
+            resp = await v3_client.get(
+                "/api/v3/violations",
+                params={"limit": 1, "cursor": cursor, "min_score": 50},
+                headers={"X-API-Key": "rwa_test"},
+            )
+            assert resp.status_code == 400
+
     @pytest.mark.asyncio
     @patch("web.backend.core.api_key_auth.validate_api_key", new_callable=AsyncMock, return_value=VALID_KEY)
     async def test_db_unavailable_returns_empty(self, _mock_validate, v3_client):
@@ -364,3 +364,101 @@ class TestGetVisibleUserUuids:
         with patch("shared.rbac.db_service", db):
             result = await get_visible_user_uuids(42, "manager")
         assert result == set()
+
+    async def test_squad_scope_resolved_in_db(self):
+        """Сквад-скоуп разрешается одним запросом по индексу, без выгрузки raw_data."""
+        from shared.rbac import get_visible_user_uuids
+
+        db = self._db(creator_rows=[{"uuid": self.OWN}], policy_rows=[])
+        db.get_user_uuids_by_squads = AsyncMock(return_value={self.FOREIGN})
+        with patch("shared.rbac.db_service", db), \
+             patch("shared.rbac.get_scope", self._scope(squad={"SQ-1"})):
+            result = await get_visible_user_uuids(42, "manager")
+        assert result == {self.OWN, self.FOREIGN}
+        db.get_user_uuids_by_squads.assert_awaited_once_with(["SQ-1"], include_external=True)
+
+
+# ── UserScope ────────────────────────────────────────────────────
+
+
+class TestUserScope:
+    """Скоуп видимости как SQL-предикат вместо списка UUID."""
+
+    def test_empty_scope_is_false(self):
+        from shared.rbac import UserScope
+
+        assert UserScope().sql("user_uuid") == ("FALSE", [])
+
+    def test_subquery_form_numbers_params_from_start(self):
+        from shared.rbac import UserScope
+
+        scope = UserScope(creator_id=7, node_uuids=("n1",), squad_uuids=("s1",))
+        sql, params = scope.sql("v.user_uuid", start=3)
+        assert params == [7, ["n1"], ["s1"], ["s1"]]
+        assert "created_by_admin_id = $3" in sql
+        assert "node_uuid = ANY($4::uuid[])" in sql
+        assert "&& $5::text[]" in sql and "ANY($6::uuid[])" in sql
+        assert sql.count("v.user_uuid IN (") == 3
+
+    def test_users_row_form_checks_own_columns(self):
+        from shared.rbac import UserScope
+
+        sql, params = UserScope(creator_id=7, squad_uuids=("s1",)).sql("uuid", users_row=True)
+        assert params == [7, ["s1"], ["s1"]]
+        assert "uuid IN (" not in sql
+        assert sql.startswith("(created_by_admin_id = $1 OR (user_internal_squads")
+
+
+class TestGetUserScope:
+    def _db(self, unrestricted):
+        from contextlib import asynccontextmanager
+
+        conn = AsyncMock()
+        conn.fetchrow = AsyncMock(
+            return_value={"unrestricted_user_access": unrestricted, "role_id": 5}
+        )
+        db = AsyncMock()
+        db.is_connected = True
+
+        @asynccontextmanager
+        async def acquire():
+            yield conn
+
+        db.acquire = acquire
+        return db, conn
+
+    @staticmethod
+    def _scope(node=None, squad=None):
+        async def fake_scope(account_id, role_id, role, resource, action):
+            return node if resource == "node" else squad
+        return fake_scope
+
+    async def test_unrestricted_without_policies_is_none(self):
+        from shared.rbac import get_user_scope
+
+        db, _ = self._db(unrestricted=True)
+        with patch("shared.rbac.db_service", db), \
+             patch("shared.rbac.get_scope", self._scope()):
+            assert await get_user_scope(42, "manager") is None
+
+    async def test_restricted_admin_keeps_own_users(self):
+        from shared.rbac import UserScope, get_user_scope
+
+        db, _ = self._db(unrestricted=False)
+        with patch("shared.rbac.db_service", db), \
+             patch("shared.rbac.get_scope", self._scope(node={"n2", "n1"})):
+            scope = await get_user_scope(42, "manager")
+        assert scope == UserScope(creator_id=42, node_uuids=("n1", "n2"))
+
+    async def test_filter_visible_runs_one_query_over_candidates(self):
+        from shared.rbac import filter_visible_user_uuids
+
+        db, conn = self._db(unrestricted=False)
+        conn.fetch = AsyncMock(return_value=[{"uuid": "aa"}])
+        with patch("shared.rbac.db_service", db), \
+             patch("shared.rbac.get_scope", self._scope()):
+            result = await filter_visible_user_uuids(42, "manager", ["AA", "bb"])
+        assert result == ["AA"]
+        sql, candidates, creator_id = conn.fetch.await_args.args
+        assert "UNNEST($1::uuid[])" in sql and "u IN (" in sql
+        assert candidates == ["AA", "bb"] and creator_id == 42
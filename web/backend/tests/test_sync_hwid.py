@@ -8,7 +8,7 @@
   устройство: их нет в выдаче API вообще, per-user синк их не касался,
   записи висели вечно и накручивали кросс-аккаунт HWID-детект.
 """
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -18,6 +18,7 @@ from shared.sync import SyncService
 def _db_mock():
     db = AsyncMock()
     db.is_connected = True
+    db.schedule_panel_counters_refresh = MagicMock()  # синхронный в DatabaseService
     return db
 
 
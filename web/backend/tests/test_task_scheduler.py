@@ -1,5 +1,7 @@
 """Tests for task_scheduler — cron-based background script execution."""
+import asyncio
 import json
+from datetime import datetime, timezone
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -18,9 +20,9 @@ def _make_task(
     script_content="echo ok",
     script_name="health_check",
     timeout_seconds=120,
-    requires_root=False,
+    agent_token="secret-token",
 ):
-    """Build a dict mimicking an asyncpg Record for a scheduled_task row."""
+    """Build a dict mimicking the asyncpg Record _fire_due loads for a due task."""
     return {
         "id": task_id,
         "script_id": script_id,
@@ -30,41 +32,49 @@ def _make_task(
         "script_content": script_content,
         "script_name": script_name,
         "timeout_seconds": timeout_seconds,
-        "requires_root": requires_root,
+        "agent_token": agent_token,
     }
 
 
-def _mock_db_service(*, is_connected=True, tasks=None, agent_token_row=None,
-                     cmd_log_id=777):
-    """Mock db_service that routes acquire() calls by order:
-
-    call 1  -> fetch(task list)
-    call 2+ -> fetchrow sequence: agent_token, INSERT returning id, then None
-    """
+def _mock_db_service(*, is_connected=True, schedule=None, tasks=None, cmd_log_id=777, signature="sig-1"):
+    """Mock db_service: fetch() returns the schedule (id, cron) or the due task
+    rows depending on the query; fetchrow() returns the command log id,
+    fetchval() the schedule signature."""
     db = MagicMock()
     db.is_connected = is_connected
+    conn = AsyncMock()
+
+    async def _fetch(query, *args):
+        if "JOIN" in query:
+            return [t for t in tasks or [] if t["id"] in args[0]]
+        return schedule or []
+
+    conn.fetch = AsyncMock(side_effect=_fetch)
+    conn.fetchrow = AsyncMock(return_value={"id": cmd_log_id})
+    conn.fetchval = AsyncMock(return_value=signature)
+    conn.execute = AsyncMock()
+    cm = AsyncMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db.acquire = MagicMock(return_value=cm)
+    db.conn = conn
+    return db
 
-    fetchrow_queue = [agent_token_row, {"id": cmd_log_id}]
 
-    call_count = 0
+@pytest.fixture(autouse=True)
+def _reset_in_flight():
+    from web.backend.core import task_scheduler
+    task_scheduler._in_flight.clear()
+    task_scheduler._running.clear()
+    yield
+    task_scheduler._in_flight.clear()
+    task_scheduler._running.clear()
 
-    def _acquire():
-        nonlocal call_count
-        call_count += 1
-        conn = AsyncMock()
-        if call_count == 1:
-            conn.fetch = AsyncMock(return_value=tasks or [])
-        else:
-            value = fetchrow_queue.pop(0) if fetchrow_queue else None
-            conn.fetchrow = AsyncMock(return_value=value)
-            conn.execute = AsyncMock()
-        cm = AsyncMock()
-        cm.__aenter__ = AsyncMock(return_value=conn)
-        cm.__aexit__ = AsyncMock(return_value=False)
-        return cm
 
-    db.acquire = _acquire
-    return db
+async def _drain():
+    """Wait for the background runs _fire_due started."""
+    from web.backend.core import task_scheduler
+    await asyncio.gather(*list(task_scheduler._running))
 
 
 def _make_agent_manager(*, is_connected=True, send_result=True):
@@ -74,10 +84,6 @@ def _make_agent_manager(*, is_connected=True, send_result=True):
     return am
 
 
-class _StopLoop(Exception):
-    """Sentinel to break out of the infinite scheduler loop."""
-
-
 # ---------------------------------------------------------------------------
 # _update_task_status
 # ---------------------------------------------------------------------------
@@ -121,195 +127,47 @@ class TestUpdateTaskStatus:
 
 
 # ---------------------------------------------------------------------------
-# task_scheduler_loop
+# _fire_due / _run_task
 # ---------------------------------------------------------------------------
 
-class TestTaskSchedulerLoop:
-    """Tests for the main scheduler loop (single-iteration via side_effect)."""
+class TestFireDue:
+    """Execution of due tasks: one query, concurrent fan-out, per-task status."""
 
     @staticmethod
-    def _sleep_side_effect():
-        """First call (startup delay) passes; second call (end-of-loop) stops."""
-        call = 0
-
-        async def _sleep(seconds):
-            nonlocal call
-            call += 1
-            if call >= 2:
-                raise _StopLoop()
-
-        return _sleep
-
-    # -- DB not connected -> skip iteration ----------------------------------
-
-    @pytest.mark.asyncio
-    async def test_skips_when_db_not_connected(self):
-        db = _mock_db_service(is_connected=False)
-
-        call = 0
-
-        async def _sleep(seconds):
-            nonlocal call
-            call += 1
-            if call >= 3:
-                raise _StopLoop()
-
-        with (
-            patch("asyncio.sleep", side_effect=_sleep),
-            patch("shared.database.db_service", db),
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-    # -- No enabled tasks -> nothing happens ---------------------------------
-
-    @pytest.mark.asyncio
-    async def test_no_tasks(self):
-        db = _mock_db_service(is_connected=True, tasks=[])
-
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-    # -- Cron does not match -> task skipped ---------------------------------
-
-    @pytest.mark.asyncio
-    async def test_cron_not_matching_skips_task(self):
-        task = _make_task()
-        db = _mock_db_service(is_connected=True, tasks=[task])
-        mock_sign = MagicMock(return_value=({"type": "exec_script"}, "sig"))
-        mock_am = _make_agent_manager()
-
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=False,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-        mock_sign.assert_not_called()
-        mock_am.send_command.assert_not_called()
-
-    # -- Agent not connected -> status=failed, no token lookup ---------------
-
-    @pytest.mark.asyncio
-    async def test_agent_not_connected_marks_failed(self):
-        task = _make_task()
-        db = _mock_db_service(is_connected=True, tasks=[task])
-        mock_sign = MagicMock(return_value=({}, "sig"))
-        mock_am = _make_agent_manager(is_connected=False)
-
+    async def _fire(task, *, am=None, sign=None):
+        db = _mock_db_service(tasks=[task])
+        am = am or _make_agent_manager()
+        sign = sign or MagicMock(return_value=({"type": "exec_script"}, "sig123"))
         with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
+            patch("web.backend.core.agent_hmac.sign_command_with_ts", sign),
+            patch("web.backend.core.agent_manager.agent_manager", am),
             patch(
                 "web.backend.core.task_scheduler._update_task_status",
                 new_callable=AsyncMock,
             ) as mock_update,
         ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-        mock_am.send_command.assert_not_called()
-        mock_update.assert_awaited()
-        assert mock_update.call_args_list[-1][0][2] == "failed"
+            from web.backend.core.task_scheduler import _fire_due
+            await _fire_due(db, [task["id"]])
+            await _drain()
+        return am, sign, mock_update
 
-    # -- No agent_token for node -> status=failed ----------------------------
+    @pytest.mark.asyncio
+    async def test_agent_not_connected_marks_failed(self):
+        am, sign, update = await self._fire(_make_task(), am=_make_agent_manager(is_connected=False))
+        am.send_command.assert_not_called()
+        assert update.call_args[0][2] == "failed"
 
     @pytest.mark.asyncio
     async def test_no_agent_token_marks_failed(self):
-        task = _make_task()
-        db = _mock_db_service(
-            is_connected=True,
-            tasks=[task],
-            agent_token_row=None,  # no token
-        )
-        mock_sign = MagicMock(return_value=({"type": "exec_script"}, "sig"))
-        mock_am = _make_agent_manager()
-
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ) as mock_update,
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-        mock_am.send_command.assert_not_called()
-        mock_update.assert_awaited()
-        assert mock_update.call_args_list[-1][0][2] == "failed"
-
-    # -- Successful send -> status=success, payload matches manual exec ------
+        am, sign, update = await self._fire(_make_task(agent_token=None))
+        am.send_command.assert_not_called()
+        assert update.call_args[0][2] == "failed"
 
     @pytest.mark.asyncio
     async def test_successful_execution(self):
-        task = _make_task(env_vars={"FOO": "bar"})
-        token_row = {"agent_token": "secret-token"}
-        db = _mock_db_service(
-            is_connected=True,
-            tasks=[task],
-            agent_token_row=token_row,
-            cmd_log_id=777,
-        )
-        mock_sign = MagicMock(return_value=({"type": "exec_script"}, "sig123"))
-        mock_am = _make_agent_manager(send_result=True)
-
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ) as mock_update,
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
+        am, sign, update = await self._fire(_make_task(env_vars={"FOO": "bar"}))
 
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-        # sign_command_with_ts called with canonical exec_script payload
-        mock_sign.assert_called_once()
-        payload_arg, token_arg = mock_sign.call_args[0]
+        payload_arg, token_arg = sign.call_args[0]
         assert payload_arg["type"] == "exec_script"
         assert payload_arg["command_id"] == 777
         assert payload_arg["timeout"] == 120
@@ -317,201 +175,222 @@ class TestTaskSchedulerLoop:
         assert "export FOO=bar" in payload_arg["script_content"]
         assert token_arg == "secret-token"
 
-        # send_command called on agent_manager (not send_to_node!)
-        mock_am.send_command.assert_awaited_once()
-        send_args = mock_am.send_command.call_args[0]
+        am.send_command.assert_awaited_once()
+        send_args = am.send_command.call_args[0]
         assert send_args[0] == "aaaa-bbbb-cccc"
         assert send_args[1].get("_sig") == "sig123"
-
-        mock_update.assert_awaited_once()
-        assert mock_update.call_args[0][2] == "success"
-
-    # -- env_vars as JSON string -> decoded and applied as shell exports -----
+        update.assert_awaited_once()
+        assert update.call_args[0][2] == "success"
 
     @pytest.mark.asyncio
     async def test_env_vars_json_string_decoded(self):
-        env_dict = {"KEY": "value", "NUM": "42"}
-        task = _make_task(env_vars=json.dumps(env_dict))
-        token_row = {"agent_token": "tok"}
-        db = _mock_db_service(
-            is_connected=True, tasks=[task], agent_token_row=token_row,
-        )
-        mock_sign = MagicMock(return_value=({}, "s"))
-        mock_am = _make_agent_manager()
-
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ),
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
-
-        script_content = mock_sign.call_args[0][0]["script_content"]
+        _, sign, _ = await self._fire(_make_task(env_vars=json.dumps({"KEY": "value", "NUM": "42"})))
+        script_content = sign.call_args[0][0]["script_content"]
         assert "export KEY=value" in script_content
         assert "export NUM=42" in script_content
 
-    # -- env_vars is None -> script unchanged, no export prefix --------------
-
     @pytest.mark.asyncio
     async def test_env_vars_none_no_exports(self):
-        task = _make_task(env_vars=None)
-        token_row = {"agent_token": "tok"}
-        db = _mock_db_service(
-            is_connected=True, tasks=[task], agent_token_row=token_row,
-        )
-        mock_sign = MagicMock(return_value=({}, "s"))
-        mock_am = _make_agent_manager()
+        _, sign, _ = await self._fire(_make_task(env_vars=None))
+        assert "export" not in sign.call_args[0][0]["script_content"]
 
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ),
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
+    @pytest.mark.asyncio
+    async def test_timeout_defaults_to_300(self):
+        _, sign, _ = await self._fire(_make_task(timeout_seconds=None))
+        assert sign.call_args[0][0]["timeout"] == 300
 
-        script_content = mock_sign.call_args[0][0]["script_content"]
-        assert "export" not in script_content
+    @pytest.mark.asyncio
+    async def test_inner_exception_marks_failed(self):
+        _, _, update = await self._fire(_make_task(), sign=MagicMock(side_effect=RuntimeError("hmac broken")))
+        update.assert_awaited_once()
+        assert update.call_args[0][2] == "failed"
 
-    # -- timeout_seconds None -> default 300 ---------------------------------
+    @pytest.mark.asyncio
+    async def test_send_failure_marks_failed(self):
+        _, _, update = await self._fire(_make_task(), am=_make_agent_manager(send_result=False))
+        assert update.call_args[0][2] == "failed"
 
     @pytest.mark.asyncio
-    async def test_timeout_defaults_to_300(self):
-        task = _make_task(timeout_seconds=None)
-        token_row = {"agent_token": "tok"}
-        db = _mock_db_service(
-            is_connected=True, tasks=[task], agent_token_row=token_row,
-        )
-        mock_sign = MagicMock(return_value=({}, "s"))
-        mock_am = _make_agent_manager()
+    async def test_fan_out_concurrent_with_per_node_limit(self):
+        from web.backend.core import task_scheduler
+        active = {"n1": 0, "n2": 0}
+        peak = {"n1": 0, "n2": 0}
+
+        async def slow_send(db, task):
+            node = task["node_uuid"]
+            active[node] += 1
+            peak[node] = max(peak[node], active[node])
+            await asyncio.sleep(0.02)
+            active[node] -= 1
+            return "success"
+
+        tasks = [_make_task(task_id=i, node_uuid="n1" if i < 5 else "n2") for i in range(8)]
+        db = _mock_db_service(tasks=tasks)
+        task_scheduler._node_slots.clear()
+        with (
+            patch.object(task_scheduler, "_send_task", slow_send),
+            patch.object(task_scheduler, "_update_task_status", new_callable=AsyncMock) as update,
+        ):
+            started = asyncio.get_running_loop().time()
+            await task_scheduler._fire_due(db, list(range(8)))
+            assert asyncio.get_running_loop().time() - started < 0.02  # не ждёт отправок
+            await _drain()
+            elapsed = asyncio.get_running_loop().time() - started
+
+        assert db.conn.fetch.await_count == 1  # все задачи — одним запросом
+        assert peak == {"n1": task_scheduler.NODE_TASK_CONCURRENCY, "n2": task_scheduler.NODE_TASK_CONCURRENCY}
+        assert elapsed < 0.02 * 8 / 2
+        assert update.await_count == 8
+        assert not task_scheduler._in_flight
 
+    @pytest.mark.asyncio
+    async def test_still_running_task_not_fired_again(self):
+        from web.backend.core import task_scheduler
+        gate = asyncio.Event()
+        sends = 0
+
+        async def blocked_send(db, task):
+            nonlocal sends
+            sends += 1
+            await gate.wait()
+            return "success"
+
+        db = _mock_db_service(tasks=[_make_task(task_id=1), _make_task(task_id=2, node_uuid="other")])
         with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ),
+            patch.object(task_scheduler, "_send_task", blocked_send),
+            patch.object(task_scheduler, "_update_task_status", new_callable=AsyncMock),
         ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
+            await task_scheduler._fire_due(db, [1])
+            await asyncio.sleep(0)
+            await task_scheduler._fire_due(db, [1, 2])  # 1 ещё идёт
+            await asyncio.sleep(0)
+            assert sends == 2
+            assert db.conn.fetch.await_args_list[1].args[1] == [2]
+            gate.set()
+            await _drain()
+        assert not task_scheduler._in_flight
 
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
 
-        payload_arg = mock_sign.call_args[0][0]
-        assert payload_arg["timeout"] == 300
+# ---------------------------------------------------------------------------
+# task_scheduler_loop
+# ---------------------------------------------------------------------------
+
+class _StopLoop(BaseException):
+    """Sentinel to break out of the infinite scheduler loop (not swallowed by
+    its ``except Exception``)."""
 
-    # -- Inner exception -> status=failed, loop continues --------------------
+
+class TestTaskSchedulerLoop:
+    """Next-fire planning: sleep until the earliest entry, reload on change."""
 
     @pytest.mark.asyncio
-    async def test_inner_exception_marks_failed(self):
-        task = _make_task()
-        token_row = {"agent_token": "tok"}
-        db = _mock_db_service(
-            is_connected=True, tasks=[task], agent_token_row=token_row,
-        )
-        mock_sign = MagicMock(side_effect=RuntimeError("hmac broken"))
-        mock_am = _make_agent_manager()
+    async def test_skips_when_db_not_connected(self):
+        db = _mock_db_service(is_connected=False)
+        call = 0
+
+        async def _sleep(seconds):
+            nonlocal call
+            call += 1
+            if call >= 3:
+                raise _StopLoop()
 
         with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
+            patch("asyncio.sleep", side_effect=_sleep),
             patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ) as mock_update,
         ):
             from web.backend.core.task_scheduler import task_scheduler_loop
 
             with pytest.raises(_StopLoop):
                 await task_scheduler_loop()
+        db.conn.fetch.assert_not_awaited()
 
-        mock_update.assert_awaited_once()
-        assert mock_update.call_args[0][2] == "failed"
-
-    # -- Outer exception -> loop does not crash -------------------------------
-
-    @pytest.mark.asyncio
-    async def test_outer_exception_does_not_crash_loop(self):
-        """If db_service.acquire() itself raises, the outer except catches it."""
-        db = MagicMock()
-        db.is_connected = True
-        db.acquire = MagicMock(side_effect=RuntimeError("pool exhausted"))
+    @staticmethod
+    async def _run_clocked(db, fire, until, on_wait=None):
+        """Run the loop on a fake clock: each wait advances it by its timeout."""
+        from datetime import timedelta
+        from web.backend.core import task_scheduler
+        clock = [datetime(2026, 10, 18, 10, 3, 30, tzinfo=timezone.utc)]
+        waits = []
+
+        class _Clock(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock[0]
+
+        async def fake_wait_for(awaitable, timeout):
+            awaitable.close()
+            waits.append(timeout)
+            clock[0] = clock[0] + timedelta(seconds=timeout)
+            if clock[0] >= until:
+                raise _StopLoop()
+            if on_wait:
+                on_wait(clock[0])
+            raise asyncio.TimeoutError
 
         with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
+            patch("asyncio.sleep", new_callable=AsyncMock),
+            patch("asyncio.wait_for", side_effect=fake_wait_for),
+            patch.object(task_scheduler, "datetime", _Clock),
+            patch.object(task_scheduler, "_fire_due", fire),
             patch("shared.database.db_service", db),
         ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
-
+            task_scheduler._schedule_changed.clear()
             with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
+                await task_scheduler.task_scheduler_loop()
+        return waits
+
+    @pytest.mark.asyncio
+    async def test_sleeps_until_next_fire(self):
+        db = _mock_db_service(schedule=[{"id": 1, "cron_expression": "*/5 * * * *"}])
+        fire = AsyncMock()
+        waits = await self._run_clocked(
+            db, fire, until=datetime(2026, 10, 18, 10, 10, 30, tzinfo=timezone.utc),
+        )
 
-    # -- Send fails -> status=failed ------------------------------------------
+        # 10:04:30 — сверка, 10:05:00 — запуск, 10:05:30 — сверка, дальше раз в минуту
+        assert waits[:4] == [60.0, 30.0, 30.0, 60.0]
+        assert max(waits) <= 60.0
+        # 10:05 и 10:10 — по одному запуску, без повторов внутри минуты
+        assert [c.args[1] for c in fire.await_args_list] == [[1], [1]]
+        assert db.conn.fetch.await_count == 1  # отпечаток не менялся — расписание не перечитывается
+        assert db.conn.fetchval.await_count > 3
 
     @pytest.mark.asyncio
-    async def test_send_failure_marks_failed(self):
-        task = _make_task()
-        token_row = {"agent_token": "tok"}
-        db = _mock_db_service(
-            is_connected=True, tasks=[task], agent_token_row=token_row,
+    async def test_change_on_other_replica_picked_up_within_a_minute(self):
+        db = _mock_db_service(schedule=[{"id": 1, "cron_expression": "0 3 * * *"}])
+        fire = AsyncMock()
+        reload_at = datetime(2026, 10, 18, 10, 5, 0, tzinfo=timezone.utc)
+
+        def edit_elsewhere(now):
+            if now >= reload_at and db.conn.fetchval.return_value == "sig-1":
+                db.conn.fetchval.return_value = "sig-2"
+
+        await self._run_clocked(
+            db, fire, until=datetime(2026, 10, 18, 10, 7, 0, tzinfo=timezone.utc),
+            on_wait=edit_elsewhere,
         )
-        mock_sign = MagicMock(return_value=({}, "s"))
-        mock_am = _make_agent_manager(send_result=False)
+        assert db.conn.fetch.await_count == 2
+        fire.assert_not_awaited()
 
-        with (
-            patch("asyncio.sleep", side_effect=self._sleep_side_effect()),
-            patch("shared.database.db_service", db),
-            patch(
-                "web.backend.core.automation_engine.cron_matches_now",
-                return_value=True,
-            ),
-            patch("web.backend.core.agent_hmac.sign_command_with_ts", mock_sign),
-            patch("web.backend.core.agent_manager.agent_manager", mock_am),
-            patch(
-                "web.backend.core.task_scheduler._update_task_status",
-                new_callable=AsyncMock,
-            ) as mock_update,
-        ):
-            from web.backend.core.task_scheduler import task_scheduler_loop
+    @pytest.mark.asyncio
+    async def test_change_reloads_schedule(self):
+        from web.backend.core import task_scheduler
+        real_sleep = asyncio.sleep
+
+        async def no_startup_delay(seconds):
+            await real_sleep(0)
+
+        db = _mock_db_service(schedule=[{"id": 1, "cron_expression": "0 3 * * *"}])
+        with patch("asyncio.sleep", side_effect=no_startup_delay), patch("shared.database.db_service", db):
+            task_scheduler._schedule_changed.clear()
+            loop_task = asyncio.create_task(task_scheduler.task_scheduler_loop())
+            try:
+                await real_sleep(0.05)
+                assert db.conn.fetch.await_count == 1
+                task_scheduler.invalidate_schedule()
+                await real_sleep(0.05)
+                assert db.conn.fetch.await_count == 2
+            finally:
+                loop_task.cancel()
 
-            with pytest.raises(_StopLoop):
-                await task_scheduler_loop()
 
-        mock_update.assert_awaited_once()
-        assert mock_update.call_args[0][2] == "failed"
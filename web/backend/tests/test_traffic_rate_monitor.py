@@ -0,0 +1,133 @@
+"""Tests for web.backend.core.traffic_rate_monitor — rate detection from local deltas."""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from shared.db import DatabaseService
+from web.backend.core.traffic_rate_monitor import TrafficRateMonitor
+
+GB = 1024 ** 3
+
+CFG = {
+    "enabled": True,
+    "threshold_gb": 10.0,
+    "window_minutes": 60,
+    "check_interval_minutes": 5,
+    "cooldown_minutes": 60,
+    "auto_action": "notify",
+    "auto_block_gb": 50.0,
+}
+
+
+def _row(uuid, delta_gb, elapsed_min=30, username="user"):
+    return {
+        "user_uuid": uuid,
+        "username": username,
+        "delta_bytes": int(delta_gb * GB),
+        "elapsed_seconds": elapsed_min * 60.0,
+    }
+
+
+def _mock_db(rows, excluded=()):
+    db = MagicMock()
+    db.is_connected = True
+    db.get_user_traffic_in_window = AsyncMock(return_value=rows)
+    db.get_whitelist_excluded = AsyncMock(return_value=set(excluded))
+    return db
+
+
+async def _check(monitor, db, cfg=CFG):
+    with patch("shared.database.db_service", db), \
+         patch("shared.sync.SyncService._get_sync_interval", return_value=300), \
+         patch.object(monitor, "_send_notification", new_callable=AsyncMock) as send:
+        await monitor._check_traffic_rates(cfg)
+    return [c.args[0] for c in send.await_args_list]
+
+
+class TestTrafficRateCheck:
+
+    @pytest.mark.asyncio
+    async def test_reads_window_from_db_without_panel(self):
+        db = _mock_db([_row("u1", 12, elapsed_min=40, username="alice")])
+        monitor = TrafficRateMonitor()
+        with patch("shared.api_client.api_client") as api:
+            sent = await _check(monitor, db)
+        api.get_users.assert_not_called()
+        db.get_user_traffic_in_window.assert_awaited_once_with(60, 10 * GB, 300)
+        assert sent == [{
+            "user_uuid": "u1",
+            "username": "alice",
+            "delta_gb": 12.0,
+            "elapsed_minutes": 40.0,
+            "rate_gb_per_hour": 18.0,
+        }]
+
+    @pytest.mark.asyncio
+    async def test_whitelist_checked_in_one_batch(self):
+        db = _mock_db([_row("u1", 12), _row("u2", 15), _row("u3", 20)], excluded={"u2"})
+        sent = await _check(TrafficRateMonitor(), db)
+        db.get_whitelist_excluded.assert_awaited_once_with(["u1", "u2", "u3"], "traffic_rate")
+        assert [v["user_uuid"] for v in sent] == ["u1", "u3"]
+
+    @pytest.mark.asyncio
+    async def test_needs_a_minute_of_history(self):
+        db = _mock_db([_row("u1", 12, elapsed_min=0.5)])
+        assert await _check(TrafficRateMonitor(), db) == []
+
+    @pytest.mark.asyncio
+    async def test_cooldown_suppresses_repeat(self):
+        db = _mock_db([_row("u1", 12)])
+        monitor = TrafficRateMonitor()
+        assert len(await _check(monitor, db)) == 1
+        assert await _check(monitor, db) == []
+
+    @pytest.mark.asyncio
+    async def test_no_candidates_skips_whitelist(self):
+        db = _mock_db([])
+        assert await _check(TrafficRateMonitor(), db) == []
+        db.get_whitelist_excluded.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_db_error_is_tolerated(self):
+        db = _mock_db([])
+        db.get_user_traffic_in_window.side_effect = RuntimeError("db down")
+        assert await _check(TrafficRateMonitor(), db) == []
+
+
+class TestTrafficWindowQuery:
+    """get_user_traffic_in_window — elapsed covers the sync interval of the first delta."""
+
+    @staticmethod
+    def _db(rows):
+        conn = MagicMock()
+        conn.fetch = AsyncMock(return_value=rows)
+        cm = AsyncMock()
+        cm.__aenter__ = AsyncMock(return_value=conn)
+        cm.__aexit__ = AsyncMock(return_value=False)
+        db = DatabaseService()
+        db._pool = MagicMock(_closed=False)
+        db.acquire = MagicMock(return_value=cm)
+        return db, conn
+
+    @pytest.mark.asyncio
+    async def test_elapsed_starts_one_interval_before_first_delta(self):
+        db, conn = self._db([])
+        await db.get_user_traffic_in_window(60, 10 * GB, 300)
+        sql, *args = conn.fetch.await_args.args
+        assert args == [60, 10 * GB, 300]
+        assert "MIN(h.recorded_at) - make_interval(secs := $3)" in sql
+        assert "GREATEST(" in sql  # но не раньше начала окна
+
+    @pytest.mark.asyncio
+    async def test_single_fresh_delta_not_inflated(self):
+        # Одна дельта 12 GB, записанная 2 минуты назад, накоплена за 5-минутный
+        # интервал синхронизации до неё: база отдаёт 7 минут, а не 2.
+        db, _ = self._db([{
+            "user_uuid": "u1", "username": "alice",
+            "delta_bytes": 12 * GB, "elapsed_seconds": 420.0,
+        }])
+        rows = await db.get_user_traffic_in_window(60, 10 * GB, 300)
+        sent = await _check(TrafficRateMonitor(), _mock_db(rows))
+        assert sent[0]["elapsed_minutes"] == 7.0
+        assert sent[0]["rate_gb_per_hour"] == round(12 / (7 / 60), 2)
+        assert sent[0]["rate_gb_per_hour"] < 12 / (2 / 60)
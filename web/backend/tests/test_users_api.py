@@ -64,70 +64,67 @@ class TestListUsers:
     """GET /api/v2/users."""
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
     @patch("shared.database.db_service")
-    async def test_list_users_success(self, mock_db, mock_get, client):
-        mock_db.is_connected = False  # Force API fallback path
-        resp = await client.get("/api/v2/users")
+    async def test_list_users_from_db(self, mock_db, client):
+        mock_db.is_connected = True
+        mock_db.get_users_page = AsyncMock(return_value=(MOCK_USERS[:1], 7, "next"))
+        mock_db.get_hwid_device_counts_for_uuids = AsyncMock(return_value={})
+        mock_db.get_raw_traffic_for_uuids = AsyncMock(return_value={})
+        resp = await client.get("/api/v2/users?search=alice&status=active&per_page=1")
         assert resp.status_code == 200
         data = resp.json()
-        assert data["total"] == 2
-        assert len(data["items"]) == 2
+        assert data["total"] == 7
+        assert data["next_cursor"] == "next"
+        assert data["items"][0]["username"] == "alice"
+        kwargs = mock_db.get_users_page.call_args.kwargs
+        assert kwargs["search"] == "alice" and kwargs["status"] == "active"
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
+    @patch("web.backend.api.v2.users.fetch_users_page_from_api", new_callable=AsyncMock,
+           return_value={"users": MOCK_USERS, "total": 2})
     @patch("shared.database.db_service")
-    async def test_list_users_pagination(self, mock_db, mock_get, client):
+    async def test_list_users_panel_page_without_db(self, mock_db, mock_page, client):
         mock_db.is_connected = False
-        resp = await client.get("/api/v2/users?page=1&per_page=1")
+        resp = await client.get("/api/v2/users")
         assert resp.status_code == 200
         data = resp.json()
-        assert len(data["items"]) == 1
         assert data["total"] == 2
+        assert len(data["items"]) == 2
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
-    @patch("shared.database.db_service")
-    async def test_list_users_search(self, mock_db, mock_get, client):
-        mock_db.is_connected = False
-        resp = await client.get("/api/v2/users?search=alice")
-        assert resp.status_code == 200
-        data = resp.json()
-        assert data["total"] == 1
-        assert data["items"][0]["username"] == "alice"
-
-    @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
+    @patch("web.backend.api.v2.users.fetch_users_page_from_api", new_callable=AsyncMock,
+           return_value={"users": MOCK_USERS[1:], "total": 2})
     @patch("shared.database.db_service")
-    async def test_list_users_filter_status(self, mock_db, mock_get, client):
+    async def test_list_users_panel_fetches_one_page(self, mock_db, mock_page, client):
+        """Без БД из панели берётся ровно запрошенная страница, не весь список."""
         mock_db.is_connected = False
-        resp = await client.get("/api/v2/users?status=active")
+        resp = await client.get("/api/v2/users?page=2&per_page=1")
         assert resp.status_code == 200
         data = resp.json()
-        assert data["total"] == 1
-        assert data["items"][0]["status"] == "active"
+        assert len(data["items"]) == 1
+        assert data["total"] == 2
+        mock_page.assert_awaited_once_with(start=1, size=1)
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
+    @pytest.mark.parametrize("query", [
+        "search=alice", "status=active", "external_squad_uuid=squad-aaa", "tag=VIP",
+    ])
+    @patch("web.backend.api.v2.users.fetch_users_page_from_api", new_callable=AsyncMock)
     @patch("shared.database.db_service")
-    async def test_list_users_filter_external_squad(self, mock_db, mock_get, client):
+    async def test_list_users_filters_need_db(self, mock_db, mock_page, client, query):
+        """Фильтры работают только в SQL — без БД 503, а не выгрузка всех юзеров."""
         mock_db.is_connected = False
-        resp = await client.get("/api/v2/users?external_squad_uuid=squad-aaa")
-        assert resp.status_code == 200
-        data = resp.json()
-        assert data["total"] == 1
-        assert data["items"][0]["username"] == "alice"
+        resp = await client.get(f"/api/v2/users?{query}")
+        assert resp.status_code == 503
+        mock_page.assert_not_awaited()
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=MOCK_USERS)
+    @patch("web.backend.api.v2.users.fetch_users_page_from_api", new_callable=AsyncMock, return_value=None)
     @patch("shared.database.db_service")
-    async def test_list_users_filter_tag(self, mock_db, mock_get, client):
+    async def test_list_users_panel_unavailable(self, mock_db, mock_page, client):
         mock_db.is_connected = False
-        resp = await client.get("/api/v2/users?tag=VIP")
-        assert resp.status_code == 200
-        data = resp.json()
-        assert data["total"] == 1
-        assert data["items"][0]["username"] == "alice"
+        resp = await client.get("/api/v2/users")
+        assert resp.status_code == 503
 
     @pytest.mark.asyncio
     async def test_list_users_as_viewer_allowed(self, app, viewer):
@@ -136,13 +133,14 @@ class TestListUsers:
         from httpx import ASGITransport, AsyncClient
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
             with patch("shared.database.db_service") as mock_db:
-                mock_db.is_connected = False
-                with patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=[]):
-                    resp = await ac.get("/api/v2/users")
-                    assert resp.status_code == 200
+                mock_db.is_connected = True
+                mock_db.get_users_page = AsyncMock(return_value=([], 0, None))
+                resp = await ac.get("/api/v2/users")
+                assert resp.status_code == 200
 
     @pytest.mark.asyncio
-    @patch("web.backend.api.v2.users._get_users_list", new_callable=AsyncMock, return_value=[])
+    @patch("web.backend.api.v2.users.fetch_users_page_from_api", new_callable=AsyncMock,
+           return_value={"users": [], "total": 0})
     @patch("shared.database.db_service")
     async def test_list_users_empty(self, mock_db, mock_get, client):
         mock_db.is_connected = False
@@ -229,27 +227,3 @@ class TestEnsureSnakeCase:
         result = _ensure_snake_case(user)
         assert result["used_traffic_bytes"] == 1000
         assert result["lifetime_used_traffic_bytes"] == 5000
-
-
-class TestParseDt:
-    """Tests for _parse_dt helper."""
-
-    def test_none(self):
-        from web.backend.api.v2.users import _parse_dt
-        assert _parse_dt(None) is None
-
-    def test_iso_string(self):
-        from web.backend.api.v2.users import _parse_dt
-        result = _parse_dt("2026-01-15T10:30:00Z")
-        assert result is not None
-        assert result.year == 2026
-
-    def test_datetime_passthrough(self):
-        from web.backend.api.v2.users import _parse_dt
-        from datetime import datetime
-        dt = datetime(2026, 1, 1)
-        assert _parse_dt(dt) is dt
-
-    def test_invalid_string(self):
-        from web.backend.api.v2.users import _parse_dt
-        assert _parse_dt("not-a-date") is None
@@ -96,6 +96,42 @@ class TestListViolations:
         assert resp.status_code == 200
         assert mock_db.get_violations_for_period.call_args.kwargs["include_annulled"] is True
 
+    @pytest.mark.asyncio
+    async def test_list_cursor_round_trip(self, app, client):
+        """Полная страница отдаёт next_cursor; он превращается в keyset after=(value, id)."""
+        from web.backend.api.deps import get_db
+
+        mock_db = MagicMock()
+        mock_db.is_connected = True
+        mock_db.count_violations_for_period = AsyncMock(return_value=10)
+        mock_db.get_violations_for_period = AsyncMock(return_value=MOCK_VIOLATIONS)
+        app.dependency_overrides[get_db] = lambda: mock_db
+
+        resp = await client.get("/api/v2/violations", params={"per_page": 2, "sort_by": "score"})
+        assert resp.status_code == 200
+        cursor = resp.json()["next_cursor"]
+        assert cursor
+
+        resp = await client.get(
+            "/api/v2/violations", params={"per_page": 2, "sort_by": "score", "cursor": cursor},
+        )
+        assert resp.status_code == 200
+        kwargs = mock_db.get_violations_for_period.call_args.kwargs
+        assert kwargs["after"] == (45.0, 2)
+        assert kwargs["offset"] == 0
+
+        # курсор от другой сортировки — 400, а не молча неверная страница
+        resp = await client.get("/api/v2/violations", params={"cursor": cursor})
+        assert resp.status_code == 400
+        # и от других фильтров тоже
+        resp = await client.get(
+            "/api/v2/violations",
+            params={"per_page": 2, "sort_by": "score", "cursor": cursor, "min_score": 80},
+        )
+        assert resp.status_code == 400
+        resp = await client.get("/api/v2/violations", params={"cursor": "garbage"})
+        assert resp.status_code == 400
+
     @pytest.mark.asyncio
     async def test_list_violations_as_viewer_allowed(self, app, viewer):
         """Viewers have violations.view permission."""
@@ -131,22 +167,23 @@ class TestAnnulScope:
         mock_db.annul_all_pending_violations = AsyncMock(return_value=99)
         app.dependency_overrides[get_db] = lambda: mock_db
 
-        with patch("web.backend.core.rbac.get_visible_user_uuids",
-                   new_callable=AsyncMock, return_value={"aaaa"}):
+        from shared.rbac import UserScope
+        with patch("web.backend.core.rbac.get_user_scope",
+                   new_callable=AsyncMock, return_value=UserScope(creator_id=2)):
             resp = await client.post("/api/v2/violations/annul-all", json={})
         assert resp.status_code == 403
         mock_db.annul_all_pending_violations.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_annul_all_allowed_for_unrestricted_admin(self, app, client):
-        """Админ без ограничения видимости (visible=None) проходит гейт."""
+        """Админ без ограничения видимости (scope=None) проходит гейт."""
         from web.backend.api.deps import get_db
         mock_db = MagicMock()
         mock_db.is_connected = True
         mock_db.annul_all_pending_violations = AsyncMock(return_value=5)
         app.dependency_overrides[get_db] = lambda: mock_db
 
-        with patch("web.backend.core.rbac.get_visible_user_uuids",
+        with patch("web.backend.core.rbac.get_user_scope",
                    new_callable=AsyncMock, return_value=None), \
              patch("web.backend.api.v2.violations.write_audit_log", new_callable=AsyncMock):
             resp = await client.post("/api/v2/violations/annul-all", json={})
@@ -163,8 +200,8 @@ class TestAnnulScope:
         mock_db.update_violation_action = AsyncMock(return_value=True)
         app.dependency_overrides[get_db] = lambda: mock_db
 
-        with patch("web.backend.core.rbac.get_visible_user_uuids",
-                   new_callable=AsyncMock, return_value={"other-uuid"}):
+        with patch("web.backend.core.rbac.is_user_visible",
+                   new_callable=AsyncMock, return_value=False):
             resp = await client.post("/api/v2/violations/7/annul", json={})
         assert resp.status_code == 403
         mock_db.update_violation_action.assert_not_called()
@@ -366,8 +403,8 @@ class TestResolveBlockIdempotent:
                    AsyncMock(side_effect=Exception("User is already disabled"))), \
              patch("shared.api_client.api_client.get_user_by_id",
                    AsyncMock(return_value={"response": {"status": "DISABLED"}})), \
-             patch("web.backend.core.rbac.get_visible_user_uuids",
-                   AsyncMock(return_value=None)):
+             patch("web.backend.core.rbac.is_user_visible",
+                   AsyncMock(return_value=True)):
             resp = await client.post("/api/v2/violations/1/resolve",
                                      json={"action": "block"})
 
@@ -386,8 +423,8 @@ class TestResolveBlockIdempotent:
                    AsyncMock(side_effect=Exception("boom"))), \
              patch("shared.api_client.api_client.get_user_by_id",
                    AsyncMock(return_value={"response": {"status": "ACTIVE"}})), \
-             patch("web.backend.core.rbac.get_visible_user_uuids",
-                   AsyncMock(return_value=None)):
+             patch("web.backend.core.rbac.is_user_visible",
+                   AsyncMock(return_value=True)):
             resp = await client.post("/api/v2/violations/1/resolve",
                                      json={"action": "block"})
 
@@ -4,10 +4,16 @@
 reserved/link-local) и что публичные адреса проходят. URL используют
 литеральные IP — без обращения к DNS.
 """
+import asyncio
 import ipaddress
+import socket
+from unittest.mock import AsyncMock, patch
+from urllib.parse import urlparse
 
+import httpx
 import pytest
 
+from web.backend.core import webhook_security as ws
 from web.backend.core.webhook_security import check_url_safety, _ip_is_blocked
 
 
@@ -57,3 +63,121 @@ def test_scheme_must_be_http():
 def test_empty_url_rejected():
     ok, _ = check_url_safety("")
     assert ok is False
+
+
+# ── Доставка: кэш проверенных резолвов и пиннинг IP ─────────────
+
+def _infos(*ips):
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (ip, 0)) for ip in ips]
+
+
+@pytest.fixture()
+def clean_delivery_state():
+    ws._resolve_cache.clear()
+    yield
+    ws._resolve_cache.clear()
+    ws._clients.clear()
+
+
+@pytest.mark.asyncio
+async def test_resolution_cached_only_when_safe(clean_delivery_state):
+    loop = asyncio.get_running_loop()
+    with patch.object(loop, "getaddrinfo", AsyncMock(return_value=_infos("93.184.216.34"))) as gai:
+        assert await ws.resolve_webhook_url("https://hooks.example/x") == (True, None, ["93.184.216.34"])
+        await ws.resolve_webhook_url("https://hooks.example/y")
+    assert gai.await_count == 1
+
+    with patch.object(loop, "getaddrinfo", AsyncMock(return_value=_infos("8.8.8.8", "10.0.0.1"))) as gai:
+        for _ in range(2):
+            ok, reason, _ = await ws.resolve_webhook_url("https://rebind.example/x")
+            assert not ok and "10.0.0.1" in reason
+    assert gai.await_count == 2  # отказ не кэшируется
+
+
+@pytest.mark.asyncio
+async def test_deliver_connects_to_pinned_ip(clean_delivery_state):
+    """Запрос уходит на проверенный IP с исходным Host, клиент переиспользуется."""
+    seen = []
+
+    async def handle(reader, writer):
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int([l for l in head.split(b"\r\n") if l.lower().startswith(b"content-length")][0].split(b":")[1])
+            await reader.readexactly(length)
+            seen.append((head, writer.get_extra_info("peername")[1]))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            if len(seen) >= 2:
+                break
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+    with patch.object(ws, "_ip_is_blocked", lambda addr: False), \
+         patch.object(loop, "getaddrinfo", AsyncMock(return_value=_infos("127.0.0.1"))):
+        for _ in range(2):
+            ok, status, body, error, _ = await ws.deliver_once(
+                1, f"http://hooks.example:{port}/hook", None, "v1", "user.updated", {},
+            )
+            assert (ok, status, body, error) == (True, 200, "ok", None)
+    await ws.close_delivery_clients()
+    server.close()
+
+    assert all(f"host: hooks.example:{port}".encode() in head.lower() for head, _ in seen)
+    assert seen[0][1] == seen[1][1]  # keep-alive: одно TCP-соединение на обе доставки
+
+
+@pytest.mark.asyncio
+async def test_deliver_falls_back_to_next_address(clean_delivery_state):
+    """Недоступный первый адрес dual-stack получателя не роняет доставку."""
+    tried = []
+
+    def handler(request):
+        tried.append(request.url.host)
+        if request.url.host == "2001:db8::1":
+            raise httpx.ConnectError("network unreachable")
+        return httpx.Response(200, text="ok")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    loop = asyncio.get_running_loop()
+    with patch.object(ws, "_ip_is_blocked", lambda addr: False), \
+         patch.object(ws, "_client_for", lambda parsed: client), \
+         patch.object(loop, "getaddrinfo", AsyncMock(return_value=_infos("2001:db8::1", "93.184.216.34"))):
+        for _ in range(2):
+            ok, status, body, error, _ = await ws.deliver_once(
+                1, "https://hooks.example/hook", None, "v1", "user.updated", {},
+            )
+            assert (ok, status, body, error) == (True, 200, "ok", None)
+
+    # вторая доставка сразу идёт на ответивший адрес
+    assert tried == ["2001:db8::1", "93.184.216.34", "93.184.216.34"]
+
+
+@pytest.mark.asyncio
+async def test_deliver_all_addresses_down(clean_delivery_state):
+    def handler(request):
+        raise httpx.ConnectError("connection refused")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    loop = asyncio.get_running_loop()
+    with patch.object(ws, "_ip_is_blocked", lambda addr: False), \
+         patch.object(ws, "_client_for", lambda parsed: client), \
+         patch.object(loop, "getaddrinfo", AsyncMock(return_value=_infos("93.184.216.34", "93.184.216.35"))):
+        ok, status, _, error, _ = await ws.deliver_once(
+            1, "https://hooks.example/hook", None, "v1", "user.updated", {},
+        )
+    assert (ok, status, error) == (False, 0, "connection refused")
+    assert "hooks.example" not in ws._resolve_cache  # следующая попытка резолвит заново
+
+
+@pytest.mark.asyncio
+async def test_delivery_client_keeps_no_cookies(clean_delivery_state):
+    """Клиент общий для подписок одного origin — куки получателя не сохраняются."""
+    client = ws._client_for(urlparse("https://hooks.example/a"))
+    client.cookies.extract_cookies(httpx.Response(
+        200, headers={"set-cookie": "sid=secret; Path=/"},
+        request=httpx.Request("POST", "https://hooks.example/a"),
+    ))
+    assert len(client.cookies) == 0
+    await ws.close_delivery_clients()
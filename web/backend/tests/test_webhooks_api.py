@@ -18,6 +18,17 @@ def _allow_private_webhook_urls(monkeypatch):
     monkeypatch.setattr("web.backend.core.webhook_security.WEBHOOK_ALLOW_PRIVATE_URL", True)
 
 
+@pytest.fixture(autouse=True)
+def _reset_dispatch_state():
+    from web.backend.core import webhook_security
+    webhook_security.invalidate_subscriptions()
+    webhook_security._endpoint_slots.clear()
+    yield
+    webhook_security.invalidate_subscriptions()
+    webhook_security._delivery_log.clear()
+    webhook_security._succeeded.clear()
+
+
 MOCK_WEBHOOK_ROW = {
     "id": 1,
     "name": "My Webhook",
@@ -229,7 +240,8 @@ class TestDispatchWebhookEvent:
     @patch("shared.database.db_service")
     async def test_dispatch_sends_with_hmac(self, mock_db_svc, mock_post):
         """Verify HMAC signature is computed correctly."""
-        webhook_row = {"id": 1, "url": "https://example.com/hook", "secret": "test-secret", "signature_version": "v1"}
+        webhook_row = {"id": 1, "url": "https://example.com/hook", "secret": "test-secret",
+                       "signature_version": "v1", "events": ["user.created"]}
         mock_svc, mock_conn = _mock_db_service(fetch_return=[webhook_row])
         mock_db_svc.is_connected = mock_svc.is_connected
         mock_db_svc.acquire = mock_svc.acquire
@@ -252,6 +264,137 @@ class TestDispatchWebhookEvent:
         expected_sig = hmac.new(b"test-secret", body.encode(), hashlib.sha256).hexdigest()
         assert headers["X-Webhook-Signature"] == f"sha256={expected_sig}"
 
+    @pytest.mark.asyncio
+    @patch("web.backend.core.webhook_security.deliver_once", new_callable=AsyncMock,
+           return_value=(True, 200, "ok", None, 5))
+    @patch("shared.database.db_service")
+    async def test_subscriptions_indexed_and_logs_batched(self, mock_db_svc, mock_deliver):
+        """Подписки читаются одним SELECT на серию событий, логи — одной пачкой."""
+        from web.backend.core import webhook_security
+        rows = [
+            {"id": 1, "url": "https://a.example/h", "secret": None, "signature_version": "v2",
+             "events": ["user.updated"]},
+            {"id": 2, "url": "https://b.example/h", "secret": None, "signature_version": "v2",
+             "events": ["user.updated", "user.created"]},
+        ]
+        mock_svc, mock_conn = _mock_db_service(fetch_return=rows)
+        mock_conn.transaction = MagicMock()
+        mock_conn.transaction.return_value.__aenter__ = AsyncMock()
+        mock_conn.transaction.return_value.__aexit__ = AsyncMock(return_value=False)
+        mock_db_svc.is_connected = True
+        mock_db_svc.acquire = mock_svc.acquire
+
+        for i in range(10):
+            await webhook_security.dispatch_event("user.updated", {"i": i})
+        await webhook_security.dispatch_event("user.created", {})
+        await webhook_security.dispatch_event("node.offline", {})
+
+        assert mock_conn.fetch.await_count == 1
+        assert mock_deliver.await_count == 21
+        mock_conn.execute.assert_not_awaited()  # ничего не пишется поштучно
+
+        assert await webhook_security._flush_delivery_logs() == 21
+        insert_args = mock_conn.execute.await_args_list[0].args
+        assert "UNNEST" in insert_args[0] and len(insert_args[1]) == 21
+        success_args = mock_conn.execute.await_args_list[-1].args
+        assert success_args[1] == [1, 2]
+
+        webhook_security.invalidate_subscriptions()
+        await webhook_security.dispatch_event("user.updated", {})
+        assert mock_conn.fetch.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_endpoint_concurrency_bounded(self):
+        import asyncio
+        from web.backend.core import webhook_security
+        active = peak = 0
+
+        async def slow_deliver(*args):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return (True, 200, None, None, 10)
+
+        with patch.object(webhook_security, "deliver_once", slow_deliver), \
+             patch.object(webhook_security, "WEBHOOK_ENDPOINT_CONCURRENCY", 2):
+            await asyncio.gather(*(
+                webhook_security._attempt_and_handle(7, "https://slow.example", None, "v2", "e", {}, attempt=1)
+                for _ in range(8)
+            ))
+        assert peak == 2
+
+
+    @pytest.mark.asyncio
+    async def test_interleaved_success_resets_failure_streak(self):
+        """Успех между неудачами внутри одного окна сброса обрывает серию."""
+        from web.backend.core import webhook_security
+        state = {"consecutive_failures": 0, "is_active": True}
+
+        async def fake_fetchrow(query, webhook_id):
+            if "consecutive_failures = 1" in query:
+                state["consecutive_failures"] = 1
+            else:
+                state["consecutive_failures"] += 1
+            return dict(state)
+
+        mock_svc, mock_conn = _mock_db_service()
+        mock_conn.fetchrow = AsyncMock(side_effect=fake_fetchrow)
+        with patch("shared.database.db_service", mock_svc):
+            for _ in range(webhook_security.WEBHOOK_AUTO_DISABLE_AFTER * 2):
+                await webhook_security._mark_success(3)
+                assert await webhook_security._bump_failure(3) is False
+            assert state["consecutive_failures"] == 1
+            assert 3 not in webhook_security._succeeded
+
+            # Без промежуточных успехов серия растёт как раньше
+            await webhook_security._bump_failure(3)
+            assert state["consecutive_failures"] == 2
+        mock_conn.execute.assert_not_awaited()  # авто-отключения не было
+
+    @pytest.mark.asyncio
+    async def test_flush_keeps_entries_logged_during_write(self):
+        """Попытки, пришедшие (и вытесненные лимитом) во время записи, не теряются."""
+        import asyncio
+        from web.backend.core import webhook_security
+        mock_svc, mock_conn = _mock_db_service()
+        mock_conn.transaction = MagicMock()
+        mock_conn.transaction.return_value.__aenter__ = AsyncMock()
+        mock_conn.transaction.return_value.__aexit__ = AsyncMock(return_value=False)
+        gate = asyncio.Event()
+
+        async def slow_execute(*args):
+            await gate.wait()
+            return "INSERT 0 1"
+
+        mock_conn.execute = AsyncMock(side_effect=slow_execute)
+        with patch("shared.database.db_service", mock_svc), \
+             patch.object(webhook_security, "WEBHOOK_LOG_BUFFER_MAX", 3):
+            for i in range(3):
+                await webhook_security._log_delivery(1, f"old{i}", 200, None, None, 1)
+            flush = asyncio.create_task(webhook_security._flush_delivery_logs())
+            await asyncio.sleep(0)
+            for i in range(4):
+                await webhook_security._log_delivery(1, f"new{i}", 200, None, None, 1)
+            gate.set()
+            assert await flush == 3
+
+        events = [entry[1] for entry in webhook_security._delivery_log]
+        assert events == ["new1", "new2", "new3"]
+
+    @pytest.mark.asyncio
+    async def test_endpoint_slots_dropped_for_inactive_webhooks(self):
+        from web.backend.core import webhook_security
+        rows = [{"id": 1, "url": "https://a.example/h", "secret": None,
+                 "signature_version": "v2", "events": ["user.updated"]}]
+        mock_svc, _ = _mock_db_service(fetch_return=rows)
+        webhook_security._endpoint_slot(1)
+        webhook_security._endpoint_slot(2)  # удалён/выключен
+        with patch("shared.database.db_service", mock_svc):
+            webhook_security.invalidate_subscriptions()
+            await webhook_security._get_subscriptions("user.updated")
+        assert set(webhook_security._endpoint_slots) == {1}
 
 class TestWebhooksRBAC:
     """RBAC tests for webhooks endpoints."""
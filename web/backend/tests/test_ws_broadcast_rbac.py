@@ -1,4 +1,5 @@
 """RBAC-фильтр WS-рассылки: события уходят только админам с нужным правом."""
+import asyncio
 from types import SimpleNamespace
 
 import pytest
@@ -53,6 +54,7 @@ async def test_broadcast_filters_by_permission():
     await mgr.connect(no, WITHOUT)
 
     await mgr.broadcast({"type": "violation", "data": {}}, permission=("violations", "view"))
+    await asyncio.sleep(0.01)  # доставку выполняют задачи клиентов
 
     assert ok.sent, "админ с правом должен получить событие"
     assert not no.sent, "админ без права не должен получить событие"
@@ -66,5 +68,6 @@ async def test_broadcast_without_permission_reaches_all():
     await mgr.connect(b, WITHOUT)
 
     await mgr.broadcast({"type": "activity", "data": {}})  # без permission — всем
+    await asyncio.sleep(0.01)
 
     assert a.sent and b.sent
@@ -0,0 +1,136 @@
+"""dashboard_publisher_loop: рассылка по уведомлениям, только при подписчиках."""
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from web.backend.api.v2 import websocket
+from web.backend.api.deps import AdminUser
+
+
+class FakeWS:
+    def __init__(self):
+        self.sent = []
+        self.state = SimpleNamespace(auth_subprotocol=None)
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+
+def _make_db():
+    conn = MagicMock()
+    conn.add_listener = AsyncMock()
+    conn.remove_listener = AsyncMock()
+    conn.add_termination_listener = MagicMock()
+    conn.remove_termination_listener = MagicMock()
+    conn.is_closed = MagicMock(return_value=False)
+    cm = MagicMock()
+    cm.__aenter__ = AsyncMock(return_value=conn)
+    cm.__aexit__ = AsyncMock(return_value=False)
+    db = MagicMock()
+    db.is_connected = True
+    db.acquire = MagicMock(return_value=cm)
+    return db, conn
+
+
+@pytest.fixture()
+def publisher_env():
+    mgr = websocket.ConnectionManager()
+    db, conn = _make_db()
+    stats = AsyncMock(side_effect=lambda: {"total_users": stats.await_count})
+    with patch.object(websocket, "manager", mgr), \
+         patch.object(websocket, "_dashboard_wakeup", asyncio.Event()), \
+         patch.object(websocket, "DASHBOARD_MIN_INTERVAL", 0.05), \
+         patch.object(websocket, "_compute_dashboard_stats", stats), \
+         patch("shared.database.db_service", db):
+        yield mgr, conn, stats
+
+
+@pytest.mark.asyncio
+async def test_idle_without_subscribers(publisher_env):
+    mgr, conn, stats = publisher_env
+    task = asyncio.create_task(websocket.dashboard_publisher_loop())
+    websocket._on_panel_change(None, 0, "panel_changes", "users")
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    conn.add_listener.assert_not_awaited()
+    stats.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_changes_coalesced_and_listener_released(publisher_env):
+    mgr, conn, stats = publisher_env
+    ws = FakeWS()
+    await mgr.connect(ws, AdminUser(account_id=None, role="admin"))
+    mgr.subscribe(ws, ["dashboard"])
+    task = asyncio.create_task(websocket.dashboard_publisher_loop())
+
+    websocket._dashboard_wakeup.set()  # как при подписке
+    await asyncio.sleep(0.02)
+    conn.add_listener.assert_awaited_once()
+
+    for source in ("users", "nodes", "users"):
+        websocket._on_panel_change(None, 0, "panel_changes", source)
+    websocket._on_panel_change(None, 0, "panel_changes", "violations")
+    await asyncio.sleep(0.2)
+
+    assert stats.await_count == 1  # три уведомления → одна рассылка
+    assert [m["type"] for m in ws.sent] == ["dashboard_stats"]
+
+    await mgr.disconnect(ws)
+    websocket._dashboard_wakeup.set()
+    await asyncio.sleep(0.1)
+    conn.remove_listener.assert_awaited_once()
+    task.cancel()
+
+
+async def _subscribe(mgr):
+    ws = FakeWS()
+    await mgr.connect(ws, AdminUser(account_id=None, role="admin"))
+    mgr.subscribe(ws, ["dashboard"])
+    return ws
+
+
+@pytest.mark.asyncio
+async def test_retries_after_listen_setup_failure(publisher_env):
+    mgr, conn, stats = publisher_env
+    conn.add_listener.side_effect = [ConnectionError("pool exhausted"), None]
+    ws = await _subscribe(mgr)
+    task = asyncio.create_task(websocket.dashboard_publisher_loop())
+
+    websocket._dashboard_wakeup.set()  # как при подписке
+    await asyncio.sleep(0.15)
+    assert conn.add_listener.await_count == 2  # повтор без новой подписки
+
+    websocket._on_panel_change(None, 0, "panel_changes", "users")
+    await asyncio.sleep(0.15)
+    assert [m["type"] for m in ws.sent] == ["dashboard_stats", "dashboard_stats"]
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_reconnects_when_listen_connection_dies(publisher_env):
+    mgr, conn, stats = publisher_env
+    await _subscribe(mgr)
+    task = asyncio.create_task(websocket.dashboard_publisher_loop())
+
+    websocket._dashboard_wakeup.set()
+    await asyncio.sleep(0.1)
+    conn.add_termination_listener.assert_called_once_with(websocket._on_listen_closed)
+
+    conn.is_closed.return_value = True  # рестарт Postgres
+    websocket._on_listen_closed(conn)
+    await asyncio.sleep(0.02)
+    conn.is_closed.return_value = False  # пул выдал новое соединение
+    await asyncio.sleep(0.15)
+
+    assert conn.add_listener.await_count == 2
+    stats.assert_awaited_once()  # после переподключения — сразу, без ожидания уведомления
+    conn.remove_termination_listener.assert_called_with(websocket._on_listen_closed)
+    task.cancel()
@@ -0,0 +1,98 @@
+"""Очереди отправки WS-клиентов: схлопывание, лимит и отключение медленных."""
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from web.backend.api.v2 import websocket
+from web.backend.api.v2.websocket import ConnectionManager
+from web.backend.api.deps import AdminUser
+
+
+ADMIN = AdminUser(account_id=None, role="admin")
+
+
+class FakeWS:
+    def __init__(self, delay: float = 0.0):
+        self.sent = []
+        self.closed = None
+        self.delay = delay
+        self.state = SimpleNamespace(auth_subprotocol=None)
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+@pytest.mark.asyncio
+async def test_superseded_snapshots_coalesced():
+    mgr = ConnectionManager()
+    ws = FakeWS()
+    await mgr.connect(ws, ADMIN)
+
+    await mgr.broadcast({"type": "node_status", "n": 1}, coalesce_key="node_status:a")
+    await mgr.broadcast({"type": "activity", "n": 2})
+    await mgr.broadcast({"type": "node_status", "n": 3}, coalesce_key="node_status:a")
+    await mgr.broadcast({"type": "node_status", "n": 4}, coalesce_key="node_status:b")
+    await asyncio.sleep(0.01)
+
+    # последний снимок ноды a занял место первого, события без ключа не схлопываются
+    assert [m["n"] for m in ws.sent] == [3, 2, 4]
+
+
+@pytest.mark.asyncio
+async def test_queue_bounded_drops_oldest():
+    mgr = ConnectionManager()
+    ws = FakeWS()
+    with patch.object(websocket, "OUTBOX_MAX_MESSAGES", 3):
+        await mgr.connect(ws, ADMIN)
+        for n in range(5):
+            await mgr.broadcast({"type": "activity", "n": n})
+        await asyncio.sleep(0.01)
+
+    assert [m["n"] for m in ws.sent] == [2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_does_not_block_others():
+    mgr = ConnectionManager()
+    slow, fast = FakeWS(delay=10), FakeWS()
+    with patch.object(websocket, "SEND_TIMEOUT", 0.05):
+        await mgr.connect(slow, ADMIN)
+        await mgr.connect(fast, ADMIN)
+
+        started = asyncio.get_running_loop().time()
+        await mgr.broadcast({"type": "activity"})
+        assert asyncio.get_running_loop().time() - started < 0.05
+        await asyncio.sleep(0.2)
+
+    assert fast.sent == [{"type": "activity"}]
+    assert slow not in mgr.active_connections  # отключён как медленный
+    assert slow.closed == 1013
+    assert fast in mgr.active_connections
+
+
+@pytest.mark.asyncio
+async def test_topic_index_skips_serialization_without_subscribers():
+    mgr = ConnectionManager()
+    ws = FakeWS()
+    await mgr.connect(ws, ADMIN)
+    assert not mgr.has_subscribers("dashboard")
+
+    with patch.object(websocket.json, "dumps") as dumps:
+        await mgr.broadcast({"type": "dashboard_stats"}, topic="dashboard")
+    dumps.assert_not_called()
+
+    mgr.subscribe(ws, ["dashboard"])
+    assert mgr.has_subscribers("dashboard")
+    await mgr.disconnect(ws)
+    assert not mgr.has_subscribers("dashboard")